@@ -0,0 +1,531 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include <string.h>
+#include <glib.h>
+
+/**
+ * @file
+ *
+ * Keeping decoded annotations, indexed by sample range.
+ */
+
+/**
+ * @defgroup grp_annstore Annotation store
+ *
+ * Keeping annotations for range queries.
+ *
+ * When enabled with srd_session_ann_store_set(), every instance keeps
+ * the annotations it puts, and frontends can query the annotations of
+ * a row which overlap a range of samples, or count them per bucket of
+ * samples for zoomed out views, without keeping lists of their own.
+ *
+ * The annotations of each class are kept in blocks in the order the
+ * decoder puts them. Every block is summarized by a node holding the
+ * range of samples its annotations cover and their number, and nodes
+ * are summarized by nodes of the next level in turn. Queries skip all
+ * nodes outside of the range, and counts use the summaries of nodes
+ * which fall into a single bucket, so they need not look at every
+ * annotation.
+ *
+ * @{
+ */
+
+/** @cond PRIVATE */
+
+/* The number of annotations per block. */
+#define ANN_BLOCK_SIZE 256
+/* The number of nodes summarized by a node of the next level. */
+#define ANN_FANOUT 64
+#define ANN_MAX_LEVELS 8
+
+struct ann_record {
+	uint64_t start_sample;
+	uint64_t end_sample;
+	struct srd_pd_output *pdo;
+	struct srd_proto_data_annotation pda;
+};
+
+/* Summary of a block, or of up to ANN_FANOUT nodes of the level below. */
+struct ann_node {
+	uint64_t min_start;
+	/* Exclusive, zero length annotations count as one sample. */
+	uint64_t max_end;
+	uint64_t count;
+};
+
+/* The annotations of one class. */
+struct ann_index {
+	GPtrArray *blocks;
+	uint64_t num_records;
+	/* Level 0 has a node per block, the top level a single node. */
+	unsigned int num_levels;
+	GArray *levels[ANN_MAX_LEVELS];
+};
+
+struct srd_ann_store {
+	/* Annotations are added by the instance's thread. */
+	GMutex mutex;
+	unsigned int num_classes;
+	struct ann_index *classes;
+};
+
+/** @endcond */
+
+static uint64_t record_end(const struct ann_record *rec)
+{
+	if (rec->end_sample > rec->start_sample)
+		return rec->end_sample;
+
+	return rec->start_sample + 1;
+}
+
+static void node_add(struct ann_node *node, uint64_t min_start,
+		uint64_t max_end, uint64_t count)
+{
+	node->min_start = MIN(node->min_start, min_start);
+	node->max_end = MAX(node->max_end, max_end);
+	node->count += count;
+}
+
+static struct ann_node *node_get(const struct ann_index *idx,
+		unsigned int level, guint pos)
+{
+	return &g_array_index(idx->levels[level], struct ann_node, pos);
+}
+
+static guint block_len(const struct ann_index *idx, guint block)
+{
+	return MIN(ANN_BLOCK_SIZE, idx->num_records -
+		(uint64_t)block * ANN_BLOCK_SIZE);
+}
+
+static void index_add(struct ann_index *idx, const struct ann_record *rec)
+{
+	struct ann_record *block;
+	struct ann_node node, *first;
+	unsigned int level;
+	guint pos;
+
+	if (!idx->blocks)
+		idx->blocks = g_ptr_array_new_with_free_func(g_free);
+	if (!(idx->num_records % ANN_BLOCK_SIZE)) {
+		g_ptr_array_add(idx->blocks,
+			g_malloc(ANN_BLOCK_SIZE * sizeof(struct ann_record)));
+	}
+	block = g_ptr_array_index(idx->blocks, idx->blocks->len - 1);
+	block[idx->num_records++ % ANN_BLOCK_SIZE] = *rec;
+
+	pos = idx->blocks->len - 1;
+	for (level = 0; level < ANN_MAX_LEVELS; level++) {
+		if (level == idx->num_levels) {
+			/* A new top level, covering the previous one's node. */
+			idx->levels[level] = g_array_new(FALSE, FALSE,
+				sizeof(struct ann_node));
+			if (level) {
+				first = node_get(idx, level - 1, 0);
+				g_array_append_vals(idx->levels[level], first, 1);
+			}
+			idx->num_levels++;
+		}
+		if (pos == idx->levels[level]->len) {
+			node.min_start = UINT64_MAX;
+			node.max_end = 0;
+			node.count = 0;
+			g_array_append_vals(idx->levels[level], &node, 1);
+		}
+		node_add(node_get(idx, level, pos), rec->start_sample,
+			record_end(rec), 1);
+		if (idx->levels[level]->len == 1)
+			break;
+		pos /= ANN_FANOUT;
+	}
+}
+
+static void index_clear(struct ann_index *idx)
+{
+	struct ann_record *block;
+	unsigned int i;
+	guint b, r;
+
+	if (!idx->blocks)
+		return;
+
+	for (b = 0; b < idx->blocks->len; b++) {
+		block = g_ptr_array_index(idx->blocks, b);
+		for (r = 0; r < block_len(idx, b); r++) {
+			if (block[r].pda.payload)
+				g_variant_unref(block[r].pda.payload);
+			if (block[r].pda.ann_text_id == SRD_ANN_TEXT_ID_NONE)
+				g_strfreev(block[r].pda.ann_text);
+		}
+	}
+	g_ptr_array_free(idx->blocks, TRUE);
+	idx->blocks = NULL;
+	idx->num_records = 0;
+
+	for (i = 0; i < idx->num_levels; i++)
+		g_array_free(idx->levels[i], TRUE);
+	idx->num_levels = 0;
+}
+
+/* Collect the annotations of a node which overlap [start, end). */
+static void index_collect(const struct ann_index *idx, unsigned int level,
+		guint pos, uint64_t start, uint64_t end, GPtrArray *records)
+{
+	const struct ann_node *node;
+	struct ann_record *block;
+	guint i, last;
+
+	node = node_get(idx, level, pos);
+	if (node->min_start >= end || node->max_end <= start)
+		return;
+
+	if (!level) {
+		block = g_ptr_array_index(idx->blocks, pos);
+		for (i = 0; i < block_len(idx, pos); i++) {
+			if (block[i].start_sample < end &&
+					record_end(&block[i]) > start)
+				g_ptr_array_add(records, &block[i]);
+		}
+		return;
+	}
+
+	last = MIN((pos + 1) * ANN_FANOUT, idx->levels[level - 1]->len);
+	for (i = pos * ANN_FANOUT; i < last; i++)
+		index_collect(idx, level - 1, i, start, end, records);
+}
+
+/* Count annotations from min_start to max_end in the buckets they touch. */
+static void count_range(uint64_t min_start, uint64_t max_end, uint64_t count,
+		uint64_t start, uint64_t bucket_size, unsigned int num_buckets,
+		uint64_t *counts)
+{
+	uint64_t first, last, i;
+
+	first = min_start < start ? 0 : (min_start - start) / bucket_size;
+	last = MIN(num_buckets - 1, (max_end - 1 - start) / bucket_size);
+	for (i = first; i <= last; i++)
+		counts[i] += count;
+}
+
+static void index_count(const struct ann_index *idx, unsigned int level,
+		guint pos, uint64_t start, uint64_t bucket_size,
+		unsigned int num_buckets, uint64_t *counts)
+{
+	const struct ann_node *node;
+	struct ann_record *block;
+	uint64_t end;
+	guint i, last;
+
+	node = node_get(idx, level, pos);
+	end = start + bucket_size * num_buckets;
+	if (node->min_start >= end || node->max_end <= start)
+		return;
+
+	/* All of the node's annotations are within a single bucket. */
+	if (node->min_start >= start && (node->min_start - start) /
+			bucket_size == (node->max_end - 1 - start) / bucket_size) {
+		count_range(node->min_start, node->max_end, node->count,
+			start, bucket_size, num_buckets, counts);
+		return;
+	}
+
+	if (!level) {
+		block = g_ptr_array_index(idx->blocks, pos);
+		for (i = 0; i < block_len(idx, pos); i++) {
+			if (block[i].start_sample >= end ||
+					record_end(&block[i]) <= start)
+				continue;
+			count_range(block[i].start_sample, record_end(&block[i]),
+				1, start, bucket_size, num_buckets, counts);
+		}
+		return;
+	}
+
+	last = MIN((pos + 1) * ANN_FANOUT, idx->levels[level - 1]->len);
+	for (i = pos * ANN_FANOUT; i < last; i++) {
+		index_count(idx, level - 1, i, start, bucket_size,
+			num_buckets, counts);
+	}
+}
+
+static int record_cmp(gconstpointer a, gconstpointer b)
+{
+	const struct ann_record *ra, *rb;
+
+	ra = *(const struct ann_record **)a;
+	rb = *(const struct ann_record **)b;
+
+	if (ra->start_sample != rb->start_sample)
+		return ra->start_sample < rb->start_sample ? -1 : 1;
+	if (ra->end_sample != rb->end_sample)
+		return ra->end_sample > rb->end_sample ? -1 : 1;
+
+	return ra->pda.ann_class - rb->pda.ann_class;
+}
+
+/*
+ * Get the annotation classes of a row, or all classes if row_id is NULL,
+ * as a newly allocated array of booleans.
+ */
+static gboolean *row_classes(const struct srd_decoder_inst *di,
+		const char *row_id)
+{
+	const GSList *l, *c;
+	const struct srd_decoder_annotation_row *row;
+	gboolean *classes;
+	unsigned int i, cls;
+
+	classes = g_malloc0(di->ann_store->num_classes * sizeof(gboolean));
+	if (!row_id) {
+		for (i = 0; i < di->ann_store->num_classes; i++)
+			classes[i] = TRUE;
+		return classes;
+	}
+
+	for (l = di->decoder->annotation_rows; l; l = l->next) {
+		row = l->data;
+		if (strcmp(row->id, row_id))
+			continue;
+		for (c = row->ann_classes; c; c = c->next) {
+			cls = GPOINTER_TO_SIZE(c->data);
+			if (cls < di->ann_store->num_classes)
+				classes[cls] = TRUE;
+		}
+		return classes;
+	}
+
+	srd_err("%s: Unknown annotation row '%s'.", di->inst_id, row_id);
+	g_free(classes);
+
+	return NULL;
+}
+
+/** @private */
+SRD_PRIV struct srd_ann_store *srd_ann_store_new(
+		const struct srd_decoder_inst *di)
+{
+	struct srd_ann_store *store;
+
+	store = g_malloc(sizeof(struct srd_ann_store));
+	g_mutex_init(&store->mutex);
+	store->num_classes = g_slist_length(di->decoder->annotations);
+	store->classes = g_malloc0(store->num_classes *
+		sizeof(struct ann_index));
+
+	return store;
+}
+
+/**
+ * Keep an annotation of an instance.
+ *
+ * @param di The decoder instance which put the annotation.
+ * @param pdata The annotation. Its payload gets referenced, its texts
+ *              get copied unless they are interned.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_store_add(struct srd_decoder_inst *di,
+		const struct srd_proto_data *pdata)
+{
+	struct srd_ann_store *store;
+	struct ann_record rec;
+
+	store = di->ann_store;
+	rec.start_sample = pdata->start_sample;
+	rec.end_sample = pdata->end_sample;
+	rec.pdo = pdata->pdo;
+	rec.pda = *(const struct srd_proto_data_annotation *)pdata->data;
+	if ((unsigned int)rec.pda.ann_class >= store->num_classes)
+		return;
+	if (rec.pda.payload)
+		g_variant_ref(rec.pda.payload);
+	if (rec.pda.ann_text_id == SRD_ANN_TEXT_ID_NONE)
+		rec.pda.ann_text = g_strdupv(rec.pda.ann_text);
+
+	g_mutex_lock(&store->mutex);
+	index_add(&store->classes[rec.pda.ann_class], &rec);
+	g_mutex_unlock(&store->mutex);
+}
+
+/**
+ * Drop all annotations an instance kept.
+ *
+ * @param store The instance's annotation store.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_store_clear(struct srd_ann_store *store)
+{
+	unsigned int i;
+
+	g_mutex_lock(&store->mutex);
+	for (i = 0; i < store->num_classes; i++)
+		index_clear(&store->classes[i]);
+	g_mutex_unlock(&store->mutex);
+}
+
+/** @private */
+SRD_PRIV void srd_ann_store_free(struct srd_ann_store *store)
+{
+	if (!store)
+		return;
+
+	srd_ann_store_clear(store);
+	g_free(store->classes);
+	g_mutex_clear(&store->mutex);
+	g_free(store);
+}
+
+/**
+ * Get the kept annotations of an instance which overlap a range of samples.
+ *
+ * The callback gets the annotations of the row which overlap
+ * [start_sample, end_sample), ordered by their start sample, like an
+ * SRD_OUTPUT_ANN callback would. Annotations without duration overlap
+ * the range if they start within it. The callback must not keep the
+ * pdata, nor call annotation store functions of the instance.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ * @param row_id The id of the annotation row, or NULL for all annotations.
+ * @param start_sample The first sample of the range.
+ * @param end_sample The sample after the range.
+ * @param cb The function to call for each annotation. Must not be NULL.
+ * @param cb_data Private data for the callback.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_inst_ann_store_query(struct srd_decoder_inst *di,
+		const char *row_id, uint64_t start_sample, uint64_t end_sample,
+		srd_pd_output_callback cb, void *cb_data)
+{
+	struct srd_ann_store *store;
+	const struct ann_index *idx;
+	struct ann_record *rec;
+	struct srd_proto_data pdata;
+	GPtrArray *records;
+	gboolean *classes;
+	unsigned int i;
+	guint pos;
+
+	if (!di || !cb) {
+		srd_err("Invalid decoder instance or callback.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!(classes = row_classes(di, row_id)))
+		return SRD_ERR_ARG;
+
+	store = di->ann_store;
+	records = g_ptr_array_new();
+	g_mutex_lock(&store->mutex);
+
+	for (i = 0; i < store->num_classes; i++) {
+		idx = &store->classes[i];
+		if (!classes[i] || !idx->num_levels)
+			continue;
+		for (pos = 0; pos < idx->levels[idx->num_levels - 1]->len; pos++) {
+			index_collect(idx, idx->num_levels - 1, pos,
+				start_sample, end_sample, records);
+		}
+	}
+	g_ptr_array_sort(records, record_cmp);
+
+	for (pos = 0; pos < records->len; pos++) {
+		rec = g_ptr_array_index(records, pos);
+		pdata.start_sample = rec->start_sample;
+		pdata.end_sample = rec->end_sample;
+		pdata.pdo = rec->pdo;
+		pdata.data = &rec->pda;
+		cb(&pdata, cb_data);
+	}
+
+	g_mutex_unlock(&store->mutex);
+	g_ptr_array_free(records, TRUE);
+	g_free(classes);
+
+	return SRD_OK;
+}
+
+/**
+ * Count the kept annotations of an instance per bucket of samples.
+ *
+ * Bucket i covers the samples from start_sample + i * bucket_size up to
+ * (but not including) start_sample + (i + 1) * bucket_size, and its count
+ * is the number of the row's annotations which overlap it, as with
+ * srd_inst_ann_store_query(). Long annotations count in every bucket
+ * they overlap.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ * @param row_id The id of the annotation row, or NULL for all annotations.
+ * @param start_sample The first sample of the first bucket.
+ * @param bucket_size The number of samples per bucket. Must not be 0.
+ * @param num_buckets The number of buckets. Must not be 0.
+ * @param counts The counts, as an array of num_buckets elements which
+ *               gets overwritten. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_inst_ann_store_summary(struct srd_decoder_inst *di,
+		const char *row_id, uint64_t start_sample, uint64_t bucket_size,
+		unsigned int num_buckets, uint64_t *counts)
+{
+	struct srd_ann_store *store;
+	const struct ann_index *idx;
+	gboolean *classes;
+	unsigned int i;
+	guint pos;
+
+	if (!di || !bucket_size || !num_buckets || !counts ||
+			bucket_size > (UINT64_MAX - start_sample) / num_buckets) {
+		srd_err("Invalid decoder instance or buckets.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!(classes = row_classes(di, row_id)))
+		return SRD_ERR_ARG;
+
+	memset(counts, 0, num_buckets * sizeof(uint64_t));
+
+	store = di->ann_store;
+	g_mutex_lock(&store->mutex);
+
+	for (i = 0; i < store->num_classes; i++) {
+		idx = &store->classes[i];
+		if (!classes[i] || !idx->num_levels)
+			continue;
+		for (pos = 0; pos < idx->levels[idx->num_levels - 1]->len; pos++) {
+			index_count(idx, idx->num_levels - 1, pos, start_sample,
+				bucket_size, num_buckets, counts);
+		}
+	}
+
+	g_mutex_unlock(&store->mutex);
+	g_free(classes);
+
+	return SRD_OK;
+}
+
+/** @} */
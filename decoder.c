@@ -22,6 +22,10 @@
 #include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
 #include "libsigrokdecode.h"
 #include <glib.h>
+#include <glib/gstdio.h>
+#include <inttypes.h>
+#include <string.h>
+#include <sys/stat.h>
 
 /**
  * @file
@@ -42,6 +46,34 @@
 /* The list of loaded protocol decoders. */
 static GSList *pd_list = NULL;
 
+/*
+ * Loaded decoders which were not imported yet, by module name. See
+ * srd_decoder_load_all() and srd_decoder_import().
+ */
+static GHashTable *lazy_decoders = NULL;
+
+/*
+ * The decoder metadata cache, as read from its file, and its entries used
+ * while loading all decoders. Entries are keyed by the modules' paths.
+ */
+struct decoder_cache {
+	char *path;
+	GHashTable *entries;
+	GHashTable *used;
+	gboolean changed;
+};
+
+/* Changes with the format, and with the library version. */
+#define DECODER_CACHE_VERSION "1-" SRD_PACKAGE_VERSION_STRING
+#define DECODER_CACHE_DECODER "(sssssasasasa(sss)a(sss)a(ssmas)a(ssai)a(ss)a(smsmvav))"
+/* The stamp of a module's files, and its decoder if it has one. */
+#define DECODER_CACHE_ENTRY "(sm" DECODER_CACHE_DECODER ")"
+#define DECODER_CACHE "(sa{s" DECODER_CACHE_ENTRY "})"
+
+/* The index of a decoder bundle, and its first line. */
+#define DECODER_BUNDLE_INDEX "decoders.index"
+#define DECODER_BUNDLE_FORMAT "libsigrokdecode decoder bundle 1"
+
 /* srd.c */
 extern SRD_PRIV GSList *searchpaths;
 
@@ -49,9 +81,6 @@ extern SRD_PRIV GSList *searchpaths;
 extern SRD_PRIV GSList *sessions;
 extern SRD_PRIV int max_session_id;
 
-/* module_sigrokdecode.c */
-extern SRD_PRIV PyObject *mod_sigrokdecode;
-
 /** @endcond */
 
 static gboolean srd_check_init(void)
@@ -165,6 +194,7 @@ static void decoder_free(struct srd_decoder *dec)
 	g_slist_free_full(dec->options, &decoder_option_free);
 	g_slist_free_full(dec->binary, (GDestroyNotify)&g_strfreev);
 	g_slist_free_full(dec->annotation_rows, &annotation_row_free);
+	g_slist_free_full(dec->ann_formats, (GDestroyNotify)&g_strfreev);
 	g_slist_free_full(dec->annotations, (GDestroyNotify)&g_strfreev);
 	g_slist_free_full(dec->opt_channels, &channel_free);
 	g_slist_free_full(dec->channels, &channel_free);
@@ -378,13 +408,44 @@ err_out:
 	return SRD_ERR_PYTHON;
 }
 
-/* Convert annotation class attribute to GSList of char **. */
+/* Check an annotation class' text templates, see srd_ann_text_format(). */
+static int check_ann_formats(const struct srd_decoder *dec, const char *id,
+		char **formats)
+{
+	GString *s;
+	int i, ret;
+
+	if (!formats[0]) {
+		srd_err("Protocol decoder %s annotation %s has no templates.",
+			dec->name, id);
+		return SRD_ERR_ARG;
+	}
+
+	s = g_string_sized_new(32);
+	for (i = 0, ret = SRD_OK; formats[i] && ret >= 0; i++) {
+		ret = srd_ann_text_format(s, formats[i], NULL, 0);
+		if (ret > SRD_ANN_MAX_VALUES)
+			ret = SRD_ERR_ARG;
+		if (ret < 0)
+			srd_err("Protocol decoder %s annotation %s has invalid "
+				"template '%s'.", dec->name, id, formats[i]);
+	}
+	g_string_free(s, TRUE);
+
+	return ret < 0 ? ret : SRD_OK;
+}
+
+/*
+ * Convert annotation class attribute to GSList of char **, and the
+ * classes' optional text templates to another GSList of char **.
+ */
 static int get_annotations(struct srd_decoder *dec)
 {
-	PyObject *py_annlist, *py_ann;
-	GSList *annotations;
-	char **annpair;
+	PyObject *py_annlist, *py_ann, *py_pair, *py_formats;
+	GSList *annotations, *ann_formats;
+	char **annpair, **formats;
 	ssize_t i;
+	int ret;
 	PyGILState_STATE gstate;
 
 	gstate = PyGILState_Ensure();
@@ -395,6 +456,7 @@ static int get_annotations(struct srd_decoder *dec)
 	}
 
 	annotations = NULL;
+	ann_formats = NULL;
 
 	py_annlist = PyObject_GetAttrString(dec->py_dec, "annotations");
 	if (!py_annlist)
@@ -411,18 +473,40 @@ static int get_annotations(struct srd_decoder *dec)
 		if (!py_ann)
 			goto except_out;
 
-		if (!PyTuple_Check(py_ann) || PyTuple_Size(py_ann) != 2) {
+		if (!PyTuple_Check(py_ann) || PyTuple_Size(py_ann) < 2 ||
+				PyTuple_Size(py_ann) > 3) {
 			srd_err("Protocol decoder %s annotation %zd should "
-				"be a tuple with two elements.",
+				"be a tuple with two or three elements.",
 				dec->name, i + 1);
 			goto err_out;
 		}
-		if (py_strseq_to_char(py_ann, &annpair) != SRD_OK)
+		if (!(py_pair = PyTuple_GetSlice(py_ann, 0, 2)))
+			goto except_out;
+		ret = py_strseq_to_char(py_pair, &annpair);
+		Py_DECREF(py_pair);
+		if (ret != SRD_OK)
 			goto err_out;
-
 		annotations = g_slist_prepend(annotations, annpair);
+
+		/* The optional third element is a tuple of text templates. */
+		formats = NULL;
+		if (PyTuple_Size(py_ann) == 3) {
+			py_formats = PyTuple_GetItem(py_ann, 2);
+			if (!PyTuple_Check(py_formats)) {
+				srd_err("Protocol decoder %s annotation %s "
+					"templates should be a tuple.",
+					dec->name, annpair[0]);
+				goto err_out;
+			}
+			if (py_strseq_to_char(py_formats, &formats) != SRD_OK)
+				goto err_out;
+		}
+		ann_formats = g_slist_prepend(ann_formats, formats);
+		if (formats && check_ann_formats(dec, annpair[0], formats) != SRD_OK)
+			goto err_out;
 	}
 	dec->annotations = annotations;
+	dec->ann_formats = ann_formats;
 	Py_DECREF(py_annlist);
 	PyGILState_Release(gstate);
 
@@ -432,6 +516,7 @@ except_out:
 	srd_exception_catch("Failed to get %s decoder annotations", dec->name);
 
 err_out:
+	g_slist_free_full(ann_formats, (GDestroyNotify)&g_strfreev);
 	g_slist_free_full(annotations, (GDestroyNotify)&g_strfreev);
 	Py_XDECREF(py_annlist);
 	PyGILState_Release(gstate);
@@ -606,6 +691,54 @@ err_out:
 	return SRD_ERR_PYTHON;
 }
 
+/*
+ * Get the number of memory blocks Python allocated so far, and the number
+ * of bytes if tracemalloc is tracing (else -1). The caller holds the GIL.
+ */
+static void py_alloc_get(int64_t *blocks, int64_t *bytes)
+{
+	PyObject *py_mod, *py_res;
+
+	*blocks = *bytes = -1;
+
+	if ((py_mod = py_import_by_name("sys"))) {
+		py_res = PyObject_CallMethod(py_mod, "getallocatedblocks", NULL);
+		if (py_res && PyLong_Check(py_res))
+			*blocks = PyLong_AsLongLong(py_res);
+		Py_XDECREF(py_res);
+		Py_DECREF(py_mod);
+	}
+
+	if ((py_mod = py_import_by_name("_tracemalloc"))) {
+		py_res = PyObject_CallMethod(py_mod, "is_tracing", NULL);
+		if (py_res && PyObject_IsTrue(py_res) == 1) {
+			Py_DECREF(py_res);
+			py_res = PyObject_CallMethod(py_mod,
+				"get_traced_memory", NULL);
+			if (py_res && PyTuple_Check(py_res))
+				*bytes = PyLong_AsLongLong(
+					PyTuple_GetItem(py_res, 0));
+		}
+		Py_XDECREF(py_res);
+		Py_DECREF(py_mod);
+	}
+
+	PyErr_Clear();
+}
+
+/* Account what loading a decoder allocated, from the counts before. */
+static void load_stats_alloc(struct srd_decoder_load_stats *stats,
+		int64_t blocks, int64_t bytes)
+{
+	int64_t blocks_after, bytes_after;
+
+	py_alloc_get(&blocks_after, &bytes_after);
+	stats->alloc_blocks += (blocks < 0 || blocks_after < 0) ?
+		0 : blocks_after - blocks;
+	stats->alloc_bytes = (bytes < 0 || bytes_after < 0) ?
+		-1 : stats->alloc_bytes + bytes_after - bytes;
+}
+
 /* Check whether the Decoder class defines the named method. */
 static int check_method(PyObject *py_dec, const char *mod_name,
 		const char *method_name)
@@ -668,6 +801,104 @@ SRD_PRIV long srd_decoder_apiver(const struct srd_decoder *d)
 	return apiver;
 }
 
+/**
+ * Format an annotation text from a template and raw values.
+ *
+ * Templates are printf-like, with the conversions d, i, u, x, X, o, c
+ * and b (binary), each with optional flags, field width and precision,
+ * and %% for a percent sign. Each conversion formats the next value,
+ * missing values are formatted as zero. The c conversion formats values
+ * outside of printable ASCII as [XX].
+ *
+ * @param s The string to append the text to. Must not be NULL.
+ * @param template The template. Must not be NULL.
+ * @param values The values, may be NULL if num_values is 0.
+ * @param num_values The number of values.
+ *
+ * @return The number of conversions in the template, or SRD_ERR_ARG if
+ *         the template is invalid.
+ *
+ * @private
+ */
+SRD_PRIV int srd_ann_text_format(GString *s, const char *template,
+		const int64_t *values, unsigned int num_values)
+{
+	const char *p, *flags;
+	char spec[32], bits[65];
+	size_t len, num_flags;
+	unsigned int n;
+	uint64_t value;
+	int i, width;
+
+	n = 0;
+	for (p = template; *p; p++) {
+		if (*p != '%') {
+			g_string_append_c(s, *p);
+			continue;
+		}
+		if (*++p == '%') {
+			g_string_append_c(s, '%');
+			continue;
+		}
+
+		/* Flags, field width and precision, then the conversion. */
+		flags = p;
+		num_flags = strspn(p, "-+ #0");
+		p += num_flags;
+		p += strspn(p, "0123456789");
+		if (*p == '.') {
+			p++;
+			p += strspn(p, "0123456789");
+		}
+		len = p - flags;
+		if (!*p || !strchr("diuxXocb", *p) || len > sizeof(spec) - 5)
+			return SRD_ERR_ARG;
+
+		value = (n < num_values) ? (uint64_t)values[n] : 0;
+		n++;
+
+		switch (*p) {
+		case 'c':
+			if (value >= 0x20 && value < 0x7f)
+				g_string_append_c(s, (char)value);
+			else
+				g_string_append_printf(s, "[%02" PRIX64 "]", value);
+			break;
+		case 'b':
+			/* printf() has no binary conversion, pad it here. */
+			i = sizeof(bits) - 1;
+			bits[i] = '\0';
+			do {
+				bits[--i] = '0' + (value & 1);
+				value >>= 1;
+			} while (value);
+			width = atoi(flags + num_flags) - (sizeof(bits) - 1 - i);
+			if (memchr(flags, '-', num_flags)) {
+				g_string_append(s, bits + i);
+				for (; width > 0; width--)
+					g_string_append_c(s, ' ');
+				break;
+			}
+			for (; width > 0; width--)
+				g_string_append_c(s,
+					memchr(flags, '0', num_flags) ? '0' : ' ');
+			g_string_append(s, bits + i);
+			break;
+		default:
+			g_snprintf(spec, sizeof(spec), "%%%.*sll%c",
+				(int)len, flags, *p);
+			if (*p == 'd' || *p == 'i')
+				g_string_append_printf(s, spec, (long long)value);
+			else
+				g_string_append_printf(s, spec,
+					(unsigned long long)value);
+			break;
+		}
+	}
+
+	return n;
+}
+
 static gboolean contains_duplicates(GSList *list)
 {
 	for (GSList *l1 = list; l1; l1 = l1->next) {
@@ -731,6 +962,7 @@ SRD_API int srd_decoder_load(const char *module_name)
 	long apiver;
 	int is_subclass;
 	const char *fail_txt;
+	int64_t start_time, import_time, blocks, bytes;
 	PyGILState_STATE gstate;
 
 	if (!srd_check_init())
@@ -741,8 +973,10 @@ SRD_API int srd_decoder_load(const char *module_name)
 
 	gstate = PyGILState_Ensure();
 
-	if (PyDict_GetItemString(PyImport_GetModuleDict(), module_name)) {
-		/* Module was already imported. */
+	if (PyDict_GetItemString(PyImport_GetModuleDict(), module_name) ||
+			(lazy_decoders && g_hash_table_contains(lazy_decoders,
+			module_name))) {
+		/* Module was already imported, or loaded from the cache. */
 		PyGILState_Release(gstate);
 		return SRD_OK;
 	}
@@ -750,13 +984,16 @@ SRD_API int srd_decoder_load(const char *module_name)
 	d = g_malloc0(sizeof(struct srd_decoder));
 	fail_txt = NULL;
 
+	py_alloc_get(&blocks, &bytes);
+	start_time = g_get_monotonic_time();
 	d->py_mod = py_import_by_name(module_name);
+	import_time = g_get_monotonic_time();
 	if (!d->py_mod) {
 		fail_txt = "import by name failed";
 		goto except_out;
 	}
 
-	if (!mod_sigrokdecode) {
+	if (!srd_module_get()) {
 		srd_err("sigrokdecode module not loaded.");
 		fail_txt = "sigrokdecode(3) not loaded";
 		goto err_out;
@@ -769,7 +1006,7 @@ SRD_API int srd_decoder_load(const char *module_name)
 		goto except_out;
 	}
 
-	py_basedec = PyObject_GetAttrString(mod_sigrokdecode, "Decoder");
+	py_basedec = PyObject_GetAttrString(srd_module_get(), "Decoder");
 	if (!py_basedec) {
 		fail_txt = "no 'Decoder' attribute in sigrokdecode(3)";
 		goto except_out;
@@ -944,6 +1181,10 @@ SRD_API int srd_decoder_load(const char *module_name)
 		goto err_out;
 	}
 
+	d->load_stats.import_time = import_time - start_time;
+	d->load_stats.metadata_time = g_get_monotonic_time() - import_time;
+	load_stats_alloc(&d->load_stats, blocks, bytes);
+
 	PyGILState_Release(gstate);
 
 	/* Append it to the list of loaded decoders. */
@@ -968,6 +1209,93 @@ err_out:
 	return SRD_ERR_PYTHON;
 }
 
+static gboolean lazy_decoder_is(gpointer key, gpointer value,
+		gpointer user_data)
+{
+	(void)key;
+
+	return value == user_data;
+}
+
+/**
+ * Import the Python module of a decoder which was loaded from the
+ * metadata cache, see srd_decoder_load_all().
+ *
+ * @param dec The decoder. Must not be NULL.
+ *
+ * @return SRD_OK upon success (or if the module was imported before),
+ *         a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_decoder_import(struct srd_decoder *dec)
+{
+	PyObject *py_mod, *py_dec;
+	const char *module_name;
+	char *id;
+	GHashTableIter iter;
+	gpointer key, value;
+	int64_t start_time, blocks, bytes;
+	PyGILState_STATE gstate;
+
+	if (dec->py_mod)
+		return SRD_OK;
+
+	module_name = NULL;
+	if (lazy_decoders) {
+		g_hash_table_iter_init(&iter, lazy_decoders);
+		while (g_hash_table_iter_next(&iter, &key, &value)) {
+			if (value == dec) {
+				module_name = key;
+				break;
+			}
+		}
+	}
+	if (!module_name)
+		return SRD_ERR_BUG;
+
+	srd_dbg("Importing decoder %s.", module_name);
+
+	gstate = PyGILState_Ensure();
+
+	py_alloc_get(&blocks, &bytes);
+	start_time = g_get_monotonic_time();
+	py_dec = NULL;
+	if (!(py_mod = py_import_by_name(module_name)) ||
+			!(py_dec = PyObject_GetAttrString(py_mod, "Decoder"))) {
+		srd_exception_catch("Failed to import decoder %s", module_name);
+		goto err_out;
+	}
+
+	/* The module changed since the cache was written. */
+	if (py_attr_as_str(py_dec, "id", &id) != SRD_OK)
+		goto err_out;
+	if (strcmp(id, dec->id)) {
+		srd_err("Decoder %s changed its id to %s, reload decoders.",
+			dec->id, id);
+		g_free(id);
+		goto err_out;
+	}
+	g_free(id);
+
+	dec->py_mod = py_mod;
+	dec->py_dec = py_dec;
+	dec->load_stats.import_time = g_get_monotonic_time() - start_time;
+	load_stats_alloc(&dec->load_stats, blocks, bytes);
+	PyGILState_Release(gstate);
+
+	g_hash_table_foreach_remove(lazy_decoders, lazy_decoder_is, dec);
+
+	return SRD_OK;
+
+err_out:
+	Py_XDECREF(py_dec);
+	Py_XDECREF(py_mod);
+	PyGILState_Release(gstate);
+
+	return SRD_ERR_PYTHON;
+}
+
 /**
  * Return a protocol decoder's docstring.
  *
@@ -987,7 +1315,7 @@ SRD_API char *srd_decoder_doc_get(const struct srd_decoder *dec)
 	if (!srd_check_init())
 		return NULL;
 
-	if (!dec || !dec->py_mod)
+	if (!dec || srd_decoder_import((struct srd_decoder *)dec) != SRD_OK)
 		return NULL;
 
 	gstate = PyGILState_Ensure();
@@ -1015,6 +1343,52 @@ err:
 	return NULL;
 }
 
+/**
+ * Get one text of an annotation.
+ *
+ * This works for annotations with texts, as well as for annotations
+ * which the decoder put as raw values, by formatting the annotation
+ * class' template of the given verbosity level. See
+ * srd_session_lazy_ann_text_set().
+ *
+ * @param pdata The annotation, as passed to an SRD_OUTPUT_ANN callback.
+ *              Must not be NULL.
+ * @param level The verbosity level, 0 is the most verbose text.
+ *
+ * @return A newly allocated text, or NULL if the annotation has no text
+ *         of this level. The caller is responsible for g_free()ing it.
+ *
+ * @since 0.6.0
+ */
+SRD_API char *srd_proto_data_annotation_text(const struct srd_proto_data *pdata,
+		unsigned int level)
+{
+	const struct srd_proto_data_annotation *pda;
+	char **formats;
+	GString *s;
+
+	if (!pdata || !pdata->pdo || !pdata->data ||
+			pdata->pdo->output_type != SRD_OUTPUT_ANN)
+		return NULL;
+	pda = pdata->data;
+
+	if (pda->ann_text) {
+		if (level >= g_strv_length(pda->ann_text))
+			return NULL;
+		return g_strdup(pda->ann_text[level]);
+	}
+
+	formats = g_slist_nth_data(pdata->pdo->di->decoder->ann_formats,
+		pda->ann_class);
+	if (!formats || level >= g_strv_length(formats))
+		return NULL;
+
+	s = g_string_sized_new(32);
+	srd_ann_text_format(s, formats[level], pda->values, pda->num_values);
+
+	return g_string_free(s, FALSE);
+}
+
 /**
  * Unload the specified protocol decoder.
  *
@@ -1048,13 +1422,548 @@ SRD_API int srd_decoder_unload(struct srd_decoder *dec)
 
 	/* Remove the PD from the list of loaded decoders. */
 	pd_list = g_slist_remove(pd_list, dec);
+	if (lazy_decoders)
+		g_hash_table_foreach_remove(lazy_decoders, lazy_decoder_is, dec);
 
 	decoder_free(dec);
 
 	return SRD_OK;
 }
 
-static void srd_decoder_load_all_zip_path(char *zip_path)
+static GVariant *strlist_to_variant(const GSList *list)
+{
+	GVariantBuilder b;
+
+	g_variant_builder_init(&b, G_VARIANT_TYPE_STRING_ARRAY);
+	for (; list; list = list->next)
+		g_variant_builder_add(&b, "s", list->data);
+
+	return g_variant_builder_end(&b);
+}
+
+static GSList *strlist_from_variant(GVariant *var)
+{
+	GVariantIter iter;
+	GSList *list;
+	const char *str;
+
+	list = NULL;
+	g_variant_iter_init(&iter, var);
+	while (g_variant_iter_next(&iter, "&s", &str))
+		list = g_slist_append(list, g_strdup(str));
+
+	return list;
+}
+
+static GVariant *channels_to_variant(const GSList *channels)
+{
+	const struct srd_channel *ch;
+	GVariantBuilder b;
+
+	g_variant_builder_init(&b, G_VARIANT_TYPE("a(sss)"));
+	for (; channels; channels = channels->next) {
+		ch = channels->data;
+		g_variant_builder_add(&b, "(sss)", ch->id, ch->name, ch->desc);
+	}
+
+	return g_variant_builder_end(&b);
+}
+
+static GSList *channels_from_variant(GVariant *var, int offset)
+{
+	GVariantIter iter;
+	GSList *channels;
+	struct srd_channel *ch;
+	const char *id, *name, *desc;
+
+	channels = NULL;
+	g_variant_iter_init(&iter, var);
+	while (g_variant_iter_next(&iter, "(&s&s&s)", &id, &name, &desc)) {
+		ch = g_malloc(sizeof(struct srd_channel));
+		ch->id = g_strdup(id);
+		ch->name = g_strdup(name);
+		ch->desc = g_strdup(desc);
+		ch->order = offset++;
+		channels = g_slist_append(channels, ch);
+	}
+
+	return channels;
+}
+
+/* Convert a decoder's metadata for the cache, see DECODER_CACHE_DECODER. */
+static GVariant *decoder_to_variant(const struct srd_decoder *dec)
+{
+	const GSList *l, *f, *c;
+	const struct srd_decoder_annotation_row *row;
+	const struct srd_decoder_option *o;
+	char **ann, **formats, **bin;
+	GVariantBuilder anns, rows, classes, bins, opts, values;
+
+	g_variant_builder_init(&anns, G_VARIANT_TYPE("a(ssmas)"));
+	for (l = dec->annotations, f = dec->ann_formats; l; l = l->next) {
+		ann = l->data;
+		formats = f ? f->data : NULL;
+		g_variant_builder_add(&anns, "(ss@mas)", ann[0], ann[1],
+			g_variant_new_maybe(G_VARIANT_TYPE_STRING_ARRAY, formats ?
+			g_variant_new_strv((const char *const *)formats, -1) : NULL));
+		f = f ? f->next : NULL;
+	}
+
+	g_variant_builder_init(&rows, G_VARIANT_TYPE("a(ssai)"));
+	for (l = dec->annotation_rows; l; l = l->next) {
+		row = l->data;
+		g_variant_builder_init(&classes, G_VARIANT_TYPE("ai"));
+		for (c = row->ann_classes; c; c = c->next)
+			g_variant_builder_add(&classes, "i", GPOINTER_TO_INT(c->data));
+		g_variant_builder_add(&rows, "(ssai)", row->id, row->desc,
+			&classes);
+	}
+
+	g_variant_builder_init(&bins, G_VARIANT_TYPE("a(ss)"));
+	for (l = dec->binary; l; l = l->next) {
+		bin = l->data;
+		g_variant_builder_add(&bins, "(ss)", bin[0], bin[1]);
+	}
+
+	g_variant_builder_init(&opts, G_VARIANT_TYPE("a(smsmvav)"));
+	for (l = dec->options; l; l = l->next) {
+		o = l->data;
+		g_variant_builder_init(&values, G_VARIANT_TYPE("av"));
+		for (c = o->values; c; c = c->next)
+			g_variant_builder_add(&values, "v", c->data);
+		g_variant_builder_add(&opts, "(sms@mvav)", o->id, o->desc,
+			g_variant_new_maybe(G_VARIANT_TYPE_VARIANT, o->def ?
+			g_variant_new_variant(o->def) : NULL), &values);
+	}
+
+	return g_variant_new("(sssss@as@as@as@a(sss)@a(sss)a(ssmas)a(ssai)"
+		"a(ss)a(smsmvav))", dec->id, dec->name, dec->longname,
+		dec->desc, dec->license, strlist_to_variant(dec->inputs),
+		strlist_to_variant(dec->outputs), strlist_to_variant(dec->tags),
+		channels_to_variant(dec->channels),
+		channels_to_variant(dec->opt_channels), &anns, &rows, &bins,
+		&opts);
+}
+
+/* Create a decoder from its cached metadata, without importing it. */
+static struct srd_decoder *decoder_from_variant(GVariant *var)
+{
+	struct srd_decoder *d;
+	struct srd_decoder_annotation_row *row;
+	struct srd_decoder_option *o;
+	GVariant *inputs, *outputs, *tags, *channels, *opt_channels;
+	GVariant *anns, *rows, *bins, *opts, *formats, *def, *values, *value;
+	GVariant *classes, *maybe;
+	GVariantIter iter, citer;
+	const char *id, *desc;
+	char **pair, *opt_desc;
+	gint32 cls;
+
+	d = g_malloc0(sizeof(struct srd_decoder));
+	g_variant_get(var, "(sssss@as@as@as@a(sss)@a(sss)@a(ssmas)@a(ssai)"
+		"@a(ss)@a(smsmvav))", &d->id, &d->name, &d->longname, &d->desc,
+		&d->license, &inputs, &outputs, &tags, &channels, &opt_channels,
+		&anns, &rows, &bins, &opts);
+
+	d->inputs = strlist_from_variant(inputs);
+	d->outputs = strlist_from_variant(outputs);
+	d->tags = strlist_from_variant(tags);
+	d->channels = channels_from_variant(channels, 0);
+	d->opt_channels = channels_from_variant(opt_channels,
+		g_slist_length(d->channels));
+
+	g_variant_iter_init(&iter, anns);
+	while (g_variant_iter_next(&iter, "(&s&s@mas)", &id, &desc, &maybe)) {
+		pair = g_malloc0(3 * sizeof(char *));
+		pair[0] = g_strdup(id);
+		pair[1] = g_strdup(desc);
+		d->annotations = g_slist_append(d->annotations, pair);
+		formats = g_variant_get_maybe(maybe);
+		d->ann_formats = g_slist_append(d->ann_formats,
+			formats ? g_variant_dup_strv(formats, NULL) : NULL);
+		if (formats)
+			g_variant_unref(formats);
+		g_variant_unref(maybe);
+	}
+
+	g_variant_iter_init(&iter, rows);
+	while (g_variant_iter_next(&iter, "(&s&s@ai)", &id, &desc, &classes)) {
+		row = g_malloc0(sizeof(struct srd_decoder_annotation_row));
+		row->id = g_strdup(id);
+		row->desc = g_strdup(desc);
+		g_variant_iter_init(&citer, classes);
+		while (g_variant_iter_next(&citer, "i", &cls)) {
+			row->ann_classes = g_slist_append(row->ann_classes,
+				GINT_TO_POINTER(cls));
+		}
+		d->annotation_rows = g_slist_append(d->annotation_rows, row);
+		g_variant_unref(classes);
+	}
+
+	g_variant_iter_init(&iter, bins);
+	while (g_variant_iter_next(&iter, "(&s&s)", &id, &desc)) {
+		pair = g_malloc0(3 * sizeof(char *));
+		pair[0] = g_strdup(id);
+		pair[1] = g_strdup(desc);
+		d->binary = g_slist_append(d->binary, pair);
+	}
+
+	g_variant_iter_init(&iter, opts);
+	while (g_variant_iter_next(&iter, "(&sms@mv@av)", &id, &opt_desc,
+			&maybe, &values)) {
+		o = g_malloc0(sizeof(struct srd_decoder_option));
+		o->id = g_strdup(id);
+		o->desc = opt_desc;
+		if ((def = g_variant_get_maybe(maybe))) {
+			o->def = g_variant_get_variant(def);
+			g_variant_unref(def);
+		}
+		g_variant_iter_init(&citer, values);
+		while (g_variant_iter_next(&citer, "v", &value))
+			o->values = g_slist_append(o->values, value);
+		d->options = g_slist_append(d->options, o);
+		g_variant_unref(values);
+		g_variant_unref(maybe);
+	}
+
+	g_variant_unref(inputs);
+	g_variant_unref(outputs);
+	g_variant_unref(tags);
+	g_variant_unref(channels);
+	g_variant_unref(opt_channels);
+	g_variant_unref(anns);
+	g_variant_unref(rows);
+	g_variant_unref(bins);
+	g_variant_unref(opts);
+
+	return d;
+}
+
+static gint strcmp_cb(gconstpointer a, gconstpointer b)
+{
+	return strcmp(*(const char **)a, *(const char **)b);
+}
+
+/*
+ * Get a stamp of a module's files (names, sizes and modification times),
+ * as a checksum which changes when any of them changes. The stamp of the
+ * "common" modules is included, since decoders can use them.
+ */
+static char *module_stamp(const char *path, const char *common_stamp)
+{
+	GDir *dir;
+	GPtrArray *names;
+	GChecksum *sum;
+	GStatBuf st;
+	const char *name;
+	char *file, *line, *stamp;
+	guint i;
+
+	names = g_ptr_array_new_with_free_func(g_free);
+	if ((dir = g_dir_open(path, 0, NULL))) {
+		while ((name = g_dir_read_name(dir)))
+			g_ptr_array_add(names, g_strdup(name));
+		g_dir_close(dir);
+	}
+	g_ptr_array_sort(names, strcmp_cb);
+
+	sum = g_checksum_new(G_CHECKSUM_SHA1);
+	if (common_stamp)
+		g_checksum_update(sum, (const guchar *)common_stamp, -1);
+	for (i = 0; i < names->len; i++) {
+		name = g_ptr_array_index(names, i);
+		file = g_build_filename(path, name, NULL);
+		/* Skip directories, e.g. Python's bytecode cache. */
+		if (!g_stat(file, &st) && S_ISREG(st.st_mode)) {
+			line = g_strdup_printf("%s %" G_GINT64_FORMAT " %"
+				G_GINT64_FORMAT "\n", name, (gint64)st.st_size,
+				(gint64)st.st_mtime);
+			g_checksum_update(sum, (const guchar *)line, -1);
+			g_free(line);
+		}
+		g_free(file);
+	}
+	stamp = g_strdup(g_checksum_get_string(sum));
+
+	g_checksum_free(sum);
+	g_ptr_array_free(names, TRUE);
+
+	return stamp;
+}
+
+/*
+ * Read the decoder metadata cache. Returns NULL if the cache is disabled
+ * (SIGROKDECODE_CACHE is set, but empty). A missing, outdated or broken
+ * cache file results in an empty cache.
+ */
+static struct decoder_cache *decoder_cache_open(void)
+{
+	struct decoder_cache *cache;
+	GVariant *var, *entries, *entry;
+	GVariantIter iter;
+	const char *env_path, *version, *key;
+	gchar *data;
+	gsize len;
+
+	if ((env_path = g_getenv("SIGROKDECODE_CACHE")) && !*env_path)
+		return NULL;
+
+	cache = g_malloc(sizeof(struct decoder_cache));
+	if (env_path)
+		cache->path = g_strdup(env_path);
+	else
+		cache->path = g_build_filename(g_get_user_cache_dir(),
+			PACKAGE_TARNAME, "decoders.cache", NULL);
+	cache->entries = g_hash_table_new_full(g_str_hash, g_str_equal,
+		g_free, (GDestroyNotify)g_variant_unref);
+	cache->used = g_hash_table_new_full(g_str_hash, g_str_equal,
+		g_free, (GDestroyNotify)g_variant_unref);
+	cache->changed = FALSE;
+
+	if (!g_file_get_contents(cache->path, &data, &len, NULL))
+		return cache;
+
+	var = g_variant_ref_sink(g_variant_new_from_data(
+		G_VARIANT_TYPE(DECODER_CACHE), data, len, FALSE, g_free, data));
+	g_variant_get(var, "(&s@a{s" DECODER_CACHE_ENTRY "})", &version,
+		&entries);
+	if (!strcmp(version, DECODER_CACHE_VERSION)) {
+		g_variant_iter_init(&iter, entries);
+		while (g_variant_iter_next(&iter, "{&s@" DECODER_CACHE_ENTRY "}",
+				&key, &entry))
+			g_hash_table_insert(cache->entries, g_strdup(key), entry);
+	} else {
+		srd_dbg("Ignoring decoder cache %s of version %s.",
+			cache->path, version);
+	}
+	g_variant_unref(entries);
+	g_variant_unref(var);
+
+	srd_dbg("Read %u entries from decoder cache %s.",
+		g_hash_table_size(cache->entries), cache->path);
+
+	return cache;
+}
+
+/* Write the decoder metadata cache if it changed, and free it. */
+static void decoder_cache_close(struct decoder_cache *cache)
+{
+	GVariantBuilder b;
+	GHashTableIter iter;
+	GVariant *var;
+	GError *error;
+	gpointer key, entry;
+	char *dir;
+
+	if (!cache)
+		return;
+
+	/* Entries of modules which were not seen again are dropped. */
+	if (cache->changed || g_hash_table_size(cache->used) !=
+			g_hash_table_size(cache->entries)) {
+		g_variant_builder_init(&b,
+			G_VARIANT_TYPE("a{s" DECODER_CACHE_ENTRY "}"));
+		g_hash_table_iter_init(&iter, cache->used);
+		while (g_hash_table_iter_next(&iter, &key, &entry)) {
+			g_variant_builder_add(&b, "{s@" DECODER_CACHE_ENTRY "}",
+				key, entry);
+		}
+		var = g_variant_ref_sink(g_variant_new("(sa{s"
+			DECODER_CACHE_ENTRY "})", DECODER_CACHE_VERSION, &b));
+
+		error = NULL;
+		dir = g_path_get_dirname(cache->path);
+		g_mkdir_with_parents(dir, 0755);
+		if (!g_file_set_contents(cache->path, g_variant_get_data(var),
+				g_variant_get_size(var), &error)) {
+			srd_warn("Failed to write decoder cache: %s",
+				error->message);
+			g_error_free(error);
+		} else {
+			srd_dbg("Wrote %u entries to decoder cache %s.",
+				g_hash_table_size(cache->used), cache->path);
+		}
+		g_free(dir);
+		g_variant_unref(var);
+	}
+
+	g_hash_table_destroy(cache->used);
+	g_hash_table_destroy(cache->entries);
+	g_free(cache->path);
+	g_free(cache);
+}
+
+static gboolean module_loaded(const char *module_name)
+{
+	gboolean loaded;
+	PyGILState_STATE gstate;
+
+	if (lazy_decoders && g_hash_table_contains(lazy_decoders, module_name))
+		return TRUE;
+
+	gstate = PyGILState_Ensure();
+	loaded = PyDict_GetItemString(PyImport_GetModuleDict(),
+		module_name) != NULL;
+	PyGILState_Release(gstate);
+
+	return loaded;
+}
+
+/*
+ * Check whether a module which srd_decoder_load() failed on was imported,
+ * but has no decoder (e.g. a helper module).
+ */
+static gboolean module_without_decoder(const char *module_name)
+{
+	PyObject *py_mod;
+	gboolean ret;
+	PyGILState_STATE gstate;
+
+	gstate = PyGILState_Ensure();
+	py_mod = PyDict_GetItemString(PyImport_GetModuleDict(), module_name);
+	ret = py_mod && !PyObject_HasAttrString(py_mod, "Decoder");
+	PyGILState_Release(gstate);
+
+	return ret;
+}
+
+/*
+ * Load a decoder from its cached metadata if its files did not change,
+ * otherwise import it like srd_decoder_load() does, and cache it.
+ * Modules which fail to load are not cached, since the cause might not
+ * be in their files (e.g. a missing Python module), so they are tried
+ * again next time.
+ */
+static void decoder_load_cached(struct decoder_cache *cache,
+		const char *module_name, const char *module_path,
+		const char *stamp)
+{
+	struct srd_decoder *dec;
+	GVariant *entry, *maybe, *var;
+	const char *entry_stamp;
+	guint num_decoders;
+
+	if (module_loaded(module_name))
+		return;
+
+	if ((entry = g_hash_table_lookup(cache->entries, module_path))) {
+		g_variant_get(entry, "(&s@m" DECODER_CACHE_DECODER ")",
+			&entry_stamp, &maybe);
+		if (!strcmp(entry_stamp, stamp)) {
+			/* Modules without a decoder are cached, too. */
+			if ((var = g_variant_get_maybe(maybe))) {
+				dec = decoder_from_variant(var);
+				g_variant_unref(var);
+				if (!lazy_decoders) {
+					lazy_decoders = g_hash_table_new_full(
+						g_str_hash, g_str_equal, g_free,
+						NULL);
+				}
+				g_hash_table_insert(lazy_decoders,
+					g_strdup(module_name), dec);
+				pd_list = g_slist_append(pd_list, dec);
+			}
+			g_variant_unref(maybe);
+			g_hash_table_insert(cache->used, g_strdup(module_path),
+				g_variant_ref(entry));
+			return;
+		}
+		g_variant_unref(maybe);
+	}
+
+	num_decoders = g_slist_length(pd_list);
+	dec = NULL;
+	if (srd_decoder_load(module_name) == SRD_OK &&
+			g_slist_length(pd_list) > num_decoders)
+		dec = g_slist_last(pd_list)->data;
+	else if (!module_without_decoder(module_name))
+		return;
+
+	entry = g_variant_new("(s@m" DECODER_CACHE_DECODER ")", stamp,
+		g_variant_new_maybe(G_VARIANT_TYPE(DECODER_CACHE_DECODER),
+		dec ? decoder_to_variant(dec) : NULL));
+	g_hash_table_insert(cache->used, g_strdup(module_path),
+		g_variant_ref_sink(entry));
+	cache->changed = TRUE;
+}
+
+/*
+ * Load the decoders listed in the index of a decoder bundle, a zip archive
+ * of precompiled modules as created by tools/install-decoders. Decoders
+ * are looked up in the metadata cache, which is stamped with the bundle's
+ * id. Returns FALSE if the archive has no index. The caller holds the GIL.
+ */
+static gboolean load_bundle(struct decoder_cache *cache,
+		const char *zip_path, PyObject *zipimporter, const char *prefix)
+{
+	PyObject *py_data;
+	char *data, *index_path, *module_path, **lines, **names;
+	const char *bundle_id;
+	Py_ssize_t len;
+	long magic;
+	guint i, num_names;
+
+	index_path = g_strconcat(prefix, DECODER_BUNDLE_INDEX, NULL);
+	py_data = PyObject_CallMethod(zipimporter, "get_data", "s", index_path);
+	g_free(index_path);
+	if (!py_data) {
+		PyErr_Clear();
+		return FALSE;
+	}
+	if (PyBytes_AsStringAndSize(py_data, &data, &len) < 0) {
+		srd_exception_catch("Failed to read the index of %s", zip_path);
+		Py_DECREF(py_data);
+		return TRUE;
+	}
+	lines = g_strsplit(data, "\n", 0);
+	Py_DECREF(py_data);
+
+	if (!lines[0] || strcmp(lines[0], DECODER_BUNDLE_FORMAT)) {
+		srd_err("Unsupported decoder bundle format in %s.", zip_path);
+		g_strfreev(lines);
+		return TRUE;
+	}
+
+	magic = -1;
+	bundle_id = NULL;
+	names = g_malloc0_n(g_strv_length(lines), sizeof(char *));
+	num_names = 0;
+	for (i = 1; lines[i]; i++) {
+		if (g_str_has_prefix(lines[i], "magic "))
+			magic = strtol(lines[i] + 6, NULL, 10);
+		else if (g_str_has_prefix(lines[i], "id "))
+			bundle_id = lines[i] + 3;
+		else if (g_str_has_prefix(lines[i], "decoder "))
+			names[num_names++] = lines[i] + 8;
+	}
+
+	/* Bytecode only loads with the Python version it was compiled for. */
+	if (magic != PyImport_GetMagicNumber()) {
+		srd_err("Decoder bundle %s was built for another Python "
+			"version.", zip_path);
+		num_names = 0;
+	}
+
+	srd_dbg("Loading %u decoders from bundle %s.", num_names, zip_path);
+	for (i = 0; i < num_names; i++) {
+		if (cache && bundle_id) {
+			module_path = g_build_filename(zip_path, names[i], NULL);
+			decoder_load_cached(cache, names[i], module_path,
+				bundle_id);
+			g_free(module_path);
+		} else {
+			srd_decoder_load(names[i]);
+		}
+	}
+
+	g_free(names);
+	g_strfreev(lines);
+
+	return TRUE;
+}
+
+static void srd_decoder_load_all_zip_path(struct decoder_cache *cache,
+		char *zip_path)
 {
 	PyObject *zipimport_mod, *zipimporter_class, *zipimporter;
 	PyObject *prefix_obj, *files, *key, *value, *set, *modname;
@@ -1083,16 +1992,26 @@ static void srd_decoder_load_all_zip_path(char *zip_path)
 	if (prefix_obj == NULL)
 		goto err_out;
 
-	files = PyObject_GetAttrString(zipimporter, "_files");
-	if (files == NULL || !PyDict_Check(files))
+	if (py_str_as_str(prefix_obj, &prefix) != SRD_OK)
 		goto err_out;
 
-	set = PySet_New(NULL);
-	if (set == NULL)
+	if (load_bundle(cache, zip_path, zipimporter, prefix)) {
+		g_free(prefix);
 		goto err_out;
+	}
 
-	if (py_str_as_str(prefix_obj, &prefix) != SRD_OK)
+	/* Any other archive: import everything that looks like a module. */
+	files = PyObject_GetAttrString(zipimporter, "_files");
+	if (files == NULL || !PyDict_Check(files)) {
+		g_free(prefix);
 		goto err_out;
+	}
+
+	set = PySet_New(NULL);
+	if (set == NULL) {
+		g_free(prefix);
+		goto err_out;
+	}
 
 	prefix_len = strlen(prefix);
 
@@ -1138,17 +2057,26 @@ err_out:
 	PyGILState_Release(gstate);
 }
 
-static void srd_decoder_load_all_path(char *path)
+static void srd_decoder_load_all_path(struct decoder_cache *cache,
+		char *path)
 {
 	GDir *dir;
 	const gchar *direntry;
+	char *common_path, *common_stamp, *module_path, *stamp;
 
 	if (!(dir = g_dir_open(path, 0, NULL))) {
 		/* Not really fatal. Try zipimport method too. */
-		srd_decoder_load_all_zip_path(path);
+		srd_decoder_load_all_zip_path(cache, path);
 		return;
 	}
 
+	common_stamp = NULL;
+	if (cache) {
+		common_path = g_build_filename(path, "common", NULL);
+		common_stamp = module_stamp(common_path, NULL);
+		g_free(common_path);
+	}
+
 	/*
 	 * This ignores errors returned by srd_decoder_load(). That
 	 * function will have logged the cause, but in any case we
@@ -1156,27 +2084,58 @@ static void srd_decoder_load_all_path(char *path)
 	 */
 	while ((direntry = g_dir_read_name(dir)) != NULL) {
 		/* The directory name is the module name (e.g. "i2c"). */
-		srd_decoder_load(direntry);
+		if (cache) {
+			/* Not a decoder, and its stamp is in every decoder's. */
+			if (!strcmp(direntry, "common"))
+				continue;
+			module_path = g_build_filename(path, direntry, NULL);
+			stamp = module_stamp(module_path, common_stamp);
+			decoder_load_cached(cache, direntry, module_path, stamp);
+			g_free(stamp);
+			g_free(module_path);
+		} else {
+			srd_decoder_load(direntry);
+		}
 	}
 	g_dir_close(dir);
+	g_free(common_stamp);
 }
 
 /**
  * Load all installed protocol decoders.
  *
+ * Decoders' metadata is kept in a cache file, so decoders whose files
+ * did not change since can be listed and looked up without importing
+ * their Python modules. These get imported when needed, e.g. when an
+ * instance is created. Decoders which fail to load are not cached. The
+ * cache file is "libsigrokdecode/decoders.cache" in the user's cache
+ * directory (e.g. ~/.cache), the SIGROKDECODE_CACHE environment variable
+ * can name another file, or be set to an empty string to disable the
+ * cache.
+ *
+ * A search path may also be a decoder bundle, a zip archive of precompiled
+ * decoders as created by "tools/install-decoders -b". The decoders in its
+ * index are loaded, other zip archives are searched for modules.
+ *
  * @return SRD_OK upon success, a (negative) error code otherwise.
  *
  * @since 0.1.0
  */
 SRD_API int srd_decoder_load_all(void)
 {
+	struct decoder_cache *cache;
 	GSList *l;
+	int64_t start_time;
 
 	if (!srd_check_init())
 		return SRD_ERR;
 
+	start_time = g_get_monotonic_time();
+	cache = decoder_cache_open();
 	for (l = searchpaths; l; l = l->next)
-		srd_decoder_load_all_path(l->data);
+		srd_decoder_load_all_path(cache, l->data);
+	decoder_cache_close(cache);
+	srd_load_stats_print(g_get_monotonic_time() - start_time);
 
 	return SRD_OK;
 }
@@ -1200,6 +2159,9 @@ SRD_API int srd_decoder_unload_all(void)
 	g_slist_foreach(pd_list, srd_decoder_unload_cb, NULL);
 	g_slist_free(pd_list);
 	pd_list = NULL;
+	if (lazy_decoders)
+		g_hash_table_destroy(lazy_decoders);
+	lazy_decoders = NULL;
 
 	return SRD_OK;
 }
@@ -207,7 +207,8 @@ def decode_frame_end(self, can_rx, bitnum):
             crc_bits = self.bits[x:x + self.crc_len + 1]
             self.crc = bitpack_msb(crc_bits)
             self.putb([11, ['%s sequence: 0x%04x' % (crc_type, self.crc),
-                            '%s: 0x%04x' % (crc_type, self.crc), '%s' % crc_type]])
+                            '%s: 0x%04x' % (crc_type, self.crc), '%s' % crc_type],
+                       self.crc])
             if not self.is_valid_crc(crc_bits):
                 self.putb([16, ['CRC is invalid']])
 
@@ -297,7 +298,7 @@ def decode_standard_frame(self, can_rx, bitnum):
         elif bitnum == self.dlc_start + 3:
             self.dlc = bitpack_msb(self.bits[self.dlc_start:self.dlc_start + 4])
             self.putb([10, ['Data length code: %d' % self.dlc,
-                            'DLC: %d' % self.dlc, 'DLC']])
+                            'DLC: %d' % self.dlc, 'DLC'], self.dlc])
             self.last_databit = self.dlc_start + 3 + (dlc2len(self.dlc) * 8)
             if self.dlc > 8 and not self.fd:
                 self.putb([16, ['Data length code (DLC) > 8 is not allowed']])
@@ -317,7 +318,7 @@ def decode_standard_frame(self, can_rx, bitnum):
                 ss = self.ss_databytebits[i * 8]
                 es = self.ss_databytebits[((i + 1) * 8) - 1]
                 self.putg(ss, es, [0, ['Data byte %d: 0x%02x' % (i, b),
-                                       'DB %d: 0x%02x' % (i, b), 'DB']])
+                                       'DB %d: 0x%02x' % (i, b), 'DB'], (i, b)])
             self.ss_databytebits = []
 
         elif bitnum > self.last_databit:
@@ -339,12 +340,12 @@ def decode_extended_frame(self, can_rx, bitnum):
             self.eid = bitpack_msb(self.bits[14:])
             s = '%d (0x%x)' % (self.eid, self.eid)
             self.putb([4, ['Extended Identifier: %s' % s,
-                           'Extended ID: %s' % s, 'Extended ID', 'EID']])
+                           'Extended ID: %s' % s, 'Extended ID', 'EID'], self.eid])
 
             self.fullid = self.ident << 18 | self.eid
             s = '%d (0x%x)' % (self.fullid, self.fullid)
             self.putb([5, ['Full Identifier: %s' % s, 'Full ID: %s' % s,
-                           'Full ID', 'FID']])
+                           'Full ID', 'FID'], self.fullid])
 
             # Bit 12: Substitute remote request (SRR) bit
             self.put12([9, ['Substitute remote request: %d' % self.bits[12],
@@ -399,7 +400,7 @@ def decode_extended_frame(self, can_rx, bitnum):
         elif bitnum == self.dlc_start + 3:
             self.dlc = bitpack_msb(self.bits[self.dlc_start:self.dlc_start + 4])
             self.putb([10, ['Data length code: %d' % self.dlc,
-                            'DLC: %d' % self.dlc, 'DLC']])
+                            'DLC: %d' % self.dlc, 'DLC'], self.dlc])
             self.last_databit = self.dlc_start + 3 + (dlc2len(self.dlc) * 8)
 
         # Remember all databyte bits, except the very last one.
@@ -417,7 +418,7 @@ def decode_extended_frame(self, can_rx, bitnum):
                 ss = self.ss_databytebits[i * 8]
                 es = self.ss_databytebits[((i + 1) * 8) - 1]
                 self.putg(ss, es, [0, ['Data byte %d: 0x%02x' % (i, b),
-                                       'DB %d: 0x%02x' % (i, b), 'DB']])
+                                       'DB %d: 0x%02x' % (i, b), 'DB'], (i, b)])
             self.ss_databytebits = []
 
         elif bitnum > self.last_databit:
@@ -465,7 +466,7 @@ def handle_bit(self, can_rx):
             self.ident = bitpack_msb(self.bits[1:])
             self.fullid = self.ident
             s = '%d (0x%x)' % (self.ident, self.ident),
-            self.putb([3, ['Identifier: %s' % s, 'ID: %s' % s, 'ID']])
+            self.putb([3, ['Identifier: %s' % s, 'ID: %s' % s, 'ID'], self.ident])
             if (self.ident & 0x7f0) == 0x7f0:
                 self.putb([16, ['Identifier bits 10..4 must not be all recessive']])
 
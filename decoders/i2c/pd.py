@@ -85,11 +85,14 @@ class Decoder(srd.Decoder):
         ('stop', 'Stop condition'),
         ('ack', 'ACK'),
         ('nack', 'NACK'),
-        ('bit', 'Data/address bit'),
-        ('address-read', 'Address read'),
-        ('address-write', 'Address write'),
-        ('data-read', 'Data read'),
-        ('data-write', 'Data write'),
+        ('bit', 'Data/address bit', ('%d',)),
+        ('address-read', 'Address read',
+            ('Address read: %02X', 'AR: %02X', '%02X')),
+        ('address-write', 'Address write',
+            ('Address write: %02X', 'AW: %02X', '%02X')),
+        ('data-read', 'Data read', ('Data read: %02X', 'DR: %02X', '%02X')),
+        ('data-write', 'Data write',
+            ('Data write: %02X', 'DW: %02X', '%02X')),
         ('warning', 'Warning'),
     )
     annotation_rows = (
@@ -208,16 +211,15 @@ def handle_address_or_data(self, pins):
         self.putb([bin_class, bytes([d])])
 
         for bit in self.bits:
-            self.put(bit[1], bit[2], self.out_ann, [5, ['%d' % bit[0]]])
+            self.put(bit[1], bit[2], self.out_ann, [5, (bit[0],)])
 
         if cmd.startswith('ADDRESS'):
             self.ss, self.es = self.samplenum, self.samplenum + self.bitwidth
             w = ['Write', 'Wr', 'W'] if self.wr else ['Read', 'Rd', 'R']
-            self.putx([proto[cmd][0], w])
+            self.putx([proto[cmd][0], w, bool(self.wr)])
             self.ss, self.es = self.ss_byte, self.samplenum
 
-        self.putx([proto[cmd][0], ['%s: %02X' % (proto[cmd][1], d),
-                   '%s: %02X' % (proto[cmd][2], d), '%02X' % d]])
+        self.putx([proto[cmd][0], (d,)])
 
         # Done with this packet.
         self.bitcount = self.databyte = 0
@@ -229,7 +231,7 @@ def get_ack(self, pins):
         self.ss, self.es = self.samplenum, self.samplenum + self.bitwidth
         cmd = 'NACK' if (sda == 1) else 'ACK'
         self.putp([cmd, None])
-        self.putx([proto[cmd][0], proto[cmd][1:]])
+        self.putx([proto[cmd][0], proto[cmd][1:], sda == 0])
         # There could be multiple data bytes in a row, so either find
         # another data byte or a STOP condition next.
         self.state = 'FIND DATA'
@@ -63,6 +63,7 @@ def __init__(self):
     def reset(self):
         self.samplerate = None
         self.oldws = 1
+        self.newws = 1
         self.bitcount = 0
         self.data = 0
         self.samplesreceived = 0
@@ -126,54 +127,70 @@ def wav_sample(self, sample):
         return struct.pack('<I', self.data)
 
     def decode(self):
+        # Fetch SCK edges in batches, this saves a wait() call per edge.
+        # Pin values come packed into an integer, bit N is channel N.
+        # Rising edges shift in data bits. After WS has flipped, the
+        # word gets submitted upon the next falling edge.
+        flipped = False
         while True:
-            # Wait for a rising edge on the SCK pin.
-            sck, ws, sd = self.wait({0: 'r'})
-
-            self.data = (self.data << 1) | sd
-            self.bitcount += 1
-
-            # This was not the LSB unless WS has flipped.
-            if ws == self.oldws:
-                continue
-
-            # Only submit the sample, if we received the beginning of it.
-            if self.ss_block is not None:
-
-                if not self.wrote_wav_header:
-                    self.put(0, 0, self.out_binary, [0, self.wav_header()])
-                    self.wrote_wav_header = True
-
-                self.samplesreceived += 1
-
-                sck = self.wait({0: 'f'})
-
-                idx = 0 if not self.oldws else 1
-                c1 = 'Left channel' if not self.oldws else 'Right channel'
-                c2 = 'Left' if not self.oldws else 'Right'
-                c3 = 'L' if not self.oldws else 'R'
-                v = '%08x' % self.data
-                self.putpb(['DATA', [c3, self.data]])
-                self.putb([idx, ['%s: %s' % (c1, v), '%s: %s' % (c2, v),
-                                 '%s: %s' % (c3, v), c3]])
-                self.putbin([0, self.wav_sample(self.data)])
-
-                # Check that the data word was the correct length.
-                if self.wordlength != -1 and self.wordlength != self.bitcount:
-                    self.putb([2, ['Received %d-bit word, expected %d-bit '
-                                   'word' % (self.bitcount, self.wordlength)]])
-
-                self.wordlength = self.bitcount
-            else:
-                sck = self.wait({0: 'f'})
-
-            # Reset decoder state.
-            self.data = 0
-            self.bitcount = 0
-            self.ss_block = self.samplenum
+            samplenums, pins, _ = self.wait_many({0: 'e'}, 256)
+            for self.samplenum, p in zip(samplenums, pins):
+                sck, ws, sd = p & 1, (p >> 1) & 1, (p >> 2) & 1
+                if not flipped:
+                    if sck:
+                        flipped = self.handle_rising_edge(ws, sd)
+                    continue
+                if sck:
+                    continue
+                self.handle_falling_edge()
+                flipped = False
+
+    def handle_rising_edge(self, ws, sd):
+        self.data = (self.data << 1) | sd
+        self.bitcount += 1
+
+        # This was not the LSB unless WS has flipped.
+        if ws == self.oldws:
+            return False
+
+        # Only submit the sample, if we received the beginning of it.
+        if self.ss_block is not None:
+
+            if not self.wrote_wav_header:
+                self.put(0, 0, self.out_binary, [0, self.wav_header()])
+                self.wrote_wav_header = True
+
+            self.samplesreceived += 1
+
+        self.newws = ws
+        return True
+
+    def handle_falling_edge(self):
+        if self.ss_block is not None:
+            idx = 0 if not self.oldws else 1
+            c1 = 'Left channel' if not self.oldws else 'Right channel'
+            c2 = 'Left' if not self.oldws else 'Right'
+            c3 = 'L' if not self.oldws else 'R'
+            v = '%08x' % self.data
+            self.putpb(['DATA', [c3, self.data]])
+            self.putb([idx, ['%s: %s' % (c1, v), '%s: %s' % (c2, v),
+                             '%s: %s' % (c3, v), c3]])
+            self.putbin([0, self.wav_sample(self.data)])
+
+            # Check that the data word was the correct length.
+            if self.wordlength != -1 and self.wordlength != self.bitcount:
+                self.putb([2, ['Received %d-bit word, expected %d-bit '
+                               'word' % (self.bitcount, self.wordlength)]])
+
+            self.wordlength = self.bitcount
+
+        # Reset decoder state.
+        self.data = 0
+        self.bitcount = 0
+        self.ss_block = self.samplenum
 
-            # Save the first sample position.
-            if self.first_sample is None:
-                self.first_sample = self.samplenum
+        # Save the first sample position.
+        if self.first_sample is None:
+            self.first_sample = self.samplenum
 
-            self.oldws = ws
+        self.oldws = self.newws
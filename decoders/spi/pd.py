@@ -103,10 +103,10 @@ class Decoder(srd.Decoder):
         {'id': 'wordsize', 'desc': 'Word size', 'default': 8},
     )
     annotations = (
-        ('miso-data', 'MISO data'),
-        ('mosi-data', 'MOSI data'),
-        ('miso-bit', 'MISO bit'),
-        ('mosi-bit', 'MOSI bit'),
+        ('miso-data', 'MISO data', ('%02X',)),
+        ('mosi-data', 'MOSI data', ('%02X',)),
+        ('miso-bit', 'MISO bit', ('%d',)),
+        ('mosi-bit', 'MOSI bit', ('%d',)),
         ('warning', 'Warning'),
         ('miso-transfer', 'MISO transfer'),
         ('mosi-transfer', 'MOSI transfer'),
@@ -183,16 +183,16 @@ def putdata(self):
         # Bit annotations.
         if self.have_miso:
             for bit in self.misobits:
-                self.put(bit[1], bit[2], self.out_ann, [2, ['%d' % bit[0]]])
+                self.put(bit[1], bit[2], self.out_ann, [2, (bit[0],)])
         if self.have_mosi:
             for bit in self.mosibits:
-                self.put(bit[1], bit[2], self.out_ann, [3, ['%d' % bit[0]]])
+                self.put(bit[1], bit[2], self.out_ann, [3, (bit[0],)])
 
         # Dataword annotations.
         if self.have_miso:
-            self.put(ss, es, self.out_ann, [0, ['%02X' % self.misodata]])
+            self.put(ss, es, self.out_ann, [0, (self.misodata,)])
         if self.have_mosi:
-            self.put(ss, es, self.out_ann, [1, ['%02X' % self.mosidata]])
+            self.put(ss, es, self.out_ann, [1, (self.mosidata,)])
 
     def reset_decoder_state(self):
         self.misodata = 0 if self.have_miso else None
@@ -281,10 +281,12 @@ def find_clk_edge(self, miso, mosi, clk, cs, first):
             elif self.ss_transfer != -1:
                 if self.have_miso:
                     self.put(self.ss_transfer, self.samplenum, self.out_ann,
-                        [5, [' '.join(format(x.val, '02X') for x in self.misobytes)]])
+                        [5, [' '.join(format(x.val, '02X') for x in self.misobytes)],
+                        [x.val for x in self.misobytes]])
                 if self.have_mosi:
                     self.put(self.ss_transfer, self.samplenum, self.out_ann,
-                        [6, [' '.join(format(x.val, '02X') for x in self.mosibytes)]])
+                        [6, [' '.join(format(x.val, '02X') for x in self.mosibytes)],
+                        [x.val for x in self.mosibytes]])
                 self.put(self.ss_transfer, self.samplenum, self.out_python,
                     ['TRANSFER', self.mosibytes, self.misobytes])
 
@@ -342,6 +344,11 @@ def decode(self):
         (clk, miso, mosi, cs) = self.wait({})
         self.find_clk_edge(miso, mosi, clk, cs, True)
 
+        # Fetch edges in batches, this saves a wait() call per edge.
+        # Pin values come packed into an integer, bit N is channel N.
         while True:
-            (clk, miso, mosi, cs) = self.wait(wait_cond)
-            self.find_clk_edge(miso, mosi, clk, cs, False)
+            samplenums, pins, matched = self.wait_many(wait_cond, 256)
+            for self.samplenum, p, m in zip(samplenums, pins, matched):
+                self.matched = (bool(m & 1), bool(m & 2))
+                clk, miso, mosi, cs = p & 1, (p >> 1) & 1, (p >> 2) & 1, (p >> 3) & 1
+                self.find_clk_edge(miso, mosi, clk, cs, False)
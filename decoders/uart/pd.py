@@ -299,7 +299,8 @@ def handle_packet(self, rxtx):
                     s += ' '
             if self.options['format'] != 'ascii' and s[-1] == ' ':
                 s = s[:-1] # Drop trailing space.
-            self.putx_packet(rxtx, [Ann.RX_PACKET + rxtx, [s]])
+            self.putx_packet(rxtx, [Ann.RX_PACKET + rxtx, [s],
+                list(self.packet_cache[rxtx])])
             self.packet_cache[rxtx] = []
 
     def get_data_bits(self, rxtx, signal):
@@ -307,7 +308,8 @@ def get_data_bits(self, rxtx, signal):
         if self.startsample[rxtx] == -1:
             self.startsample[rxtx] = self.samplenum
 
-        self.putg([Ann.RX_DATA_BIT + rxtx, ['%d' % signal]])
+        if self.has_ann_listener(Ann.RX_DATA_BIT + rxtx):
+            self.putg([Ann.RX_DATA_BIT + rxtx, ['%d' % signal]])
 
         # Store individual data bits and their start/end samplenumbers.
         s, halfbit = self.samplenum, int(self.bit_width / 2)
@@ -329,7 +331,7 @@ def get_data_bits(self, rxtx, signal):
         b = self.datavalue[rxtx]
         formatted = self.format_value(b)
         if formatted is not None:
-            self.putx(rxtx, [rxtx, [formatted]])
+            self.putx(rxtx, [rxtx, [formatted], b])
 
         bdata = b.to_bytes(self.bw, byteorder='big')
         self.putbin(rxtx, [Bin.RX + rxtx, bdata])
@@ -280,7 +280,7 @@ def handle_packet(self):
         pidname = pids.get(pid, ('UNKNOWN', 'Unknown PID'))[0]
         self.ss, self.es = self.bits[8][1], self.bits[15][2]
         self.putpb(['PID', pidname])
-        self.putb([2, ['PID: %s' % pidname, pidname, pidname[0]]])
+        self.putb([2, ['PID: %s' % pidname, pidname, pidname[0]], pidname])
         self.packet.append(pid)
         self.packet_summary += pidname
 
@@ -294,7 +294,8 @@ def handle_packet(self):
                 framenum = bitstr_to_num(packet[16:26 + 1])
                 self.ss, self.es = self.bits[16][1], self.bits[26][2]
                 self.putpb(['FRAMENUM', framenum])
-                self.putb([3, ['Frame: %d' % framenum, 'Frame', 'Fr', 'F']])
+                self.putb([3, ['Frame: %d' % framenum, 'Frame', 'Fr', 'F'],
+                           framenum])
                 self.packet.append(framenum)
                 self.packet_summary += ' %d' % framenum
             else:
@@ -303,7 +304,7 @@ def handle_packet(self):
                 self.ss, self.es = self.bits[16][1], self.bits[22][2]
                 self.putpb(['ADDR', addr])
                 self.putb([4, ['Address: %d' % addr, 'Addr: %d' % addr,
-                               'Addr', 'A']])
+                               'Addr', 'A'], addr])
                 self.packet.append(addr)
                 self.packet_summary += ' ADDR %d' % addr
 
@@ -311,7 +312,8 @@ def handle_packet(self):
                 ep = bitstr_to_num(packet[23:26 + 1])
                 self.ss, self.es = self.bits[23][1], self.bits[26][2]
                 self.putpb(['EP', ep])
-                self.putb([5, ['Endpoint: %d' % ep, 'EP: %d' % ep, 'EP', 'E']])
+                self.putb([5, ['Endpoint: %d' % ep, 'EP: %d' % ep, 'EP', 'E'],
+                           ep])
                 self.packet.append(ep)
                 self.packet_summary += ' EP %d' % ep
 
@@ -321,10 +323,11 @@ def handle_packet(self):
             self.ss, self.es = self.bits[27][1], self.bits[31][2]
             if crc5 == crc5_calc:
                 self.putpb(['CRC5', crc5])
-                self.putb([6, ['CRC5: 0x%02X' % crc5, 'CRC5', 'C']])
+                self.putb([6, ['CRC5: 0x%02X' % crc5, 'CRC5', 'C'], crc5])
             else:
                 self.putpb(['CRC5 ERROR', crc5])
-                self.putb([7, ['CRC5 ERROR: 0x%02X' % crc5, 'CRC5 ERR', 'CE', 'C']])
+                self.putb([7, ['CRC5 ERROR: 0x%02X' % crc5, 'CRC5 ERR', 'CE', 'C'],
+                           crc5])
             self.packet.append(crc5)
         elif pidname in ('DATA0', 'DATA1', 'DATA2', 'MDATA'):
             # Bits[16:packetlen-16]: Data
@@ -337,7 +340,7 @@ def handle_packet(self):
                 self.ss, self.es = self.bits[16 + i][1], self.bits[23 + i][2]
                 self.putpb(['DATABYTE', db])
                 self.putb([8, ['Databyte: %02X' % db, 'Data: %02X' % db,
-                               'DB: %02X' % db, '%02X' % db]])
+                               'DB: %02X' % db, '%02X' % db], db])
                 databytes.append(db)
                 self.packet_summary += ' %02X' % db
             self.packet_summary += ' ]'
@@ -353,10 +356,11 @@ def handle_packet(self):
             self.ss, self.es = self.bits[-16][1], self.bits[-1][2]
             if crc16 == crc16_calc:
                 self.putpb(['CRC16', crc16])
-                self.putb([9, ['CRC16: 0x%04X' % crc16, 'CRC16', 'C']])
+                self.putb([9, ['CRC16: 0x%04X' % crc16, 'CRC16', 'C'], crc16])
             else:
                 self.putpb(['CRC16 ERROR', crc16])
-                self.putb([10, ['CRC16 ERROR: 0x%04X' % crc16, 'CRC16 ERR', 'CE', 'C']])
+                self.putb([10, ['CRC16 ERROR: 0x%04X' % crc16, 'CRC16 ERR', 'CE', 'C'],
+                           crc16])
             self.packet.append(crc16)
         elif pidname in ('ACK', 'NAK', 'STALL', 'NYET', 'ERR'):
             pass # Nothing to do, these only have SYNC+PID+EOP fields.
@@ -30,6 +30,12 @@
 
 extern SRD_PRIV GSList *sessions;
 
+/*
+ * All decoder instances of all sessions, keyed by their Python object,
+ * see srd_inst_find_by_obj(). Only accessed while holding the GIL.
+ */
+static GHashTable *inst_by_obj = NULL;
+
 /** @endcond */
 
 /**
@@ -78,19 +84,23 @@ static void oldpins_array_free(struct srd_decoder_inst *di)
 }
 
 /**
- * Set one or more options in a decoder instance.
+ * Convert options to the values a decoder's instances see, a dict of
+ * Python objects with the defaults for options which are not given.
  *
- * Handled options are removed from the hash.
+ * The caller must hold the GIL.
  *
- * @param di Decoder instance.
- * @param options A GHashTable of options to set.
+ * @param dec The decoder.
+ * @param inst_id The instance ID, for messages.
+ * @param options A GHashTable of options, or NULL for the defaults.
+ * @param py_options Returns a new reference to the dict, or NULL if the
+ *                   decoder has no options.
  *
  * @return SRD_OK upon success, a (negative) error code otherwise.
  *
- * @since 0.1.0
+ * @private
  */
-SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
-		GHashTable *options)
+SRD_PRIV int srd_inst_options_to_dict(const struct srd_decoder *dec,
+		const char *inst_id, GHashTable *options, PyObject **py_options)
 {
 	struct srd_decoder_option *sdo;
 	PyObject *py_di_options, *py_optval;
@@ -98,54 +108,36 @@ SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
 	GSList *l;
 	double val_double;
 	gint64 val_int;
-	int ret;
+	guint num_given;
 	const char *val_str;
-	PyGILState_STATE gstate;
-
-	if (!di) {
-		srd_err("Invalid decoder instance.");
-		return SRD_ERR_ARG;
-	}
-
-	if (!options) {
-		srd_err("Invalid options GHashTable.");
-		return SRD_ERR_ARG;
-	}
 
-	gstate = PyGILState_Ensure();
+	*py_options = NULL;
 
-	if (!PyObject_HasAttrString(di->decoder->py_dec, "options")) {
+	if (!PyObject_HasAttrString(dec->py_dec, "options")) {
 		/* Decoder has no options. */
-		PyGILState_Release(gstate);
-		if (g_hash_table_size(options) == 0) {
+		if (!options || g_hash_table_size(options) == 0) {
 			/* No options provided. */
 			return SRD_OK;
 		} else {
 			srd_err("Protocol decoder has no options.");
 			return SRD_ERR_ARG;
 		}
-		return SRD_OK;
 	}
 
-	ret = SRD_ERR_PYTHON;
-	py_optval = NULL;
-
 	/*
 	 * The 'options' tuple is a class variable, but we need to
 	 * change it. Changing it directly will affect the entire class,
 	 * so we need to create a new object for it, and populate that
 	 * instead.
 	 */
-	if (!(py_di_options = PyObject_GetAttrString(di->py_inst, "options")))
+	if (!(py_di_options = PyDict_New()))
 		goto err_out;
-	Py_DECREF(py_di_options);
-	py_di_options = PyDict_New();
-	PyObject_SetAttrString(di->py_inst, "options", py_di_options);
-	Py_DECREF(py_di_options);
 
-	for (l = di->decoder->options; l; l = l->next) {
+	num_given = 0;
+	for (l = dec->options; l; l = l->next) {
 		sdo = l->data;
-		if ((value = g_hash_table_lookup(options, sdo->id))) {
+		py_optval = NULL;
+		if (options && (value = g_hash_table_lookup(options, sdo->id))) {
 			/* A value was supplied for this option. */
 			if (!g_variant_type_equal(g_variant_get_type(value),
 				  g_variant_get_type(sdo->def))) {
@@ -153,6 +145,7 @@ SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
 					"as the default value.", sdo->id);
 				goto err_out;
 			}
+			num_given++;
 		} else {
 			/* Use default for this option. */
 			value = sdo->def;
@@ -187,20 +180,72 @@ SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
 			Py_XDECREF(py_optval);
 			goto err_out;
 		}
-		/* Not harmful even if we used the default. */
-		g_hash_table_remove(options, sdo->id);
 		Py_XDECREF(py_optval);
 	}
-	if (g_hash_table_size(options) != 0)
-		srd_warn("Unknown options specified for '%s'", di->inst_id);
+	if (options && g_hash_table_size(options) != num_given)
+		srd_warn("Unknown options specified for '%s'", inst_id);
+
+	*py_options = py_di_options;
 
-	ret = SRD_OK;
+	return SRD_OK;
 
 err_out:
-	if (PyErr_Occurred()) {
+	Py_XDECREF(py_di_options);
+	if (PyErr_Occurred())
 		srd_exception_catch("Stray exception in srd_inst_option_set()");
-		ret = SRD_ERR_PYTHON;
+
+	return SRD_ERR_PYTHON;
+}
+
+/**
+ * Set one or more options in a decoder instance.
+ *
+ * Handled options are removed from the hash.
+ *
+ * @param di Decoder instance.
+ * @param options A GHashTable of options to set.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.1.0
+ */
+SRD_API int srd_inst_option_set(struct srd_decoder_inst *di,
+		GHashTable *options)
+{
+	struct srd_decoder_option *sdo;
+	PyObject *py_di_options;
+	GSList *l;
+	int ret;
+	PyGILState_STATE gstate;
+
+	if (!di) {
+		srd_err("Invalid decoder instance.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!options) {
+		srd_err("Invalid options GHashTable.");
+		return SRD_ERR_ARG;
+	}
+
+	gstate = PyGILState_Ensure();
+
+	ret = srd_inst_options_to_dict(di->decoder, di->inst_id, options,
+		&py_di_options);
+	if (ret == SRD_OK && py_di_options) {
+		if (PyObject_SetAttrString(di->py_inst, "options",
+				py_di_options) < 0) {
+			srd_exception_catch("Failed to set options of %s",
+				di->inst_id);
+			ret = SRD_ERR_PYTHON;
+		}
+		Py_DECREF(py_di_options);
+		for (l = di->decoder->options; l; l = l->next) {
+			sdo = l->data;
+			g_hash_table_remove(options, sdo->id);
+		}
 	}
+
 	PyGILState_Release(gstate);
 
 	return ret;
@@ -214,51 +259,51 @@ static gint compare_channel_id(const struct srd_channel *pdch,
 }
 
 /**
- * Set all channels in a decoder instance.
- *
- * This function sets _all_ channels for the specified decoder instance, i.e.,
- * it overwrites any channels that were already defined (if any).
+ * Map channels to the indexes of a decoder's instances' input data.
  *
- * @param di Decoder instance.
- * @param new_channels A GHashTable of channels to set. Key is channel name,
- *                     value is the channel number. Samples passed to this
- *                     instance will be arranged in this order.
+ * @param dec The decoder.
+ * @param new_channels A GHashTable of channels, see
+ *                     srd_inst_channel_set_all().
+ * @param channelmap Returns the newly allocated channel map, or NULL if
+ *                   no channels were given.
  *
  * @return SRD_OK upon success, a (negative) error code otherwise.
  *
- * @since 0.4.0
+ * @private
  */
-SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
-		GHashTable *new_channels)
+SRD_PRIV int srd_inst_channelmap_new(const struct srd_decoder *dec,
+		GHashTable *new_channels, int **channelmap)
 {
 	GVariant *channel_val;
 	GList *l;
 	GSList *sl;
 	struct srd_channel *pdch;
-	int *new_channelmap, new_channelnum, num_required_channels, i;
+	int *new_channelmap, new_channelnum, num_channels;
+	int num_required_channels, i;
 	char *channel_id;
 
-	srd_dbg("Setting channels for instance %s with list of %d channels.",
-		di->inst_id, g_hash_table_size(new_channels));
+	*channelmap = NULL;
 
 	if (g_hash_table_size(new_channels) == 0)
 		/* No channels provided. */
 		return SRD_OK;
 
-	if (di->dec_num_channels == 0) {
+	num_required_channels = g_slist_length(dec->channels);
+	num_channels = num_required_channels + g_slist_length(dec->opt_channels);
+	if (num_channels == 0) {
 		/* Decoder has no channels. */
 		srd_err("Protocol decoder %s has no channels to define.",
-			di->decoder->name);
+			dec->name);
 		return SRD_ERR_ARG;
 	}
 
-	new_channelmap = g_malloc0(sizeof(int) * di->dec_num_channels);
+	new_channelmap = g_malloc0(sizeof(int) * num_channels);
 
 	/*
 	 * For now, map all indexes to channel -1 (can be overridden later).
 	 * This -1 is interpreted as an unspecified channel later.
 	 */
-	for (i = 0; i < di->dec_num_channels; i++)
+	for (i = 0; i < num_channels; i++)
 		new_channelmap[i] = -1;
 
 	for (l = g_hash_table_get_keys(new_channels); l; l = l->next) {
@@ -272,13 +317,13 @@ SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
 			return SRD_ERR_ARG;
 		}
 		new_channelnum = g_variant_get_int32(channel_val);
-		if (!(sl = g_slist_find_custom(di->decoder->channels, channel_id,
+		if (!(sl = g_slist_find_custom(dec->channels, channel_id,
 				(GCompareFunc)compare_channel_id))) {
 			/* Fall back on optional channels. */
-			if (!(sl = g_slist_find_custom(di->decoder->opt_channels,
+			if (!(sl = g_slist_find_custom(dec->opt_channels,
 			     channel_id, (GCompareFunc)compare_channel_id))) {
 				srd_err("Protocol decoder %s has no channel "
-					"'%s'.", di->decoder->name, channel_id);
+					"'%s'.", dec->name, channel_id);
 				g_free(new_channelmap);
 				return SRD_ERR_ARG;
 			}
@@ -290,11 +335,10 @@ SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
 	}
 
 	srd_dbg("Final channel map:");
-	num_required_channels = g_slist_length(di->decoder->channels);
-	for (i = 0; i < di->dec_num_channels; i++) {
-		GSList *ll = g_slist_nth(di->decoder->channels, i);
+	for (i = 0; i < num_channels; i++) {
+		GSList *ll = g_slist_nth(dec->channels, i);
 		if (!ll)
-			ll = g_slist_nth(di->decoder->opt_channels,
+			ll = g_slist_nth(dec->opt_channels,
 				i - num_required_channels);
 		pdch = ll->data;
 		srd_dbg(" - PD ch idx %d (%s) = input data ch idx %d (%s)", i,
@@ -306,72 +350,110 @@ SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
 	for (i = 0; i < num_required_channels; i++) {
 		if (new_channelmap[i] != -1)
 			continue;
-		pdch = g_slist_nth(di->decoder->channels, i)->data;
+		pdch = g_slist_nth(dec->channels, i)->data;
 		srd_err("Required channel '%s' (index %d) was not specified.",
 			pdch->id, i);
 		g_free(new_channelmap);
 		return SRD_ERR;
 	}
 
+	*channelmap = new_channelmap;
+
+	return SRD_OK;
+}
+
+/**
+ * Set all channels in a decoder instance.
+ *
+ * This function sets _all_ channels for the specified decoder instance, i.e.,
+ * it overwrites any channels that were already defined (if any).
+ *
+ * @param di Decoder instance.
+ * @param new_channels A GHashTable of channels to set. Key is channel name,
+ *                     value is the channel number. Samples passed to this
+ *                     instance will be arranged in this order.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
+		GHashTable *new_channels)
+{
+	int *new_channelmap, ret;
+
+	srd_dbg("Setting channels for instance %s with list of %d channels.",
+		di->inst_id, g_hash_table_size(new_channels));
+
+	ret = srd_inst_channelmap_new(di->decoder, new_channels,
+		&new_channelmap);
+	if (ret != SRD_OK || !new_channelmap)
+		return ret;
+
 	g_free(di->dec_channelmap);
 	di->dec_channelmap = new_channelmap;
 
+	/* Compiled conditions refer to the previous channel map. */
+	condition_cache_free(di);
+
+	return SRD_OK;
+}
+
+/*
+ * Give an instance its own copy of the options, see srd_inst_option_set(),
+ * or make it use the decoder class' options if py_options is NULL. The
+ * caller must hold the GIL.
+ */
+static int inst_options_set(struct srd_decoder_inst *di, PyObject *py_options)
+{
+	PyObject *py_copy;
+
+	if (!py_options) {
+		/* Not an error if the instance has no options of its own. */
+		if (PyObject_DelAttrString(di->py_inst, "options") < 0)
+			PyErr_Clear();
+		return SRD_OK;
+	}
+
+	py_copy = PyDict_Copy(py_options);
+	if (!py_copy || PyObject_SetAttrString(di->py_inst, "options",
+			py_copy) < 0) {
+		Py_XDECREF(py_copy);
+		srd_exception_catch("Failed to set options of %s", di->inst_id);
+		return SRD_ERR_PYTHON;
+	}
+	Py_DECREF(py_copy);
+
 	return SRD_OK;
 }
 
 /**
- * Create a new protocol decoder instance.
+ * Create a decoder instance from options which were already converted.
  *
  * @param sess The session holding the protocol decoder instance.
- *             Must not be NULL.
- * @param decoder_id Decoder 'id' field.
- * @param options GHashtable of options which override the defaults set in
- *                the decoder class. May be NULL.
+ * @param dec The decoder, which must have been imported.
+ * @param inst_id The instance ID, which must be unique in the session.
+ *                The instance takes ownership of it.
+ * @param py_options A dict of the instance's options, or NULL to keep the
+ *                   decoder class' options. The instance gets a copy.
  *
  * @return Pointer to a newly allocated struct srd_decoder_inst, or
  *         NULL in case of failure.
  *
- * @since 0.3.0
+ * @private
  */
-SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
-		const char *decoder_id, GHashTable *options)
+SRD_PRIV struct srd_decoder_inst *srd_inst_create(struct srd_session *sess,
+		struct srd_decoder *dec, char *inst_id, PyObject *py_options)
 {
 	int i;
-	struct srd_decoder *dec;
 	struct srd_decoder_inst *di;
-	char *inst_id;
 	PyGILState_STATE gstate;
 
-	i = 1;
-
-	if (!sess)
-		return NULL;
-
-	if (!(dec = srd_decoder_get_by_id(decoder_id))) {
-		srd_err("Protocol decoder %s not found.", decoder_id);
-		return NULL;
-	}
-
 	di = g_malloc0(sizeof(struct srd_decoder_inst));
 
 	di->decoder = dec;
 	di->sess = sess;
-
-	if (options) {
-		inst_id = g_hash_table_lookup(options, "id");
-		if (inst_id)
-			di->inst_id = g_strdup(inst_id);
-		g_hash_table_remove(options, "id");
-	}
-
-	/* Create a unique instance ID (as none was provided). */
-	if (!di->inst_id) {
-		di->inst_id = g_strdup_printf("%s-%d", decoder_id, i++);
-		while (srd_inst_find_by_id(sess, di->inst_id)) {
-			g_free(di->inst_id);
-			di->inst_id = g_strdup_printf("%s-%d", decoder_id, i++);
-		}
-	}
+	di->inst_id = inst_id;
 
 	/*
 	 * Prepare a default channel map, where samples come in the
@@ -400,27 +482,41 @@ SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
 	if (!(di->py_inst = PyObject_CallObject(dec->py_dec, NULL))) {
 		if (PyErr_Occurred())
 			srd_exception_catch("Failed to create %s instance",
-					decoder_id);
-		PyGILState_Release(gstate);
-		g_free(di->dec_channelmap);
-		g_free(di);
-		return NULL;
+					dec->id);
+		goto err_out;
 	}
 
-	PyGILState_Release(gstate);
-
-	if (options && srd_inst_option_set(di, options) != SRD_OK) {
-		g_free(di->dec_channelmap);
-		g_free(di);
-		return NULL;
+	if (py_options && inst_options_set(di, py_options) != SRD_OK) {
+		Py_DECREF(di->py_inst);
+		goto err_out;
 	}
 
+	PyGILState_Release(gstate);
+
 	di->condition_list = NULL;
+	di->condition_cache = NULL;
+	di->condition_key = NULL;
+	di->condition_skips = NULL;
 	di->match_array = NULL;
+	di->ann_batch = NULL;
+	di->bin_coalesce = NULL;
+	di->output_filters = NULL;
+	di->ann_store = srd_ann_store_new(di);
+	di->py_decode = NULL;
+	di->py_decode_items = NULL;
+	di->py_items = NULL;
 	di->abs_start_samplenum = 0;
 	di->abs_end_samplenum = 0;
 	di->inbuf = NULL;
 	di->inbuflen = 0;
+	di->py_inbuf = NULL;
+	di->transitions = NULL;
+	di->num_transitions = 0;
+	di->transition_idx = 0;
+	di->chunk = NULL;
+	g_queue_init(&di->chunk_queue);
+	di->abs_next_samplenum = 0;
+	di->abs_first_samplenum = 0;
 	di->abs_cur_samplenum = 0;
 	di->thread_handle = NULL;
 	di->got_new_samples = FALSE;
@@ -438,13 +534,132 @@ SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
 	g_cond_init(&di->handled_all_samples_cond);
 	g_mutex_init(&di->data_mutex);
 
+	gstate = PyGILState_Ensure();
+	if (!inst_by_obj)
+		inst_by_obj = g_hash_table_new(g_direct_hash, g_direct_equal);
+	g_hash_table_insert(inst_by_obj, di->py_inst, di);
+	PyGILState_Release(gstate);
+
 	/* Instance takes input from a frontend by default. */
 	sess->di_list = g_slist_append(sess->di_list, di);
-	srd_dbg("Creating new %s instance %s.", decoder_id, di->inst_id);
+	srd_dbg("Creating new %s instance %s.", dec->id, di->inst_id);
+
+	return di;
+
+err_out:
+	PyGILState_Release(gstate);
+	oldpins_array_free(di);
+	g_free(di->channel_samples);
+	g_free(di->dec_channelmap);
+	g_free(di->inst_id);
+	g_free(di);
+
+	return NULL;
+}
+
+/**
+ * Create a new protocol decoder instance.
+ *
+ * @param sess The session holding the protocol decoder instance.
+ *             Must not be NULL.
+ * @param decoder_id Decoder 'id' field.
+ * @param options GHashtable of options which override the defaults set in
+ *                the decoder class. May be NULL.
+ *
+ * @return Pointer to a newly allocated struct srd_decoder_inst, or
+ *         NULL in case of failure.
+ *
+ * @since 0.3.0
+ */
+SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
+		const char *decoder_id, GHashTable *options)
+{
+	int i, ret;
+	struct srd_decoder *dec;
+	struct srd_decoder_inst *di;
+	struct srd_decoder_option *sdo;
+	char *inst_id;
+	GSList *l;
+	PyObject *py_options;
+	PyGILState_STATE gstate;
+
+	i = 1;
+
+	if (!sess)
+		return NULL;
+
+	if (!(dec = srd_decoder_get_by_id(decoder_id))) {
+		srd_err("Protocol decoder %s not found.", decoder_id);
+		return NULL;
+	}
+
+	/* Decoders loaded from the metadata cache get imported now. */
+	if (srd_decoder_import(dec) != SRD_OK)
+		return NULL;
+
+	inst_id = NULL;
+	if (options) {
+		inst_id = g_strdup(g_hash_table_lookup(options, "id"));
+		g_hash_table_remove(options, "id");
+	}
+
+	/* Create a unique instance ID (as none was provided). */
+	if (!inst_id) {
+		inst_id = g_strdup_printf("%s-%d", decoder_id, i++);
+		while (srd_inst_find_by_id(sess, inst_id)) {
+			g_free(inst_id);
+			inst_id = g_strdup_printf("%s-%d", decoder_id, i++);
+		}
+	}
+
+	py_options = NULL;
+	if (options) {
+		gstate = PyGILState_Ensure();
+		ret = srd_inst_options_to_dict(dec, inst_id, options,
+			&py_options);
+		PyGILState_Release(gstate);
+		if (ret != SRD_OK) {
+			g_free(inst_id);
+			return NULL;
+		}
+		/* Handled options are removed, see srd_inst_option_set(). */
+		for (l = dec->options; l; l = l->next) {
+			sdo = l->data;
+			g_hash_table_remove(options, sdo->id);
+		}
+	}
+
+	di = srd_inst_create(sess, dec, inst_id, py_options);
+
+	if (py_options) {
+		gstate = PyGILState_Ensure();
+		Py_DECREF(py_options);
+		PyGILState_Release(gstate);
+	}
 
 	return di;
 }
 
+/**
+ * Find a decoder instance by its Python object.
+ *
+ * I.e. find that instance's instantiation of the sigrokdecode.Decoder class,
+ * anywhere in the stack tree of all sessions. The caller must hold the GIL.
+ *
+ * @param obj The Python class instantiation.
+ *
+ * @return Pointer to struct srd_decoder_inst, or NULL if not found.
+ *
+ * @private
+ */
+SRD_PRIV struct srd_decoder_inst *srd_inst_find_by_obj(const PyObject *obj)
+{
+	if (!inst_by_obj || !obj)
+		return NULL;
+
+	return g_hash_table_lookup(inst_by_obj, obj);
+}
+
 static void srd_inst_join_decode_thread(struct srd_decoder_inst *di)
 {
 	if (!di)
@@ -481,20 +696,63 @@ static void srd_inst_join_decode_thread(struct srd_decoder_inst *di)
 	g_mutex_init(&di->data_mutex);
 }
 
-static void srd_inst_reset_state(struct srd_decoder_inst *di)
+static void chunk_free(struct srd_chunk *chunk)
 {
-	if (!di)
+	PyGILState_STATE gstate;
+
+	if (!chunk)
 		return;
 
-	srd_dbg("%s: Resetting decoder state.", di->inst_id);
+	gstate = PyGILState_Ensure();
+	Py_DECREF(chunk->py_inbuf);
+	PyGILState_Release(gstate);
+	g_free(chunk->transitions);
+	g_free(chunk);
+}
 
-	/* Reset internal state of the decoder. */
-	condition_list_free(di);
+/*
+ * Free the current chunk (if owned) and all queued chunks, and drop
+ * the view of the current chunk's samples, see .peek_chunk().
+ */
+static void chunk_queue_free(struct srd_decoder_inst *di)
+{
+	struct srd_chunk *chunk;
+	PyGILState_STATE gstate;
+
+	if (di->py_inbuf) {
+		gstate = PyGILState_Ensure();
+		Py_DECREF((PyObject *)di->py_inbuf);
+		di->py_inbuf = NULL;
+		PyGILState_Release(gstate);
+	}
+
+	chunk_free(di->chunk);
+	di->chunk = NULL;
+	while ((chunk = g_queue_pop_head(&di->chunk_queue)))
+		chunk_free(chunk);
+}
+
+static void srd_inst_reset_state(struct srd_decoder_inst *di)
+{
+	if (!di)
+		return;
+
+	srd_dbg("%s: Resetting decoder state.", di->inst_id);
+
+	/* Reset internal state of the decoder. */
+	condition_list_free(di);
 	match_array_free(di);
+	srd_inst_output_discard(di);
+	srd_ann_store_clear(di->ann_store);
 	di->abs_start_samplenum = 0;
 	di->abs_end_samplenum = 0;
 	di->inbuf = NULL;
 	di->inbuflen = 0;
+	di->transitions = NULL;
+	di->num_transitions = 0;
+	chunk_queue_free(di);
+	di->abs_next_samplenum = 0;
+	di->abs_first_samplenum = 0;
 	di->abs_cur_samplenum = 0;
 	oldpins_array_free(di);
 	di->got_new_samples = FALSE;
@@ -520,6 +778,8 @@ SRD_API int srd_inst_stack(struct srd_session *sess,
 		struct srd_decoder_inst *di_bottom,
 		struct srd_decoder_inst *di_top)
 {
+	PyGILState_STATE gstate;
+
 	if (!sess)
 		return SRD_ERR_ARG;
 
@@ -528,6 +788,35 @@ SRD_API int srd_inst_stack(struct srd_session *sess,
 		return SRD_ERR_ARG;
 	}
 
+	/*
+	 * Look up the method(s) which receive the bottom instance's
+	 * output once, instead of upon every put(). Decoders which
+	 * implement decode_items() get their input queued, and passed
+	 * as a list of (ss, es, data) tuples when a chunk was processed.
+	 */
+	if (!di_top->py_decode) {
+		gstate = PyGILState_Ensure();
+		di_top->py_decode = PyObject_GetAttrString(di_top->py_inst, "decode");
+		if (!di_top->py_decode) {
+			srd_exception_catch("Protocol decoder instance %s",
+					di_top->inst_id);
+			PyGILState_Release(gstate);
+			return SRD_ERR_PYTHON;
+		}
+		if (PyObject_HasAttrString(di_top->py_inst, "decode_items")) {
+			di_top->py_decode_items = PyObject_GetAttrString(
+				di_top->py_inst, "decode_items");
+			di_top->py_items = PyList_New(0);
+			if (!di_top->py_decode_items || !di_top->py_items) {
+				srd_exception_catch("Protocol decoder instance %s",
+						di_top->inst_id);
+				Py_CLEAR(di_top->py_decode_items);
+				Py_CLEAR(di_top->py_items);
+			}
+		}
+		PyGILState_Release(gstate);
+	}
+
 	if (g_slist_find(sess->di_list, di_top)) {
 		/* Remove from the unstacked list. */
 		sess->di_list = g_slist_remove(sess->di_list, di_top);
@@ -627,6 +916,270 @@ SRD_API struct srd_decoder_inst *srd_inst_find_by_id(struct srd_session *sess,
 	return di;
 }
 
+/**
+ * Declare which output of an instance is wanted by the frontend.
+ *
+ * Unwanted output is dropped in put(), before it gets converted and
+ * passed to callbacks. Decoders can check for wanted annotation classes
+ * by calling self.has_ann_listener(), and skip building unwanted
+ * annotations entirely. Output is also dropped when no callback wants
+ * it, see srd_pd_output_callback_add_filtered().
+ *
+ * @param di Decoder instance to use. Must not be NULL.
+ * @param output_type The output type to filter. SRD_OUTPUT_ANN and
+ *                    SRD_OUTPUT_BINARY filter by annotation and binary
+ *                    classes, SRD_OUTPUT_META output can only be dropped
+ *                    entirely (with an empty list of classes). Python
+ *                    output always goes to stacked decoders.
+ * @param classes The wanted classes, or NULL to remove the filter, i.e.
+ *                to have all output of the type delivered.
+ * @param num_classes The number of entries in 'classes'.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_inst_output_filter_set(struct srd_decoder_inst *di,
+		int output_type, const int *classes, unsigned int num_classes)
+{
+	struct srd_class_filter *filter;
+	unsigned int i;
+	int max_class;
+
+	if (!di) {
+		srd_err("Invalid decoder instance.");
+		return SRD_ERR_ARG;
+	}
+
+	if (output_type < 0 || output_type >= SRD_NUM_OUTPUT_TYPES ||
+			output_type == SRD_OUTPUT_PYTHON) {
+		srd_err("Cannot filter output type %d.", output_type);
+		return SRD_ERR_ARG;
+	}
+	if (output_type == SRD_OUTPUT_META && classes && num_classes) {
+		srd_err("Meta output has no classes.");
+		return SRD_ERR_ARG;
+	}
+	for (i = 0; classes && i < num_classes; i++) {
+		if (classes[i] < 0) {
+			srd_err("Invalid class %d.", classes[i]);
+			return SRD_ERR_ARG;
+		}
+	}
+
+	if (!di->output_filters)
+		di->output_filters = g_malloc0(SRD_NUM_OUTPUT_TYPES *
+			sizeof(struct srd_class_filter));
+	filter = &di->output_filters[output_type];
+
+	g_free(filter->classes);
+	filter->classes = NULL;
+	filter->num_classes = 0;
+	filter->active = classes != NULL;
+	if (!classes)
+		return SRD_OK;
+
+	/* A lookup table, indexed by class. */
+	max_class = -1;
+	for (i = 0; i < num_classes; i++)
+		max_class = MAX(max_class, classes[i]);
+	filter->num_classes = max_class + 1;
+	filter->classes = g_malloc0(filter->num_classes * sizeof(gboolean));
+	for (i = 0; i < num_classes; i++)
+		filter->classes[classes[i]] = TRUE;
+
+	srd_dbg("%s: Filtering %s output, %u wanted classes.", di->inst_id,
+		output_type_name(output_type), num_classes);
+
+	return SRD_OK;
+}
+
+/**
+ * Declare which annotation rows of an instance are wanted by the frontend.
+ *
+ * This is srd_inst_output_filter_set() for SRD_OUTPUT_ANN, with the
+ * annotation classes of the given rows.
+ *
+ * @param di Decoder instance to use. Must not be NULL.
+ * @param row_ids NULL terminated list of the wanted rows' ids, or NULL
+ *                to remove the filter.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_inst_ann_row_filter_set(struct srd_decoder_inst *di,
+		const char *const *row_ids)
+{
+	const GSList *l, *c;
+	const struct srd_decoder_annotation_row *row;
+	GArray *classes;
+	int cls, ret;
+	unsigned int i;
+
+	if (!di) {
+		srd_err("Invalid decoder instance.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!row_ids)
+		return srd_inst_output_filter_set(di, SRD_OUTPUT_ANN, NULL, 0);
+
+	classes = g_array_new(FALSE, FALSE, sizeof(int));
+	for (i = 0; row_ids[i]; i++) {
+		for (l = di->decoder->annotation_rows; l; l = l->next) {
+			row = l->data;
+			if (!strcmp(row->id, row_ids[i]))
+				break;
+		}
+		if (!l) {
+			srd_err("%s: Unknown annotation row '%s'.",
+				di->inst_id, row_ids[i]);
+			g_array_free(classes, TRUE);
+			return SRD_ERR_ARG;
+		}
+		for (c = row->ann_classes; c; c = c->next) {
+			cls = GPOINTER_TO_SIZE(c->data);
+			g_array_append_val(classes, cls);
+		}
+	}
+
+	ret = srd_inst_output_filter_set(di, SRD_OUTPUT_ANN,
+		(const int *)classes->data, classes->len);
+	g_array_free(classes, TRUE);
+
+	return ret;
+}
+
+/**
+ * Check whether output of the given type and class is wanted, see
+ * srd_inst_output_filter_set().
+ *
+ * @param di The decoder instance.
+ * @param output_type The output type.
+ * @param output_class The annotation or binary class, or -1.
+ *
+ * @private
+ */
+SRD_PRIV gboolean srd_inst_output_filter_wants(
+		const struct srd_decoder_inst *di, int output_type,
+		int output_class)
+{
+	const struct srd_class_filter *filter;
+
+	if (!di->output_filters)
+		return TRUE;
+
+	filter = &di->output_filters[output_type];
+	if (!filter->active)
+		return TRUE;
+	if (output_class < 0 || (unsigned int)output_class >= filter->num_classes)
+		return FALSE;
+
+	return filter->classes[output_class];
+}
+
+/**
+ * Have consecutive binary output of an instance delivered in one piece.
+ *
+ * Some decoders emit large volumes of binary output in small pieces
+ * (e.g. one audio sample per call). With coalescing enabled, binary
+ * output of the same output and binary class is collected, and passed
+ * to the frontend's callback as one piece, spanning the samples of all
+ * of its parts. Collected data is delivered when output of another
+ * class is emitted, when it reaches 'max_size' bytes, and when the
+ * decoder stack finished a chunk of samples.
+ *
+ * Must not be called while the instance's decoder stack processes
+ * samples.
+ *
+ * @param di Decoder instance to use. Must not be NULL.
+ * @param max_size The number of bytes at which collected data gets
+ *                 delivered, or 0 to disable coalescing (the default).
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_inst_binary_coalesce_set(struct srd_decoder_inst *di,
+		uint64_t max_size)
+{
+	if (!di) {
+		srd_err("Invalid decoder instance.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!max_size) {
+		if (di->bin_coalesce) {
+			g_byte_array_free(di->bin_coalesce->data, TRUE);
+			g_free(di->bin_coalesce);
+			di->bin_coalesce = NULL;
+		}
+		return SRD_OK;
+	}
+
+	if (!di->bin_coalesce) {
+		di->bin_coalesce = g_malloc0(sizeof(struct srd_bin_coalesce));
+		di->bin_coalesce->data = g_byte_array_new();
+	}
+	di->bin_coalesce->max_size = max_size;
+	srd_dbg("%s: Coalescing binary output up to %" PRIu64 " bytes.",
+		di->inst_id, max_size);
+
+	return SRD_OK;
+}
+
+/* Drop an instance's output filters, see srd_inst_output_filter_set(). */
+static void output_filters_free(struct srd_decoder_inst *di)
+{
+	int i;
+
+	for (i = 0; di->output_filters && i < SRD_NUM_OUTPUT_TYPES; i++)
+		g_free(di->output_filters[i].classes);
+	g_free(di->output_filters);
+	di->output_filters = NULL;
+}
+
+/**
+ * Undo what the frontend set up on an instance after its creation.
+ *
+ * The options and the channel map are set back to the ones the instance
+ * was created with, output filters and binary coalescing are dropped.
+ * Must not be called while the instance's decoder stack processes
+ * samples.
+ *
+ * @param di The decoder instance.
+ * @param py_options The options the instance was created with, see
+ *                   srd_inst_create().
+ * @param channelmap The channel map the instance was created with, or
+ *                   NULL for the default one.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_inst_settings_restore(struct srd_decoder_inst *di,
+		PyObject *py_options, const int *channelmap)
+{
+	int i, ret;
+	PyGILState_STATE gstate;
+
+	gstate = PyGILState_Ensure();
+	ret = inst_options_set(di, py_options);
+	PyGILState_Release(gstate);
+	if (ret != SRD_OK)
+		return ret;
+
+	for (i = 0; i < di->dec_num_channels; i++)
+		di->dec_channelmap[i] = channelmap ? channelmap[i] : i;
+	condition_cache_free(di);
+
+	output_filters_free(di);
+	srd_inst_binary_coalesce_set(di, 0);
+
+	return SRD_OK;
+}
+
 /**
  * Set the list of initial (assumed) pin values.
  *
@@ -787,34 +1340,191 @@ SRD_PRIV void match_array_free(struct srd_decoder_inst *di)
 	di->match_array = NULL;
 }
 
-/** @private */
+/**
+ * Release the instance's current condition list.
+ *
+ * The compiled list itself is owned by the instance's condition cache,
+ * and gets re-used when .wait() gets called with the same conditions.
+ *
+ * @private
+ */
 SRD_PRIV void condition_list_free(struct srd_decoder_inst *di)
 {
-	GSList *l, *ll;
-
 	if (!di)
 		return;
 
-	for (l = di->condition_list; l; l = l->next) {
-		ll = l->data;
-		if (ll)
-			g_slist_free_full(ll, g_free);
+	di->condition_list = NULL;
+}
+
+static void condition_list_destroy(void *data)
+{
+	struct srd_condition_list *cl = data;
+
+	if (!cl)
+		return;
+
+	g_free(cl->masks);
+	g_free(cl);
+}
+
+static guint condition_list_key_hash(gconstpointer data)
+{
+	const struct srd_condition_list *cl = data;
+	unsigned int i;
+	guint hash;
+
+	hash = 5381;
+	for (i = 0; i < cl->key_len; i++)
+		hash = hash * 33 + cl->key[i];
+
+	return hash;
+}
+
+static gboolean condition_list_key_equal(gconstpointer a, gconstpointer b)
+{
+	const struct srd_condition_list *cl1 = a, *cl2 = b;
+
+	if (cl1->key_len != cl2->key_len)
+		return FALSE;
+
+	return memcmp(cl1->key, cl2->key, cl1->key_len * sizeof(cl1->key[0])) == 0;
+}
+
+/*
+ * Compile a condition list from its key, see condition_list_get().
+ * The list, its conditions and terms, and a copy of the key live in
+ * one allocation. Byte offsets and bit masks of the terms' input
+ * channels get resolved here, from the current channel map.
+ */
+static struct srd_condition_list *condition_list_new(
+		const struct srd_decoder_inst *di, const uint32_t *key,
+		unsigned int key_len)
+{
+	struct srd_condition_list *cl;
+	struct srd_term *term;
+	unsigned int num_conds, num_terms, num_pin_terms, i, k, pos;
+	int idx;
+
+	/* Caller ensures the key is well-formed. */
+	num_conds = key[0];
+	num_terms = key_len - 1 - num_conds;
+
+	cl = g_malloc0(sizeof(*cl) + num_conds * sizeof(cl->conds[0]) +
+		num_terms * sizeof(cl->terms[0]) + key_len * sizeof(key[0]));
+	cl->num_conds = num_conds;
+	cl->num_terms = num_terms;
+	cl->conds = (struct srd_condition *)(cl + 1);
+	cl->terms = (struct srd_term *)(cl->conds + num_conds);
+	cl->key = (uint32_t *)(cl->terms + num_terms);
+	cl->key_len = key_len;
+	memcpy(cl->key, key, key_len * sizeof(key[0]));
+
+	pos = 1;
+	term = cl->terms;
+	for (i = 0; i < num_conds; i++) {
+		cl->conds[i].num_terms = key[pos++];
+		cl->conds[i].terms = term;
+		num_pin_terms = 0;
+		for (k = 0; k < cl->conds[i].num_terms; k++, term++) {
+			term->type = SRD_COND_KEY_TYPE(key[pos]);
+			term->channel = SRD_COND_KEY_CHANNEL(key[pos]);
+			pos++;
+			term->byte_offset = -1;
+			term->bit_mask = 0;
+			if (term->type == SRD_TERM_SKIP) {
+				cl->conds[i].have_skip = TRUE;
+				cl->have_skip = TRUE;
+				continue;
+			}
+			if (term->type == SRD_TERM_ALWAYS_FALSE)
+				continue;
+			num_pin_terms++;
+			idx = di->dec_channelmap[term->channel];
+			if (idx < 0)
+				continue;
+			term->byte_offset = idx / 8;
+			term->bit_mask = 1 << (idx % 8);
+		}
+		if (cl->conds[i].have_skip && num_pin_terms)
+			cl->skip_mixed = TRUE;
 	}
 
-	g_slist_free(di->condition_list);
+	return cl;
+}
+
+/**
+ * Get the compiled condition list for the given key.
+ *
+ * The key describes the conditions of a .wait() call: The number of
+ * conditions, followed by each condition's number of terms and then its
+ * terms, see SRD_COND_KEY(). Compiled lists are cached per instance,
+ * such that decoders which wait for the same conditions over and over
+ * don't pay for the allocation and setup again. Skip counts are not
+ * part of the key, callers set them in the returned list's terms.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ * @param key The condition list key. Must not be NULL.
+ * @param key_len The number of elements in the key. Must be > 0.
+ *
+ * @return The compiled condition list, owned by the instance's cache.
+ *
+ * @private
+ */
+SRD_PRIV struct srd_condition_list *condition_list_get(
+		struct srd_decoder_inst *di, const uint32_t *key,
+		unsigned int key_len)
+{
+	struct srd_condition_list lookup, *cl;
+
+	if (!di->condition_cache) {
+		di->condition_cache = g_hash_table_new_full(
+			condition_list_key_hash, condition_list_key_equal,
+			condition_list_destroy, NULL);
+	}
+
+	lookup.key = (uint32_t *)key;
+	lookup.key_len = key_len;
+	if ((cl = g_hash_table_lookup(di->condition_cache, &lookup)))
+		return cl;
+
+	/*
+	 * Keep the cache bounded for decoders which construct ever
+	 * different conditions. The current list is not referenced
+	 * while .wait() sets up new conditions.
+	 */
+	if (g_hash_table_size(di->condition_cache) >= SRD_CONDITION_CACHE_SIZE) {
+		srd_dbg("%s: Flushing condition cache.", di->inst_id);
+		g_hash_table_remove_all(di->condition_cache);
+	}
+
+	cl = condition_list_new(di, key, key_len);
+	g_hash_table_insert(di->condition_cache, cl, cl);
+
+	return cl;
+}
+
+/** @private */
+SRD_PRIV void condition_cache_free(struct srd_decoder_inst *di)
+{
+	if (!di)
+		return;
+
 	di->condition_list = NULL;
+	if (di->condition_cache) {
+		g_hash_table_destroy(di->condition_cache);
+		di->condition_cache = NULL;
+	}
 }
 
 static gboolean have_non_null_conds(const struct srd_decoder_inst *di)
 {
-	GSList *l, *cond;
+	unsigned int i;
 
 	if (!di)
 		return FALSE;
 
-	for (l = di->condition_list; l; l = l->next) {
-		cond = l->data;
-		if (cond)
+	for (i = 0; i < di->condition_list->num_conds; i++) {
+		if (di->condition_list->conds[i].num_terms)
 			return TRUE;
 	}
 
@@ -841,90 +1551,622 @@ static void update_old_pins_array(struct srd_decoder_inst *di,
 	}
 }
 
-static void update_old_pins_array_initial_pins(struct srd_decoder_inst *di)
+/**
+ * Get the location of a sample of the current chunk.
+ *
+ * For chunks of transitions this is the sample of the last transition
+ * at or before the given sample number.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ * @param abs_samplenum The absolute sample number. Must be within the
+ *                      current chunk.
+ *
+ * @return Pointer to the sample's data.
+ *
+ * @private
+ */
+SRD_PRIV const uint8_t *srd_inst_sample_pos(struct srd_decoder_inst *di,
+		uint64_t abs_samplenum)
+{
+	uint64_t idx, lo, hi;
+
+	if (!di->transitions)
+		return di->inbuf + ((abs_samplenum - di->abs_start_samplenum) * di->data_unitsize);
+
+	/* Most accesses are at or just after the previous one. */
+	idx = di->transition_idx;
+	if (di->transitions[idx] <= abs_samplenum) {
+		while (idx + 1 < di->num_transitions &&
+				di->transitions[idx + 1] <= abs_samplenum)
+			idx++;
+	} else {
+		lo = 0;
+		hi = idx;
+		while (lo + 1 < hi) {
+			idx = lo + (hi - lo) / 2;
+			if (di->transitions[idx] <= abs_samplenum)
+				lo = idx;
+			else
+				hi = idx;
+		}
+		idx = lo;
+	}
+	di->transition_idx = idx;
+
+	return di->inbuf + idx * di->data_unitsize;
+}
+
+static void update_old_pins_array_initial_pins(struct srd_decoder_inst *di)
+{
+	uint8_t sample;
+	int i, byte_offset, bit_offset;
+	const uint8_t *sample_pos;
+
+	if (!di || !di->dec_channelmap)
+		return;
+
+	sample_pos = srd_inst_sample_pos(di, di->abs_cur_samplenum);
+
+	oldpins_array_seed(di);
+	for (i = 0; i < di->dec_num_channels; i++) {
+		if (di->old_pins_array->data[i] != SRD_INITIAL_PIN_SAME_AS_SAMPLE0)
+			continue;
+		if (di->dec_channelmap[i] == -1)
+			continue; /* Ignore unused optional channels. */
+		byte_offset = di->dec_channelmap[i] / 8;
+		bit_offset = di->dec_channelmap[i] % 8;
+		sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
+		di->old_pins_array->data[i] = sample;
+	}
+}
+
+static gboolean term_matches(const struct srd_decoder_inst *di,
+		struct srd_term *term, const uint8_t *sample_pos)
+{
+	uint8_t old_sample, sample;
+
+	/* Caller ensures di, di->dec_channelmap, term, sample_pos != NULL. */
+
+	if (term->type == SRD_TERM_SKIP)
+		return sample_matches(0, 0, term);
+
+	/* Unused optional channels, or channels beyond the unitsize. */
+	if (term->byte_offset < 0 || term->byte_offset >= di->data_unitsize)
+		return FALSE;
+
+	sample = *(sample_pos + term->byte_offset) & term->bit_mask ? 1 : 0;
+	old_sample = di->old_pins_array->data[term->channel];
+
+	return sample_matches(old_sample, sample, term);
+}
+
+static gboolean all_terms_match(const struct srd_decoder_inst *di,
+		const struct srd_condition *cond, const uint8_t *sample_pos)
+{
+	unsigned int i;
+	struct srd_term *term;
+
+	/* Caller ensures di, cond, sample_pos != NULL. */
+
+	for (i = 0; i < cond->num_terms; i++) {
+		term = &cond->terms[i];
+		if (term->type == SRD_TERM_ALWAYS_FALSE)
+			return FALSE;
+		if (!term_matches(di, term, sample_pos))
+			return FALSE;
+	}
+
+	return TRUE;
+}
+
+static gboolean at_least_one_condition_matched(
+		const struct srd_decoder_inst *di, unsigned int num_conditions)
+{
+	unsigned int i;
+
+	/* Caller ensures di != NULL. */
+
+	for (i = 0; i < num_conditions; i++) {
+		if (di->match_array->data[i])
+			return TRUE;
+	}
+
+	return FALSE;
+}
+
+/*
+ * Add one term to a compiled condition. Returns FALSE when the term
+ * can never match (invalid channel or type, or contradicting terms).
+ */
+static gboolean cond_mask_add_term(struct srd_cond_mask *cm,
+		const struct srd_term *term, unsigned int unitsize)
+{
+	unsigned int byte;
+	uint8_t bit;
+	gboolean want_level, want_high;
+
+	if (term->type == SRD_TERM_ALWAYS_FALSE)
+		return FALSE;
+
+	if (term->byte_offset < 0 || (unsigned int)term->byte_offset >= unitsize)
+		return FALSE;
+	byte = term->byte_offset;
+	bit = term->bit_mask;
+
+	want_level = want_high = FALSE;
+	switch (term->type) {
+	case SRD_TERM_HIGH:
+		want_level = want_high = TRUE;
+		break;
+	case SRD_TERM_LOW:
+		want_level = TRUE;
+		break;
+	case SRD_TERM_RISING_EDGE:
+		want_level = want_high = TRUE;
+		cm->edge[byte] |= bit;
+		break;
+	case SRD_TERM_FALLING_EDGE:
+		want_level = TRUE;
+		cm->edge[byte] |= bit;
+		break;
+	case SRD_TERM_EITHER_EDGE:
+		cm->edge[byte] |= bit;
+		break;
+	case SRD_TERM_NO_EDGE:
+		cm->stable[byte] |= bit;
+		break;
+	default:
+		srd_err("Unknown term type %d.", term->type);
+		return FALSE;
+	}
+
+	if (want_level) {
+		if ((cm->level[byte] & bit) &&
+				!!(cm->value[byte] & bit) != want_high)
+			return FALSE;
+		cm->level[byte] |= bit;
+		if (want_high)
+			cm->value[byte] |= bit;
+	}
+	if (cm->edge[byte] & cm->stable[byte])
+		return FALSE;
+
+	cm->lo = MIN(cm->lo, byte);
+	cm->hi = MAX(cm->hi, byte);
+
+	return TRUE;
+}
+
+/*
+ * Compile the instance's condition list into bit masks for the raw
+ * sample data of the current unitsize. The result is kept with the
+ * (cached) condition list, until the unitsize changes.
+ */
+static struct srd_cond_masks *cond_masks_get(struct srd_decoder_inst *di)
+{
+	struct srd_condition_list *cl;
+	struct srd_cond_masks *m;
+	struct srd_cond_mask *cm;
+	unsigned int num_conds, unitsize, i, k, b;
+	uint8_t *bytes;
+
+	cl = di->condition_list;
+	unitsize = di->data_unitsize;
+	if (cl->masks && cl->masks->unitsize == unitsize)
+		return cl->masks;
+
+	g_free(cl->masks);
+
+	/* One allocation for the header, the conditions, and all masks. */
+	num_conds = cl->num_conds;
+	m = g_malloc0(sizeof(*m) + num_conds * sizeof(*cm) +
+		(2 + 4 * num_conds) * unitsize);
+	m->num_conds = num_conds;
+	m->unitsize = unitsize;
+	m->conds = (struct srd_cond_mask *)(m + 1);
+	bytes = (uint8_t *)(m->conds + num_conds);
+	m->watch = bytes;
+	m->prev = bytes + unitsize;
+	bytes += 2 * unitsize;
+	m->change_driven = TRUE;
+
+	for (i = 0; i < num_conds; i++) {
+		cm = &m->conds[i];
+		cm->level = bytes;
+		cm->value = bytes + unitsize;
+		cm->edge = bytes + 2 * unitsize;
+		cm->stable = bytes + 3 * unitsize;
+		bytes += 4 * unitsize;
+		cm->lo = unitsize;
+		cm->hi = 0;
+
+		/* Empty conditions never match (unless all of them are). */
+		cm->never_matches = !cl->conds[i].num_terms;
+		for (k = 0; k < cl->conds[i].num_terms && !cm->never_matches; k++) {
+			if (!cond_mask_add_term(cm, &cl->conds[i].terms[k], unitsize))
+				cm->never_matches = TRUE;
+		}
+		if (cm->never_matches)
+			continue;
+
+		/* Conditions without any terms left match every sample. */
+		if (cm->lo > cm->hi) {
+			cm->lo = 0;
+			cm->hi = 0;
+			m->change_driven = FALSE;
+		}
+		for (b = cm->lo; b <= cm->hi; b++) {
+			m->watch[b] |= cm->level[b] | cm->edge[b];
+			if (cm->stable[b])
+				m->change_driven = FALSE;
+		}
+	}
+
+	/* Replicate the watched bits for word-wise scans where possible. */
+	m->watch_word = 0;
+	if (unitsize == 1 || unitsize == 2 || unitsize == 4 || unitsize == 8) {
+		for (b = 0; b < sizeof(m->watch_word); b++)
+			((uint8_t *)&m->watch_word)[b] = m->watch[b % unitsize];
+	}
+
+	cl->masks = m;
+
+	return m;
+}
+
+/*
+ * Prepare the raw previous sample from the instance's old pins. This
+ * fails in the unusual case where several decoder channels are mapped
+ * to the same input channel, yet have different old pin values.
+ */
+static gboolean cond_masks_seed_prev(const struct srd_decoder_inst *di,
+		struct srd_cond_masks *m, const uint8_t *sample_pos)
+{
+	int i, idx;
+	uint8_t bit, *byte, *seen;
+
+	memcpy(m->prev, sample_pos, m->unitsize);
+	seen = g_alloca(m->unitsize);
+	memset(seen, 0, m->unitsize);
+	for (i = 0; i < di->dec_num_channels; i++) {
+		idx = di->dec_channelmap[i];
+		if (idx < 0 || (unsigned int)idx / 8 >= m->unitsize)
+			continue;
+		byte = &m->prev[idx / 8];
+		bit = 1 << (idx % 8);
+		if ((seen[idx / 8] & bit) &&
+				!!(*byte & bit) != !!di->old_pins_array->data[i])
+			return FALSE;
+		seen[idx / 8] |= bit;
+		if (di->old_pins_array->data[i] == SRD_INITIAL_PIN_HIGH)
+			*byte |= bit;
+		else if (di->old_pins_array->data[i] == SRD_INITIAL_PIN_LOW)
+			*byte &= ~bit;
+	}
+
+	return TRUE;
+}
+
+__attribute__((always_inline))
+static inline gboolean cond_mask_matches(const struct srd_cond_mask *cm,
+		const uint8_t *sample, const uint8_t *prev)
+{
+	unsigned int b;
+	uint8_t diff;
+
+	for (b = cm->lo; b <= cm->hi; b++) {
+		if ((sample[b] ^ cm->value[b]) & cm->level[b])
+			return FALSE;
+		diff = sample[b] ^ prev[b];
+		if ((diff & cm->edge[b]) != cm->edge[b])
+			return FALSE;
+		if (diff & cm->stable[b])
+			return FALSE;
+	}
+
+	return TRUE;
+}
+
+__attribute__((always_inline))
+static inline gboolean watched_bits_differ(const struct srd_cond_masks *m,
+		const uint8_t *sample, const uint8_t *prev)
+{
+	unsigned int b;
+
+	for (b = 0; b < m->unitsize; b++) {
+		if ((sample[b] ^ prev[b]) & m->watch[b])
+			return TRUE;
+	}
+
+	return FALSE;
+}
+
+/*
+ * Find the first sample at or after index 'i' (i >= 1) in 'buf' where
+ * any of the watched bits differ from the preceding sample. Checks up
+ * to 4 words of 64 bits per iteration, i.e. 32/16/8/4 samples for
+ * unitsizes of 1/2/4/8 bytes, and only narrows down to the individual
+ * sample after a change was seen.
+ *
+ * @return The index of the sample, or 'num' if there was no change.
+ */
+static uint64_t scan_for_change(const struct srd_cond_masks *m,
+		const uint8_t *buf, uint64_t i, uint64_t num)
+{
+	uint64_t a[4], b[4], diff, step, wordsamples;
+	const uint8_t *p;
+	unsigned int unitsize, k;
+
+	unitsize = m->unitsize;
+	if (m->watch_word) {
+		wordsamples = sizeof(uint64_t) / unitsize;
+		step = G_N_ELEMENTS(a) * wordsamples;
+		while (i + step <= num) {
+			p = buf + i * unitsize;
+			memcpy(a, p, sizeof(a));
+			memcpy(b, p - unitsize, sizeof(b));
+			diff = 0;
+			for (k = 0; k < G_N_ELEMENTS(a); k++)
+				diff |= a[k] ^ b[k];
+			if (diff & m->watch_word)
+				break;
+			i += step;
+		}
+		while (i + wordsamples <= num) {
+			p = buf + i * unitsize;
+			memcpy(a, p, sizeof(a[0]));
+			memcpy(b, p - unitsize, sizeof(b[0]));
+			if ((a[0] ^ b[0]) & m->watch_word)
+				break;
+			i += wordsamples;
+		}
+	}
+
+	/* Pinpoint the sample within the word, or handle the tail. */
+	for (; i < num; i++) {
+		p = buf + i * unitsize;
+		if (watched_bits_differ(m, p, p - unitsize))
+			return i;
+	}
+
+	return num;
+}
+
+/* Check all conditions against one sample, update the match array. */
+static gboolean cond_masks_match_all(struct srd_decoder_inst *di,
+		const struct srd_cond_masks *m, const uint8_t *sample_pos,
+		const uint8_t *prev)
+{
+	unsigned int j;
+	gboolean matched, any;
+
+	/* IMPORTANT: We need to check all conditions, even if there was a match already! */
+	any = FALSE;
+	for (j = 0; j < m->num_conds; j++) {
+		matched = !m->conds[j].never_matches &&
+			cond_mask_matches(&m->conds[j], sample_pos, prev);
+		di->match_array->data[j] = matched;
+		any |= matched;
+	}
+
+	return any;
+}
+
+/*
+ * Check all conditions against the samples of a chunk of transitions.
+ * Samples between transitions don't change, so only the first two
+ * samples of each run need to be checked: the transition itself, and
+ * the following sample without any change (which then is the result
+ * for all of the remaining samples of the run).
+ */
+static gboolean find_match_transitions(struct srd_decoder_inst *di,
+		struct srd_cond_masks *m, uint64_t num_samples_to_process)
 {
-	uint8_t sample;
-	int i, byte_offset, bit_offset;
-	const uint8_t *sample_pos;
+	const uint8_t *sample_pos, *prev;
+	uint64_t samplenum, end, run_end;
+
+	/* Caller ensures num_samples_to_process > 0. */
+
+	samplenum = di->abs_cur_samplenum;
+	end = samplenum + num_samples_to_process;
+	prev = m->prev;
+	while (samplenum < end) {
+		sample_pos = srd_inst_sample_pos(di, samplenum);
+		run_end = end;
+		if (di->transition_idx + 1 < di->num_transitions)
+			run_end = MIN(run_end, di->transitions[di->transition_idx + 1]);
+
+		if (cond_masks_match_all(di, m, sample_pos, prev)) {
+			di->abs_cur_samplenum = samplenum;
+			update_old_pins_array(di, sample_pos);
+			return TRUE;
+		}
+		if (samplenum + 1 < run_end && !m->change_driven &&
+				cond_masks_match_all(di, m, sample_pos, sample_pos)) {
+			di->abs_cur_samplenum = samplenum + 1;
+			update_old_pins_array(di, sample_pos);
+			return TRUE;
+		}
 
-	if (!di || !di->dec_channelmap)
-		return;
+		prev = sample_pos;
+		samplenum = run_end;
+	}
 
-	sample_pos = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * di->data_unitsize);
+	di->abs_cur_samplenum = end;
+	update_old_pins_array(di, prev);
 
-	oldpins_array_seed(di);
-	for (i = 0; i < di->dec_num_channels; i++) {
-		if (di->old_pins_array->data[i] != SRD_INITIAL_PIN_SAME_AS_SAMPLE0)
-			continue;
-		if (di->dec_channelmap[i] == -1)
-			continue; /* Ignore unused optional channels. */
-		byte_offset = di->dec_channelmap[i] / 8;
-		bit_offset = di->dec_channelmap[i] % 8;
-		sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
-		di->old_pins_array->data[i] = sample;
-	}
+	return FALSE;
 }
 
-static gboolean term_matches(const struct srd_decoder_inst *di,
-		struct srd_term *term, const uint8_t *sample_pos)
+/*
+ * Check all conditions against the samples in the current chunk,
+ * using the compiled bit masks. When all conditions depend on pin
+ * changes, samples which don't change any of the watched bits cannot
+ * match (the previous sample did not match either), and are skipped
+ * in bulk by the word-wise change scanner.
+ */
+static gboolean find_match_masked(struct srd_decoder_inst *di,
+		struct srd_cond_masks *m, uint64_t num_samples_to_process)
 {
-	uint8_t old_sample, sample;
-	int byte_offset, bit_offset, ch;
+	const uint8_t *buf, *sample_pos, *prev;
+	uint64_t i;
+	unsigned int unitsize;
 
-	/* Caller ensures di, di->dec_channelmap, term, sample_pos != NULL. */
+	/* Caller ensures num_samples_to_process > 0. */
 
-	if (term->type == SRD_TERM_SKIP)
-		return sample_matches(0, 0, term);
+	if (di->transitions)
+		return find_match_transitions(di, m, num_samples_to_process);
 
-	ch = term->channel;
-	byte_offset = di->dec_channelmap[ch] / 8;
-	bit_offset = di->dec_channelmap[ch] % 8;
-	sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
-	old_sample = di->old_pins_array->data[ch];
+	unitsize = m->unitsize;
+	buf = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * unitsize);
 
-	return sample_matches(old_sample, sample, term);
+	i = 0;
+	while (i < num_samples_to_process) {
+		if (i > 0 && m->change_driven) {
+			i = scan_for_change(m, buf, i, num_samples_to_process);
+			if (i >= num_samples_to_process)
+				break;
+		}
+		sample_pos = buf + i * unitsize;
+		prev = i ? sample_pos - unitsize : m->prev;
+		if (cond_masks_match_all(di, m, sample_pos, prev)) {
+			di->abs_cur_samplenum += i;
+			update_old_pins_array(di, sample_pos);
+			return TRUE;
+		}
+		i++;
+	}
+
+	di->abs_cur_samplenum += num_samples_to_process;
+	update_old_pins_array(di, buf + (num_samples_to_process - 1) * unitsize);
+
+	return FALSE;
 }
 
-static gboolean all_terms_match(const struct srd_decoder_inst *di,
-		const GSList *cond, const uint8_t *sample_pos)
+/*
+ * Get the number of samples a skip condition still has to skip before
+ * it matches. Skip terms of a condition count one after another, the
+ * condition matches when all of them did. Returns UINT64_MAX for
+ * conditions which never match.
+ */
+static uint64_t skip_remaining(const struct srd_condition *cond)
 {
-	const GSList *l;
-	struct srd_term *term;
-
-	/* Caller ensures di, cond, sample_pos != NULL. */
+	const struct srd_term *term;
+	uint64_t remaining;
+	unsigned int i;
 
-	for (l = cond; l; l = l->next) {
-		term = l->data;
-		if (term->type == SRD_TERM_ALWAYS_FALSE)
-			return FALSE;
-		if (!term_matches(di, term, sample_pos))
-			return FALSE;
+	remaining = 0;
+	for (i = 0; i < cond->num_terms; i++) {
+		term = &cond->terms[i];
+		if (term->type != SRD_TERM_SKIP)
+			return UINT64_MAX;
+		if (term->num_samples_to_skip - term->num_samples_already_skipped >
+				UINT64_MAX - 1 - remaining)
+			return UINT64_MAX - 1;
+		remaining += term->num_samples_to_skip -
+			term->num_samples_already_skipped;
 	}
 
-	return TRUE;
+	return remaining;
 }
 
-static gboolean at_least_one_condition_matched(
-		const struct srd_decoder_inst *di, unsigned int num_conditions)
+/* Account for 'count' samples which a skip condition did not match. */
+static void skip_advance(struct srd_condition *cond, uint64_t count)
 {
+	struct srd_term *term;
+	uint64_t n;
 	unsigned int i;
 
-	/* Caller ensures di != NULL. */
+	for (i = 0; i < cond->num_terms && count; i++) {
+		term = &cond->terms[i];
+		if (term->type != SRD_TERM_SKIP)
+			break;
+		n = MIN(count, term->num_samples_to_skip -
+			term->num_samples_already_skipped);
+		term->num_samples_already_skipped += n;
+		count -= n;
+	}
+}
 
-	for (i = 0; i < num_conditions; i++) {
-		if (di->match_array->data[i])
-			return TRUE;
+/*
+ * Check conditions which consist of skip terms only, optionally OR-ed
+ * with conditions on pins. The sample at which the first skip condition
+ * matches is computed, and the pin conditions are only checked for the
+ * samples before it, using the compiled bit masks. Skip counts carry
+ * over to the next chunk when the target is not within this chunk.
+ */
+static gboolean find_match_skip(struct srd_decoder_inst *di,
+		struct srd_cond_masks *m)
+{
+	struct srd_condition_list *cl;
+	struct srd_condition *cond;
+	const uint8_t *sample_pos;
+	uint64_t num_samples_to_process, window, remaining;
+	unsigned int j;
+	gboolean have_pin_conds, matched, any;
+
+	cl = di->condition_list;
+	num_samples_to_process = di->abs_end_samplenum - di->abs_cur_samplenum;
+
+	window = num_samples_to_process;
+	have_pin_conds = FALSE;
+	for (j = 0; j < cl->num_conds; j++) {
+		if (cl->conds[j].have_skip)
+			window = MIN(window, skip_remaining(&cl->conds[j]));
+		else if (!m->conds[j].never_matches)
+			have_pin_conds = TRUE;
 	}
 
-	return FALSE;
+	/* Samples before the skip target: only pin conditions can match. */
+	if (window) {
+		if (have_pin_conds) {
+			if (find_match_masked(di, m, window))
+				return TRUE;
+		} else {
+			memset(di->match_array->data, 0,
+				cl->num_conds * sizeof(gboolean));
+			di->abs_cur_samplenum += window;
+			sample_pos = srd_inst_sample_pos(di, di->abs_cur_samplenum - 1);
+			update_old_pins_array(di, sample_pos);
+		}
+		for (j = 0; j < cl->num_conds; j++) {
+			if (cl->conds[j].have_skip)
+				skip_advance(&cl->conds[j], window);
+		}
+	}
+
+	if (di->abs_cur_samplenum == di->abs_end_samplenum)
+		return FALSE;
+
+	/* The skip target: check all conditions at this sample. */
+	sample_pos = srd_inst_sample_pos(di, di->abs_cur_samplenum);
+	any = FALSE;
+	for (j = 0; j < cl->num_conds; j++) {
+		cond = &cl->conds[j];
+		if (!cond->num_terms)
+			continue;
+		if (cond->have_skip) {
+			remaining = skip_remaining(cond);
+			matched = remaining == 0;
+			if (!matched)
+				skip_advance(cond, 1);
+		} else {
+			matched = all_terms_match(di, cond, sample_pos);
+		}
+		di->match_array->data[j] = matched;
+		any |= matched;
+	}
+	update_old_pins_array(di, sample_pos);
+
+	return any;
 }
 
 static gboolean find_match(struct srd_decoder_inst *di)
 {
-	uint64_t i, j, num_samples_to_process;
-	GSList *l, *cond;
+	uint64_t i, num_samples_to_process;
 	const uint8_t *sample_pos;
-	unsigned int num_conditions;
+	unsigned int j, num_conditions;
+	struct srd_cond_masks *masks;
 
 	/* Caller ensures di != NULL. */
 
@@ -941,28 +2183,45 @@ static gboolean find_match(struct srd_decoder_inst *di)
 	}
 
 	num_samples_to_process = di->abs_end_samplenum - di->abs_cur_samplenum;
-	num_conditions = g_slist_length(di->condition_list);
+	num_conditions = di->condition_list->num_conds;
 
-	/* di->match_array is NULL here. Create a new GArray. */
-	di->match_array = g_array_sized_new(FALSE, TRUE, sizeof(gboolean), num_conditions);
+	/* The match array is kept across calls, only its size changes. */
+	if (!di->match_array)
+		di->match_array = g_array_sized_new(FALSE, TRUE, sizeof(gboolean), num_conditions);
 	g_array_set_size(di->match_array, num_conditions);
+	memset(di->match_array->data, 0, num_conditions * sizeof(gboolean));
 
-	/* Sample 0: Set di->old_pins_array for SRD_INITIAL_PIN_SAME_AS_SAMPLE0 pins. */
-	if (di->abs_cur_samplenum == 0)
+	/* First sample: Set di->old_pins_array for SRD_INITIAL_PIN_SAME_AS_SAMPLE0 pins. */
+	if (di->abs_cur_samplenum == di->abs_first_samplenum)
 		update_old_pins_array_initial_pins(di);
 
+	/*
+	 * Skip terms count the samples which were checked, and depend on
+	 * the evaluation order of terms. Only skip terms which are combined
+	 * with pin terms in a condition take the slow path.
+	 */
+	if (num_samples_to_process && !di->condition_list->skip_mixed) {
+		masks = cond_masks_get(di);
+		sample_pos = srd_inst_sample_pos(di, di->abs_cur_samplenum);
+		if (cond_masks_seed_prev(di, masks, sample_pos)) {
+			if (di->condition_list->have_skip)
+				return find_match_skip(di, masks);
+			return find_match_masked(di, masks, num_samples_to_process);
+		}
+	}
+
 	for (i = 0; i < num_samples_to_process; i++, (di->abs_cur_samplenum)++) {
 
-		sample_pos = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * di->data_unitsize);
+		sample_pos = srd_inst_sample_pos(di, di->abs_cur_samplenum);
 
 		/* Check whether the current sample matches at least one of the conditions (logical OR). */
 		/* IMPORTANT: We need to check all conditions, even if there was a match already! */
-		for (l = di->condition_list, j = 0; l; l = l->next, j++) {
-			cond = l->data;
-			if (!cond)
+		for (j = 0; j < num_conditions; j++) {
+			if (!di->condition_list->conds[j].num_terms)
 				continue;
-			/* All terms in 'cond' must match (logical AND). */
-			di->match_array->data[j] = all_terms_match(di, cond, sample_pos);
+			/* All terms in the condition must match (logical AND). */
+			di->match_array->data[j] = all_terms_match(di,
+				&di->condition_list->conds[j], sample_pos);
 		}
 
 		update_old_pins_array(di, sample_pos);
@@ -1061,6 +2320,9 @@ static gpointer di_thread(gpointer data)
 	if (!py_res)
 		di->decoder_state = SRD_ERR;
 
+	/* Deliver output which is still batched or coalesced. */
+	srd_inst_output_flush(di);
+
 	/*
 	 * Make sure to unblock potentially pending srd_inst_decode()
 	 * calls in application threads after the decode() method might
@@ -1119,6 +2381,251 @@ static gpointer di_thread(gpointer data)
 	return NULL;
 }
 
+/* Make a chunk the instance's current chunk. Caller holds the mutex. */
+static void chunk_load(struct srd_decoder_inst *di,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize,
+		const uint64_t *transitions, uint64_t num_transitions)
+{
+	di->abs_start_samplenum = abs_start_samplenum;
+	di->abs_end_samplenum = abs_end_samplenum;
+	di->inbuf = inbuf;
+	di->inbuflen = inbuflen;
+	di->data_unitsize = unitsize;
+	di->transitions = transitions;
+	di->num_transitions = num_transitions;
+	di->transition_idx = 0;
+	di->got_new_samples = TRUE;
+	di->handled_all_samples = FALSE;
+}
+
+/**
+ * Finish the worker thread's current chunk.
+ *
+ * Continues with the next queued chunk if there is one, or has the
+ * worker thread wait for new samples otherwise. Signals the application
+ * thread, which may wait for room in the queue, or for the completion
+ * of all chunks. The caller holds di->data_mutex.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+SRD_PRIV void srd_inst_chunk_done(struct srd_decoder_inst *di)
+{
+	struct srd_chunk *chunk;
+
+	chunk_free(di->chunk);
+	di->chunk = NULL;
+
+	if ((chunk = g_queue_pop_head(&di->chunk_queue))) {
+		chunk_load(di, chunk->abs_start_samplenum,
+			chunk->abs_end_samplenum, chunk->inbuf,
+			chunk->inbuflen, chunk->unitsize,
+			chunk->transitions, chunk->num_transitions);
+		di->chunk = chunk;
+	} else {
+		di->got_new_samples = FALSE;
+		di->handled_all_samples = TRUE;
+		di->abs_start_samplenum = 0;
+		di->abs_end_samplenum = 0;
+		di->inbuf = NULL;
+		di->inbuflen = 0;
+		di->transitions = NULL;
+		di->num_transitions = 0;
+	}
+
+	g_cond_signal(&di->handled_all_samples_cond);
+}
+
+static void py_bytes_free(PyObject *py_bytes)
+{
+	PyGILState_STATE gstate;
+
+	if (!py_bytes)
+		return;
+
+	gstate = PyGILState_Ensure();
+	Py_DECREF(py_bytes);
+	PyGILState_Release(gstate);
+}
+
+/*
+ * Hand a chunk of samples to the worker thread. With a queue depth of
+ * zero, wait until the chunk was processed. Otherwise, the chunk gets
+ * copied and queued, and only waits for room in the queue.
+ */
+static int decode_chunk(struct srd_decoder_inst *di,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize,
+		const uint64_t *transitions, uint64_t num_transitions,
+		unsigned int queue_depth)
+{
+	struct srd_chunk *chunk;
+	uint64_t expected;
+	PyObject *py_inbuf;
+	PyGILState_STATE gstate;
+
+	/* If this is the first call, start the worker thread. */
+	if (!di->thread_handle) {
+		srd_dbg("No worker thread for this decoder stack "
+			"exists yet, creating one: %s.", di->inst_id);
+		di->thread_handle = g_thread_new(di->inst_id,
+						 di_thread, di);
+	}
+
+	/*
+	 * The caller may re-use its buffers, queued chunks get a copy.
+	 * It's a Python bytes object, such that views of the samples
+	 * which decoders keep remain valid after the chunk was done.
+	 * Copied before taking the mutex, the worker thread takes the
+	 * GIL while holding it.
+	 */
+	py_inbuf = NULL;
+	if (queue_depth) {
+		gstate = PyGILState_Ensure();
+		py_inbuf = PyBytes_FromStringAndSize((const char *)inbuf,
+			inbuflen);
+		if (!py_inbuf)
+			srd_exception_catch("Failed to copy the samples");
+		PyGILState_Release(gstate);
+		if (!py_inbuf)
+			return SRD_ERR_MALLOC;
+	}
+
+	g_mutex_lock(&di->data_mutex);
+
+	/* Wait for room in the queue (or for the worker to be idle). */
+	while (!di->want_wait_terminate && di->got_new_samples &&
+			g_queue_get_length(&di->chunk_queue) >= queue_depth)
+		g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
+
+	if (di->want_wait_terminate) {
+		g_mutex_unlock(&di->data_mutex);
+		py_bytes_free(py_inbuf);
+		return SRD_ERR_TERM_REQ;
+	}
+
+	expected = di->got_new_samples ? di->abs_next_samplenum : di->abs_cur_samplenum;
+	if (abs_start_samplenum != expected) {
+		g_mutex_unlock(&di->data_mutex);
+		py_bytes_free(py_inbuf);
+		srd_dbg("Incorrect sample numbers: start=%" PRIu64 ", expected %"
+			PRIu64 ".", abs_start_samplenum, expected);
+		return SRD_ERR_ARG;
+	}
+	di->abs_next_samplenum = abs_end_samplenum;
+
+	/* Synchronous operation: process the caller's buffer in place. */
+	if (!queue_depth) {
+		chunk_load(di, abs_start_samplenum, abs_end_samplenum, inbuf,
+			inbuflen, unitsize, transitions, num_transitions);
+
+		/* Signal the thread that we have new data. */
+		g_cond_signal(&di->got_new_samples_cond);
+
+		/* When all samples in this chunk were handled, return. */
+		while (!di->handled_all_samples && !di->want_wait_terminate)
+			g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
+		g_mutex_unlock(&di->data_mutex);
+
+		if (di->want_wait_terminate)
+			return SRD_ERR_TERM_REQ;
+
+		return SRD_OK;
+	}
+
+	chunk = g_malloc(sizeof(*chunk));
+	chunk->abs_start_samplenum = abs_start_samplenum;
+	chunk->abs_end_samplenum = abs_end_samplenum;
+	chunk->py_inbuf = py_inbuf;
+	chunk->inbuf = (uint8_t *)PyBytes_AsString(py_inbuf);
+	chunk->inbuflen = inbuflen;
+	chunk->unitsize = unitsize;
+	chunk->transitions = NULL;
+	chunk->num_transitions = num_transitions;
+	if (transitions) {
+		chunk->transitions = g_malloc(num_transitions * sizeof(*transitions));
+		memcpy(chunk->transitions, transitions,
+			num_transitions * sizeof(*transitions));
+	}
+
+	if (di->got_new_samples) {
+		g_queue_push_tail(&di->chunk_queue, chunk);
+	} else {
+		chunk_load(di, abs_start_samplenum, abs_end_samplenum,
+			chunk->inbuf, inbuflen, unitsize, chunk->transitions,
+			num_transitions);
+		di->chunk = chunk;
+		g_cond_signal(&di->got_new_samples_cond);
+	}
+
+	g_mutex_unlock(&di->data_mutex);
+
+	return SRD_OK;
+}
+
+/**
+ * Wait until the worker thread processed all chunks of the instance.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_inst_flush(struct srd_decoder_inst *di)
+{
+	int ret;
+
+	if (!di)
+		return SRD_ERR_ARG;
+
+	g_mutex_lock(&di->data_mutex);
+	while (di->got_new_samples && !di->want_wait_terminate)
+		g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
+	ret = di->want_wait_terminate ? SRD_ERR_TERM_REQ : SRD_OK;
+	g_mutex_unlock(&di->data_mutex);
+
+	return ret;
+}
+
+/**
+ * Set the sample number at which the instance's input stream starts.
+ *
+ * Only allowed before the instance received its first chunk, i.e. after
+ * it was created or reset.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ * @param abs_first_samplenum The absolute sample number of the first
+ *              sample which will be sent.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_inst_first_samplenum_set(struct srd_decoder_inst *di,
+		uint64_t abs_first_samplenum)
+{
+	if (!di)
+		return SRD_ERR_ARG;
+
+	g_mutex_lock(&di->data_mutex);
+	if (di->got_new_samples ||
+			di->abs_next_samplenum != di->abs_first_samplenum) {
+		g_mutex_unlock(&di->data_mutex);
+		srd_err("%s: Cannot change the start of the stream after "
+			"samples were sent.", di->inst_id);
+		return SRD_ERR;
+	}
+	di->abs_first_samplenum = abs_first_samplenum;
+	di->abs_next_samplenum = abs_first_samplenum;
+	di->abs_cur_samplenum = abs_first_samplenum;
+	g_mutex_unlock(&di->data_mutex);
+
+	return SRD_OK;
+}
+
 /**
  * Decode a chunk of samples.
  *
@@ -1164,6 +2671,9 @@ static gpointer di_thread(gpointer data)
  * @param inbuf The buffer to decode. Must not be NULL.
  * @param inbuflen Length of the buffer. Must be > 0.
  * @param unitsize The number of bytes per sample. Must be > 0.
+ * @param queue_depth The max. number of chunks which are queued for the
+ *                    worker thread. Zero to wait until the chunk was
+ *                    processed.
  *
  * @return SRD_OK upon success, a (negative) error code otherwise.
  *
@@ -1171,7 +2681,8 @@ static gpointer di_thread(gpointer data)
  */
 SRD_PRIV int srd_inst_decode(struct srd_decoder_inst *di,
 		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
-		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize)
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize,
+		unsigned int queue_depth)
 {
 	/* Return an error upon unusable input. */
 	if (!di) {
@@ -1191,53 +2702,64 @@ SRD_PRIV int srd_inst_decode(struct srd_decoder_inst *di,
 		return SRD_ERR_ARG;
 	}
 
-	if (abs_start_samplenum != di->abs_cur_samplenum ||
-	    abs_end_samplenum < abs_start_samplenum) {
-		srd_dbg("Incorrect sample numbers: start=%" PRIu64 ", cur=%"
-			PRIu64 ", end=%" PRIu64 ".", abs_start_samplenum,
-			di->abs_cur_samplenum, abs_end_samplenum);
+	if (abs_end_samplenum < abs_start_samplenum) {
+		srd_dbg("Incorrect sample numbers: start=%" PRIu64 ", end=%"
+			PRIu64 ".", abs_start_samplenum, abs_end_samplenum);
 		return SRD_ERR_ARG;
 	}
 
-	di->data_unitsize = unitsize;
-
 	srd_dbg("Decoding: abs start sample %" PRIu64 ", abs end sample %"
 		PRIu64 " (%" PRIu64 " samples, %" PRIu64 " bytes, unitsize = "
-		"%d), instance %s.", abs_start_samplenum, abs_end_samplenum,
-		abs_end_samplenum - abs_start_samplenum, inbuflen, di->data_unitsize,
-		di->inst_id);
-
-	/* If this is the first call, start the worker thread. */
-	if (!di->thread_handle) {
-		srd_dbg("No worker thread for this decoder stack "
-			"exists yet, creating one: %s.", di->inst_id);
-		di->thread_handle = g_thread_new(di->inst_id,
-						 di_thread, di);
-	}
-
-	/* Push the new sample chunk to the worker thread. */
-	g_mutex_lock(&di->data_mutex);
-	di->abs_start_samplenum = abs_start_samplenum;
-	di->abs_end_samplenum = abs_end_samplenum;
-	di->inbuf = inbuf;
-	di->inbuflen = inbuflen;
-	di->got_new_samples = TRUE;
-	di->handled_all_samples = FALSE;
-
-	/* Signal the thread that we have new data. */
-	g_cond_signal(&di->got_new_samples_cond);
-	g_mutex_unlock(&di->data_mutex);
+		"%" PRIu64 "), instance %s.", abs_start_samplenum,
+		abs_end_samplenum, abs_end_samplenum - abs_start_samplenum,
+		inbuflen, unitsize, di->inst_id);
 
-	/* When all samples in this chunk were handled, return. */
-	g_mutex_lock(&di->data_mutex);
-	while (!di->handled_all_samples && !di->want_wait_terminate)
-		g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
-	g_mutex_unlock(&di->data_mutex);
+	return decode_chunk(di, abs_start_samplenum, abs_end_samplenum,
+		inbuf, inbuflen, unitsize, NULL, 0, queue_depth);
+}
 
-	if (di->want_wait_terminate)
-		return SRD_ERR_TERM_REQ;
+/**
+ * Decode a chunk of samples, given as a list of transitions.
+ *
+ * Like srd_inst_decode(), but the chunk's samples are given by the
+ * sample numbers where the input changes, and the samples at these
+ * transitions. The first transition must be at the chunk's start, the
+ * samples up to the next transition (or the chunk's end) are equal to
+ * it. The caller (srd_session_send_transitions()) checks the input.
+ *
+ * @param di The decoder instance to call. Must not be NULL.
+ * @param abs_start_samplenum The absolute starting sample number.
+ * @param abs_end_samplenum The absolute ending sample number.
+ * @param samplenums The absolute sample numbers of the transitions.
+ * @param samples The samples at the transitions.
+ * @param num_transitions The number of transitions. Must be > 0.
+ * @param unitsize The number of bytes per sample. Must be > 0.
+ * @param queue_depth The max. number of queued chunks, see decode_chunk().
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_inst_decode_transitions(struct srd_decoder_inst *di,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint64_t *samplenums, const uint8_t *samples,
+		uint64_t num_transitions, uint64_t unitsize,
+		unsigned int queue_depth)
+{
+	if (!di) {
+		srd_dbg("empty decoder instance");
+		return SRD_ERR_ARG;
+	}
 
-	return SRD_OK;
+	srd_dbg("Decoding: abs start sample %" PRIu64 ", abs end sample %"
+		PRIu64 " (%" PRIu64 " samples, %" PRIu64 " transitions, "
+		"unitsize = %" PRIu64 "), instance %s.", abs_start_samplenum,
+		abs_end_samplenum, abs_end_samplenum - abs_start_samplenum,
+		num_transitions, unitsize, di->inst_id);
+
+	return decode_chunk(di, abs_start_samplenum, abs_end_samplenum,
+		samples, num_transitions * unitsize, unitsize,
+		samplenums, num_transitions, queue_depth);
 }
 
 /**
@@ -1316,8 +2838,27 @@ SRD_PRIV void srd_inst_free(struct srd_decoder_inst *di)
 	srd_inst_join_decode_thread(di);
 
 	srd_inst_reset_state(di);
+	srd_inst_binary_coalesce_set(di, 0);
+	output_filters_free(di);
+	srd_ann_store_free(di->ann_store);
+	condition_cache_free(di);
+	if (di->condition_key)
+		g_array_free(di->condition_key, TRUE);
+	if (di->condition_skips)
+		g_array_free(di->condition_skips, TRUE);
 
 	gstate = PyGILState_Ensure();
+	if (inst_by_obj) {
+		g_hash_table_remove(inst_by_obj, di->py_inst);
+		if (!g_hash_table_size(inst_by_obj)) {
+			g_hash_table_destroy(inst_by_obj);
+			inst_by_obj = NULL;
+		}
+	}
+	Py_XDECREF((PyObject *)di->py_inbuf);
+	Py_XDECREF((PyObject *)di->py_decode);
+	Py_XDECREF((PyObject *)di->py_decode_items);
+	Py_XDECREF((PyObject *)di->py_items);
 	Py_DECREF(di->py_inst);
 	PyGILState_Release(gstate);
 
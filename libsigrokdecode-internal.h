@@ -22,7 +22,7 @@
 #define LIBSIGROKDECODE_LIBSIGROKDECODE_INTERNAL_H
 
 /* Use the stable ABI subset as per PEP 384. */
-#define Py_LIMITED_API 0x03020000
+#define Py_LIMITED_API 0x03030000
 
 #include <Python.h> /* First, so we avoid a _POSIX_C_SOURCE warning. */
 #include "libsigrokdecode.h"
@@ -41,10 +41,83 @@ enum {
 struct srd_term {
 	int type;
 	int channel;
+	/* Location of the channel in the sample data, -1 if not mapped. */
+	int byte_offset;
+	uint8_t bit_mask;
 	uint64_t num_samples_to_skip;
 	uint64_t num_samples_already_skipped;
 };
 
+/* The terms of one dict passed to .wait(), all of which must match. */
+struct srd_condition {
+	unsigned int num_terms;
+	struct srd_term *terms;
+	/* Whether any of the terms is a skip term. */
+	gboolean have_skip;
+};
+
+/*
+ * One condition (the terms of one dict passed to .wait()), compiled into
+ * bit masks which apply to the raw sample data of the current unitsize.
+ * A sample matches when all 'level' bits have the value in 'value', all
+ * 'edge' bits have changed, and none of the 'stable' bits have changed,
+ * compared to the previous sample. Only bytes 'lo' to 'hi' (inclusive)
+ * have non-zero masks.
+ */
+struct srd_cond_mask {
+	gboolean never_matches;
+	unsigned int lo, hi;
+	uint8_t *level;
+	uint8_t *value;
+	uint8_t *edge;
+	uint8_t *stable;
+};
+
+/* All conditions of a .wait() call, compiled for the sample scanner. */
+struct srd_cond_masks {
+	unsigned int num_conds;
+	unsigned int unitsize;
+	/* Whether a match requires a change of at least one 'watch' bit. */
+	gboolean change_driven;
+	/* Union of all conditions' level and edge bits. */
+	uint8_t *watch;
+	/* 'watch' replicated to 64 bits, zero if unitsize is not 1/2/4/8. */
+	uint64_t watch_word;
+	/* Previous sample in raw format, derived from old_pins_array. */
+	uint8_t *prev;
+	struct srd_cond_mask *conds;
+};
+
+/*
+ * Condition list keys, see condition_list_get(): The number of conditions,
+ * then for each condition its number of terms, followed by its terms.
+ * Terms are encoded as type and channel. Skip counts are not part of the
+ * key.
+ */
+#define SRD_COND_KEY(type, channel)	(((uint32_t)(type) << 16) | ((channel) & 0xffff))
+#define SRD_COND_KEY_TYPE(key)	((int)((key) >> 16))
+#define SRD_COND_KEY_CHANNEL(key)	((int)((key) & 0xffff))
+
+/* Max. number of compiled condition lists kept per decoder instance. */
+#define SRD_CONDITION_CACHE_SIZE 64
+
+/* All conditions of a .wait() call, in compiled form. */
+struct srd_condition_list {
+	unsigned int num_conds;
+	unsigned int num_terms;
+	struct srd_condition *conds;
+	/* All terms of all conditions, in order. */
+	struct srd_term *terms;
+	/* Whether any of the terms is a skip term. */
+	gboolean have_skip;
+	/* Whether skip terms are combined with pin terms in a condition. */
+	gboolean skip_mixed;
+	/* Bit masks for the sample scanner, built on demand. */
+	struct srd_cond_masks *masks;
+	unsigned int key_len;
+	uint32_t *key;
+};
+
 /* Custom Python types: */
 
 typedef struct {
@@ -57,35 +130,180 @@ typedef struct {
 	PyObject *sample;
 } srd_logic;
 
+/* A copy of a chunk of samples, queued for a worker thread. */
+struct srd_chunk {
+	uint64_t abs_start_samplenum;
+	uint64_t abs_end_samplenum;
+	/* Python bytes holding inbuf, views on it can outlive the chunk. */
+	PyObject *py_inbuf;
+	uint8_t *inbuf;
+	uint64_t inbuflen;
+	uint64_t unitsize;
+	uint64_t *transitions;
+	uint64_t num_transitions;
+};
+
+/*
+ * Annotations of one decoder instance, not yet delivered to a batched
+ * callback. The 'data' pointers get filled in upon delivery, since the
+ * arrays move while they grow.
+ */
+struct srd_ann_batch {
+	/* struct srd_proto_data, as passed to the callback. */
+	GArray *pdata;
+	/* struct srd_proto_data_annotation, one per pdata. */
+	GArray *pda;
+};
+
+/*
+ * Binary output of one decoder instance, see srd_inst_binary_coalesce_set():
+ * Consecutive output of the same output and binary class, not yet
+ * delivered to the frontend.
+ */
+struct srd_bin_coalesce {
+	uint64_t max_size;
+	GByteArray *data;
+	struct srd_proto_data pdata;
+	struct srd_proto_data_binary pdb;
+};
+
+/* The number of output types (SRD_OUTPUT_*). */
+#define SRD_NUM_OUTPUT_TYPES (SRD_OUTPUT_META + 1)
+
+/* Wanted output of one output type, see srd_inst_output_filter_set(). */
+struct srd_class_filter {
+	/* Whether the filter applies, otherwise all output is wanted. */
+	gboolean active;
+	/* Indexed by class, classes >= num_classes are not wanted. */
+	unsigned int num_classes;
+	gboolean *classes;
+};
+
+/* State of the sigrokdecode module, see module_sigrokdecode.c. */
+struct srd_module_state {
+	/*
+	 * Interned term type strings ("h", "l", ...), in the order of the
+	 * SRD_TERM_* values they represent, starting at SRD_TERM_HIGH.
+	 */
+	PyObject *term_type_strs[SRD_TERM_NO_EDGE - SRD_TERM_HIGH + 1];
+	/* The array.array type, for .wait_many() results. */
+	PyObject *array_type;
+};
+
 struct srd_session {
 	int session_id;
 
+	/* Max. number of chunks queued per decoder stack, 0 = synchronous. */
+	unsigned int queue_depth;
+
+	/*
+	 * Output window, see srd_session_shard_set(): Only output which
+	 * starts within [output_start, output_end) goes to the frontend.
+	 */
+	uint64_t output_start;
+	uint64_t output_end;
+
+	/* Whether annotations with raw values are formatted on demand. */
+	gboolean lazy_ann_text;
+
+	/* Whether instances keep their annotations, see annstore.c. */
+	gboolean ann_store;
+
 	/* List of decoder instances. */
 	GSList *di_list;
 
-	/* List of frontend callbacks to receive decoder output. */
-	GSList *callbacks;
+	/* Lists of frontend callbacks to receive decoder output, by type. */
+	GSList *callbacks[SRD_NUM_OUTPUT_TYPES];
+
+	/*
+	 * Serializes the invocation of frontend callbacks, which decoder
+	 * stacks' threads call concurrently when chunks are queued. Only
+	 * taken while not holding the GIL.
+	 */
+	GMutex callback_mutex;
+
+	/*
+	 * Interned annotation texts, see srd_session_ann_text_get(): The
+	 * text vectors by id, and the ids (plus one) by the texts, joined
+	 * and NUL terminated. The mutex protects both, the scratch buffer
+	 * for building keys is only used while holding the GIL.
+	 */
+	GMutex ann_text_mutex;
+	GPtrArray *ann_texts;
+	GHashTable *ann_text_ids;
+	GString *ann_text_key;
 };
 
+/*
+ * Max. number of distinct annotation texts interned per session. Texts
+ * beyond this (e.g. unique data values) get copied per annotation.
+ */
+#define SRD_ANN_TEXTS_MAX 65536
+
 /* srd.c */
 SRD_PRIV int srd_decoder_searchpath_add(const char *path);
+SRD_PRIV void srd_load_stats_print(int64_t load_time);
 
 /* session.c */
-SRD_PRIV struct srd_pd_callback *srd_pd_output_callback_find(struct srd_session *sess,
-		int output_type);
+SRD_PRIV void srd_pd_output_callback_remove(struct srd_session *sess,
+		srd_pd_output_callback cb, void *cb_data);
+SRD_PRIV struct srd_pd_callback *srd_pd_output_batch_callback_find(
+		struct srd_session *sess);
+SRD_PRIV gboolean srd_pd_output_callback_wants(
+		const struct srd_pd_callback *pd_cb,
+		const struct srd_decoder_inst *di, int output_class);
+SRD_PRIV gboolean srd_session_output_wanted(const struct srd_session *sess,
+		uint64_t start_sample);
+SRD_PRIV int srd_session_recycle(struct srd_session *sess);
 
 /* instance.c */
+SRD_PRIV int srd_inst_options_to_dict(const struct srd_decoder *dec,
+		const char *inst_id, GHashTable *options, PyObject **py_options);
+SRD_PRIV int srd_inst_channelmap_new(const struct srd_decoder *dec,
+		GHashTable *new_channels, int **channelmap);
+SRD_PRIV struct srd_decoder_inst *srd_inst_create(struct srd_session *sess,
+		struct srd_decoder *dec, char *inst_id, PyObject *py_options);
+SRD_PRIV int srd_inst_settings_restore(struct srd_decoder_inst *di,
+		PyObject *py_options, const int *channelmap);
 SRD_PRIV int srd_inst_start(struct srd_decoder_inst *di);
+SRD_PRIV struct srd_decoder_inst *srd_inst_find_by_obj(const PyObject *obj);
 SRD_PRIV void match_array_free(struct srd_decoder_inst *di);
 SRD_PRIV void condition_list_free(struct srd_decoder_inst *di);
+SRD_PRIV struct srd_condition_list *condition_list_get(
+		struct srd_decoder_inst *di, const uint32_t *key,
+		unsigned int key_len);
+SRD_PRIV void condition_cache_free(struct srd_decoder_inst *di);
 SRD_PRIV int srd_inst_decode(struct srd_decoder_inst *di,
 		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
-		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize);
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize,
+		unsigned int queue_depth);
+SRD_PRIV int srd_inst_decode_transitions(struct srd_decoder_inst *di,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint64_t *samplenums, const uint8_t *samples,
+		uint64_t num_transitions, uint64_t unitsize,
+		unsigned int queue_depth);
+SRD_PRIV int srd_inst_flush(struct srd_decoder_inst *di);
+SRD_PRIV gboolean srd_inst_output_filter_wants(
+		const struct srd_decoder_inst *di, int output_type,
+		int output_class);
+SRD_PRIV int srd_inst_first_samplenum_set(struct srd_decoder_inst *di,
+		uint64_t abs_first_samplenum);
+SRD_PRIV void srd_inst_chunk_done(struct srd_decoder_inst *di);
+SRD_PRIV const uint8_t *srd_inst_sample_pos(struct srd_decoder_inst *di,
+		uint64_t abs_samplenum);
 SRD_PRIV int process_samples_until_condition_match(struct srd_decoder_inst *di, gboolean *found_match);
 SRD_PRIV int srd_inst_terminate_reset(struct srd_decoder_inst *di);
 SRD_PRIV void srd_inst_free(struct srd_decoder_inst *di);
 SRD_PRIV void srd_inst_free_all(struct srd_session *sess);
 
+/* annstore.c */
+SRD_PRIV struct srd_ann_store *srd_ann_store_new(
+		const struct srd_decoder_inst *di);
+SRD_PRIV void srd_ann_store_add(struct srd_decoder_inst *di,
+		const struct srd_proto_data *pdata);
+SRD_PRIV void srd_ann_store_clear(struct srd_ann_store *store);
+SRD_PRIV void srd_ann_store_free(struct srd_ann_store *store);
+
 /* log.c */
 #if defined(G_OS_WIN32) && (__GNUC__ > 4 || (__GNUC__ == 4 && __GNUC_MINOR__ >= 4))
 /*
@@ -105,17 +323,24 @@ SRD_PRIV int srd_log(int loglevel, const char *format, ...) G_GNUC_PRINTF(2, 3);
 #define srd_err(...)	srd_log(SRD_LOG_ERR,  __VA_ARGS__)
 
 /* decoder.c */
+SRD_PRIV int srd_decoder_import(struct srd_decoder *dec);
 SRD_PRIV long srd_decoder_apiver(const struct srd_decoder *d);
+SRD_PRIV int srd_ann_text_format(GString *s, const char *template,
+		const int64_t *values, unsigned int num_values);
 
 /* type_decoder.c */
 SRD_PRIV PyObject *srd_Decoder_type_new(void);
 SRD_PRIV const char *output_type_name(unsigned int idx);
+SRD_PRIV void srd_inst_output_flush(struct srd_decoder_inst *di);
+SRD_PRIV void srd_inst_output_discard(struct srd_decoder_inst *di);
 
 /* type_logic.c */
 SRD_PRIV PyObject *srd_logic_type_new(void);
 
 /* module_sigrokdecode.c */
 PyMODINIT_FUNC PyInit_sigrokdecode(void);
+SRD_PRIV PyObject *srd_module_get(void);
+SRD_PRIV struct srd_module_state *srd_module_state_get(void);
 
 /* util.c */
 SRD_PRIV PyObject *py_import_by_name(const char *name);
@@ -29,6 +29,16 @@ extern "C" {
 #endif
 
 struct srd_session;
+struct srd_condition_list;
+struct srd_chunk;
+struct srd_ann_batch;
+struct srd_bin_coalesce;
+struct srd_class_filter;
+struct srd_ann_store;
+struct srd_outfile;
+struct srd_outfile_reader;
+struct srd_stack_template;
+struct srd_stack_pool;
 
 /**
  * @file
@@ -136,6 +146,28 @@ enum srd_configkey {
 	SRD_CONF_SAMPLERATE = 10000,
 };
 
+/**
+ * What loading a protocol decoder took, see srd_decoder_load(). Decoders
+ * loaded from the metadata cache only have their import accounted, once
+ * the module gets imported.
+ */
+struct srd_decoder_load_stats {
+	/** Wall clock time of importing the Python module, in us. */
+	uint64_t import_time;
+
+	/** Wall clock time of reading and checking the metadata, in us. */
+	uint64_t metadata_time;
+
+	/** Number of memory blocks Python allocated while loading. */
+	int64_t alloc_blocks;
+
+	/**
+	 * Number of bytes Python allocated while loading, or -1 unless
+	 * tracemalloc is tracing (e.g. PYTHONTRACEMALLOC is set).
+	 */
+	int64_t alloc_bytes;
+};
+
 struct srd_decoder {
 	/** The decoder ID. Must be non-NULL and unique for all decoders. */
 	char *id;
@@ -196,6 +228,17 @@ struct srd_decoder {
 
 	/** sigrokdecode.Decoder class. */
 	void *py_dec;
+
+	/**
+	 * List of annotation text templates. Each list item is a NULL
+	 * terminated list of printf-like templates (one per verbosity level,
+	 * most verbose first), or NULL if the annotation class has none.
+	 * See srd_proto_data_annotation_text().
+	 */
+	GSList *ann_formats;
+
+	/** What loading the decoder took. */
+	struct srd_decoder_load_stats load_stats;
 };
 
 enum srd_initial_pin {
@@ -245,11 +288,40 @@ struct srd_decoder_inst {
 	GSList *next_di;
 
 	/** List of conditions a PD wants to wait for. */
-	GSList *condition_list;
+	struct srd_condition_list *condition_list;
+
+	/** Compiled condition lists, by their key. */
+	GHashTable *condition_cache;
+
+	/** Scratch buffers for building condition list keys. */
+	GArray *condition_key;
+	GArray *condition_skips;
 
 	/** Array of booleans denoting which conditions matched. */
 	GArray *match_array;
 
+	/** Annotations not yet delivered to a batched callback, or NULL. */
+	struct srd_ann_batch *ann_batch;
+
+	/** Binary output not yet delivered, or NULL if not coalescing. */
+	struct srd_bin_coalesce *bin_coalesce;
+
+	/** Wanted output per output type, or NULL if all is wanted. */
+	struct srd_class_filter *output_filters;
+
+	/** Kept annotations, see srd_session_ann_store_set(). */
+	struct srd_ann_store *ann_store;
+
+	/** The Python instance's decode() method, when stacked. */
+	void *py_decode;
+
+	/**
+	 * The Python instance's decode_items() method, and the list of
+	 * queued (ss, es, data) items for it, or NULL.
+	 */
+	void *py_decode_items;
+	void *py_items;
+
 	/** Absolute start sample number. */
 	uint64_t abs_start_samplenum;
 
@@ -262,6 +334,33 @@ struct srd_decoder_inst {
 	/** Length (in bytes) of the input sample buffer. */
 	uint64_t inbuflen;
 
+	/** Python memoryview of the input sample buffer, or NULL. */
+	void *py_inbuf;
+
+	/**
+	 * Sample numbers of the transitions in the input buffer, which
+	 * then holds one sample per transition. NULL for dense chunks.
+	 */
+	const uint64_t *transitions;
+
+	/** Number of transitions. */
+	uint64_t num_transitions;
+
+	/** Index of the most recently accessed transition. */
+	uint64_t transition_idx;
+
+	/** The current chunk if it's a copy owned by the instance, or NULL. */
+	struct srd_chunk *chunk;
+
+	/** Chunks waiting to be processed by the worker thread. */
+	GQueue chunk_queue;
+
+	/** Absolute sample number at which the next chunk has to start. */
+	uint64_t abs_next_samplenum;
+
+	/** Absolute sample number of the first sample of the stream. */
+	uint64_t abs_first_samplenum;
+
 	/** Absolute current samplenumber. */
 	uint64_t abs_cur_samplenum;
 
@@ -305,9 +404,19 @@ struct srd_proto_data {
 	struct srd_pd_output *pdo;
 	void *data;
 };
+/** The max. number of raw values of an annotation. */
+#define SRD_ANN_MAX_VALUES 4
+/** The ann_text_id of annotations without texts. */
+#define SRD_ANN_TEXT_ID_NONE UINT32_MAX
 struct srd_proto_data_annotation {
 	int ann_class; /* Index into "struct srd_decoder"->annotations. */
-	char **ann_text;
+	char **ann_text; /* Owned by the session, see ann_text_id. */
+	uint32_t ann_text_id; /* See srd_session_ann_text_get(). */
+	/* Raw values, see srd_proto_data_annotation_text(). */
+	unsigned int num_values;
+	int64_t values[SRD_ANN_MAX_VALUES];
+	/* Typed values, or NULL. Take a reference to keep them. */
+	GVariant *payload;
 };
 struct srd_proto_data_binary {
 	int bin_class; /* Index into "struct srd_decoder"->binary. */
@@ -317,11 +426,20 @@ struct srd_proto_data_binary {
 
 typedef void (*srd_pd_output_callback)(struct srd_proto_data *pdata,
 					void *cb_data);
+typedef void (*srd_pd_output_batch_callback)(struct srd_proto_data *pdata,
+					unsigned int num_pdata, void *cb_data);
 
 struct srd_pd_callback {
 	int output_type;
 	srd_pd_output_callback cb;
 	void *cb_data;
+	/* Only used for batched callbacks. */
+	srd_pd_output_batch_callback batch_cb;
+	unsigned int batch_size;
+	/* Only used for filtered callbacks. */
+	const struct srd_decoder_inst *di;
+	unsigned int num_classes;
+	gboolean *classes;
 };
 
 /* srd.c */
@@ -337,16 +455,41 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 SRD_API int srd_session_send(struct srd_session *sess,
 		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize);
+SRD_API int srd_session_send_transitions(struct srd_session *sess,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint64_t *samplenums, const uint8_t *samples,
+		uint64_t num_transitions, uint64_t unitsize);
+SRD_API int srd_session_queue_depth_set(struct srd_session *sess,
+		unsigned int depth);
+SRD_API int srd_session_flush(struct srd_session *sess);
+SRD_API int srd_session_shard_set(struct srd_session *sess,
+		uint64_t abs_start_samplenum, uint64_t abs_output_start,
+		uint64_t abs_output_end);
 SRD_API int srd_session_terminate_reset(struct srd_session *sess);
+SRD_API int srd_session_lazy_ann_text_set(struct srd_session *sess,
+		gboolean lazy);
+SRD_API int srd_session_ann_store_set(struct srd_session *sess,
+		gboolean enable);
+SRD_API char **srd_session_ann_text_get(struct srd_session *sess,
+		uint32_t ann_text_id);
 SRD_API int srd_session_destroy(struct srd_session *sess);
 SRD_API int srd_pd_output_callback_add(struct srd_session *sess,
 		int output_type, srd_pd_output_callback cb, void *cb_data);
+SRD_API int srd_pd_output_callback_add_filtered(struct srd_session *sess,
+		int output_type, srd_pd_output_callback cb, void *cb_data,
+		const struct srd_decoder_inst *di, const int *classes,
+		unsigned int num_classes);
+SRD_API int srd_pd_output_callback_add_batched(struct srd_session *sess,
+		int output_type, srd_pd_output_batch_callback cb,
+		unsigned int batch_size, void *cb_data);
 
 /* decoder.c */
 SRD_API const GSList *srd_decoder_list(void);
 SRD_API struct srd_decoder *srd_decoder_get_by_id(const char *id);
 SRD_API int srd_decoder_load(const char *name);
 SRD_API char *srd_decoder_doc_get(const struct srd_decoder *dec);
+SRD_API char *srd_proto_data_annotation_text(const struct srd_proto_data *pdata,
+		unsigned int level);
 SRD_API int srd_decoder_unload(struct srd_decoder *dec);
 SRD_API int srd_decoder_load_all(void);
 SRD_API int srd_decoder_unload_all(void);
@@ -362,9 +505,51 @@ SRD_API int srd_inst_stack(struct srd_session *sess,
 		struct srd_decoder_inst *di_from, struct srd_decoder_inst *di_to);
 SRD_API struct srd_decoder_inst *srd_inst_find_by_id(struct srd_session *sess,
 		const char *inst_id);
+SRD_API int srd_inst_output_filter_set(struct srd_decoder_inst *di,
+		int output_type, const int *classes, unsigned int num_classes);
+SRD_API int srd_inst_ann_row_filter_set(struct srd_decoder_inst *di,
+		const char *const *row_ids);
+SRD_API int srd_inst_binary_coalesce_set(struct srd_decoder_inst *di,
+		uint64_t max_size);
 SRD_API int srd_inst_initial_pins_set_all(struct srd_decoder_inst *di,
 		GArray *initial_pins);
 
+/* annstore.c */
+SRD_API int srd_inst_ann_store_query(struct srd_decoder_inst *di,
+		const char *row_id, uint64_t start_sample, uint64_t end_sample,
+		srd_pd_output_callback cb, void *cb_data);
+SRD_API int srd_inst_ann_store_summary(struct srd_decoder_inst *di,
+		const char *row_id, uint64_t start_sample, uint64_t bucket_size,
+		unsigned int num_buckets, uint64_t *counts);
+
+/* template.c */
+SRD_API int srd_stack_template_new(struct srd_stack_template **tmpl);
+SRD_API int srd_stack_template_add(struct srd_stack_template *tmpl,
+		const char *decoder_id, GHashTable *options,
+		GHashTable *channels);
+SRD_API int srd_stack_template_instantiate(struct srd_stack_template *tmpl,
+		struct srd_session *sess, struct srd_decoder_inst **di_bottom);
+SRD_API void srd_stack_template_free(struct srd_stack_template *tmpl);
+SRD_API int srd_stack_pool_new(struct srd_stack_template *tmpl,
+		struct srd_stack_pool **pool);
+SRD_API int srd_stack_pool_get(struct srd_stack_pool *pool,
+		struct srd_session **sess);
+SRD_API int srd_stack_pool_put(struct srd_stack_pool *pool,
+		struct srd_session *sess);
+SRD_API void srd_stack_pool_free(struct srd_stack_pool *pool);
+
+/* outfile.c */
+SRD_API int srd_outfile_open(struct srd_session *sess, const char *path,
+		struct srd_outfile **outfile);
+SRD_API int srd_outfile_close(struct srd_outfile *outfile);
+SRD_API int srd_outfile_reader_open(const char *path,
+		struct srd_outfile_reader **reader);
+SRD_API int srd_outfile_reader_seek(struct srd_outfile_reader *reader,
+		uint64_t start_sample, uint64_t end_sample);
+SRD_API gboolean srd_outfile_reader_next(struct srd_outfile_reader *reader,
+		struct srd_proto_data **pdata, const char **inst_id);
+SRD_API int srd_outfile_reader_close(struct srd_outfile_reader *reader);
+
 /* log.c */
 typedef int (*srd_log_callback)(void *cb_data, int loglevel,
 				  const char *format, va_list args);
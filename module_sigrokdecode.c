@@ -21,27 +21,74 @@
 #include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
 #include "libsigrokdecode.h"
 
-/** @cond PRIVATE */
+static void sigrokdecode_module_free(void *mod);
 
 /*
- * When initialized, a reference to this module inside the Python interpreter
- * lives here.
+ * The module keeps its state in the module object rather than in
+ * C globals, which gets released along with the module. Note that this
+ * alone does not make the module usable in sub-interpreters, or with
+ * free-threaded Python builds: The library runs all decoders in the
+ * one interpreter which srd_init() creates, under its GIL.
  */
-SRD_PRIV PyObject *mod_sigrokdecode = NULL;
-
-/** @endcond */
-
 static struct PyModuleDef sigrokdecode_module = {
 	PyModuleDef_HEAD_INIT,
 	.m_name = "sigrokdecode",
 	.m_doc = "sigrokdecode module",
-	.m_size = -1,
+	.m_size = sizeof(struct srd_module_state),
+	.m_free = sigrokdecode_module_free,
 };
 
+static void sigrokdecode_module_free(void *mod)
+{
+	struct srd_module_state *state;
+	unsigned int i;
+
+	state = PyModule_GetState(mod);
+	if (!state)
+		return;
+
+	for (i = 0; i < G_N_ELEMENTS(state->term_type_strs); i++)
+		Py_CLEAR(state->term_type_strs[i]);
+	Py_CLEAR(state->array_type);
+}
+
+/**
+ * Get the sigrokdecode module.
+ *
+ * @return A borrowed reference to the module, or NULL if the module
+ *         was not imported yet.
+ *
+ * @private
+ */
+SRD_PRIV PyObject *srd_module_get(void)
+{
+	return PyState_FindModule(&sigrokdecode_module);
+}
+
+/**
+ * Get the state of the sigrokdecode module.
+ *
+ * @return The module state, or NULL if the module was not imported yet.
+ *
+ * @private
+ */
+SRD_PRIV struct srd_module_state *srd_module_state_get(void)
+{
+	PyObject *mod;
+
+	if (!(mod = srd_module_get()))
+		return NULL;
+
+	return PyModule_GetState(mod);
+}
+
 /** @cond PRIVATE */
 PyMODINIT_FUNC PyInit_sigrokdecode(void)
 {
+	static const char *const term_types[] = { "h", "l", "r", "f", "e", "n" };
 	PyObject *mod, *Decoder_type;
+	struct srd_module_state *state;
+	unsigned int i;
 	PyGILState_STATE gstate;
 
 	gstate = PyGILState_Ensure();
@@ -50,6 +97,14 @@ PyMODINIT_FUNC PyInit_sigrokdecode(void)
 	if (!mod)
 		goto err_out;
 
+	/* Interned term type strings, see srd_module_state. */
+	state = PyModule_GetState(mod);
+	for (i = 0; i < G_N_ELEMENTS(state->term_type_strs); i++) {
+		state->term_type_strs[i] = PyUnicode_InternFromString(term_types[i]);
+		if (!state->term_type_strs[i])
+			goto err_out;
+	}
+
 	Decoder_type = srd_Decoder_type_new();
 	if (!Decoder_type)
 		goto err_out;
@@ -69,8 +124,6 @@ PyMODINIT_FUNC PyInit_sigrokdecode(void)
 	if (PyModule_AddIntConstant(mod, "SRD_CONF_SAMPLERATE", SRD_CONF_SAMPLERATE) < 0)
 		goto err_out;
 
-	mod_sigrokdecode = mod;
-
 	PyGILState_Release(gstate);
 
 	return mod;
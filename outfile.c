@@ -0,0 +1,878 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include <errno.h>
+#include <stdio.h>
+#include <string.h>
+#include <glib.h>
+#include <glib/gstdio.h>
+
+/**
+ * @file
+ *
+ * Writing decoder output to files, and reading it back.
+ */
+
+/**
+ * @defgroup grp_outfile Output files
+ *
+ * Storing decoder output in a compact binary format, and replaying it.
+ *
+ * An output file starts with an 8 byte file header ("SRDOUT01"), which
+ * is followed by chunks. Each chunk has a 32 byte header:
+ *
+ *   - "SRDC"
+ *   - uint32: The size of the chunk's body in bytes.
+ *   - uint32: The number of records in the chunk.
+ *   - uint32: Reserved, 0.
+ *   - uint64: The lowest start sample of the chunk's records.
+ *   - uint64: The highest start sample of the chunk's records.
+ *
+ * All integers in headers are little endian. The body is a sequence of
+ * records, each starting with a tag byte. Numbers in the body are
+ * unsigned LEB128 varints, signed numbers are zigzag encoded, strings
+ * are a varint length followed by the (not NUL terminated) bytes.
+ *
+ *   - Output (1): pdo_id, output type, instance id, protocol id.
+ *     Defines the next output index of the chunk, starting at 0.
+ *   - Text (2): The number of texts, then the texts. Defines the next
+ *     text index of the chunk, starting at 0.
+ *   - Annotation (3): Output index, start sample delta (signed, to the
+ *     previous record's start sample in the chunk, or to 0 for the first
+ *     record), duration, class, text index + 1 (0 if none), the number
+ *     of raw values and the values (signed), payload (see below).
+ *   - Binary (4): Output index, start sample delta, duration, class,
+ *     size, the data bytes.
+ *   - Meta (5): Output index, start sample delta, duration, payload.
+ *
+ * A payload is a GVariant type string (empty if there is no payload),
+ * followed by the variant's serialized data as string.
+ *
+ * Chunks are self-contained, so readers can skip to any chunk, and a
+ * chunk which was not completely written (e.g. after a crash) is ignored.
+ *
+ * @{
+ */
+
+/** @cond PRIVATE */
+
+#define OUTFILE_MAGIC "SRDOUT01"
+#define OUTFILE_MAGIC_LEN 8
+#define CHUNK_MAGIC "SRDC"
+#define CHUNK_HEADER_LEN 32
+#define CHUNK_SIZE (64 * 1024)
+
+enum {
+	TAG_OUTPUT = 1,
+	TAG_TEXT,
+	TAG_ANN,
+	TAG_BINARY,
+	TAG_META,
+};
+
+struct srd_outfile {
+	struct srd_session *sess;
+	FILE *file;
+	char *path;
+	gboolean failed;
+
+	/* Callbacks can be invoked by several decoder stacks' threads. */
+	GMutex mutex;
+
+	/* The current chunk. */
+	GByteArray *body;
+	uint32_t num_records;
+	uint64_t first_sample;
+	uint64_t last_sample;
+	uint64_t prev_sample;
+
+	/* Output and text indices (plus one) of the current chunk. */
+	GHashTable *outputs;
+	unsigned int num_outputs;
+	GHashTable *texts;
+	unsigned int num_texts;
+};
+
+struct outfile_output {
+	struct srd_pd_output pdo;
+	char *inst_id;
+};
+
+struct srd_outfile_reader {
+	GMappedFile *file;
+	const guint8 *data;
+	gsize size;
+
+	/* Offsets of all complete chunks. */
+	GArray *chunks;
+	guint chunk_idx;
+
+	/* Only records starting in [start_sample, end_sample). */
+	uint64_t start_sample;
+	uint64_t end_sample;
+
+	/* Position in the current chunk, and the chunk's definitions. */
+	const guint8 *pos;
+	const guint8 *end;
+	uint64_t prev_sample;
+	GPtrArray *outputs;
+	GPtrArray *texts;
+
+	/* The current record. */
+	struct srd_proto_data pdata;
+	struct srd_proto_data_annotation pda;
+	struct srd_proto_data_binary pdb;
+	GVariant *payload;
+};
+
+/** @endcond */
+
+static uint32_t read_u32(const guint8 *p)
+{
+	return (uint32_t)p[0] | (uint32_t)p[1] << 8 |
+		(uint32_t)p[2] << 16 | (uint32_t)p[3] << 24;
+}
+
+static uint64_t read_u64(const guint8 *p)
+{
+	return (uint64_t)read_u32(p) | (uint64_t)read_u32(p + 4) << 32;
+}
+
+static void write_u32(guint8 *p, uint32_t value)
+{
+	int i;
+
+	for (i = 0; i < 4; i++)
+		p[i] = value >> (8 * i);
+}
+
+static void write_u64(guint8 *p, uint64_t value)
+{
+	write_u32(p, value);
+	write_u32(p + 4, value >> 32);
+}
+
+static void put_tag(GByteArray *buf, guint8 tag)
+{
+	g_byte_array_append(buf, &tag, 1);
+}
+
+static void put_varint(GByteArray *buf, uint64_t value)
+{
+	guint8 bytes[10];
+	guint len;
+
+	len = 0;
+	do {
+		bytes[len] = value & 0x7f;
+		value >>= 7;
+		if (value)
+			bytes[len] |= 0x80;
+		len++;
+	} while (value);
+
+	g_byte_array_append(buf, bytes, len);
+}
+
+static void put_svarint(GByteArray *buf, int64_t value)
+{
+	put_varint(buf, ((uint64_t)value << 1) ^ (uint64_t)(value >> 63));
+}
+
+static void put_string(GByteArray *buf, const char *str, size_t len)
+{
+	put_varint(buf, len);
+	g_byte_array_append(buf, (const guint8 *)str, len);
+}
+
+static void put_payload(GByteArray *buf, GVariant *payload)
+{
+	const char *type;
+
+	if (!payload) {
+		put_varint(buf, 0);
+		return;
+	}
+
+	type = g_variant_get_type_string(payload);
+	put_string(buf, type, strlen(type));
+	put_varint(buf, g_variant_get_size(payload));
+	g_byte_array_set_size(buf, buf->len + g_variant_get_size(payload));
+	g_variant_store(payload, buf->data + buf->len -
+		g_variant_get_size(payload));
+}
+
+static gboolean get_varint(const guint8 **pos, const guint8 *end,
+		uint64_t *value)
+{
+	unsigned int shift;
+
+	*value = 0;
+	for (shift = 0; *pos < end && shift < 64; shift += 7) {
+		*value |= (uint64_t)(**pos & 0x7f) << shift;
+		if (!(*(*pos)++ & 0x80))
+			return TRUE;
+	}
+
+	return FALSE;
+}
+
+static gboolean get_svarint(const guint8 **pos, const guint8 *end,
+		int64_t *value)
+{
+	uint64_t zigzag;
+
+	if (!get_varint(pos, end, &zigzag))
+		return FALSE;
+	*value = (int64_t)(zigzag >> 1) ^ -(int64_t)(zigzag & 1);
+
+	return TRUE;
+}
+
+/* Get a string, which points into the file and is not NUL terminated. */
+static gboolean get_string(const guint8 **pos, const guint8 *end,
+		const char **str, uint64_t *len)
+{
+	if (!get_varint(pos, end, len) || *len > (uint64_t)(end - *pos))
+		return FALSE;
+	*str = (const char *)*pos;
+	*pos += *len;
+
+	return TRUE;
+}
+
+/*
+ * Get a payload. Its type must be a definite one, since no variant can
+ * be built from data of e.g. type "*".
+ */
+static gboolean get_payload(const guint8 **pos, const guint8 *end,
+		GVariant **payload)
+{
+	const char *str;
+	uint64_t len;
+	char *type;
+	gpointer data;
+
+	*payload = NULL;
+	if (!get_string(pos, end, &str, &len))
+		return FALSE;
+	if (!len)
+		return TRUE;
+
+	type = g_strndup(str, len);
+	if (!g_variant_type_string_is_valid(type) ||
+			!g_variant_type_is_definite(G_VARIANT_TYPE(type)) ||
+			!get_string(pos, end, &str, &len)) {
+		g_free(type);
+		return FALSE;
+	}
+
+	/* Copied, since the data in the file is not aligned. */
+	data = g_malloc(len);
+	memcpy(data, str, len);
+	*payload = g_variant_ref_sink(g_variant_new_from_data(
+		G_VARIANT_TYPE(type), data, len, FALSE, g_free, data));
+	g_free(type);
+
+	return TRUE;
+}
+
+static void outfile_chunk_reset(struct srd_outfile *of)
+{
+	g_byte_array_set_size(of->body, 0);
+	of->num_records = 0;
+	of->first_sample = UINT64_MAX;
+	of->last_sample = 0;
+	of->prev_sample = 0;
+	g_hash_table_remove_all(of->outputs);
+	of->num_outputs = 0;
+	g_hash_table_remove_all(of->texts);
+	of->num_texts = 0;
+}
+
+/* Write the current chunk. The caller must hold the mutex. */
+static void outfile_chunk_write(struct srd_outfile *of)
+{
+	guint8 header[CHUNK_HEADER_LEN];
+
+	if (!of->num_records)
+		return;
+
+	memcpy(header, CHUNK_MAGIC, 4);
+	write_u32(header + 4, of->body->len);
+	write_u32(header + 8, of->num_records);
+	write_u32(header + 12, 0);
+	write_u64(header + 16, of->first_sample);
+	write_u64(header + 24, of->last_sample);
+
+	if (!of->failed && (fwrite(header, sizeof(header), 1, of->file) != 1 ||
+			fwrite(of->body->data, of->body->len, 1, of->file) != 1)) {
+		srd_err("Failed to write to %s: %s.", of->path,
+			g_strerror(errno));
+		of->failed = TRUE;
+	}
+
+	outfile_chunk_reset(of);
+}
+
+/*
+ * Start a record in the current chunk, defining its output if needed.
+ * The caller must hold the mutex.
+ */
+static void outfile_record_start(struct srd_outfile *of, int tag,
+		const struct srd_proto_data *pdata)
+{
+	struct srd_pd_output *pdo;
+	gpointer idx;
+
+	pdo = pdata->pdo;
+	if (!(idx = g_hash_table_lookup(of->outputs, pdo))) {
+		put_tag(of->body, TAG_OUTPUT);
+		put_varint(of->body, pdo->pdo_id);
+		put_varint(of->body, pdo->output_type);
+		put_string(of->body, pdo->di->inst_id, strlen(pdo->di->inst_id));
+		put_string(of->body, pdo->proto_id, strlen(pdo->proto_id));
+		idx = GUINT_TO_POINTER(++of->num_outputs);
+		g_hash_table_insert(of->outputs, pdo, idx);
+	}
+
+	put_tag(of->body, tag);
+	put_varint(of->body, GPOINTER_TO_UINT(idx) - 1);
+	put_svarint(of->body, pdata->start_sample - of->prev_sample);
+	put_varint(of->body, pdata->end_sample - pdata->start_sample);
+
+	of->num_records++;
+	of->prev_sample = pdata->start_sample;
+	of->first_sample = MIN(of->first_sample, pdata->start_sample);
+	of->last_sample = MAX(of->last_sample, pdata->start_sample);
+}
+
+/*
+ * Get the text index (plus one) of an annotation, defining its texts.
+ * Texts which the session did not intern (SRD_ANN_TEXT_ID_NONE) are
+ * defined for every annotation.
+ */
+static unsigned int outfile_text_idx(struct srd_outfile *of,
+		const struct srd_proto_data *pdata)
+{
+	const struct srd_proto_data_annotation *pda;
+	GPtrArray *texts;
+	gpointer idx;
+	char *text;
+	unsigned int i, num_texts;
+	gboolean interned;
+
+	pda = pdata->data;
+	interned = pda->ann_text && pda->ann_text_id != SRD_ANN_TEXT_ID_NONE;
+	if (interned && (idx = g_hash_table_lookup(of->texts,
+			GUINT_TO_POINTER(pda->ann_text_id + 1))))
+		return GPOINTER_TO_UINT(idx);
+
+	put_tag(of->body, TAG_TEXT);
+	if (pda->ann_text) {
+		num_texts = g_strv_length(pda->ann_text);
+		put_varint(of->body, num_texts);
+		for (i = 0; i < num_texts; i++) {
+			put_string(of->body, pda->ann_text[i],
+				strlen(pda->ann_text[i]));
+		}
+		idx = GUINT_TO_POINTER(++of->num_texts);
+		if (interned)
+			g_hash_table_insert(of->texts,
+				GUINT_TO_POINTER(pda->ann_text_id + 1), idx);
+		return GPOINTER_TO_UINT(idx);
+	}
+
+	/* Lazy annotations' texts are formatted, and not interned. */
+	texts = g_ptr_array_new_with_free_func(g_free);
+	while ((text = srd_proto_data_annotation_text(pdata, texts->len)))
+		g_ptr_array_add(texts, text);
+	put_varint(of->body, texts->len);
+	for (i = 0; i < texts->len; i++) {
+		text = g_ptr_array_index(texts, i);
+		put_string(of->body, text, strlen(text));
+	}
+	g_ptr_array_free(texts, TRUE);
+
+	return ++of->num_texts;
+}
+
+static void outfile_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct srd_outfile *of;
+	const struct srd_proto_data_annotation *pda;
+	const struct srd_proto_data_binary *pdb;
+	unsigned int i, text_idx;
+
+	of = cb_data;
+	g_mutex_lock(&of->mutex);
+
+	/* Chunks are written once full, i.e. hold a bit more. */
+	if (of->body->len >= CHUNK_SIZE)
+		outfile_chunk_write(of);
+
+	switch (pdata->pdo->output_type) {
+	case SRD_OUTPUT_ANN:
+		pda = pdata->data;
+		text_idx = outfile_text_idx(of, pdata);
+		outfile_record_start(of, TAG_ANN, pdata);
+		put_varint(of->body, pda->ann_class);
+		put_varint(of->body, text_idx);
+		put_varint(of->body, pda->num_values);
+		for (i = 0; i < pda->num_values; i++)
+			put_svarint(of->body, pda->values[i]);
+		put_payload(of->body, pda->payload);
+		break;
+	case SRD_OUTPUT_BINARY:
+		pdb = pdata->data;
+		outfile_record_start(of, TAG_BINARY, pdata);
+		put_varint(of->body, pdb->bin_class);
+		put_string(of->body, (const char *)pdb->data, pdb->size);
+		break;
+	case SRD_OUTPUT_META:
+		outfile_record_start(of, TAG_META, pdata);
+		put_payload(of->body, pdata->data);
+		break;
+	default:
+		break;
+	}
+
+	g_mutex_unlock(&of->mutex);
+}
+
+/**
+ * Write a session's output to a file.
+ *
+ * All annotations, binary output and meta values which the session's
+ * callbacks receive are written to the file, see srd_outfile_reader_open()
+ * for reading them back. Annotation texts are stored once per chunk of
+ * the file. Lazy annotations (see srd_session_lazy_ann_text_set()) are
+ * formatted for the file.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param path The file to write. An existing file is overwritten.
+ * @param outfile Will hold the new output file upon success.
+ *                Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_outfile_open(struct srd_session *sess, const char *path,
+		struct srd_outfile **outfile)
+{
+	struct srd_outfile *of;
+	FILE *file;
+	int i;
+
+	if (!sess || !path || !outfile)
+		return SRD_ERR_ARG;
+
+	if (!(file = g_fopen(path, "wb"))) {
+		srd_err("Failed to open %s: %s.", path, g_strerror(errno));
+		return SRD_ERR;
+	}
+	if (fwrite(OUTFILE_MAGIC, OUTFILE_MAGIC_LEN, 1, file) != 1) {
+		srd_err("Failed to write to %s: %s.", path, g_strerror(errno));
+		fclose(file);
+		return SRD_ERR;
+	}
+
+	of = g_malloc0(sizeof(struct srd_outfile));
+	of->sess = sess;
+	of->file = file;
+	of->path = g_strdup(path);
+	g_mutex_init(&of->mutex);
+	of->body = g_byte_array_sized_new(CHUNK_SIZE + 1024);
+	of->outputs = g_hash_table_new(g_direct_hash, g_direct_equal);
+	of->texts = g_hash_table_new(g_direct_hash, g_direct_equal);
+	outfile_chunk_reset(of);
+
+	for (i = SRD_OUTPUT_ANN; i <= SRD_OUTPUT_META; i++) {
+		if (i != SRD_OUTPUT_PYTHON)
+			srd_pd_output_callback_add(sess, i, outfile_cb, of);
+	}
+
+	srd_dbg("Writing output of session %d to %s.", sess->session_id, path);
+
+	*outfile = of;
+
+	return SRD_OK;
+}
+
+/**
+ * Finish writing an output file, and close it.
+ *
+ * Must be called after all output was received (e.g. after
+ * srd_session_flush()), and before the session is destroyed.
+ *
+ * @param outfile The output file. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code if writing the
+ *         file failed.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_outfile_close(struct srd_outfile *outfile)
+{
+	int ret;
+
+	if (!outfile)
+		return SRD_ERR_ARG;
+
+	srd_pd_output_callback_remove(outfile->sess, outfile_cb, outfile);
+
+	outfile_chunk_write(outfile);
+	if (fclose(outfile->file) != 0 && !outfile->failed) {
+		srd_err("Failed to write to %s: %s.", outfile->path,
+			g_strerror(errno));
+		outfile->failed = TRUE;
+	}
+	ret = outfile->failed ? SRD_ERR : SRD_OK;
+
+	g_hash_table_destroy(outfile->texts);
+	g_hash_table_destroy(outfile->outputs);
+	g_byte_array_free(outfile->body, TRUE);
+	g_mutex_clear(&outfile->mutex);
+	g_free(outfile->path);
+	g_free(outfile);
+
+	return ret;
+}
+
+static void outfile_output_free(void *data)
+{
+	struct outfile_output *output;
+
+	output = data;
+	g_free(output->pdo.proto_id);
+	g_free(output->inst_id);
+	g_free(output);
+}
+
+/**
+ * Open an output file for reading.
+ *
+ * The file is memory-mapped. Its records are read with
+ * srd_outfile_reader_next(), optionally restricted to a sample range
+ * with srd_outfile_reader_seek().
+ *
+ * @param path The file to read, see srd_outfile_open().
+ * @param reader Will hold the new reader upon success. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_outfile_reader_open(const char *path,
+		struct srd_outfile_reader **reader)
+{
+	struct srd_outfile_reader *r;
+	GMappedFile *file;
+	GError *error;
+	gsize offset, body_len;
+
+	if (!path || !reader)
+		return SRD_ERR_ARG;
+
+	error = NULL;
+	if (!(file = g_mapped_file_new(path, FALSE, &error))) {
+		srd_err("Failed to open %s: %s.", path, error->message);
+		g_error_free(error);
+		return SRD_ERR;
+	}
+
+	r = g_malloc0(sizeof(struct srd_outfile_reader));
+	r->file = file;
+	r->data = (const guint8 *)g_mapped_file_get_contents(file);
+	r->size = g_mapped_file_get_length(file);
+	if (r->size < OUTFILE_MAGIC_LEN ||
+			memcmp(r->data, OUTFILE_MAGIC, OUTFILE_MAGIC_LEN)) {
+		srd_err("%s is not a decoder output file.", path);
+		g_mapped_file_unref(file);
+		g_free(r);
+		return SRD_ERR_ARG;
+	}
+
+	/* Index the complete chunks. */
+	r->chunks = g_array_new(FALSE, FALSE, sizeof(gsize));
+	offset = OUTFILE_MAGIC_LEN;
+	while (r->size - offset >= CHUNK_HEADER_LEN) {
+		if (memcmp(r->data + offset, CHUNK_MAGIC, 4))
+			break;
+		body_len = read_u32(r->data + offset + 4);
+		if (body_len > r->size - offset - CHUNK_HEADER_LEN)
+			break;
+		g_array_append_val(r->chunks, offset);
+		offset += CHUNK_HEADER_LEN + body_len;
+	}
+	if (offset != r->size)
+		srd_warn("%s: Ignoring %" G_GSIZE_FORMAT " trailing bytes.",
+			path, r->size - offset);
+
+	r->end_sample = UINT64_MAX;
+	r->outputs = g_ptr_array_new_with_free_func(outfile_output_free);
+	r->texts = g_ptr_array_new_with_free_func((GDestroyNotify)g_strfreev);
+
+	*reader = r;
+
+	return SRD_OK;
+}
+
+/**
+ * Restrict an output file reader to a sample range, and rewind it.
+ *
+ * Only chunks of the file which hold records in the range are read.
+ *
+ * @param reader The reader. Must not be NULL.
+ * @param start_sample Only read records starting at or after this sample.
+ * @param end_sample Only read records starting before this sample.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_outfile_reader_seek(struct srd_outfile_reader *reader,
+		uint64_t start_sample, uint64_t end_sample)
+{
+	if (!reader)
+		return SRD_ERR_ARG;
+
+	reader->start_sample = start_sample;
+	reader->end_sample = end_sample;
+	reader->chunk_idx = 0;
+	reader->pos = reader->end = NULL;
+
+	return SRD_OK;
+}
+
+/* Go to the next chunk with records in the reader's range. */
+static gboolean reader_next_chunk(struct srd_outfile_reader *r)
+{
+	const guint8 *header;
+
+	g_ptr_array_set_size(r->outputs, 0);
+	g_ptr_array_set_size(r->texts, 0);
+
+	while (r->chunk_idx < r->chunks->len) {
+		header = r->data + g_array_index(r->chunks, gsize, r->chunk_idx++);
+		if (read_u64(header + 24) < r->start_sample ||
+				read_u64(header + 16) >= r->end_sample)
+			continue;
+		r->pos = header + CHUNK_HEADER_LEN;
+		r->end = r->pos + read_u32(header + 4);
+		r->prev_sample = 0;
+		return TRUE;
+	}
+
+	return FALSE;
+}
+
+/* Read a definition record. */
+static gboolean reader_definition(struct srd_outfile_reader *r, int tag)
+{
+	struct outfile_output *output;
+	uint64_t value, len, num_texts, i;
+	const char *str;
+	char **texts;
+
+	if (tag == TAG_OUTPUT) {
+		output = g_malloc0(sizeof(struct outfile_output));
+		g_ptr_array_add(r->outputs, output);
+		if (!get_varint(&r->pos, r->end, &value))
+			return FALSE;
+		output->pdo.pdo_id = value;
+		if (!get_varint(&r->pos, r->end, &value))
+			return FALSE;
+		output->pdo.output_type = value;
+		if (!get_string(&r->pos, r->end, &str, &len))
+			return FALSE;
+		output->inst_id = g_strndup(str, len);
+		if (!get_string(&r->pos, r->end, &str, &len))
+			return FALSE;
+		output->pdo.proto_id = g_strndup(str, len);
+		return TRUE;
+	}
+
+	if (!get_varint(&r->pos, r->end, &num_texts) ||
+			num_texts > (uint64_t)(r->end - r->pos))
+		return FALSE;
+	texts = g_new0(char *, num_texts + 1);
+	g_ptr_array_add(r->texts, texts);
+	for (i = 0; i < num_texts; i++) {
+		if (!get_string(&r->pos, r->end, &str, &len))
+			return FALSE;
+		texts[i] = g_strndup(str, len);
+	}
+
+	return TRUE;
+}
+
+/**
+ * Read the next record of an output file.
+ *
+ * The record is returned like output is passed to output callbacks. The
+ * protocol data, its pdo (which has no decoder instance), the texts and
+ * the binary data are owned by the reader, and are valid until the next
+ * call. Take a reference to keep payloads.
+ *
+ * @param reader The reader. Must not be NULL.
+ * @param pdata Will point to the record's protocol data. Must not be NULL.
+ * @param inst_id Will point to the id of the decoder instance which
+ *                emitted the record. Can be NULL.
+ *
+ * @return TRUE if a record was read, FALSE at the end of the file (or of
+ *         the range, see srd_outfile_reader_seek()) or for invalid files.
+ *
+ * @since 0.6.0
+ */
+SRD_API gboolean srd_outfile_reader_next(struct srd_outfile_reader *reader,
+		struct srd_proto_data **pdata, const char **inst_id)
+{
+	struct srd_outfile_reader *r;
+	struct outfile_output *output;
+	uint64_t idx, duration, value, i;
+	int64_t delta;
+	const char *str;
+	int tag;
+
+	if (!reader || !pdata)
+		return FALSE;
+	r = reader;
+
+	if (r->payload)
+		g_variant_unref(r->payload);
+	r->payload = NULL;
+
+	while (TRUE) {
+		if (r->pos >= r->end && !reader_next_chunk(r))
+			return FALSE;
+		if (r->pos >= r->end)
+			continue;
+
+		tag = *r->pos++;
+		if (tag == TAG_OUTPUT || tag == TAG_TEXT) {
+			if (!reader_definition(r, tag))
+				goto err;
+			continue;
+		}
+		if (tag < TAG_ANN || tag > TAG_META)
+			goto err;
+
+		if (!get_varint(&r->pos, r->end, &idx) || idx >= r->outputs->len)
+			goto err;
+		output = g_ptr_array_index(r->outputs, idx);
+		if (!get_svarint(&r->pos, r->end, &delta) ||
+				!get_varint(&r->pos, r->end, &duration))
+			goto err;
+		r->prev_sample += delta;
+		r->pdata.start_sample = r->prev_sample;
+		r->pdata.end_sample = r->prev_sample + duration;
+		r->pdata.pdo = &output->pdo;
+
+		switch (tag) {
+		case TAG_ANN:
+			if (!get_varint(&r->pos, r->end, &value))
+				goto err;
+			r->pda.ann_class = value;
+			if (!get_varint(&r->pos, r->end, &idx) ||
+					idx > r->texts->len)
+				goto err;
+			r->pda.ann_text = idx ?
+				g_ptr_array_index(r->texts, idx - 1) : NULL;
+			r->pda.ann_text_id = SRD_ANN_TEXT_ID_NONE;
+			if (!get_varint(&r->pos, r->end, &value) ||
+					value > SRD_ANN_MAX_VALUES)
+				goto err;
+			r->pda.num_values = value;
+			for (i = 0; i < value; i++) {
+				if (!get_svarint(&r->pos, r->end, &r->pda.values[i]))
+					goto err;
+			}
+			if (!get_payload(&r->pos, r->end, &r->payload))
+				goto err;
+			r->pda.payload = r->payload;
+			r->pdata.data = &r->pda;
+			break;
+		case TAG_BINARY:
+			if (!get_varint(&r->pos, r->end, &value) ||
+					!get_string(&r->pos, r->end, &str,
+					&r->pdb.size))
+				goto err;
+			r->pdb.bin_class = value;
+			r->pdb.data = (const unsigned char *)str;
+			r->pdata.data = &r->pdb;
+			break;
+		case TAG_META:
+			if (!get_payload(&r->pos, r->end, &r->payload))
+				goto err;
+			r->pdata.data = r->payload;
+			break;
+		}
+
+		if (r->pdata.start_sample < r->start_sample ||
+				r->pdata.start_sample >= r->end_sample) {
+			if (r->payload)
+				g_variant_unref(r->payload);
+			r->payload = NULL;
+			continue;
+		}
+
+		*pdata = &r->pdata;
+		if (inst_id)
+			*inst_id = output->inst_id;
+
+		return TRUE;
+	}
+
+err:
+	srd_err("Invalid record in decoder output file.");
+	r->pos = r->end = NULL;
+	r->chunk_idx = r->chunks->len;
+
+	return FALSE;
+}
+
+/**
+ * Close an output file reader.
+ *
+ * @param reader The reader. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_outfile_reader_close(struct srd_outfile_reader *reader)
+{
+	if (!reader)
+		return SRD_ERR_ARG;
+
+	if (reader->payload)
+		g_variant_unref(reader->payload);
+	g_ptr_array_free(reader->texts, TRUE);
+	g_ptr_array_free(reader->outputs, TRUE);
+	g_array_free(reader->chunks, TRUE);
+	g_mapped_file_unref(reader->file);
+	g_free(reader);
+
+	return SRD_OK;
+}
+
+/** @} */
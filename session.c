@@ -60,12 +60,28 @@ SRD_PRIV int max_session_id = -1;
  */
 SRD_API int srd_session_new(struct srd_session **sess)
 {
+	int i;
+
 	if (!sess)
 		return SRD_ERR_ARG;
 
 	*sess = g_malloc(sizeof(struct srd_session));
 	(*sess)->session_id = ++max_session_id;
-	(*sess)->di_list = (*sess)->callbacks = NULL;
+	(*sess)->queue_depth = 0;
+	(*sess)->output_start = 0;
+	(*sess)->output_end = UINT64_MAX;
+	(*sess)->lazy_ann_text = FALSE;
+	(*sess)->ann_store = FALSE;
+	(*sess)->di_list = NULL;
+	for (i = 0; i < SRD_NUM_OUTPUT_TYPES; i++)
+		(*sess)->callbacks[i] = NULL;
+	g_mutex_init(&(*sess)->callback_mutex);
+	g_mutex_init(&(*sess)->ann_text_mutex);
+	(*sess)->ann_texts = g_ptr_array_new_with_free_func(
+		(GDestroyNotify)g_strfreev);
+	(*sess)->ann_text_ids = g_hash_table_new_full(g_bytes_hash,
+		g_bytes_equal, (GDestroyNotify)g_bytes_unref, NULL);
+	(*sess)->ann_text_key = g_string_sized_new(64);
 
 	/* Keep a list of all sessions, so we can clean up as needed. */
 	sessions = g_slist_append(sessions, *sess);
@@ -215,7 +231,8 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
  * The calls to this function must provide the samples that shall be
  * used by the protocol decoder
  *  - in the correct order ([...]5, 6, 4, 7, 8[...] is a bug),
- *  - starting from sample zero (2, 3, 4, 5, 6[...] is a bug),
+ *  - starting from sample zero (2, 3, 4, 5, 6[...] is a bug), unless
+ *    a shard was set up using srd_session_shard_set(),
  *  - consecutively, with no gaps (0, 1, 2, 4, 5[...] is a bug).
  *
  * The start- and end-sample numbers are absolute sample numbers (relative
@@ -271,13 +288,257 @@ SRD_API int srd_session_send(struct srd_session *sess,
 
 	for (d = sess->di_list; d; d = d->next) {
 		if ((ret = srd_inst_decode(d->data, abs_start_samplenum,
-				abs_end_samplenum, inbuf, inbuflen, unitsize)) != SRD_OK)
+				abs_end_samplenum, inbuf, inbuflen, unitsize,
+				sess->queue_depth)) != SRD_OK)
+			return ret;
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Send a chunk of logic sample data, given as a list of transitions.
+ *
+ * This is an alternative to srd_session_send() for input which rarely
+ * changes: Instead of every sample, only the samples where the input
+ * changes (transitions) are passed in, along with their sample numbers.
+ * A transition's sample holds until the next transition, or the end of
+ * the chunk. Decoders see the same samples as if all of them had been
+ * sent by srd_session_send(), yet conditions of .wait() calls are only
+ * checked at transitions, and the work for long runs of unchanged
+ * samples does not depend on their length.
+ *
+ * The first transition must be at the chunk's start sample (it holds the
+ * state of the input at the start of the chunk), the transitions' sample
+ * numbers must be strictly increasing, and less than abs_end_samplenum.
+ * The same rules as for srd_session_send() apply to the sample numbers
+ * of consecutive chunks, and the sample format.
+ *
+ * Example (4096 samples total, input changes at samples 0, 1000, 1003):
+ *   samplenums = { 0, 1000, 1003 };
+ *   srd_session_send_transitions(s, 0, 4096, samplenums, samples, 3, 1);
+ *
+ * Decoders' .peek_chunk() calls return None for chunks of transitions.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param abs_start_samplenum The absolute starting sample number for the
+ *              chunk, relative to the start of capture.
+ * @param abs_end_samplenum The absolute ending sample number for the
+ *              chunk, relative to the start of capture.
+ * @param samplenums The absolute sample numbers of the transitions.
+ *              Must not be NULL.
+ * @param samples The samples at the transitions, 'unitsize' bytes each.
+ *              Must not be NULL.
+ * @param num_transitions The number of transitions. Must be > 0.
+ * @param unitsize The number of bytes per sample. Must be > 0.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_session_send_transitions(struct srd_session *sess,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint64_t *samplenums, const uint8_t *samples,
+		uint64_t num_transitions, uint64_t unitsize)
+{
+	GSList *d;
+	uint64_t i;
+	int ret;
+
+	if (!sess || !samplenums || !samples || !num_transitions || !unitsize)
+		return SRD_ERR_ARG;
+
+	if (samplenums[0] != abs_start_samplenum) {
+		srd_err("First transition (%" PRIu64 ") is not at the chunk's "
+			"start (%" PRIu64 ").", samplenums[0], abs_start_samplenum);
+		return SRD_ERR_ARG;
+	}
+	for (i = 1; i < num_transitions; i++) {
+		if (samplenums[i] <= samplenums[i - 1]) {
+			srd_err("Transitions are not in increasing order.");
+			return SRD_ERR_ARG;
+		}
+	}
+	if (samplenums[num_transitions - 1] >= abs_end_samplenum) {
+		srd_err("Transition beyond the chunk's end.");
+		return SRD_ERR_ARG;
+	}
+
+	for (d = sess->di_list; d; d = d->next) {
+		if ((ret = srd_inst_decode_transitions(d->data,
+				abs_start_samplenum, abs_end_samplenum,
+				samplenums, samples, num_transitions,
+				unitsize, sess->queue_depth)) != SRD_OK)
+			return ret;
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Set the number of chunks which may be queued per decoder stack.
+ *
+ * By default (a depth of 0), srd_session_send() returns when all decoder
+ * stacks processed the chunk, one stack after the other. With a depth
+ * of N > 0, srd_session_send() copies the chunk and queues it for each
+ * stack, and only waits while a stack has N chunks queued already.
+ * Decoder stacks then process chunks concurrently, and in parallel with
+ * the caller's acquisition. Use srd_session_flush() to wait until all
+ * chunks have been processed, e.g. before srd_session_terminate_reset()
+ * or srd_session_destroy().
+ *
+ * Note that with a depth > 0, the frontend's output callbacks are
+ * invoked from several decoder stacks' threads. The session serializes
+ * these invocations (a callback never runs concurrently with another
+ * callback of the same session), yet callbacks must not assume to run
+ * in the caller's thread. Errors in decoders are reported by subsequent
+ * srd_session_send() or srd_session_flush() calls.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param depth The max. number of queued chunks per decoder stack.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_session_queue_depth_set(struct srd_session *sess,
+		unsigned int depth)
+{
+	if (!sess)
+		return SRD_ERR_ARG;
+
+	srd_dbg("Setting queue depth %u for session %d.", depth,
+		sess->session_id);
+	sess->queue_depth = depth;
+
+	return SRD_OK;
+}
+
+/**
+ * Wait until all decoder stacks in a session processed all queued chunks.
+ *
+ * See srd_session_queue_depth_set(). Returns immediately when chunks are
+ * not queued.
+ *
+ * @param sess The session to use. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_session_flush(struct srd_session *sess)
+{
+	GSList *d;
+	int ret;
+
+	if (!sess)
+		return SRD_ERR_ARG;
+
+	for (d = sess->di_list; d; d = d->next) {
+		if ((ret = srd_inst_flush(d->data)) != SRD_OK)
+			return ret;
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Restrict a session to one shard of a capture.
+ *
+ * This is a building block for frontends which split large captures
+ * into shards, and decode the shards in parallel (e.g. in separate
+ * processes, each with its own session and the same decoder stack).
+ * Decoders need some input to synchronize to the protocol (e.g. a start
+ * condition, or a frame boundary), so each shard is decoded starting
+ * from a point before the shard (the resync prefix), and until somewhat
+ * after its end, such that the last annotations of the shard can
+ * complete.
+ *
+ * This routine makes the session's input stream start at
+ * abs_start_samplenum instead of sample zero, and only passes output
+ * to the frontend's callbacks when the output's start sample is in
+ * [abs_output_start, abs_output_end). Output of the resync prefix (where
+ * decoders may still be out of sync) and after the shard is dropped.
+ * Stacked decoders still receive all output of the decoders below them.
+ *
+ * The library neither runs the shards nor merges their output: Choosing
+ * the shards, the lengths of the resync prefix and of the tail, and
+ * merging the output is up to the frontend. Output of a shard comes in
+ * the order decoders put it, which need not be the order of the start
+ * samples. The merged output need not match the output of decoding the
+ * whole capture at once either: Output which spans a shard's end is
+ * missing when the tail is too short for it to complete, and decoders
+ * which did not resync by the start of the output window report wrong
+ * or partial output near it.
+ *
+ * A typical sequence for one shard is:
+ *   srd_session_terminate_reset(s);
+ *   srd_session_shard_set(s, prefix_start, shard_start, shard_end);
+ *   srd_inst_initial_pins_set_all(di, pins_before_prefix_start);
+ *   srd_session_send(s, prefix_start, ...);
+ *   ...
+ *   srd_session_send(s, ..., shard_end + tail);
+ *
+ * The initial pins are optional, see srd_inst_initial_pins_set_all().
+ * Must be called before the session received samples, or after
+ * srd_session_terminate_reset(), which also removes the shard.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param abs_start_samplenum The absolute sample number of the first
+ *              sample which will be sent, i.e. the start of the resync
+ *              prefix. Must be <= abs_output_start.
+ * @param abs_output_start The absolute sample number of the shard's
+ *              first sample.
+ * @param abs_output_end The absolute sample number following the shard's
+ *              last sample. Must be > abs_output_start. Use UINT64_MAX
+ *              for the last shard.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_session_shard_set(struct srd_session *sess,
+		uint64_t abs_start_samplenum, uint64_t abs_output_start,
+		uint64_t abs_output_end)
+{
+	GSList *d;
+	int ret;
+
+	if (!sess)
+		return SRD_ERR_ARG;
+
+	if (abs_start_samplenum > abs_output_start ||
+			abs_output_start >= abs_output_end) {
+		srd_err("Invalid shard: start %" PRIu64 ", output %" PRIu64
+			"-%" PRIu64 ".", abs_start_samplenum, abs_output_start,
+			abs_output_end);
+		return SRD_ERR_ARG;
+	}
+
+	srd_dbg("Setting shard %" PRIu64 "-%" PRIu64 " (from %" PRIu64
+		") for session %d.", abs_output_start, abs_output_end,
+		abs_start_samplenum, sess->session_id);
+
+	for (d = sess->di_list; d; d = d->next) {
+		ret = srd_inst_first_samplenum_set(d->data, abs_start_samplenum);
+		if (ret != SRD_OK)
 			return ret;
 	}
+	sess->output_start = abs_output_start;
+	sess->output_end = abs_output_end;
 
 	return SRD_OK;
 }
 
+/* Drop the interned annotation texts of a session. */
+static void ann_texts_clear(struct srd_session *sess)
+{
+	g_mutex_lock(&sess->ann_text_mutex);
+	g_hash_table_remove_all(sess->ann_text_ids);
+	g_ptr_array_set_size(sess->ann_texts, 0);
+	g_mutex_unlock(&sess->ann_text_mutex);
+}
+
 /**
  * Terminate currently executing decoders in a session, reset internal state.
  *
@@ -292,7 +553,8 @@ SRD_API int srd_session_send(struct srd_session *sess,
  * This routine also allows callers to re-use previously created decoder
  * stacks to process new input data which is not related to previously
  * processed input data. This avoids the necessity to re-construct the
- * decoder stack.
+ * decoder stack. The interned annotation texts are dropped as well, see
+ * srd_session_ann_text_get().
  *
  * @param sess The session in which to terminate decoders. Must not be NULL.
  *
@@ -308,15 +570,131 @@ SRD_API int srd_session_terminate_reset(struct srd_session *sess)
 	if (!sess)
 		return SRD_ERR_ARG;
 
+	sess->output_start = 0;
+	sess->output_end = UINT64_MAX;
 	for (d = sess->di_list; d; d = d->next) {
 		ret = srd_inst_terminate_reset(d->data);
 		if (ret != SRD_OK)
 			return ret;
 	}
+	ann_texts_clear(sess);
 
 	return SRD_OK;
 }
 
+/**
+ * Get the texts of an annotation by their id.
+ *
+ * Texts which decoders put into annotations are interned per session:
+ * Each distinct list of texts is stored once, and gets an id
+ * (srd_proto_data_annotation.ann_text_id) which remains valid until
+ * srd_session_terminate_reset() or srd_session_destroy(). Frontends can
+ * keep the id instead of copies of the texts, and look them up here
+ * when needed.
+ *
+ * The number of interned texts per session is limited. Once the limit
+ * is reached, annotations with texts which were not interned yet get
+ * the ann_text_id SRD_ANN_TEXT_ID_NONE, and their texts are only valid
+ * during the callback (or while the annotation store keeps them).
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param ann_text_id The id of the texts.
+ *
+ * @return The NULL terminated list of texts, or NULL if the id is not
+ *         known. The list is owned by the session and must not be
+ *         modified or freed.
+ *
+ * @since 0.6.0
+ */
+SRD_API char **srd_session_ann_text_get(struct srd_session *sess,
+		uint32_t ann_text_id)
+{
+	char **ann_text;
+
+	if (!sess)
+		return NULL;
+
+	g_mutex_lock(&sess->ann_text_mutex);
+	ann_text = NULL;
+	if (ann_text_id < sess->ann_texts->len)
+		ann_text = g_ptr_array_index(sess->ann_texts, ann_text_id);
+	g_mutex_unlock(&sess->ann_text_mutex);
+
+	return ann_text;
+}
+
+/**
+ * Have annotations with raw values formatted on demand only.
+ *
+ * Decoders can put annotations as raw values, which get formatted using
+ * templates from the decoder's annotation classes, see
+ * srd_proto_data_annotation_text(). By default, the library formats all
+ * templates of such annotations and interns the texts like any others.
+ * In lazy mode, these annotations are passed to the callbacks without
+ * texts (ann_text is NULL, ann_text_id is SRD_ANN_TEXT_ID_NONE), and
+ * frontends format only the texts they show, or render the raw values
+ * themselves.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param lazy TRUE to only format texts on demand.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_session_lazy_ann_text_set(struct srd_session *sess,
+		gboolean lazy)
+{
+	if (!sess)
+		return SRD_ERR_ARG;
+
+	srd_dbg("%s lazy annotation texts for session %d.",
+		lazy ? "Enabling" : "Disabling", sess->session_id);
+	sess->lazy_ann_text = lazy;
+
+	return SRD_OK;
+}
+
+/**
+ * Have the session's instances keep their annotations.
+ *
+ * Kept annotations can be queried by sample range with
+ * srd_inst_ann_store_query() and srd_inst_ann_store_summary(), whether
+ * or not there are SRD_OUTPUT_ANN callbacks. Annotations outside of the
+ * output window (see srd_session_shard_set()), or not wanted by an
+ * instance's output filter, are not kept. Instances drop their kept
+ * annotations when they get reset, e.g. by srd_session_terminate_reset().
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param enable TRUE to keep annotations from now on, FALSE to stop
+ *               keeping new ones.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_session_ann_store_set(struct srd_session *sess,
+		gboolean enable)
+{
+	if (!sess)
+		return SRD_ERR_ARG;
+
+	srd_dbg("%s the annotation store for session %d.",
+		enable ? "Enabling" : "Disabling", sess->session_id);
+	sess->ann_store = enable;
+
+	return SRD_OK;
+}
+
+static void callback_free(void *data)
+{
+	struct srd_pd_callback *pd_cb;
+
+	pd_cb = data;
+	g_free(pd_cb->classes);
+	g_free(pd_cb);
+}
+
 /**
  * Destroy a decoding session.
  *
@@ -330,7 +708,7 @@ SRD_API int srd_session_terminate_reset(struct srd_session *sess)
  */
 SRD_API int srd_session_destroy(struct srd_session *sess)
 {
-	int session_id;
+	int session_id, i;
 
 	if (!sess)
 		return SRD_ERR_ARG;
@@ -338,8 +716,13 @@ SRD_API int srd_session_destroy(struct srd_session *sess)
 	session_id = sess->session_id;
 	if (sess->di_list)
 		srd_inst_free_all(sess);
-	if (sess->callbacks)
-		g_slist_free_full(sess->callbacks, g_free);
+	for (i = 0; i < SRD_NUM_OUTPUT_TYPES; i++)
+		g_slist_free_full(sess->callbacks[i], callback_free);
+	g_hash_table_destroy(sess->ann_text_ids);
+	g_ptr_array_free(sess->ann_texts, TRUE);
+	g_string_free(sess->ann_text_key, TRUE);
+	g_mutex_clear(&sess->ann_text_mutex);
+	g_mutex_clear(&sess->callback_mutex);
 	sessions = g_slist_remove(sessions, sess);
 	g_free(sess);
 
@@ -348,6 +731,81 @@ SRD_API int srd_session_destroy(struct srd_session *sess)
 	return SRD_OK;
 }
 
+/**
+ * Prepare a session with a decoder stack for its next user.
+ *
+ * The instances are kept, as srd_session_terminate_reset() left them.
+ * The output callbacks, the interned annotation texts and the session's
+ * settings are dropped, like in a new session.
+ *
+ * @param sess The session to recycle. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_session_recycle(struct srd_session *sess)
+{
+	int ret, i;
+
+	if ((ret = srd_session_terminate_reset(sess)) != SRD_OK)
+		return ret;
+
+	for (i = 0; i < SRD_NUM_OUTPUT_TYPES; i++) {
+		g_slist_free_full(sess->callbacks[i], callback_free);
+		sess->callbacks[i] = NULL;
+	}
+	sess->queue_depth = 0;
+	sess->lazy_ann_text = FALSE;
+	sess->ann_store = FALSE;
+
+	srd_dbg("Recycled session %d.", sess->session_id);
+
+	return SRD_OK;
+}
+
+static int callback_add(struct srd_session *sess, int output_type,
+		srd_pd_output_callback cb, srd_pd_output_batch_callback batch_cb,
+		unsigned int batch_size, void *cb_data,
+		const struct srd_decoder_inst *di, const int *classes,
+		unsigned int num_classes)
+{
+	struct srd_pd_callback *pd_cb;
+	unsigned int i;
+	int max_class;
+
+	if (output_type < 0 || output_type >= SRD_NUM_OUTPUT_TYPES) {
+		srd_err("Invalid output type %d.", output_type);
+		return SRD_ERR_ARG;
+	}
+
+	pd_cb = g_malloc(sizeof(struct srd_pd_callback));
+	pd_cb->output_type = output_type;
+	pd_cb->cb = cb;
+	pd_cb->cb_data = cb_data;
+	pd_cb->batch_cb = batch_cb;
+	pd_cb->batch_size = batch_size;
+	pd_cb->di = di;
+	pd_cb->num_classes = 0;
+	pd_cb->classes = NULL;
+
+	/* A lookup table, indexed by class. */
+	if (classes && num_classes) {
+		max_class = -1;
+		for (i = 0; i < num_classes; i++)
+			max_class = MAX(max_class, classes[i]);
+		pd_cb->num_classes = max_class + 1;
+		pd_cb->classes = g_malloc0(pd_cb->num_classes * sizeof(gboolean));
+		for (i = 0; i < num_classes; i++)
+			pd_cb->classes[classes[i]] = TRUE;
+	}
+
+	sess->callbacks[output_type] = g_slist_append(
+		sess->callbacks[output_type], pd_cb);
+
+	return SRD_OK;
+}
+
 /**
  * Register/add a decoder output callback function.
  *
@@ -355,10 +813,12 @@ SRD_API int srd_session_destroy(struct srd_session *sess)
  * to the PD controller (except for Python objects, which only go up the
  * stack).
  *
+ * Several callbacks can be registered per output type, they are called
+ * in the order of their registration.
+ *
  * @param sess The output session in which to register the callback.
  *             Must not be NULL.
- * @param output_type The output type this callback will receive. Only one
- *                    callback per output type can be registered.
+ * @param output_type The output type this callback will receive.
  * @param cb The function to call. Must not be NULL.
  * @param cb_data Private data for the callback function. Can be NULL.
  *
@@ -367,43 +827,204 @@ SRD_API int srd_session_destroy(struct srd_session *sess)
 SRD_API int srd_pd_output_callback_add(struct srd_session *sess,
 		int output_type, srd_pd_output_callback cb, void *cb_data)
 {
-	struct srd_pd_callback *pd_cb;
-
 	if (!sess)
 		return SRD_ERR_ARG;
 
 	srd_dbg("Registering new callback for output type %s.",
 		output_type_name(output_type));
 
-	pd_cb = g_malloc(sizeof(struct srd_pd_callback));
-	pd_cb->output_type = output_type;
-	pd_cb->cb = cb;
-	pd_cb->cb_data = cb_data;
-	sess->callbacks = g_slist_append(sess->callbacks, pd_cb);
+	return callback_add(sess, output_type, cb, NULL, 0, cb_data,
+		NULL, NULL, 0);
+}
 
-	return SRD_OK;
+/**
+ * Register/add a decoder output callback function, which only receives
+ * part of the output.
+ *
+ * Output which no callback wants is dropped before it gets converted,
+ * e.g. annotations of bit-level rows while a frontend only shows frames.
+ *
+ * @param sess The output session in which to register the callback.
+ *             Must not be NULL.
+ * @param output_type The output type this callback will receive.
+ * @param cb The function to call. Must not be NULL.
+ * @param cb_data Private data for the callback function. Can be NULL.
+ * @param di Only receive output of this decoder instance. NULL to
+ *           receive the output of all instances.
+ * @param classes Only receive output of these annotation classes (for
+ *                SRD_OUTPUT_ANN) or binary classes (for
+ *                SRD_OUTPUT_BINARY). NULL to receive all classes.
+ *                Class ids must not be negative.
+ * @param num_classes The number of entries in 'classes'.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_pd_output_callback_add_filtered(struct srd_session *sess,
+		int output_type, srd_pd_output_callback cb, void *cb_data,
+		const struct srd_decoder_inst *di, const int *classes,
+		unsigned int num_classes)
+{
+	unsigned int i;
+
+	if (!sess || !cb)
+		return SRD_ERR_ARG;
+
+	for (i = 0; classes && i < num_classes; i++) {
+		if (classes[i] < 0) {
+			srd_err("Invalid output class %d.", classes[i]);
+			return SRD_ERR_ARG;
+		}
+	}
+
+	srd_dbg("Registering new filtered callback for output type %s "
+		"(instance %s, %u classes).", output_type_name(output_type),
+		di ? di->inst_id : "any", num_classes);
+
+	return callback_add(sess, output_type, cb, NULL, 0, cb_data,
+		di, classes, num_classes);
+}
+
+/**
+ * Register/add a decoder output callback function which receives
+ * annotations in batches.
+ *
+ * Instead of calling the frontend for every annotation, the annotations
+ * of each decoder instance are collected, and passed to the callback as
+ * an array of up to 'batch_size' struct srd_proto_data. Batches are also
+ * delivered when a decoder stack processed a chunk of samples, i.e.
+ * before srd_session_send() returns (unless chunks are queued, see
+ * srd_session_queue_depth_set()). The annotations of an instance are
+ * delivered in the order in which the decoder emitted them.
+ *
+ * The array and the annotations are only valid during the callback, and
+ * must not be modified or freed by the frontend. The annotations' texts
+ * are owned by the session, see srd_session_ann_text_get().
+ *
+ * @param sess The output session in which to register the callback.
+ *             Must not be NULL.
+ * @param output_type The output type this callback will receive. Only
+ *                    SRD_OUTPUT_ANN is supported. Only one batched
+ *                    callback can be registered per session.
+ * @param cb The function to call. Must not be NULL.
+ * @param batch_size The max. number of annotations per call. Must be > 0.
+ * @param cb_data Private data for the callback function. Can be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_pd_output_callback_add_batched(struct srd_session *sess,
+		int output_type, srd_pd_output_batch_callback cb,
+		unsigned int batch_size, void *cb_data)
+{
+	if (!sess || !cb || !batch_size)
+		return SRD_ERR_ARG;
+
+	if (output_type != SRD_OUTPUT_ANN) {
+		srd_err("Batched callbacks are not supported for output "
+			"type %s.", output_type_name(output_type));
+		return SRD_ERR_ARG;
+	}
+
+	if (srd_pd_output_batch_callback_find(sess)) {
+		srd_err("A batched callback is registered already.");
+		return SRD_ERR_ARG;
+	}
+
+	srd_dbg("Registering new batched callback for output type %s "
+		"(batch size %u).", output_type_name(output_type), batch_size);
+
+	return callback_add(sess, output_type, NULL, cb, batch_size, cb_data,
+		NULL, NULL, 0);
+}
+
+/**
+ * Remove all callbacks with the given function and private data.
+ *
+ * Must not be called while the session's decoder stacks are running.
+ *
+ * @private
+ */
+SRD_PRIV void srd_pd_output_callback_remove(struct srd_session *sess,
+		srd_pd_output_callback cb, void *cb_data)
+{
+	GSList *l, *next;
+	struct srd_pd_callback *pd_cb;
+	int i;
+
+	for (i = 0; i < SRD_NUM_OUTPUT_TYPES; i++) {
+		for (l = sess->callbacks[i]; l; l = next) {
+			next = l->next;
+			pd_cb = l->data;
+			if (pd_cb->cb != cb || pd_cb->cb_data != cb_data)
+				continue;
+			sess->callbacks[i] = g_slist_delete_link(
+				sess->callbacks[i], l);
+			callback_free(pd_cb);
+		}
+	}
 }
 
 /** @private */
-SRD_PRIV struct srd_pd_callback *srd_pd_output_callback_find(
-		struct srd_session *sess, int output_type)
+SRD_PRIV struct srd_pd_callback *srd_pd_output_batch_callback_find(
+		struct srd_session *sess)
 {
 	GSList *l;
-	struct srd_pd_callback *tmp, *pd_cb;
+	struct srd_pd_callback *pd_cb;
 
 	if (!sess)
 		return NULL;
 
-	pd_cb = NULL;
-	for (l = sess->callbacks; l; l = l->next) {
-		tmp = l->data;
-		if (tmp->output_type == output_type) {
-			pd_cb = tmp;
-			break;
-		}
+	for (l = sess->callbacks[SRD_OUTPUT_ANN]; l; l = l->next) {
+		pd_cb = l->data;
+		if (pd_cb->batch_cb)
+			return pd_cb;
+	}
+
+	return NULL;
+}
+
+/**
+ * Check whether a callback wants output of the given instance and class.
+ *
+ * @param pd_cb The callback.
+ * @param di The instance which emitted the output.
+ * @param output_class The output's annotation or binary class, or -1.
+ *
+ * @private
+ */
+SRD_PRIV gboolean srd_pd_output_callback_wants(
+		const struct srd_pd_callback *pd_cb,
+		const struct srd_decoder_inst *di, int output_class)
+{
+	if (pd_cb->di && pd_cb->di != di)
+		return FALSE;
+	if (pd_cb->classes && output_class >= 0) {
+		if ((unsigned int)output_class >= pd_cb->num_classes)
+			return FALSE;
+		return pd_cb->classes[output_class];
 	}
 
-	return pd_cb;
+	return TRUE;
+}
+
+
+/**
+ * Check whether output which starts at the given sample goes to the
+ * frontend, see srd_session_shard_set().
+ *
+ * @private
+ */
+SRD_PRIV gboolean srd_session_output_wanted(const struct srd_session *sess,
+		uint64_t start_sample)
+{
+	if (!sess)
+		return FALSE;
+
+	return start_sample >= sess->output_start &&
+		start_sample < sess->output_end;
 }
 
 /** @} */
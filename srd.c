@@ -22,6 +22,7 @@
 #include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
 #include "libsigrokdecode.h"
 #include <glib.h>
+#include <inttypes.h>
 
 /** @cond PRIVATE */
 
@@ -189,6 +190,78 @@ err:
 	return SRD_ERR_PYTHON;
 }
 
+static gint load_time_cmp(gconstpointer a, gconstpointer b)
+{
+	const struct srd_decoder *da, *db;
+	uint64_t ta, tb;
+
+	da = a;
+	db = b;
+	ta = da->load_stats.import_time + da->load_stats.metadata_time;
+	tb = db->load_stats.import_time + db->load_stats.metadata_time;
+
+	return (ta < tb) - (ta > tb);
+}
+
+/**
+ * Log what loading the protocol decoders took: the totals and the slowest
+ * decoders at debug level, every decoder at spew level.
+ *
+ * @param load_time Wall clock time of loading all decoders, in us.
+ *
+ * @private
+ */
+SRD_PRIV void srd_load_stats_print(int64_t load_time)
+{
+	const struct srd_decoder_load_stats *st;
+	struct srd_decoder *dec;
+	uint64_t import_time, metadata_time;
+	int64_t alloc_blocks;
+	GSList *decoders, *l;
+	GString *s;
+	int i;
+
+	if (srd_log_loglevel_get() < SRD_LOG_DBG)
+		return;
+
+	import_time = metadata_time = 0;
+	alloc_blocks = 0;
+	decoders = g_slist_copy((GSList *)srd_decoder_list());
+	for (l = decoders; l; l = l->next) {
+		dec = l->data;
+		import_time += dec->load_stats.import_time;
+		metadata_time += dec->load_stats.metadata_time;
+		alloc_blocks += dec->load_stats.alloc_blocks;
+	}
+	srd_dbg("Loaded %u protocol decoders in %.1f ms (import %.1f ms, "
+		"metadata %.1f ms, %" PRId64 " Python memory blocks).",
+		g_slist_length(decoders), load_time / 1000.0,
+		import_time / 1000.0, metadata_time / 1000.0, alloc_blocks);
+
+	decoders = g_slist_sort(decoders, load_time_cmp);
+	s = g_string_sized_new(500);
+	g_string_append(s, "Protocol decoder load times:\n");
+	for (l = decoders, i = 0; l; l = l->next, i++) {
+		dec = l->data;
+		st = &dec->load_stats;
+		if (i == 5 && srd_log_loglevel_get() < SRD_LOG_SPEW)
+			break;
+		g_string_append_printf(s, " - %s: import %.1f ms, metadata "
+			"%.1f ms, %" PRId64 " blocks", dec->id,
+			st->import_time / 1000.0, st->metadata_time / 1000.0,
+			st->alloc_blocks);
+		if (st->alloc_bytes >= 0)
+			g_string_append_printf(s, ", %" PRId64 " bytes",
+				st->alloc_bytes);
+		g_string_append_c(s, '\n');
+	}
+	s->str[s->len - 1] = '\0';
+	if (decoders)
+		srd_dbg("%s", s->str);
+	g_string_free(s, TRUE);
+	g_slist_free(decoders);
+}
+
 /**
  * Initialize libsigrokdecode.
  *
@@ -221,6 +294,7 @@ SRD_API int srd_init(const char *path)
 	const char *const *sys_datadirs;
 	const char *env_path;
 	size_t i;
+	int64_t start_time;
 	int ret;
 
 	if (max_session_id != -1) {
@@ -236,7 +310,10 @@ SRD_API int srd_init(const char *path)
 	PyImport_AppendInittab("sigrokdecode", PyInit_sigrokdecode);
 
 	/* Initialize the Python interpreter. */
+	start_time = g_get_monotonic_time();
 	Py_InitializeEx(0);
+	srd_dbg("Python initialized in %.1f ms.",
+		(g_get_monotonic_time() - start_time) / 1000.0);
 
 	/* Locations relative to the XDG system data directories. */
 	sys_datadirs = g_get_system_data_dirs();
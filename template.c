@@ -0,0 +1,474 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include <string.h>
+#include <glib.h>
+
+/**
+ * @file
+ *
+ * Templates of decoder stacks, and pools of sessions built from them.
+ */
+
+/**
+ * @defgroup grp_template Stack templates
+ *
+ * Building the same decoder stack many times.
+ *
+ * A stack template holds the decoders of a stack with their options
+ * and channels, which are checked and converted once when they are
+ * added. Instantiating the template into a session then only creates
+ * the instances, and takes time in the order of the stack's size.
+ *
+ * A stack pool keeps sessions holding an instance of a template. Once
+ * a frontend is done with a session, it puts it back, and the stack is
+ * reset with srd_session_terminate_reset() to be used again, instead
+ * of being destroyed and built anew.
+ *
+ * Templates and pools refer to their decoders, and must be freed
+ * before the decoders are unloaded, and before srd_exit().
+ *
+ * @{
+ */
+
+/** @cond PRIVATE */
+
+struct stack_layer {
+	struct srd_decoder *decoder;
+	char *inst_id;
+	/* Whether the instance ID was given, rather than made up. */
+	gboolean inst_id_given;
+	/* The converted options, or NULL for the decoder's defaults. */
+	PyObject *py_options;
+	/* The channel map, or NULL for the default one. */
+	int *channelmap;
+};
+
+struct srd_stack_template {
+	/* The layers, bottom first. */
+	GSList *layers;
+};
+
+struct srd_stack_pool {
+	struct srd_stack_template *tmpl;
+	/* Sessions which are ready to be used. */
+	GSList *idle;
+};
+
+/** @endcond */
+
+static void stack_layer_free(void *data)
+{
+	struct stack_layer *layer;
+	PyGILState_STATE gstate;
+
+	layer = data;
+	if (layer->py_options) {
+		gstate = PyGILState_Ensure();
+		Py_DECREF(layer->py_options);
+		PyGILState_Release(gstate);
+	}
+	g_free(layer->inst_id);
+	g_free(layer->channelmap);
+	g_free(layer);
+}
+
+static void session_destroy(void *data)
+{
+	srd_session_destroy(data);
+}
+
+static gboolean template_has_inst_id(const struct srd_stack_template *tmpl,
+		const char *inst_id)
+{
+	const struct stack_layer *layer;
+	GSList *l;
+
+	for (l = tmpl->layers; l; l = l->next) {
+		layer = l->data;
+		if (!strcmp(layer->inst_id, inst_id))
+			return TRUE;
+	}
+
+	return FALSE;
+}
+
+/**
+ * Create a new, empty stack template.
+ *
+ * @param tmpl Will hold the new template upon success. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_stack_template_new(struct srd_stack_template **tmpl)
+{
+	if (!tmpl)
+		return SRD_ERR_ARG;
+
+	*tmpl = g_malloc0(sizeof(struct srd_stack_template));
+
+	return SRD_OK;
+}
+
+/**
+ * Add a decoder on top of a stack template.
+ *
+ * The options and channels are checked like srd_inst_new() and
+ * srd_inst_channel_set_all() do, and kept in the template. Unlike
+ * srd_inst_new(), the options table is not modified.
+ *
+ * @param tmpl The template to use. Must not be NULL.
+ * @param decoder_id The decoder's 'id' field.
+ * @param options GHashTable of options which override the defaults set
+ *                in the decoder class, see srd_inst_new(). An "id" entry
+ *                sets the ID of the instances. May be NULL.
+ * @param channels GHashTable of channels, see srd_inst_channel_set_all().
+ *                 May be NULL for the default channel map.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_stack_template_add(struct srd_stack_template *tmpl,
+		const char *decoder_id, GHashTable *options,
+		GHashTable *channels)
+{
+	struct srd_decoder *dec;
+	struct stack_layer *layer;
+	GHashTable *dec_options;
+	GHashTableIter iter;
+	gpointer key, value;
+	const char *inst_id;
+	int i, ret;
+	PyGILState_STATE gstate;
+
+	if (!tmpl || !decoder_id)
+		return SRD_ERR_ARG;
+
+	if (!(dec = srd_decoder_get_by_id(decoder_id))) {
+		srd_err("Protocol decoder %s not found.", decoder_id);
+		return SRD_ERR_ARG;
+	}
+
+	/* Decoders loaded from the metadata cache get imported now. */
+	if ((ret = srd_decoder_import(dec)) != SRD_OK)
+		return ret;
+
+	layer = g_malloc0(sizeof(struct stack_layer));
+	layer->decoder = dec;
+
+	inst_id = options ? g_hash_table_lookup(options, "id") : NULL;
+	if (inst_id) {
+		if (template_has_inst_id(tmpl, inst_id)) {
+			srd_err("Instance ID %s is used twice in the template.",
+				inst_id);
+			g_free(layer);
+			return SRD_ERR_ARG;
+		}
+		layer->inst_id = g_strdup(inst_id);
+		layer->inst_id_given = TRUE;
+	} else {
+		i = 1;
+		layer->inst_id = g_strdup_printf("%s-%d", decoder_id, i++);
+		while (template_has_inst_id(tmpl, layer->inst_id)) {
+			g_free(layer->inst_id);
+			layer->inst_id = g_strdup_printf("%s-%d", decoder_id, i++);
+		}
+	}
+
+	/* The "id" is not an option of the decoder. */
+	dec_options = options;
+	if (inst_id) {
+		dec_options = g_hash_table_new(g_str_hash, g_str_equal);
+		g_hash_table_iter_init(&iter, options);
+		while (g_hash_table_iter_next(&iter, &key, &value)) {
+			if (strcmp(key, "id"))
+				g_hash_table_insert(dec_options, key, value);
+		}
+	}
+
+	ret = SRD_OK;
+	if (dec_options) {
+		gstate = PyGILState_Ensure();
+		ret = srd_inst_options_to_dict(dec, layer->inst_id,
+			dec_options, &layer->py_options);
+		PyGILState_Release(gstate);
+	}
+	if (dec_options != options)
+		g_hash_table_destroy(dec_options);
+
+	if (ret == SRD_OK && channels)
+		ret = srd_inst_channelmap_new(dec, channels, &layer->channelmap);
+
+	if (ret != SRD_OK) {
+		stack_layer_free(layer);
+		return ret;
+	}
+
+	tmpl->layers = g_slist_append(tmpl->layers, layer);
+	srd_dbg("Added %s to a stack template as %s.", decoder_id,
+		layer->inst_id);
+
+	return SRD_OK;
+}
+
+/**
+ * Build the stack of a template in a session.
+ *
+ * The instances get the template's instance IDs. Instance IDs which
+ * were made up are made unique in the session, if it already holds
+ * instances. Should instantiation fail, the session may hold part of
+ * the stack.
+ *
+ * @param tmpl The template to use. Must not be NULL, nor empty.
+ * @param sess The session to build the stack in. Must not be NULL.
+ * @param di_bottom Will hold the bottom instance of the stack upon
+ *                  success. May be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_stack_template_instantiate(struct srd_stack_template *tmpl,
+		struct srd_session *sess, struct srd_decoder_inst **di_bottom)
+{
+	struct stack_layer *layer;
+	struct srd_decoder_inst *di, *di_prev;
+	gboolean check_ids;
+	char *inst_id;
+	GSList *l;
+	int i, ret;
+
+	if (!tmpl || !sess)
+		return SRD_ERR_ARG;
+
+	if (!tmpl->layers) {
+		srd_err("Cannot instantiate an empty stack template.");
+		return SRD_ERR_ARG;
+	}
+
+	/* The template's IDs are unique, only existing instances can clash. */
+	check_ids = sess->di_list != NULL;
+
+	di_prev = NULL;
+	for (l = tmpl->layers; l; l = l->next) {
+		layer = l->data;
+		inst_id = g_strdup(layer->inst_id);
+		if (check_ids && srd_inst_find_by_id(sess, inst_id)) {
+			if (layer->inst_id_given) {
+				srd_err("Instance ID %s already exists in "
+					"session %d.", inst_id, sess->session_id);
+				g_free(inst_id);
+				return SRD_ERR_ARG;
+			}
+			i = 1;
+			do {
+				g_free(inst_id);
+				inst_id = g_strdup_printf("%s-%d",
+					layer->decoder->id, i++);
+			} while (srd_inst_find_by_id(sess, inst_id));
+		}
+
+		di = srd_inst_create(sess, layer->decoder, inst_id,
+			layer->py_options);
+		if (!di)
+			return SRD_ERR;
+
+		if (layer->channelmap)
+			memcpy(di->dec_channelmap, layer->channelmap,
+				sizeof(int) * di->dec_num_channels);
+
+		if (di_prev) {
+			if ((ret = srd_inst_stack(sess, di_prev, di)) != SRD_OK)
+				return ret;
+		} else if (di_bottom) {
+			*di_bottom = di;
+		}
+		di_prev = di;
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Free a stack template.
+ *
+ * Instances which were built from the template are not affected.
+ *
+ * @param tmpl The template to free. May be NULL.
+ *
+ * @since 0.6.0
+ */
+SRD_API void srd_stack_template_free(struct srd_stack_template *tmpl)
+{
+	if (!tmpl)
+		return;
+
+	g_slist_free_full(tmpl->layers, stack_layer_free);
+	g_free(tmpl);
+}
+
+/**
+ * Create a new pool of sessions holding a template's stack.
+ *
+ * The pool uses the template, which must be freed after the pool.
+ * Pools are not thread safe.
+ *
+ * @param tmpl The template of the sessions' stack. Must not be NULL.
+ * @param pool Will hold the new pool upon success. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_stack_pool_new(struct srd_stack_template *tmpl,
+		struct srd_stack_pool **pool)
+{
+	if (!tmpl || !pool)
+		return SRD_ERR_ARG;
+
+	*pool = g_malloc0(sizeof(struct srd_stack_pool));
+	(*pool)->tmpl = tmpl;
+
+	return SRD_OK;
+}
+
+/**
+ * Get a session holding the pool's stack.
+ *
+ * The session is either one which was put back into the pool, or a new
+ * one. It is like a new session: Frontends add their callbacks, set
+ * the metadata, and start it.
+ *
+ * @param pool The pool to use. Must not be NULL.
+ * @param sess Will hold the session upon success. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_stack_pool_get(struct srd_stack_pool *pool,
+		struct srd_session **sess)
+{
+	int ret;
+
+	if (!pool || !sess)
+		return SRD_ERR_ARG;
+
+	if (pool->idle) {
+		*sess = pool->idle->data;
+		pool->idle = g_slist_delete_link(pool->idle, pool->idle);
+		return SRD_OK;
+	}
+
+	if ((ret = srd_session_new(sess)) != SRD_OK)
+		return ret;
+	ret = srd_stack_template_instantiate(pool->tmpl, *sess, NULL);
+	if (ret != SRD_OK) {
+		srd_session_destroy(*sess);
+		*sess = NULL;
+	}
+
+	return ret;
+}
+
+/* Undo changes of the frontend to the instances of a template's stack. */
+static int stack_restore(const struct srd_stack_template *tmpl,
+		struct srd_session *sess)
+{
+	const struct stack_layer *layer;
+	struct srd_decoder_inst *di;
+	GSList *l;
+	int ret;
+
+	di = sess->di_list ? sess->di_list->data : NULL;
+	for (l = tmpl->layers; l && di; l = l->next) {
+		layer = l->data;
+		ret = srd_inst_settings_restore(di, layer->py_options,
+			layer->channelmap);
+		if (ret != SRD_OK)
+			return ret;
+		di = di->next_di ? di->next_di->data : NULL;
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Put a session back into its pool.
+ *
+ * The session's decoders are terminated and reset, its callbacks,
+ * annotation texts and settings are dropped, the instances get the
+ * template's options and channels back and lose their output filters,
+ * and it is kept for the next srd_stack_pool_get(). Should the reset
+ * fail, the session is destroyed instead. The session must have been
+ * returned by srd_stack_pool_get() of the same pool, with the stack left
+ * as it was.
+ *
+ * @param pool The pool to use. Must not be NULL.
+ * @param sess The session to put back. Must not be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *         The session is gone either way.
+ *
+ * @since 0.6.0
+ */
+SRD_API int srd_stack_pool_put(struct srd_stack_pool *pool,
+		struct srd_session *sess)
+{
+	int ret;
+
+	if (!pool || !sess)
+		return SRD_ERR_ARG;
+
+	if ((ret = srd_session_recycle(sess)) != SRD_OK ||
+			(ret = stack_restore(pool->tmpl, sess)) != SRD_OK) {
+		srd_warn("Failed to reset session %d, destroying it.",
+			sess->session_id);
+		srd_session_destroy(sess);
+		return ret;
+	}
+
+	pool->idle = g_slist_prepend(pool->idle, sess);
+
+	return SRD_OK;
+}
+
+/**
+ * Free a pool, and destroy the sessions it keeps.
+ *
+ * Sessions which were not put back are not affected.
+ *
+ * @param pool The pool to free. May be NULL.
+ *
+ * @since 0.6.0
+ */
+SRD_API void srd_stack_pool_free(struct srd_stack_pool *pool)
+{
+	if (!pool)
+		return;
+
+	g_slist_free_full(pool->idle, session_destroy);
+	g_free(pool);
+}
+
+/** @} */
@@ -0,0 +1,69 @@
+#!/bin/sh
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+##
+## Smoke test of srd-decode-server: start it, decode one UART frame
+## through srd-decode-client, and check that invalid requests are rejected.
+##
+## Expects top_srcdir, top_builddir and PYTHON3 in the environment.
+##
+
+: ${top_srcdir:=.} ${top_builddir:=.} ${PYTHON3:=python3}
+server=$top_builddir/tools/srd-decode-server
+client="$PYTHON3 $top_srcdir/tools/srd-decode-client"
+
+tmpdir=$(mktemp -d) || exit 1
+sock=$tmpdir/socket
+pid=
+cleanup() {
+	[ -n "$pid" ] && kill $pid && wait $pid
+	rm -rf "$tmpdir"
+}
+trap cleanup EXIT
+
+fail() {
+	echo "FAIL: $*" >&2
+	exit 1
+}
+
+# 0x41 at 1000 baud, 8 samples per bit, with idle time around.
+$PYTHON3 -c "import sys
+bits = [1, 1, 0] + [(0x41 >> i) & 1 for i in range(8)] + [1, 1, 1]
+sys.stdout.buffer.write(b''.join(bytes([b]) * 8 for b in bits))" \
+	>"$tmpdir/uart.bin" || fail "cannot create samples"
+
+# Don't write the user's decoder metadata cache.
+SIGROKDECODE_CACHE= $server -s "$sock" -j 1 -d "$top_srcdir/decoders" &
+pid=$!
+for i in $(seq 50); do
+	[ -S "$sock" ] && break
+	sleep 0.1
+done
+[ -S "$sock" ] || fail "server did not start"
+
+$client -s "$sock" -P uart:rx=0:baudrate=1000 -r 8000 "$tmpdir/uart.bin" \
+	>"$tmpdir/out" || fail "decoding failed"
+grep -q ': rx-data: "41"$' "$tmpdir/out" || fail "no data: $(cat "$tmpdir/out")"
+
+for request in "-P uart:rx=abc -r 8000" "-P uart:rx=-1 -r 8000" \
+		"-P uart:rx=0 -r -8000"; do
+	$client -s "$sock" $request "$tmpdir/uart.bin" >/dev/null 2>&1 &&
+		fail "accepted $request"
+done
+
+exit 0
@@ -0,0 +1,2255 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include <libsigrokdecode-internal.h> /* First, to avoid compiler warning. */
+#include <libsigrokdecode.h>
+#include <inttypes.h>
+#include <stdlib.h>
+#include <string.h>
+#include <check.h>
+#include "lib.h"
+
+/*
+ * Puts an annotation with the pin values and the matched conditions
+ * (both packed into integers) for every match of the 'conds' option,
+ * using .wait(), or .wait_many() when 'batch' is not 0.
+ */
+static const char waittest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'waittest'\n"
+	"    name = 'Wait test'\n"
+	"    longname = 'Wait test'\n"
+	"    desc = 'Puts the matches of conditions.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = (\n"
+	"        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},\n"
+	"        {'id': 'd1', 'name': 'D1', 'desc': 'Data 1'},\n"
+	"    )\n"
+	"    options = (\n"
+	"        {'id': 'conds', 'desc': 'Conditions', 'default': 'None'},\n"
+	"        {'id': 'batch', 'desc': 'Batch size', 'default': 0},\n"
+	"    )\n"
+	"    annotations = (('match', 'Match'),)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        conds = eval(self.options['conds'])\n"
+	"        batch = self.options['batch']\n"
+	"        while True:\n"
+	"            if batch:\n"
+	"                matches = zip(*self.wait_many(conds, batch))\n"
+	"            else:\n"
+	"                pins = self.wait(conds)\n"
+	"                p = sum(v << i for i, v in enumerate(pins))\n"
+	"                m = sum(v << i for i, v in enumerate(self.matched or ()))\n"
+	"                matches = [(self.samplenum, p, m)]\n"
+	"            for s, p, m in matches:\n"
+	"                self.put(s, s, self.out_ann, [0, ['%d %d' % (p, m)]])\n";
+
+/*
+ * Waits for the condition lists of the 'conds' option in turn, and puts
+ * the pin values and the matched conditions of every match. Lists are
+ * separated by ';', conditions by '|', and terms by ' ', a term is the
+ * type and the channel (e.g. 'r0'), or 's' and the number of samples to
+ * skip. Skip counts grow by one with every pass through the lists. See
+ * match_reference().
+ */
+static const char matchtest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'matchtest'\n"
+	"    name = 'Match test'\n"
+	"    longname = 'Match test'\n"
+	"    desc = 'Puts the matches of condition lists.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = (\n"
+	"        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},\n"
+	"        {'id': 'd1', 'name': 'D1', 'desc': 'Data 1'},\n"
+	"    )\n"
+	"    optional_channels = (\n"
+	"        {'id': 'd2', 'name': 'D2', 'desc': 'Data 2'},\n"
+	"        {'id': 'd3', 'name': 'D3', 'desc': 'Data 3'},\n"
+	"    )\n"
+	"    options = (\n"
+	"        {'id': 'conds', 'desc': 'Condition lists', 'default': ''},\n"
+	"    )\n"
+	"    annotations = (('match', 'Match'),)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def term(self, t, n):\n"
+	"        if t[0] == 's':\n"
+	"            return ('skip', int(t[1:]) + n)\n"
+	"        return (int(t[1:]), t[0])\n"
+	"\n"
+	"    def decode(self):\n"
+	"        lists = self.options['conds'].split(';')\n"
+	"        n = 0\n"
+	"        while True:\n"
+	"            conds = [dict(self.term(t, n // len(lists)) for t in c.split())\n"
+	"                for c in lists[n % len(lists)].split('|')]\n"
+	"            pins = self.wait(conds)\n"
+	"            p = ''.join('x' if v > 1 else str(v) for v in pins)\n"
+	"            m = sum(v << i for i, v in enumerate(self.matched))\n"
+	"            self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                [0, ['%s %d' % (p, m)]])\n"
+	"            n += 1\n";
+
+/*
+ * Keeps a slice of the view of the first chunk's samples, and a copy.
+ * Every 100 samples, puts the sample from the current chunk's view and
+ * whether the kept slice still holds what the copy does.
+ */
+static const char peektest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'peektest'\n"
+	"    name = 'Peek test'\n"
+	"    longname = 'Peek test'\n"
+	"    desc = 'Puts samples seen through peek_chunk().'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"    annotations = (('sample', 'Sample'),)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        self.wait()\n"
+	"        start, unitsize, view = self.peek_chunk()\n"
+	"        kept = view[10:20]\n"
+	"        copy = bytes(kept)\n"
+	"        del view\n"
+	"        while True:\n"
+	"            self.wait({'skip': 100})\n"
+	"            start, unitsize, view = self.peek_chunk()\n"
+	"            value = view[self.samplenum - start]\n"
+	"            same = 'same' if bytes(kept) == copy else 'changed'\n"
+	"            self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                [0, ['%d %s' % (value, same)]])\n";
+
+/*
+ * Puts an annotation for every sample, with the sample number (modulo
+ * the 'mod' option, unless it is 0) as text.
+ */
+static const char texttest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'texttest'\n"
+	"    name = 'Text test'\n"
+	"    longname = 'Text test'\n"
+	"    desc = 'Puts sample numbers as texts.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"    options = ({'id': 'mod', 'desc': 'Modulus', 'default': 0},)\n"
+	"    annotations = (('text', 'Text'),)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        mod = self.options['mod']\n"
+	"        while True:\n"
+	"            self.wait({'skip': 1})\n"
+	"            n = self.samplenum % mod if mod else self.samplenum\n"
+	"            self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                [0, ['v%d' % n]])\n";
+
+/*
+ * Puts an annotation with a text which can't be encoded, one with a
+ * text which is not a string, and one with a valid text.
+ */
+static const char badtexttest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'badtexttest'\n"
+	"    name = 'Bad text test'\n"
+	"    longname = 'Bad text test'\n"
+	"    desc = 'Puts annotations with bad texts.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"    annotations = (('text', 'Text'),)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        self.wait({'skip': 1})\n"
+	"        self.put(0, 1, self.out_ann, [0, ['\\ud800']])\n"
+	"        self.put(1, 2, self.out_ann, [0, [1]])\n"
+	"        self.put(2, 3, self.out_ann, [0, ['good']])\n"
+	"        while True:\n"
+	"            self.wait({'skip': 1})\n";
+
+/*
+ * Puts one byte (the sample number) of binary class 0 for every sample,
+ * and a byte of class 1 for every 40th sample.
+ */
+static const char bintest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'bintest'\n"
+	"    name = 'Binary test'\n"
+	"    longname = 'Binary test'\n"
+	"    desc = 'Puts sample numbers as binary output.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"    binary = (('a', 'A'), ('b', 'B'))\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_bin = self.register(srd.OUTPUT_BINARY)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        while True:\n"
+	"            self.wait({'skip': 1})\n"
+	"            s = self.samplenum\n"
+	"            self.put(s, s, self.out_bin, [0, bytes([s & 0xff])])\n"
+	"            if s % 40 == 0:\n"
+	"                self.put(s, s, self.out_bin, [1, b'X'])\n";
+
+/* Puts the pins as Python output at every edge of either channel. */
+static const char pylower_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'pylower'\n"
+	"    name = 'Python lower'\n"
+	"    longname = 'Python lower'\n"
+	"    desc = 'Puts pins as Python output.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = ['pins']\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = (\n"
+	"        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},\n"
+	"        {'id': 'd1', 'name': 'D1', 'desc': 'Data 1'},\n"
+	"    )\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_python = self.register(srd.OUTPUT_PYTHON)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        while True:\n"
+	"            pins = self.wait([{0: 'e'}, {1: 'e'}])\n"
+	"            self.put(self.samplenum - 1, self.samplenum,\n"
+	"                self.out_python, ['PINS', list(pins)])\n";
+
+/*
+ * Stacked on pylower, puts an annotation for every Python output it
+ * gets. A format string: The id's suffix, and the source of an optional
+ * decode_items() method.
+ */
+static const char pyupper_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'pyupper%s'\n"
+	"    name = 'Python upper'\n"
+	"    longname = 'Python upper'\n"
+	"    desc = 'Puts Python input as annotations.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['pins']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    annotations = (('pins', 'Pins'),)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self, ss, es, data):\n"
+	"        self.put(ss, es, self.out_ann,\n"
+	"            [0, ['%%s %%r' %% (data[0], data[1])]])\n"
+	"%s";
+
+static const char pyupper_items[] =
+	"\n"
+	"    def decode_items(self, items):\n"
+	"        for ss, es, data in items:\n"
+	"            self.decode(ss, es, data)\n";
+
+/* Puts an annotation every 10 samples, cycling through three classes. */
+static const char classtest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'classtest'\n"
+	"    name = 'Class test'\n"
+	"    longname = 'Class test'\n"
+	"    desc = 'Puts annotations of several classes.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"    annotations = (('a', 'A'), ('b', 'B'), ('c', 'C'))\n"
+	"    annotation_rows = (\n"
+	"        ('first', 'First', (0, 1)),\n"
+	"        ('second', 'Second', (2,)),\n"
+	"    )\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        while True:\n"
+	"            self.wait({'skip': 10})\n"
+	"            s = self.samplenum\n"
+	"            self.put(s, s, self.out_ann, [(s // 10) % 3, ['%d' % s]])\n";
+
+/*
+ * Checks self.has_ann_listener(1) at every sample, and puts the number
+ * of samples at which it returned True every 100 samples (class 0).
+ */
+static const char listentest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'listentest'\n"
+	"    name = 'Listen test'\n"
+	"    longname = 'Listen test'\n"
+	"    desc = 'Puts results of has_ann_listener().'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"    annotations = (('count', 'Count'), ('bit', 'Bit'))\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        count = 0\n"
+	"        while True:\n"
+	"            self.wait({'skip': 1})\n"
+	"            if self.has_ann_listener(1):\n"
+	"                count += 1\n"
+	"            if self.samplenum % 100 == 0:\n"
+	"                self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                    [0, ['%d' % count]])\n";
+
+/* Puts annotations with payloads, one of which can't be converted. */
+static const char payloadtest_pd[] =
+	"import sigrokdecode as srd\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'payloadtest'\n"
+	"    name = 'Payload test'\n"
+	"    longname = 'Payload test'\n"
+	"    desc = 'Puts annotations with payloads.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"    annotations = (('text', 'Text'),)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(srd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        self.wait({'skip': 1})\n"
+	"        self.put(0, 1, self.out_ann, [0, ['bad'], {'a': 1}])\n"
+	"        self.put(1, 2, self.out_ann, [0, ['good'], (1, b'ab', [2])])\n"
+	"        self.put(2, 3, self.out_ann, [0, ['none']])\n"
+	"        while True:\n"
+	"            self.wait({'skip': 1})\n";
+
+/* The UART decoder, failing when it builds unwanted data bit annotations. */
+static const char uartwrap_pd[] =
+	"from uart.pd import Decoder as Uart, Ann\n"
+	"\n"
+	"class Decoder(Uart):\n"
+	"    id = 'uartwrap'\n"
+	"\n"
+	"    def putg(self, data):\n"
+	"        if data[0] in (Ann.RX_DATA_BIT, Ann.TX_DATA_BIT):\n"
+	"            raise Exception('Built a data bit annotation.')\n"
+	"        Uart.putg(self, data)\n";
+
+static void ann_to_string_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	const struct srd_proto_data_annotation *pda;
+
+	pda = pdata->data;
+	g_string_append_printf(cb_data, "%" PRIu64 "-%" PRIu64 " %d %s\n",
+		pdata->start_sample, pdata->end_sample, pda->ann_class,
+		pda->ann_text && pda->ann_text[0] ? pda->ann_text[0] : "");
+}
+
+/*
+ * Create a session with an instance of the decoder, which puts its
+ * annotations as text (one line each) into 'out', and start it.
+ */
+static struct srd_session *decode_session_new(const char *decoder_id,
+		GHashTable *options, unsigned int queue_depth, GString *out)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+
+	srd_session_new(&sess);
+	srd_session_queue_depth_set(sess, queue_depth);
+	inst = srd_inst_new(sess, decoder_id, options);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, ann_to_string_cb, out);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(1000000));
+	srd_session_start(sess);
+
+	return sess;
+}
+
+/*
+ * Run a decoder over the samples, sent in chunks of 'chunk_size'
+ * samples with the given queue depth, and return its annotations as
+ * text (one line each). Every chunk is sent from the same buffer,
+ * which gets overwritten after it was sent, like frontends do.
+ */
+static char *decode_samples(const char *decoder_id, GHashTable *options,
+		const uint8_t *samples, uint64_t num_samples,
+		uint64_t chunk_size, unsigned int queue_depth)
+{
+	struct srd_session *sess;
+	GString *out;
+	uint8_t *buf;
+	uint64_t start, end;
+	int ret;
+
+	out = g_string_new(NULL);
+	buf = g_malloc(chunk_size);
+	sess = decode_session_new(decoder_id, options, queue_depth, out);
+	for (start = 0; start < num_samples; start = end) {
+		end = MIN(start + chunk_size, num_samples);
+		memcpy(buf, samples + start, end - start);
+		ret = srd_session_send(sess, start, end, buf, end - start, 1);
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+		memset(buf, 0xff, chunk_size);
+	}
+	ret = srd_session_flush(sess);
+	fail_unless(ret == SRD_OK, "srd_session_flush() failed: %d.", ret);
+	srd_session_destroy(sess);
+	g_free(buf);
+
+	return g_string_free(out, FALSE);
+}
+
+/*
+ * Like decode_samples(), but send every chunk as the list of its
+ * transitions, by srd_session_send_transitions().
+ */
+static char *decode_transitions(const char *decoder_id, GHashTable *options,
+		const uint8_t *samples, uint64_t num_samples,
+		uint64_t chunk_size)
+{
+	struct srd_session *sess;
+	GString *out;
+	uint64_t *samplenums;
+	uint8_t *values;
+	uint64_t start, end, i, n;
+	int ret;
+
+	out = g_string_new(NULL);
+	samplenums = g_malloc(chunk_size * sizeof(*samplenums));
+	values = g_malloc(chunk_size);
+	sess = decode_session_new(decoder_id, options, 0, out);
+	for (start = 0; start < num_samples; start = end) {
+		end = MIN(start + chunk_size, num_samples);
+		n = 0;
+		for (i = start; i < end; i++) {
+			if (i > start && samples[i] == samples[i - 1])
+				continue;
+			samplenums[n] = i;
+			values[n++] = samples[i];
+		}
+		ret = srd_session_send_transitions(sess, start, end,
+			samplenums, values, n, 1);
+		fail_unless(ret == SRD_OK,
+			"srd_session_send_transitions() failed: %d.", ret);
+	}
+	srd_session_destroy(sess);
+	g_free(values);
+	g_free(samplenums);
+
+	return g_string_free(out, FALSE);
+}
+
+static GHashTable *waittest_options(const char *conds, int64_t batch)
+{
+	GHashTable *options;
+
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "conds", g_variant_new_string(conds));
+	g_hash_table_insert(options, "batch", g_variant_new_int64(batch));
+
+	return options;
+}
+
+static char *decode_waittest(const char *conds, int64_t batch,
+		const uint8_t *samples, uint64_t num_samples)
+{
+	GHashTable *options;
+	char *out;
+
+	options = waittest_options(conds, batch);
+	out = decode_samples("waittest", options, samples, num_samples,
+		250, 0);
+	g_hash_table_destroy(options);
+
+	return out;
+}
+
+/* Two channels which change now and then, at pseudo-random samples. */
+static void random_samples(uint8_t *samples, uint64_t num_samples)
+{
+	uint64_t i;
+	uint32_t rnd;
+	uint8_t value;
+
+	rnd = 1;
+	value = 0;
+	for (i = 0; i < num_samples; i++) {
+		rnd = rnd * 1103515245 + 12345;
+		if (((rnd >> 16) & 7) == 0)
+			value ^= 1 << ((rnd >> 20) & 1);
+		samples[i] = value;
+	}
+}
+
+/*
+ * Check whether .wait_many() finds the same matches as repeated .wait()
+ * calls, also when skip counts and batches reach across chunks.
+ */
+START_TEST(test_wait_many)
+{
+	static const char *conds[] = {
+		"{'skip': 100}",
+		"None",
+		"[{0: 'r'}, {'skip': 10}]",
+		"[{0: 'e'}, {1: 'f'}]",
+		"[{0: 'h', 1: 'r'}, {'skip': 7, 1: 'f'}]",
+	};
+	static const int64_t batches[] = { 1, 3, 256 };
+	uint8_t samples[2000];
+	char *expected, *out;
+	unsigned int i, j;
+
+	random_samples(samples, sizeof(samples));
+	srdtest_decoder_add("waittest", waittest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("waittest");
+
+	for (i = 0; i < G_N_ELEMENTS(conds); i++) {
+		expected = decode_waittest(conds[i], 0, samples, sizeof(samples));
+		fail_unless(strchr(expected, '\n') != NULL,
+			"No matches of %s.", conds[i]);
+		for (j = 0; j < G_N_ELEMENTS(batches); j++) {
+			out = decode_waittest(conds[i], batches[j], samples,
+				sizeof(samples));
+			fail_unless(!strcmp(out, expected),
+				"wait_many(%s, %" PRId64 ") differs from wait().",
+				conds[i], batches[j]);
+			g_free(out);
+		}
+		g_free(expected);
+	}
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether decoders put the same annotations when the samples are
+ * sent as transitions, as when they are sent one by one.
+ */
+START_TEST(test_send_transitions)
+{
+	static const char *conds[] = {
+		"{'skip': 100}",
+		"[{0: 'e'}, {1: 'f'}]",
+		"[{0: 'r'}, {'skip': 10}]",
+		"[{0: 'h', 1: 'r'}, {'skip': 7, 1: 'f'}]",
+	};
+	uint8_t samples[2000];
+	GHashTable *options;
+	char *expected, *out;
+	unsigned int i;
+
+	random_samples(samples, sizeof(samples));
+	srdtest_decoder_add("waittest", waittest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("waittest");
+
+	for (i = 0; i < G_N_ELEMENTS(conds); i++) {
+		/* srd_inst_new() removes the options it used. */
+		options = waittest_options(conds[i], 0);
+		expected = decode_samples("waittest", options, samples,
+			sizeof(samples), 250, 0);
+		fail_unless(strchr(expected, '\n') != NULL,
+			"No matches of %s.", conds[i]);
+		g_hash_table_destroy(options);
+		options = waittest_options(conds[i], 0);
+		out = decode_transitions("waittest", options, samples,
+			sizeof(samples), 250);
+		g_hash_table_destroy(options);
+		fail_unless(!strcmp(out, expected),
+			"Transitions differ from samples for %s:\n%s",
+			conds[i], out);
+		g_free(out);
+		g_free(expected);
+	}
+
+	srd_exit();
+}
+END_TEST
+
+/* The channel ids of the matchtest decoder. */
+static const char *const matchtest_channels[] = { "d0", "d1", "d2", "d3" };
+
+/* A term of a condition of the reference, see match_reference(). */
+struct ref_term {
+	char type;
+	int channel;
+	uint64_t num_samples_to_skip;
+	uint64_t num_samples_already_skipped;
+};
+
+static uint32_t rnd_next(uint32_t *rnd)
+{
+	*rnd = *rnd * 1103515245 + 12345;
+
+	return *rnd >> 16;
+}
+
+static gboolean ref_term_matches(struct ref_term *term, const int *map,
+		const uint8_t *sample, const uint8_t *old_pins)
+{
+	int idx;
+	uint8_t pin, old_pin;
+
+	if (term->type == 's') {
+		if (term->num_samples_already_skipped == term->num_samples_to_skip)
+			return TRUE;
+		term->num_samples_already_skipped++;
+		return FALSE;
+	}
+
+	idx = map[term->channel];
+	if (idx < 0)
+		return FALSE;
+	pin = (sample[idx / 8] >> (idx % 8)) & 1;
+	old_pin = old_pins[term->channel];
+
+	switch (term->type) {
+	case 'h':
+		return pin;
+	case 'l':
+		return !pin;
+	case 'r':
+		return !old_pin && pin;
+	case 'f':
+		return old_pin && !pin;
+	case 'e':
+		return old_pin != pin;
+	case 'n':
+		return old_pin == pin;
+	}
+
+	return FALSE;
+}
+
+/*
+ * Parse a condition list of the matchtest decoder into an array of
+ * conditions, each an array of its terms. Skip counts get 'extra_skip'
+ * added.
+ */
+static GPtrArray *ref_conds_parse(const char *list, uint64_t extra_skip)
+{
+	GPtrArray *conds;
+	GArray *terms;
+	struct ref_term term;
+	char **cond_strs, **term_strs;
+	unsigned int i, k;
+
+	conds = g_ptr_array_new_with_free_func((GDestroyNotify)g_array_unref);
+	cond_strs = g_strsplit(list, "|", 0);
+	for (i = 0; cond_strs[i]; i++) {
+		terms = g_array_new(FALSE, FALSE, sizeof(term));
+		term_strs = g_strsplit(cond_strs[i], " ", 0);
+		for (k = 0; term_strs[k]; k++) {
+			term.type = term_strs[k][0];
+			term.channel = 0;
+			term.num_samples_to_skip = 0;
+			term.num_samples_already_skipped = 0;
+			if (term.type == 's')
+				term.num_samples_to_skip = atoi(term_strs[k] + 1) +
+					extra_skip;
+			else
+				term.channel = atoi(term_strs[k] + 1);
+			g_array_append_val(terms, term);
+		}
+		g_strfreev(term_strs);
+		g_ptr_array_add(conds, terms);
+	}
+	g_strfreev(cond_strs);
+
+	return conds;
+}
+
+/*
+ * Find the matches which the matchtest decoder puts, by checking every
+ * sample against all terms of all conditions. This is how .wait() used
+ * to find matches: The search starts over at the sample of the previous
+ * match, and the old pins are those of the previously checked sample
+ * (of sample 0 initially). Terms are checked in order, until one does
+ * not match, which is what skip terms count.
+ */
+static char *match_reference(const char *conds, const int *map,
+		unsigned int unitsize, const uint8_t *samples,
+		uint64_t num_samples)
+{
+	GString *out;
+	GPtrArray *cond_list;
+	GArray *terms;
+	char **lists;
+	const uint8_t *sample;
+	uint8_t old_pins[G_N_ELEMENTS(matchtest_channels)];
+	char pins[G_N_ELEMENTS(matchtest_channels) + 1];
+	unsigned int num_lists, matched, i, j, k;
+	uint64_t n, s, cur;
+	gboolean all;
+	int idx;
+
+	out = g_string_new(NULL);
+	lists = g_strsplit(conds, ";", 0);
+	num_lists = g_strv_length(lists);
+
+	for (i = 0; i < G_N_ELEMENTS(old_pins); i++) {
+		idx = map[i];
+		old_pins[i] = idx < 0 ? 0 : (samples[idx / 8] >> (idx % 8)) & 1;
+	}
+
+	cur = 0;
+	for (n = 0; ; n++) {
+		cond_list = ref_conds_parse(lists[n % num_lists], n / num_lists);
+		matched = 0;
+		for (s = cur; s < num_samples && !matched; s++) {
+			sample = samples + s * unitsize;
+			for (j = 0; j < cond_list->len; j++) {
+				terms = g_ptr_array_index(cond_list, j);
+				all = TRUE;
+				for (k = 0; k < terms->len && all; k++) {
+					all = ref_term_matches(&g_array_index(terms,
+						struct ref_term, k), map, sample,
+						old_pins);
+				}
+				if (all)
+					matched |= 1 << j;
+			}
+			for (i = 0; i < G_N_ELEMENTS(old_pins); i++) {
+				idx = map[i];
+				if (idx >= 0)
+					old_pins[i] = (sample[idx / 8] >> (idx % 8)) & 1;
+			}
+		}
+		g_ptr_array_unref(cond_list);
+		if (!matched)
+			break;
+
+		cur = s - 1;
+		sample = samples + cur * unitsize;
+		for (i = 0; i < G_N_ELEMENTS(old_pins); i++) {
+			idx = map[i];
+			pins[i] = idx < 0 ? 'x' :
+				'0' + ((sample[idx / 8] >> (idx % 8)) & 1);
+		}
+		pins[i] = '\0';
+		g_string_append_printf(out, "%" PRIu64 "-%" PRIu64 " 0 %s %u\n",
+			cur, cur, pins, matched);
+	}
+	g_strfreev(lists);
+
+	return g_string_free(out, FALSE);
+}
+
+/*
+ * Random condition lists for the matchtest decoder: Up to 3 conditions
+ * per list, each with up to 3 terms on different channels, and some
+ * with a skip term among them. The last condition has a single term on
+ * a required channel, such that every list eventually matches. Some
+ * conditions only skip samples, OR-ed with the others, and some lists
+ * only skip samples, usually beyond the end of the chunk.
+ */
+static char *random_cond_lists(uint32_t *rnd, unsigned int num_lists)
+{
+	GString *s;
+	unsigned int i, j, k, num_conds, num_terms, channel, skip_pos;
+
+	s = g_string_new(NULL);
+	for (i = 0; i < num_lists; i++) {
+		if (i)
+			g_string_append_c(s, ';');
+		if (rnd_next(rnd) % 8 == 0) {
+			g_string_append_printf(s, "s%u", rnd_next(rnd) % 700);
+			if (rnd_next(rnd) % 2)
+				g_string_append_printf(s, "|s%u",
+					rnd_next(rnd) % 700);
+			continue;
+		}
+		num_conds = 1 + rnd_next(rnd) % 3;
+		for (j = 0; j < num_conds; j++) {
+			if (j)
+				g_string_append_c(s, '|');
+			if (j < num_conds - 1 && rnd_next(rnd) % 4 == 0) {
+				g_string_append_printf(s, "s%u", rnd_next(rnd) % 64);
+				continue;
+			}
+			num_terms = 1 + rnd_next(rnd) % 3;
+			channel = rnd_next(rnd);
+			skip_pos = G_MAXUINT;
+			if (rnd_next(rnd) % 4 == 0)
+				skip_pos = rnd_next(rnd) % (num_terms + 1);
+			if (j == num_conds - 1) {
+				num_terms = 1;
+				channel %= 2;
+				skip_pos = G_MAXUINT;
+			}
+			for (k = 0; k <= num_terms; k++) {
+				if (k == skip_pos) {
+					g_string_append_printf(s, "%ss%u",
+						k ? " " : "", rnd_next(rnd) % 20);
+				}
+				if (k == num_terms)
+					break;
+				if (k || skip_pos == 0)
+					g_string_append_c(s, ' ');
+				g_string_append_printf(s, "%c%u",
+					"hlrfen"[rnd_next(rnd) % 6],
+					(channel + k) % G_N_ELEMENTS(matchtest_channels));
+			}
+		}
+	}
+
+	return g_string_free(s, FALSE);
+}
+
+/*
+ * Random samples of the unitsize, where the mapped channels change now
+ * and then (sometimes two at once), and the other input channels change
+ * all the time.
+ */
+static void random_wide_samples(uint32_t *rnd, uint8_t *samples,
+		unsigned int unitsize, uint64_t num_samples, const int *map)
+{
+	uint64_t i;
+	uint32_t r;
+	unsigned int k, bit;
+	gboolean mapped;
+
+	for (k = 0; k < unitsize; k++)
+		samples[k] = rnd_next(rnd);
+	for (i = 1; i < num_samples; i++) {
+		memcpy(samples + i * unitsize, samples + (i - 1) * unitsize,
+			unitsize);
+		r = rnd_next(rnd);
+		for (k = 0; k < 2 && (r & 7) == 0; k++) {
+			if (k && (r & 0x400))
+				break;
+			if (map[((r >> 3) + k) & 3] < 0)
+				continue;
+			bit = map[((r >> 3) + k) & 3];
+			samples[i * unitsize + bit / 8] ^= 1 << (bit % 8);
+		}
+		bit = (r >> 5) % (unitsize * 8);
+		mapped = FALSE;
+		for (k = 0; k < G_N_ELEMENTS(matchtest_channels); k++)
+			mapped |= map[k] == (int)bit;
+		if (!mapped)
+			samples[i * unitsize + bit / 8] ^= 1 << (bit % 8);
+	}
+}
+
+static void matchtest_channels_set(struct srd_decoder_inst *inst,
+		const int *map)
+{
+	GHashTable *channels;
+	unsigned int i;
+	int ret;
+
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	for (i = 0; i < G_N_ELEMENTS(matchtest_channels); i++) {
+		if (map[i] >= 0)
+			g_hash_table_insert(channels, (char *)matchtest_channels[i],
+				g_variant_new_int32(map[i]));
+	}
+	ret = srd_inst_channel_set_all(inst, channels);
+	fail_unless(ret == SRD_OK, "srd_inst_channel_set_all() failed: %d.", ret);
+	g_hash_table_destroy(channels);
+}
+
+/*
+ * Create a session with a matchtest instance for the condition lists,
+ * which puts its annotations as text (one line each) into 'out'.
+ */
+static struct srd_session *matchtest_session_new(const char *conds,
+		GString *out, struct srd_decoder_inst **inst)
+{
+	struct srd_session *sess;
+	GHashTable *options;
+
+	srd_session_new(&sess);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "conds", g_variant_new_string(conds));
+	*inst = srd_inst_new(sess, "matchtest", options);
+	g_hash_table_destroy(options);
+	fail_unless(*inst != NULL, "srd_inst_new() failed.");
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, ann_to_string_cb, out);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(1000000));
+
+	return sess;
+}
+
+/* Send the samples in chunks of random sizes. */
+static void matchtest_send(struct srd_session *sess, unsigned int unitsize,
+		const uint8_t *samples, uint64_t num_samples, uint32_t *rnd)
+{
+	uint8_t *buf;
+	uint64_t start, end;
+	int ret;
+
+	buf = g_malloc(256 * unitsize);
+	for (start = 0; start < num_samples; start = end) {
+		end = start + 1 + rnd_next(rnd) % 256;
+		end = MIN(end, num_samples);
+		memcpy(buf, samples + start * unitsize,
+			(end - start) * unitsize);
+		ret = srd_session_send(sess, start, end, buf,
+			(end - start) * unitsize, unitsize);
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+		memset(buf, 0xff, 256 * unitsize);
+	}
+	g_free(buf);
+}
+
+/*
+ * Check whether .wait() finds the matches of checking every sample
+ * against the conditions, for all unitsizes the word-wise scanner
+ * handles differently, with channels in different bytes, an unmapped
+ * optional channel, and two channels mapped to the same input.
+ *
+ * The instance's compiled conditions are re-used with other skip counts
+ * for short cycles of condition lists, and get flushed for cycles with
+ * more lists than the cache holds. The channels get remapped after a
+ * reset, which must not re-use conditions compiled for the old map.
+ */
+START_TEST(test_wait_reference)
+{
+	static const unsigned int unitsizes[] = { 1, 2, 3, 4, 8 };
+	static const unsigned int num_lists[] = {
+		20, 2 * SRD_CONDITION_CACHE_SIZE,
+	};
+	const uint64_t num_samples = 3000;
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	GString *out;
+	uint8_t *samples;
+	char *conds, *expected;
+	unsigned int i, l, m, bits;
+	uint32_t rnd;
+	int maps[2][4];
+
+	srdtest_decoder_add("matchtest", matchtest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("matchtest");
+
+	rnd = 1;
+	out = g_string_new(NULL);
+	for (i = 0; i < G_N_ELEMENTS(unitsizes); i++) {
+		bits = unitsizes[i] * 8;
+		maps[0][0] = bits - 1;
+		maps[0][1] = 0;
+		maps[0][2] = bits / 2 + 1;
+		maps[0][3] = -1;
+		maps[1][0] = bits / 2 - 1;
+		maps[1][1] = bits - 1;
+		maps[1][2] = -1;
+		maps[1][3] = bits - 1;
+		samples = g_malloc(num_samples * unitsizes[i]);
+		for (l = 0; l < G_N_ELEMENTS(num_lists); l++) {
+			conds = random_cond_lists(&rnd, num_lists[l]);
+			sess = matchtest_session_new(conds, out, &inst);
+			for (m = 0; m < G_N_ELEMENTS(maps); m++) {
+				random_wide_samples(&rnd, samples, unitsizes[i],
+					num_samples, maps[m]);
+				expected = match_reference(conds, maps[m],
+					unitsizes[i], samples, num_samples);
+				fail_unless(strchr(expected, '\n') != NULL,
+					"No matches of %s.", conds);
+				if (m)
+					srd_session_terminate_reset(sess);
+				matchtest_channels_set(inst, maps[m]);
+				if (!m)
+					srd_session_start(sess);
+				g_string_truncate(out, 0);
+				matchtest_send(sess, unitsizes[i], samples,
+					num_samples, &rnd);
+				fail_unless(!strcmp(out->str, expected),
+					"Matches differ for unitsize %u, map %u, "
+					"conditions %s.", unitsizes[i], m, conds);
+				g_free(expected);
+			}
+			srd_session_destroy(sess);
+			g_free(conds);
+		}
+		g_free(samples);
+	}
+	g_string_free(out, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether a session restricted to a shard only passes output
+ * which starts within the shard's output window.
+ */
+START_TEST(test_shard_window)
+{
+	struct srd_session *sess;
+	GHashTable *options;
+	GString *out;
+	uint8_t samples[2000];
+	uint64_t start;
+	int ret;
+
+	memset(samples, 0, sizeof(samples));
+	srdtest_decoder_add("waittest", waittest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("waittest");
+
+	out = g_string_new(NULL);
+	options = waittest_options("{'skip': 100}", 0);
+	sess = decode_session_new("waittest", options, 0, out);
+	g_hash_table_destroy(options);
+	ret = srd_session_shard_set(sess, 200, 500, 1000);
+	fail_unless(ret == SRD_OK, "srd_session_shard_set() failed: %d.", ret);
+	for (start = 200; start < sizeof(samples); start += 200) {
+		ret = srd_session_send(sess, start, start + 200,
+			samples + start, 200, 1);
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	}
+	srd_session_destroy(sess);
+
+	fail_unless(!strcmp(out->str, "500-500 0 0 1\n600-600 0 0 1\n"
+		"700-700 0 0 1\n800-800 0 0 1\n900-900 0 0 1\n"),
+		"Unexpected output of shard:\n%s", out->str);
+	g_string_free(out, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+static void bin_to_string_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	const struct srd_proto_data_binary *pdb;
+	uint64_t i;
+
+	pdb = pdata->data;
+	g_string_append_printf(cb_data, "%" PRIu64 "-%" PRIu64 " %d ",
+		pdata->start_sample, pdata->end_sample, pdb->bin_class);
+	for (i = 0; i < pdb->size; i++)
+		g_string_append_printf(cb_data, "%02x", pdb->data[i]);
+	g_string_append_c(cb_data, '\n');
+}
+
+/* Add a piece of coalesced binary output (as hex) to the expected text. */
+static void bin_run_flush(GString *expected, GString *run, uint64_t start,
+		uint64_t end, int bin_class)
+{
+	g_string_append_printf(expected, "%" PRIu64 "-%" PRIu64 " %d %s\n",
+		start, end, bin_class, run->str);
+	g_string_truncate(run, 0);
+}
+
+/*
+ * Check whether binary output of the same class gets merged up to the
+ * max. size, and delivered when the class changes and at the end of
+ * each chunk.
+ */
+START_TEST(test_binary_coalesce)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	GString *out, *expected, *run;
+	uint8_t samples[500];
+	uint64_t s, start, run_start, run_end;
+	int ret, bin_class, run_class;
+
+	srdtest_decoder_add("bintest", bintest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("bintest");
+
+	/* Expected pieces: up to 16 bytes, of one class, within a chunk. */
+	expected = g_string_new(NULL);
+	run = g_string_new(NULL);
+	run_start = run_end = 0;
+	run_class = 0;
+	for (s = 1; s < sizeof(samples); s++) {
+		for (bin_class = 0; bin_class < 2; bin_class++) {
+			if (bin_class && s % 40)
+				continue;
+			if (run->len && (bin_class != run_class ||
+					s / 100 != run_start / 100))
+				bin_run_flush(expected, run, run_start, run_end,
+					run_class);
+			if (!run->len) {
+				run_start = s;
+				run_class = bin_class;
+			}
+			run_end = s;
+			g_string_append_printf(run, "%02x",
+				bin_class ? 'X' : (unsigned int)(s & 0xff));
+			if (run->len == 2 * 16)
+				bin_run_flush(expected, run, run_start, run_end,
+					run_class);
+		}
+	}
+	if (run->len)
+		bin_run_flush(expected, run, run_start, run_end, run_class);
+
+	memset(samples, 0, sizeof(samples));
+	out = g_string_new(NULL);
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "bintest", NULL);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	ret = srd_inst_binary_coalesce_set(inst, 16);
+	fail_unless(ret == SRD_OK, "srd_inst_binary_coalesce_set() failed.");
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_BINARY, bin_to_string_cb, out);
+	srd_session_start(sess);
+	for (start = 0; start < sizeof(samples); start += 100) {
+		ret = srd_session_send(sess, start, start + 100,
+			samples + start, 100, 1);
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	}
+	srd_session_destroy(sess);
+
+	fail_unless(!strcmp(out->str, expected->str),
+		"Unexpected coalesced output:\n%s\nexpected:\n%s",
+		out->str, expected->str);
+	g_string_free(out, TRUE);
+	g_string_free(expected, TRUE);
+	g_string_free(run, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Run pylower with an upper decoder stacked on top, and return the
+ * upper decoder's annotations, with a line after each chunk.
+ */
+static char *decode_stacked(const char *upper_id, const uint8_t *samples,
+		uint64_t num_samples)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *lower, *upper;
+	GString *out;
+	uint64_t start;
+	int ret;
+
+	out = g_string_new(NULL);
+	srd_session_new(&sess);
+	lower = srd_inst_new(sess, "pylower", NULL);
+	upper = srd_inst_new(sess, upper_id, NULL);
+	fail_unless(lower && upper, "srd_inst_new() failed.");
+	ret = srd_inst_stack(sess, lower, upper);
+	fail_unless(ret == SRD_OK, "srd_inst_stack() failed: %d.", ret);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, ann_to_string_cb, out);
+	srd_session_start(sess);
+	for (start = 0; start < num_samples; start += 250) {
+		ret = srd_session_send(sess, start, start + 250,
+			samples + start, 250, 1);
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+		g_string_append_printf(out, "chunk %" PRIu64 " done\n", start);
+	}
+	srd_session_destroy(sess);
+
+	return g_string_free(out, FALSE);
+}
+
+/*
+ * Check whether stacked decoders get the same input by decode() and by
+ * decode_items(), in the same order, and delivered when each chunk was
+ * processed.
+ */
+START_TEST(test_stacked_decode_items)
+{
+	uint8_t samples[2000];
+	char *expected, *out, *source;
+
+	random_samples(samples, sizeof(samples));
+	srdtest_decoder_add("pylower", pylower_pd);
+	source = g_strdup_printf(pyupper_pd, "", "");
+	srdtest_decoder_add("pyupper", source);
+	g_free(source);
+	source = g_strdup_printf(pyupper_pd, "items", pyupper_items);
+	srdtest_decoder_add("pyupperitems", source);
+	g_free(source);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("pylower");
+	srd_decoder_load("pyupper");
+	srd_decoder_load("pyupperitems");
+
+	expected = decode_stacked("pyupper", samples, sizeof(samples));
+	fail_unless(strstr(expected, "PINS [") != NULL,
+		"No input by decode():\n%s", expected);
+	out = decode_stacked("pyupperitems", samples, sizeof(samples));
+	fail_unless(!strcmp(out, expected),
+		"decode_items() got other input than decode():\n%s", out);
+	g_free(out);
+	g_free(expected);
+
+	srd_exit();
+}
+END_TEST
+
+/* Like ann_to_string_cb(), with the instance's id at the start. */
+static void inst_ann_to_string_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	g_string_append_printf(cb_data, "%s ", pdata->pdo->di->inst_id);
+	ann_to_string_cb(pdata, cb_data);
+}
+
+static void inst_batch_to_string_cb(struct srd_proto_data *pdata,
+		unsigned int count, void *cb_data)
+{
+	unsigned int i;
+
+	for (i = 0; i < count; i++)
+		inst_ann_to_string_cb(&pdata[i], cb_data);
+}
+
+/*
+ * Get the lines of inst_ann_to_string_cb() output of the instance (or
+ * all instances if NULL), and of the classes in 'classes' (a string of
+ * class digits, or NULL for all classes).
+ */
+static char *filter_lines(const char *all, const char *inst_id,
+		const char *classes)
+{
+	GString *out;
+	char **lines, id[32];
+	unsigned int i;
+	int ann_class;
+
+	out = g_string_new(NULL);
+	lines = g_strsplit(all, "\n", 0);
+	for (i = 0; lines[i] && lines[i][0]; i++) {
+		fail_unless(sscanf(lines[i], "%31s %*s %d", id, &ann_class) == 2);
+		if (inst_id && strcmp(id, inst_id))
+			continue;
+		if (classes && !strchr(classes, '0' + ann_class))
+			continue;
+		g_string_append_printf(out, "%s\n", lines[i]);
+	}
+	g_strfreev(lines);
+
+	return g_string_free(out, FALSE);
+}
+
+/*
+ * Check whether several callbacks all get the output they want, and
+ * whether filtered callbacks only get the instance's and classes'
+ * annotations.
+ */
+START_TEST(test_callback_filters)
+{
+	static const int classes_02[] = { 0, 2 };
+	static const int classes_1[] = { 1 };
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst1, *inst2;
+	GString *all1, *all2, *batched, *by_inst, *by_class, *by_both;
+	uint8_t samples[1000];
+	char *expected;
+	int ret;
+
+	srdtest_decoder_add("classtest", classtest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("classtest");
+
+	all1 = g_string_new(NULL);
+	all2 = g_string_new(NULL);
+	batched = g_string_new(NULL);
+	by_inst = g_string_new(NULL);
+	by_class = g_string_new(NULL);
+	by_both = g_string_new(NULL);
+	srd_session_new(&sess);
+	inst1 = srd_inst_new(sess, "classtest", NULL);
+	inst2 = srd_inst_new(sess, "classtest", NULL);
+	fail_unless(inst1 && inst2, "srd_inst_new() failed.");
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, all1);
+	srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, by_inst, inst1, NULL, 0);
+	srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, by_class, NULL, classes_02, 2);
+	srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, by_both, inst2, classes_1, 1);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, all2);
+	ret = srd_pd_output_callback_add_batched(sess, SRD_OUTPUT_ANN,
+		inst_batch_to_string_cb, 7, batched);
+	fail_unless(ret == SRD_OK, "Failed to add batched callback: %d.", ret);
+	srd_session_start(sess);
+	memset(samples, 0, sizeof(samples));
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	srd_session_destroy(sess);
+
+	/* Both instances' annotations of all classes, to unfiltered ones. */
+	expected = filter_lines(all1->str, "classtest-2", "2");
+	fail_unless(expected[0] != '\0', "No annotations of classtest-2.");
+	g_free(expected);
+	fail_unless(!strcmp(all2->str, all1->str), "Callbacks differ.");
+	expected = filter_lines(all1->str, NULL, NULL);
+	fail_unless(!strcmp(batched->str, expected),
+		"Batched callback differs:\n%s", batched->str);
+	g_free(expected);
+
+	expected = filter_lines(all1->str, "classtest-1", NULL);
+	fail_unless(!strcmp(by_inst->str, expected),
+		"Instance filter failed:\n%s", by_inst->str);
+	g_free(expected);
+	expected = filter_lines(all1->str, NULL, "02");
+	fail_unless(!strcmp(by_class->str, expected),
+		"Class filter failed:\n%s", by_class->str);
+	g_free(expected);
+	expected = filter_lines(all1->str, "classtest-2", "1");
+	fail_unless(expected[0] && !strcmp(by_both->str, expected),
+		"Instance and class filter failed:\n%s", by_both->str);
+	g_free(expected);
+
+	g_string_free(all1, TRUE);
+	g_string_free(all2, TRUE);
+	g_string_free(batched, TRUE);
+	g_string_free(by_inst, TRUE);
+	g_string_free(by_class, TRUE);
+	g_string_free(by_both, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether instances' class and row filters drop the right
+ * annotations.
+ */
+START_TEST(test_output_filters)
+{
+	static const int classes_1[] = { 1 };
+	static const char *const rows[] = { "second", NULL };
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst1, *inst2;
+	GString *all, *out1, *out2;
+	uint8_t samples[1000];
+	char *expected;
+	int ret;
+
+	srdtest_decoder_add("classtest", classtest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("classtest");
+	memset(samples, 0, sizeof(samples));
+
+	all = g_string_new(NULL);
+	srd_session_new(&sess);
+	srd_inst_new(sess, "classtest", NULL);
+	srd_inst_new(sess, "classtest", NULL);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, all);
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	srd_session_destroy(sess);
+
+	out1 = g_string_new(NULL);
+	out2 = g_string_new(NULL);
+	srd_session_new(&sess);
+	inst1 = srd_inst_new(sess, "classtest", NULL);
+	inst2 = srd_inst_new(sess, "classtest", NULL);
+	fail_unless(inst1 && inst2, "srd_inst_new() failed.");
+	ret = srd_inst_output_filter_set(inst1, SRD_OUTPUT_ANN, classes_1, 1);
+	fail_unless(ret == SRD_OK, "Failed to set class filter: %d.", ret);
+	ret = srd_inst_ann_row_filter_set(inst2, rows);
+	fail_unless(ret == SRD_OK, "Failed to set row filter: %d.", ret);
+	srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, out1, inst1, NULL, 0);
+	srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+		inst_ann_to_string_cb, out2, inst2, NULL, 0);
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	srd_session_destroy(sess);
+
+	expected = filter_lines(all->str, "classtest-1", "1");
+	fail_unless(expected[0] && !strcmp(out1->str, expected),
+		"Class filter failed:\n%s", out1->str);
+	g_free(expected);
+	expected = filter_lines(all->str, "classtest-2", "2");
+	fail_unless(expected[0] && !strcmp(out2->str, expected),
+		"Row filter failed:\n%s", out2->str);
+	g_free(expected);
+	g_string_free(all, TRUE);
+	g_string_free(out1, TRUE);
+	g_string_free(out2, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Run listentest over 1000 samples, with class 1 filtered out or not,
+ * and the session's output starting at 'output_start'.
+ */
+static char *decode_listentest(gboolean filtered, uint64_t output_start)
+{
+	static const int classes_0[] = { 0 };
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	GString *out;
+	uint8_t samples[1000];
+	int ret;
+
+	memset(samples, 0, sizeof(samples));
+	out = g_string_new(NULL);
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "listentest", NULL);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	if (filtered)
+		srd_inst_output_filter_set(inst, SRD_OUTPUT_ANN, classes_0, 1);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, ann_to_string_cb, out);
+	srd_session_shard_set(sess, 0, output_start, UINT64_MAX);
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	srd_session_destroy(sess);
+
+	return g_string_free(out, FALSE);
+}
+
+/*
+ * Check whether self.has_ann_listener() reports classes which are
+ * filtered out, and samples before the session's output window, as
+ * unwanted.
+ */
+START_TEST(test_has_ann_listener)
+{
+	char *out;
+
+	srdtest_decoder_add("listentest", listentest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("listentest");
+
+	out = decode_listentest(FALSE, 0);
+	fail_unless(g_str_has_prefix(out, "100-100 0 100\n200-200 0 200\n"),
+		"Class unexpectedly unwanted:\n%s", out);
+	g_free(out);
+	out = decode_listentest(TRUE, 0);
+	fail_unless(g_str_has_prefix(out, "100-100 0 0\n200-200 0 0\n"),
+		"Filtered class wanted:\n%s", out);
+	g_free(out);
+	out = decode_listentest(FALSE, 500);
+	fail_unless(g_str_has_prefix(out, "500-500 0 1\n600-600 0 101\n"),
+		"Class wanted before the output window:\n%s", out);
+	g_free(out);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Decode one UART frame (0x41 at 1000 baud, 8 kHz samplerate) with the
+ * given UART decoder, passing its annotations to 'cb'.
+ */
+static int decode_uart(const char *decoder_id, const char *const *rows,
+		srd_pd_output_callback cb, void *cb_data)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	GHashTable *options, *channels;
+	uint8_t samples[112];
+	int i, bit, ret;
+
+	for (i = 0; i < 112; i++) {
+		bit = i / 8 - 2;
+		if (bit < 0 || bit > 8)
+			samples[i] = 1;
+		else if (bit == 0)
+			samples[i] = 0;
+		else
+			samples[i] = (0x41 >> (bit - 1)) & 1;
+	}
+
+	srd_session_new(&sess);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "baudrate", g_variant_new_int64(1000));
+	inst = srd_inst_new(sess, decoder_id, options);
+	g_hash_table_destroy(options);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "rx", g_variant_new_int32(0));
+	srd_inst_channel_set_all(inst, channels);
+	g_hash_table_destroy(channels);
+	srd_inst_ann_row_filter_set(inst, rows);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, cb, cb_data);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(8000));
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	srd_session_destroy(sess);
+
+	return ret;
+}
+
+/*
+ * Check whether the UART decoder skips building its per-bit annotations
+ * when their row is not wanted.
+ */
+START_TEST(test_uart_bits_skipped)
+{
+	static const char *const rows[] = { "rx-data-vals", NULL };
+	GString *out;
+	int ret;
+
+	srdtest_decoder_add("uartwrap", uartwrap_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uartwrap");
+
+	out = g_string_new(NULL);
+	ret = decode_uart("uartwrap", rows, ann_to_string_cb, out);
+	fail_unless(ret == SRD_OK, "Unwanted data bits were built.");
+	fail_unless(strstr(out->str, " 0 41\n") != NULL,
+		"Data missing:\n%s", out->str);
+	g_string_truncate(out, 0);
+	ret = decode_uart("uartwrap", NULL, ann_to_string_cb, out);
+	fail_unless(ret != SRD_OK, "Wanted data bits were not built.");
+	g_string_free(out, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether the SPI decoder annotates 64 bit words of 2^63 and more,
+ * which don't fit the signed raw annotation values.
+ */
+START_TEST(test_spi_wide_words)
+{
+	static const uint64_t word = 0xfedcba9876543210ULL;
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	GHashTable *options, *channels;
+	GString *out;
+	uint8_t samples[130];
+	int i, bit, ret;
+
+	/* Channel 0 is CLK, channel 1 is MOSI, MSB first in SPI mode 0. */
+	samples[0] = samples[129] = 0;
+	for (i = 0; i < 64; i++) {
+		bit = (word >> (63 - i)) & 1;
+		samples[1 + 2 * i] = bit << 1;
+		samples[2 + 2 * i] = (bit << 1) | 1;
+	}
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("spi");
+	out = g_string_new(NULL);
+	srd_session_new(&sess);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "wordsize", g_variant_new_int64(64));
+	inst = srd_inst_new(sess, "spi", options);
+	g_hash_table_destroy(options);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "clk", g_variant_new_int32(0));
+	g_hash_table_insert(channels, "mosi", g_variant_new_int32(1));
+	srd_inst_channel_set_all(inst, channels);
+	g_hash_table_destroy(channels);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, ann_to_string_cb, out);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(1000000));
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	srd_session_destroy(sess);
+	fail_unless(strstr(out->str, " 1 FEDCBA9876543210\n") != NULL,
+		"Word missing:\n%s", out->str);
+	g_string_free(out, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+static void payload_to_string_cb(struct srd_proto_data *pdata,
+		void *cb_data)
+{
+	const struct srd_proto_data_annotation *pda;
+	char *value;
+
+	pda = pdata->data;
+	value = pda->payload ? g_variant_print(pda->payload, FALSE) : NULL;
+	g_string_append_printf(cb_data, "%d %s %s %s\n", pda->ann_class,
+		pda->ann_text[0], pda->payload ?
+		g_variant_get_type_string(pda->payload) : "-",
+		value ? value : "-");
+	g_free(value);
+}
+
+/*
+ * Check whether annotations carry their payloads, and still go out
+ * without one if it can't be converted.
+ */
+START_TEST(test_ann_payload)
+{
+	struct srd_session *sess;
+	GString *out;
+	uint8_t samples[4];
+	int ret;
+
+	srdtest_decoder_add("payloadtest", payloadtest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("payloadtest");
+	srd_decoder_load("uart");
+
+	out = g_string_new(NULL);
+	memset(samples, 0, sizeof(samples));
+	srd_session_new(&sess);
+	fail_unless(srd_inst_new(sess, "payloadtest", NULL) != NULL,
+		"srd_inst_new() failed.");
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN,
+		payload_to_string_cb, out);
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	srd_session_destroy(sess);
+	fail_unless(!strcmp(out->str, "0 bad - -\n"
+		"0 good (xayax) (1, [0x61, 0x62], [2])\n0 none - -\n"),
+		"Payloads differ:\n%s", out->str);
+	g_string_free(out, TRUE);
+
+	out = g_string_new(NULL);
+	ret = decode_uart("uart", NULL, payload_to_string_cb, out);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	fail_unless(strstr(out->str, "\n0 41 x 65\n") != NULL,
+		"UART data payload missing:\n%s", out->str);
+	g_string_free(out, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+struct text_output {
+	GArray *ids;
+	GPtrArray *texts;
+};
+
+static void text_ann_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	const struct srd_proto_data_annotation *pda;
+	struct text_output *t;
+
+	pda = pdata->data;
+	t = cb_data;
+	g_array_append_val(t->ids, pda->ann_text_id);
+	g_ptr_array_add(t->texts, g_strdup(pda->ann_text[0]));
+}
+
+/*
+ * Run the texttest decoder over 'num_samples' samples, collecting the
+ * ids and texts of its annotations. Returns the session, which still
+ * holds the interned texts.
+ */
+static struct srd_session *decode_texttest(int64_t mod, uint64_t num_samples,
+		struct text_output *t)
+{
+	struct srd_session *sess;
+	GHashTable *options;
+	uint8_t *samples;
+	int ret;
+
+	t->ids = g_array_new(FALSE, FALSE, sizeof(uint32_t));
+	t->texts = g_ptr_array_new_with_free_func(g_free);
+	samples = g_malloc0(num_samples);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "mod", g_variant_new_int64(mod));
+	srd_session_new(&sess);
+	fail_unless(srd_inst_new(sess, "texttest", options) != NULL,
+		"srd_inst_new() failed.");
+	g_hash_table_destroy(options);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, text_ann_cb, t);
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, num_samples, samples, num_samples, 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	g_free(samples);
+
+	return sess;
+}
+
+/*
+ * Check whether repeated annotation texts get the same id, distinct
+ * texts distinct ids, and whether srd_session_terminate_reset() drops
+ * the interned texts.
+ */
+START_TEST(test_ann_text_ids)
+{
+	struct srd_session *sess;
+	struct text_output t;
+	uint32_t id;
+	char **texts;
+	unsigned int i;
+
+	srdtest_decoder_add("texttest", texttest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("texttest");
+
+	sess = decode_texttest(10, 1000, &t);
+	fail_unless(t.ids->len > 900, "Only %u annotations.", t.ids->len);
+	for (i = 0; i < t.ids->len; i++) {
+		id = g_array_index(t.ids, uint32_t, i);
+		fail_unless(id < 10, "Annotation %u has id %u.", i, id);
+		if (i >= 10)
+			fail_unless(id == g_array_index(t.ids, uint32_t, i - 10),
+				"Same text, different ids.");
+		else if (i > 0)
+			fail_unless(id == g_array_index(t.ids, uint32_t, i - 1) + 1,
+				"Different texts, unexpected ids.");
+		texts = srd_session_ann_text_get(sess, id);
+		fail_unless(texts && !strcmp(texts[0], t.texts->pdata[i]) &&
+			!texts[1], "Unexpected texts of id %u.", id);
+	}
+	srd_session_terminate_reset(sess);
+	fail_unless(srd_session_ann_text_get(sess, 0) == NULL,
+		"Texts kept after srd_session_terminate_reset().");
+	srd_session_destroy(sess);
+	g_array_free(t.ids, TRUE);
+	g_ptr_array_free(t.texts, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether annotations with bad texts are dropped, without leaving
+ * an exception behind which would stop the decoder.
+ */
+START_TEST(test_ann_text_bad)
+{
+	uint8_t samples[100];
+	char *out;
+
+	memset(samples, 0, sizeof(samples));
+	srdtest_decoder_add("badtexttest", badtexttest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("badtexttest");
+
+	out = decode_samples("badtexttest", NULL, samples, sizeof(samples),
+		sizeof(samples), 0);
+	fail_unless(!strcmp(out, "2-3 0 good\n"),
+		"Unexpected annotations:\n%s", out);
+	g_free(out);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether the number of interned texts is limited, and whether
+ * annotations beyond the limit still carry their texts.
+ */
+START_TEST(test_ann_text_limit)
+{
+	struct srd_session *sess;
+	struct text_output t;
+	uint32_t id;
+	unsigned int i;
+	char text[16];
+
+	srdtest_decoder_add("texttest", texttest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("texttest");
+
+	sess = decode_texttest(0, SRD_ANN_TEXTS_MAX + 100, &t);
+	fail_unless(t.ids->len > SRD_ANN_TEXTS_MAX,
+		"Only %u annotations.", t.ids->len);
+	for (i = 0; i < t.ids->len; i++) {
+		id = g_array_index(t.ids, uint32_t, i);
+		if (i < SRD_ANN_TEXTS_MAX)
+			fail_unless(id == i, "Annotation %u has id %u.", i, id);
+		else
+			fail_unless(id == SRD_ANN_TEXT_ID_NONE,
+				"Annotation %u beyond the limit has id %u.", i, id);
+		g_snprintf(text, sizeof(text), "v%u", i + 1);
+		fail_unless(!strcmp(t.texts->pdata[i], text),
+			"Annotation %u has text %s.", i,
+			(char *)t.texts->pdata[i]);
+	}
+	fail_unless(srd_session_ann_text_get(sess, SRD_ANN_TEXTS_MAX) == NULL,
+		"More texts interned than the limit.");
+	srd_session_destroy(sess);
+	g_array_free(t.ids, TRUE);
+	g_ptr_array_free(t.texts, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+struct store_output {
+	uint64_t next_sample;
+	unsigned int count;
+	gboolean in_order;
+};
+
+static void store_ann_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	const struct srd_proto_data_annotation *pda;
+	struct store_output *s;
+	char text[16];
+
+	pda = pdata->data;
+	s = cb_data;
+	g_snprintf(text, sizeof(text), "v%" PRIu64, pdata->start_sample % 100);
+	if (pdata->start_sample != s->next_sample ||
+			strcmp(pda->ann_text[0], text))
+		s->in_order = FALSE;
+	s->next_sample = pdata->start_sample + 1;
+	s->count++;
+}
+
+/*
+ * Check annotation store queries and summaries with enough annotations
+ * for several blocks and index levels, over ranges which span blocks.
+ */
+START_TEST(test_ann_store_blocks)
+{
+	static const uint64_t ranges[][2] = {
+		{ 0, 40000 }, { 200, 300 }, { 256, 257 }, { 255, 513 },
+		{ 16000, 16500 }, { 16383, 16385 }, { 30000, 45000 },
+		{ 40000, 50000 }, { 0, 1 },
+	};
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	struct store_output s;
+	GHashTable *options;
+	uint8_t *samples;
+	uint64_t counts[40], first, last;
+	unsigned int i;
+	int ret;
+
+	srdtest_decoder_add("texttest", texttest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("texttest");
+
+	/* Annotations at samples 1 to 39999, with texts "v1" to "v99". */
+	samples = g_malloc0(40000);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "mod", g_variant_new_int64(100));
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "texttest", options);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	g_hash_table_destroy(options);
+	srd_session_ann_store_set(sess, TRUE);
+	srd_session_start(sess);
+	for (i = 0; i < 40000; i += 1000) {
+		ret = srd_session_send(sess, i, i + 1000, samples + i, 1000, 1);
+		fail_unless(ret == SRD_OK,
+			"srd_session_send() failed: %d.", ret);
+	}
+	g_free(samples);
+
+	for (i = 0; i < G_N_ELEMENTS(ranges); i++) {
+		first = MAX(ranges[i][0], 1);
+		last = MIN(ranges[i][1], 40000);
+		s.next_sample = first;
+		s.count = 0;
+		s.in_order = TRUE;
+		ret = srd_inst_ann_store_query(inst, NULL, ranges[i][0],
+			ranges[i][1], store_ann_cb, &s);
+		fail_unless(ret == SRD_OK,
+			"srd_inst_ann_store_query() failed: %d.", ret);
+		fail_unless(s.in_order, "Wrong annotations in [%" PRIu64
+			", %" PRIu64 ").", ranges[i][0], ranges[i][1]);
+		fail_unless(s.count == (last > first ? last - first : 0),
+			"Found %u annotations in [%" PRIu64 ", %" PRIu64 ").",
+			s.count, ranges[i][0], ranges[i][1]);
+	}
+
+	ret = srd_inst_ann_store_summary(inst, NULL, 0, 1000, 40, counts);
+	fail_unless(ret == SRD_OK,
+		"srd_inst_ann_store_summary() failed: %d.", ret);
+	for (i = 0; i < 40; i++) {
+		fail_unless(counts[i] == (i ? 1000 : 999),
+			"Bucket %u counts %" PRIu64 ".", i, counts[i]);
+	}
+	ret = srd_inst_ann_store_summary(inst, NULL, 16000, 7, 40, counts);
+	fail_unless(ret == SRD_OK,
+		"srd_inst_ann_store_summary() failed: %d.", ret);
+	for (i = 0; i < 40; i++) {
+		fail_unless(counts[i] == 7,
+			"Bucket %u counts %" PRIu64 ".", i, counts[i]);
+	}
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+struct batch_output {
+	GArray *sizes;
+	GString *out;
+	unsigned int count;
+};
+
+static void batch_ann_cb(struct srd_proto_data *pdata, unsigned int count,
+		void *cb_data)
+{
+	struct batch_output *b;
+	unsigned int i;
+
+	b = cb_data;
+	g_array_append_val(b->sizes, count);
+	for (i = 0; i < count; i++)
+		ann_to_string_cb(&pdata[i], b->out);
+	b->count += count;
+}
+
+/*
+ * Check whether a batched callback gets full batches, and the partial
+ * batch when a chunk was processed, with the same annotations in the
+ * same order as an unbatched callback.
+ */
+START_TEST(test_batched_callback)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	struct batch_output b;
+	uint8_t samples[2000];
+	GHashTable *options;
+	char *expected;
+	uint64_t start;
+	unsigned int j, n, size;
+	int ret;
+
+	random_samples(samples, sizeof(samples));
+	srdtest_decoder_add("waittest", waittest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("waittest");
+
+	b.sizes = g_array_new(FALSE, FALSE, sizeof(unsigned int));
+	b.out = g_string_new(NULL);
+	b.count = 0;
+	srd_session_new(&sess);
+	options = waittest_options("{'skip': 7}", 0);
+	inst = srd_inst_new(sess, "waittest", options);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	g_hash_table_destroy(options);
+	ret = srd_pd_output_callback_add_batched(sess, SRD_OUTPUT_ANN,
+		batch_ann_cb, 16, &b);
+	fail_unless(ret == SRD_OK, "Failed to add batched callback: %d.", ret);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(1000000));
+	srd_session_start(sess);
+	for (start = 0; start < sizeof(samples); start += 500) {
+		ret = srd_session_send(sess, start, start + 500,
+			samples + start, 500, 1);
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+		/* Every match within the chunk was delivered. */
+		fail_unless(b.count == (start + 499) / 7,
+			"%u annotations delivered after chunk at %" PRIu64 ".",
+			b.count, start);
+	}
+	srd_session_destroy(sess);
+
+	/* Full batches, then the rest of each chunk's matches. */
+	j = 0;
+	for (start = 0; start < sizeof(samples); start += 500) {
+		n = (start + 499) / 7 - (start ? (start - 1) / 7 : 0);
+		for (; n; n -= size) {
+			size = MIN(n, 16);
+			fail_unless(j < b.sizes->len, "Batches missing.");
+			fail_unless(g_array_index(b.sizes, unsigned int, j) == size,
+				"Batch %u has %u annotations, expected %u.", j,
+				g_array_index(b.sizes, unsigned int, j), size);
+			j++;
+		}
+	}
+	fail_unless(j == b.sizes->len, "Too many batches.");
+
+	expected = decode_waittest("{'skip': 7}", 0, samples, sizeof(samples));
+	fail_unless(!strcmp(b.out->str, expected),
+		"Batched output differs.");
+	g_free(expected);
+	g_string_free(b.out, TRUE);
+	g_array_free(b.sizes, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+struct queued_output {
+	struct srd_decoder_inst *inst[3];
+	GString *out[3];
+	gint active;
+	gboolean overlap;
+};
+
+/* Like ann_to_string_cb(), per instance, and noting overlapping calls. */
+static void queued_ann_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct queued_output *q;
+	unsigned int i;
+
+	q = cb_data;
+	if (g_atomic_int_add(&q->active, 1) != 0)
+		q->overlap = TRUE;
+	for (i = 0; i < G_N_ELEMENTS(q->inst); i++) {
+		if (pdata->pdo->di == q->inst[i])
+			ann_to_string_cb(pdata, q->out[i]);
+	}
+	g_usleep(10);
+	g_atomic_int_add(&q->active, -1);
+}
+
+/*
+ * Check whether several decoder stacks with queued chunks put the same
+ * annotations as when decoding synchronously, and whether the session
+ * invokes the callback for one of them at a time.
+ */
+START_TEST(test_queued_decode)
+{
+	static const char *conds[] = {
+		"[{0: 'e'}, {1: 'f'}]",
+		"[{0: 'r'}, {'skip': 10}]",
+		"{'skip': 3}",
+	};
+	struct srd_session *sess;
+	struct queued_output q;
+	uint8_t samples[2000];
+	GHashTable *options;
+	char *expected;
+	uint64_t start;
+	unsigned int i;
+	int ret;
+
+	random_samples(samples, sizeof(samples));
+	srdtest_decoder_add("waittest", waittest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("waittest");
+
+	memset(&q, 0, sizeof(q));
+	srd_session_new(&sess);
+	srd_session_queue_depth_set(sess, 4);
+	for (i = 0; i < G_N_ELEMENTS(conds); i++) {
+		options = waittest_options(conds[i], 0);
+		q.inst[i] = srd_inst_new(sess, "waittest", options);
+		fail_unless(q.inst[i] != NULL, "srd_inst_new() failed.");
+		g_hash_table_destroy(options);
+		q.out[i] = g_string_new(NULL);
+	}
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, queued_ann_cb, &q);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(1000000));
+	srd_session_start(sess);
+	for (start = 0; start < sizeof(samples); start += 250) {
+		ret = srd_session_send(sess, start, start + 250,
+			samples + start, 250, 1);
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	}
+	ret = srd_session_flush(sess);
+	fail_unless(ret == SRD_OK, "srd_session_flush() failed: %d.", ret);
+	srd_session_destroy(sess);
+
+	fail_unless(!q.overlap, "Callbacks ran concurrently.");
+	for (i = 0; i < G_N_ELEMENTS(conds); i++) {
+		expected = decode_waittest(conds[i], 0, samples,
+			sizeof(samples));
+		fail_unless(q.out[i]->len > 0, "No matches of %s.", conds[i]);
+		fail_unless(!strcmp(q.out[i]->str, expected),
+			"Queued output differs for %s.", conds[i]);
+		g_free(expected);
+		g_string_free(q.out[i], TRUE);
+	}
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether views from .peek_chunk() show the samples, and remain
+ * valid when the decoder keeps them across chunks, with and without
+ * queueing.
+ */
+START_TEST(test_peek_chunk)
+{
+	static const unsigned int queue_depths[] = { 0, 2 };
+	uint8_t samples[2000];
+	GString *expected;
+	char *out;
+	unsigned int i;
+
+	random_samples(samples, sizeof(samples));
+	expected = g_string_new(NULL);
+	for (i = 100; i < sizeof(samples); i += 100)
+		g_string_append_printf(expected, "%u-%u 0 %d same\n", i, i,
+			samples[i]);
+
+	srdtest_decoder_add("peektest", peektest_pd);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("peektest");
+	for (i = 0; i < G_N_ELEMENTS(queue_depths); i++) {
+		out = decode_samples("peektest", NULL, samples,
+			sizeof(samples), 250, queue_depths[i]);
+		fail_unless(!strcmp(out, expected->str),
+			"Unexpected output with queue depth %u:\n%s",
+			queue_depths[i], out);
+		g_free(out);
+	}
+	g_string_free(expected, TRUE);
+
+	srd_exit();
+}
+END_TEST
+
+Suite *suite_decode(void)
+{
+	Suite *s;
+	TCase *tc;
+
+	s = suite_create("decode");
+
+	tc = tcase_create("wait");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_wait_many);
+	tcase_add_test(tc, test_peek_chunk);
+	tcase_add_test(tc, test_send_transitions);
+	tcase_add_test(tc, test_wait_reference);
+	tcase_add_test(tc, test_queued_decode);
+	tcase_add_test(tc, test_shard_window);
+	tcase_add_test(tc, test_batched_callback);
+	tcase_add_test(tc, test_ann_text_ids);
+	tcase_add_test(tc, test_ann_text_bad);
+	tcase_add_test(tc, test_ann_text_limit);
+	tcase_add_test(tc, test_ann_store_blocks);
+	tcase_add_test(tc, test_binary_coalesce);
+	tcase_add_test(tc, test_stacked_decode_items);
+	tcase_add_test(tc, test_callback_filters);
+	tcase_add_test(tc, test_output_filters);
+	tcase_add_test(tc, test_has_ann_listener);
+	tcase_add_test(tc, test_uart_bits_skipped);
+	tcase_add_test(tc, test_spi_wide_words);
+	tcase_add_test(tc, test_ann_payload);
+	suite_add_tcase(s, tc);
+
+	return s;
+}
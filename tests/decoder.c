@@ -18,8 +18,11 @@
  */
 
 #include <config.h>
-#include <libsigrokdecode.h> /* First, to avoid compiler warning. */
+#include <libsigrokdecode-internal.h> /* First, to avoid compiler warning. */
+#include <libsigrokdecode.h>
 #include <stdlib.h>
+#include <string.h>
+#include <glib/gstdio.h>
 #include <check.h>
 #include "lib.h"
 
@@ -148,6 +151,316 @@ START_TEST(test_load_nonexisting_pd_dir)
 }
 END_TEST
 
+/*
+ * Check whether srd_decoder_load() records what loading a decoder took.
+ */
+START_TEST(test_load_stats)
+{
+	struct srd_decoder *dec;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	dec = srd_decoder_get_by_id("uart");
+	fail_unless(dec != NULL);
+	fail_unless(dec->load_stats.import_time > 0);
+	fail_unless(dec->load_stats.alloc_blocks > 0);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_decoder_load_all() loads the same decoders from its
+ * metadata cache, and whether those get imported when they are used.
+ */
+START_TEST(test_load_all_cached)
+{
+	int ret;
+	char *path, *doc;
+	struct srd_session *sess;
+	struct srd_decoder *dec;
+	struct srd_decoder_inst *inst;
+	guint num_decoders, num_channels;
+
+	path = g_build_filename(g_get_tmp_dir(), "srd-test-cache", NULL);
+	g_unlink(path);
+	g_setenv("SIGROKDECODE_CACHE", path, TRUE);
+
+	/* The first run imports all decoders and writes the cache. */
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load_all();
+	num_decoders = g_slist_length((GSList *)srd_decoder_list());
+	dec = srd_decoder_get_by_id("uart");
+	fail_unless(dec != NULL && dec->py_dec != NULL);
+	num_channels = g_slist_length(dec->channels);
+	srd_exit();
+	fail_unless(g_file_test(path, G_FILE_TEST_IS_REGULAR));
+
+	/* The second run loads them from the cache. */
+	srd_init(DECODERS_TESTDIR);
+	ret = srd_decoder_load_all();
+	fail_unless(ret == SRD_OK, "srd_decoder_load_all() failed: %d.", ret);
+	fail_unless(g_slist_length((GSList *)srd_decoder_list()) == num_decoders);
+	dec = srd_decoder_get_by_id("uart");
+	fail_unless(dec != NULL && dec->py_dec == NULL);
+	fail_unless(g_slist_length(dec->channels) == num_channels);
+	fail_unless(dec->annotations != NULL && dec->options != NULL);
+
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "uart", NULL);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	fail_unless(dec->py_dec != NULL);
+	dec = srd_decoder_get_by_id("spi");
+	doc = srd_decoder_doc_get(dec);
+	fail_unless(doc != NULL);
+	g_free(doc);
+	srd_exit();
+
+	g_setenv("SIGROKDECODE_CACHE", "", TRUE);
+	g_unlink(path);
+	g_free(path);
+}
+END_TEST
+
+/* A decoder which needs a module that is missing at first. */
+static const char deptest_pd[] =
+	"import sigrokdecode as srd\n"
+	"import srdtest_dep\n"
+	"\n"
+	"class Decoder(srd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'deptest'\n"
+	"    name = 'Dependency test'\n"
+	"    longname = 'Dependency test'\n"
+	"    desc = 'Needs the srdtest_dep module.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Debug/trace']\n"
+	"    channels = ({'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},)\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        pass\n"
+	"\n"
+	"    def decode(self):\n"
+	"        while True:\n"
+	"            self.wait({'skip': 1})\n";
+
+/*
+ * Check whether decoders which failed to load are not cached, so they
+ * load once the cause is gone, while modules without a decoder are.
+ */
+START_TEST(test_load_all_cached_failure)
+{
+	char *path, *dep_dir, *dep_file;
+
+	path = g_build_filename(g_get_tmp_dir(), "srd-test-cache", NULL);
+	g_unlink(path);
+	g_setenv("SIGROKDECODE_CACHE", path, TRUE);
+	srdtest_decoder_add("deptest", deptest_pd);
+	dep_dir = g_build_filename(g_getenv("SIGROKDECODE_DIR"),
+		"srdtest_dep", NULL);
+	dep_file = g_build_filename(dep_dir, "__init__.py", NULL);
+	g_unlink(dep_file);
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load_all();
+	fail_unless(srd_decoder_get_by_id("deptest") == NULL);
+	srd_exit();
+
+	/* The module without a decoder gets cached, too. */
+	g_mkdir_with_parents(dep_dir, 0700);
+	g_file_set_contents(dep_file, "", -1, NULL);
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load_all();
+	fail_unless(srd_decoder_get_by_id("deptest") != NULL,
+		"Failed decoder was cached.");
+	srd_exit();
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load_all();
+	fail_unless(srd_decoder_get_by_id("deptest") != NULL);
+	fail_unless(srd_decoder_get_by_id("deptest")->py_dec == NULL);
+	fail_unless(srd_decoder_get_by_id("srdtest_dep") == NULL);
+	srd_exit();
+
+	g_setenv("SIGROKDECODE_CACHE", "", TRUE);
+	g_unlink(path);
+	g_free(dep_file);
+	g_free(dep_dir);
+	g_free(path);
+}
+END_TEST
+
+/* Rewrite the index of a bundle with a magic number no Python has. */
+static const char bundle_bad_magic_py[] =
+	"import sys, zipfile\n"
+	"with zipfile.ZipFile(sys.argv[1]) as zi, \\\n"
+	"        zipfile.ZipFile(sys.argv[2], 'w') as zo:\n"
+	"    for info in zi.infolist():\n"
+	"        data = zi.read(info)\n"
+	"        if info.filename == 'decoders.index':\n"
+	"            data = b'\\n'.join(b'magic 0' if l.startswith(b'magic ')\n"
+	"                else l for l in data.split(b'\\n'))\n"
+	"        zo.writestr(info, data)\n";
+
+static gboolean bundle_other_python;
+
+static int bundle_log_cb(void *cb_data, int loglevel, const char *format,
+		va_list args)
+{
+	(void)cb_data;
+	(void)loglevel;
+	(void)args;
+
+	if (strstr(format, "built for another Python version"))
+		bundle_other_python = TRUE;
+
+	return SRD_OK;
+}
+
+/* Runs the script argv[0] as __main__, sets 'ok' if it succeeded. */
+static const char run_script_py[] =
+	"import contextlib, io, runpy, sys\n"
+	"sys.argv = argv\n"
+	"ok = False\n"
+	"with contextlib.redirect_stdout(io.StringIO()):\n"
+	"    try:\n"
+	"        runpy.run_path(argv[0], run_name='__main__')\n"
+	"        ok = True\n"
+	"    except SystemExit as e:\n"
+	"        ok = not e.code\n";
+
+/*
+ * Run a Python script with the arguments in the library's interpreter,
+ * return whether it succeeded. Bundles have to be built by the Python
+ * version which loads them.
+ */
+static gboolean run_python(const char *const *argv)
+{
+	PyGILState_STATE gstate;
+	PyObject *py_globals, *py_argv, *py_str, *py_code, *py_ret, *py_ok;
+	gboolean ok;
+	int i;
+
+	srd_init(NULL);
+	gstate = PyGILState_Ensure();
+
+	py_globals = PyDict_New();
+	PyDict_SetItemString(py_globals, "__builtins__", PyEval_GetBuiltins());
+	py_argv = PyList_New(0);
+	for (i = 0; argv[i]; i++) {
+		py_str = PyUnicode_FromString(argv[i]);
+		PyList_Append(py_argv, py_str);
+		Py_DECREF(py_str);
+	}
+	PyDict_SetItemString(py_globals, "argv", py_argv);
+	Py_DECREF(py_argv);
+
+	py_code = Py_CompileString(run_script_py, "<test>", Py_file_input);
+	py_ret = NULL;
+	if (py_code) {
+		py_ret = PyEval_EvalCode(py_code, py_globals, py_globals);
+		Py_DECREF(py_code);
+	}
+	if (!py_ret)
+		PyErr_Print();
+	py_ok = PyDict_GetItemString(py_globals, "ok");
+	ok = py_ret && py_ok && PyObject_IsTrue(py_ok);
+	Py_XDECREF(py_ret);
+	Py_DECREF(py_globals);
+
+	PyGILState_Release(gstate);
+	srd_exit();
+
+	return ok;
+}
+
+/* Load all decoders with only the bundle as search path. */
+static gboolean load_bundle_decoder(const char *bundle_path)
+{
+	struct srd_decoder *dec;
+	struct srd_session *sess;
+	gboolean loaded;
+
+	bundle_other_python = FALSE;
+	srd_log_loglevel_set(SRD_LOG_ERR);
+	srd_log_callback_set(bundle_log_cb, NULL);
+	srd_init(bundle_path);
+	srd_decoder_load_all();
+	srd_log_callback_set_default();
+	srd_log_loglevel_set(SRD_LOG_NONE);
+
+	dec = srd_decoder_get_by_id("deptest");
+	if ((loaded = dec != NULL)) {
+		fail_unless(dec->py_dec != NULL);
+		srd_session_new(&sess);
+		fail_unless(srd_inst_new(sess, "deptest", NULL) != NULL,
+			"srd_inst_new() failed.");
+	}
+	srd_exit();
+
+	return loaded;
+}
+
+/*
+ * Check whether decoders are loaded from a bundle built by
+ * "tools/install-decoders -b", and not from a bundle which was built
+ * for another Python version.
+ */
+START_TEST(test_load_bundle)
+{
+	char *src_dir, *dir, *file, *bundle_path, *bad_path, *tool;
+	const char *argv[6];
+	gboolean loaded;
+
+	/* The deptest decoder, and the module it needs. */
+	srdtest_decoder_add("deptest", deptest_pd);
+	src_dir = g_strdup(g_getenv("SIGROKDECODE_DIR"));
+	dir = g_build_filename(src_dir, "srdtest_dep", NULL);
+	g_mkdir(dir, 0700);
+	file = g_build_filename(dir, "__init__.py", NULL);
+	g_file_set_contents(file, "", -1, NULL);
+	g_free(file);
+	g_free(dir);
+
+	bundle_path = g_build_filename(src_dir, "bundle.zip", NULL);
+	bad_path = g_build_filename(src_dir, "bad.zip", NULL);
+	tool = g_build_filename(TOOLS_TESTDIR, "install-decoders", NULL);
+	argv[0] = tool;
+	argv[1] = "-i";
+	argv[2] = src_dir;
+	argv[3] = "-b";
+	argv[4] = bundle_path;
+	argv[5] = NULL;
+	fail_unless(run_python(argv), "install-decoders -b failed.");
+	file = g_build_filename(src_dir, "bad_magic.py", NULL);
+	g_file_set_contents(file, bundle_bad_magic_py, -1, NULL);
+	argv[0] = file;
+	argv[1] = bundle_path;
+	argv[2] = bad_path;
+	argv[3] = NULL;
+	fail_unless(run_python(argv), "Rewriting the bundle index failed.");
+	g_free(file);
+
+	/* Only search the bundles, not the decoders' sources. */
+	g_unsetenv("SIGROKDECODE_DIR");
+	loaded = load_bundle_decoder(bundle_path);
+	fail_unless(loaded && !bundle_other_python,
+		"No decoder loaded from the bundle.");
+	loaded = load_bundle_decoder(bad_path);
+	fail_unless(!loaded && bundle_other_python,
+		"Decoder loaded from a bundle for another Python.");
+
+	g_free(tool);
+	g_free(bad_path);
+	g_free(bundle_path);
+	g_free(src_dir);
+}
+END_TEST
+
 /*
  * Check whether srd_decoder_unload_all() works.
  * If it returns != SRD_OK (or segfaults) this test will fail.
@@ -421,6 +734,58 @@ START_TEST(test_doc_get_null)
 }
 END_TEST
 
+/*
+ * Check whether srd_proto_data_annotation_text() formats annotations
+ * which were put as raw values, and returns texts of other annotations.
+ */
+START_TEST(test_annotation_text)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	struct srd_pd_output pdo;
+	struct srd_proto_data pdata;
+	struct srd_proto_data_annotation pda;
+	char *texts[] = { "Start", "S", NULL };
+	char *text;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("i2c");
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "i2c", NULL);
+
+	pdo.output_type = SRD_OUTPUT_ANN;
+	pdo.di = inst;
+	pdata.pdo = &pdo;
+	pdata.data = &pda;
+
+	/* Address write, with templates. */
+	pda.ann_class = 7;
+	pda.ann_text = NULL;
+	pda.ann_text_id = SRD_ANN_TEXT_ID_NONE;
+	pda.num_values = 1;
+	pda.values[0] = 0x5a;
+	text = srd_proto_data_annotation_text(&pdata, 0);
+	fail_unless(text && !strcmp(text, "Address write: 5A"));
+	g_free(text);
+	text = srd_proto_data_annotation_text(&pdata, 2);
+	fail_unless(text && !strcmp(text, "5A"));
+	g_free(text);
+	fail_unless(srd_proto_data_annotation_text(&pdata, 3) == NULL);
+
+	/* Start condition, without templates. */
+	pda.ann_class = 0;
+	fail_unless(srd_proto_data_annotation_text(&pdata, 0) == NULL);
+	pda.ann_text = texts;
+	text = srd_proto_data_annotation_text(&pdata, 1);
+	fail_unless(text && !strcmp(text, "S"));
+	g_free(text);
+
+	fail_unless(srd_proto_data_annotation_text(NULL, 0) == NULL);
+
+	srd_exit();
+}
+END_TEST
+
 Suite *suite_decoder(void)
 {
 	Suite *s;
@@ -438,6 +803,10 @@ Suite *suite_decoder(void)
 	tcase_add_test(tc, test_load_valid_and_bogus);
 	tcase_add_test(tc, test_load_multiple);
 	tcase_add_test(tc, test_load_nonexisting_pd_dir);
+	tcase_add_test(tc, test_load_all_cached);
+	tcase_add_test(tc, test_load_all_cached_failure);
+	tcase_add_test(tc, test_load_bundle);
+	tcase_add_test(tc, test_load_stats);
 	suite_add_tcase(s, tc);
 
 	tc = tcase_create("unload");
@@ -471,5 +840,9 @@ Suite *suite_decoder(void)
 	tcase_add_test(tc, test_doc_get_null);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("annotation_text");
+	tcase_add_test(tc, test_annotation_text);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
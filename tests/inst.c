@@ -140,6 +140,349 @@ START_TEST(test_inst_option_set_bogus)
 }
 END_TEST
 
+/*
+ * Check whether srd_inst_binary_coalesce_set() can enable and disable
+ * coalescing, and rejects a NULL instance.
+ */
+START_TEST(test_inst_binary_coalesce_set)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	int ret;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "uart", NULL);
+
+	ret = srd_inst_binary_coalesce_set(NULL, 4096);
+	fail_unless(ret != SRD_OK, "srd_inst_binary_coalesce_set() worked.");
+	ret = srd_inst_binary_coalesce_set(inst, 4096);
+	fail_unless(ret == SRD_OK, "srd_inst_binary_coalesce_set() failed: %d.", ret);
+	ret = srd_inst_binary_coalesce_set(inst, 0);
+	fail_unless(ret == SRD_OK, "srd_inst_binary_coalesce_set() failed: %d.", ret);
+	ret = srd_inst_binary_coalesce_set(inst, 64);
+	fail_unless(ret == SRD_OK, "srd_inst_binary_coalesce_set() failed: %d.", ret);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_inst_output_filter_set() and
+ * srd_inst_ann_row_filter_set() accept valid filters and reject
+ * bogus ones.
+ */
+START_TEST(test_inst_output_filter_set)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	const int classes[] = { 0, 2 };
+	const int bogus_classes[] = { -1 };
+	const char *rows[] = { "rx-data-vals", "tx-data-bits", NULL };
+	const char *bogus_rows[] = { "nonexisting", NULL };
+	int ret;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "uart", NULL);
+
+	ret = srd_inst_output_filter_set(NULL, SRD_OUTPUT_ANN, classes, 2);
+	fail_unless(ret != SRD_OK, "srd_inst_output_filter_set() worked.");
+	ret = srd_inst_output_filter_set(inst, SRD_OUTPUT_PYTHON, classes, 2);
+	fail_unless(ret != SRD_OK, "srd_inst_output_filter_set() worked.");
+	ret = srd_inst_output_filter_set(inst, SRD_OUTPUT_META, classes, 2);
+	fail_unless(ret != SRD_OK, "srd_inst_output_filter_set() worked.");
+	ret = srd_inst_output_filter_set(inst, SRD_OUTPUT_ANN, bogus_classes, 1);
+	fail_unless(ret != SRD_OK, "srd_inst_output_filter_set() worked.");
+	ret = srd_inst_output_filter_set(inst, SRD_OUTPUT_ANN, classes, 2);
+	fail_unless(ret == SRD_OK, "srd_inst_output_filter_set() failed: %d.", ret);
+	ret = srd_inst_output_filter_set(inst, SRD_OUTPUT_META, classes, 0);
+	fail_unless(ret == SRD_OK, "srd_inst_output_filter_set() failed: %d.", ret);
+	ret = srd_inst_output_filter_set(inst, SRD_OUTPUT_ANN, NULL, 0);
+	fail_unless(ret == SRD_OK, "srd_inst_output_filter_set() failed: %d.", ret);
+
+	ret = srd_inst_ann_row_filter_set(inst, bogus_rows);
+	fail_unless(ret != SRD_OK, "srd_inst_ann_row_filter_set() worked.");
+	ret = srd_inst_ann_row_filter_set(inst, rows);
+	fail_unless(ret == SRD_OK, "srd_inst_ann_row_filter_set() failed: %d.", ret);
+	ret = srd_inst_ann_row_filter_set(inst, NULL);
+	fail_unless(ret == SRD_OK, "srd_inst_ann_row_filter_set() failed: %d.", ret);
+
+	srd_exit();
+}
+END_TEST
+
+static void ann_store_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	const struct srd_proto_data_annotation *pda;
+	int *found;
+
+	pda = pdata->data;
+	found = cb_data;
+	(*found)++;
+	if (pda->ann_class == 0 && pda->payload &&
+			g_variant_is_of_type(pda->payload, G_VARIANT_TYPE_INT64) &&
+			g_variant_get_int64(pda->payload) == 0x41)
+		*found += 100;
+}
+
+/* 0x41 at 1000 baud and 8 samples per bit, with idle time around. */
+static void uart_samples(uint8_t *samples)
+{
+	int i, bit;
+
+	for (i = 0; i < 112; i++) {
+		bit = i / 8 - 2;
+		if (bit < 0 || bit > 8)
+			samples[i] = 1;
+		else if (bit == 0)
+			samples[i] = 0;
+		else
+			samples[i] = (0x41 >> (bit - 1)) & 1;
+	}
+}
+
+/*
+ * Check whether the annotation store keeps the annotations an instance
+ * puts, and finds them by sample range.
+ */
+START_TEST(test_inst_ann_store)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	GHashTable *options, *channels;
+	uint8_t samples[112];
+	uint64_t counts[2];
+	int ret, found;
+
+	uart_samples(samples);
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "baudrate", g_variant_new_int64(1000));
+	inst = srd_inst_new(sess, "uart", options);
+	g_hash_table_destroy(options);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "rx", g_variant_new_int32(0));
+	srd_inst_channel_set_all(inst, channels);
+	g_hash_table_destroy(channels);
+
+	ret = srd_session_ann_store_set(NULL, TRUE);
+	fail_unless(ret != SRD_OK, "srd_session_ann_store_set() worked.");
+	ret = srd_session_ann_store_set(sess, TRUE);
+	fail_unless(ret == SRD_OK, "srd_session_ann_store_set() failed: %d.", ret);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(8000));
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+
+	ret = srd_inst_ann_store_query(inst, "nonexisting", 0, 112,
+		ann_store_cb, &found);
+	fail_unless(ret != SRD_OK, "srd_inst_ann_store_query() worked.");
+	ret = srd_inst_ann_store_summary(inst, NULL, 0, 0, 2, counts);
+	fail_unless(ret != SRD_OK, "srd_inst_ann_store_summary() worked.");
+
+	/* The start bit, the data and the stop bit. */
+	found = 0;
+	ret = srd_inst_ann_store_query(inst, "rx-data-vals", 0, 112,
+		ann_store_cb, &found);
+	fail_unless(ret == SRD_OK, "srd_inst_ann_store_query() failed: %d.", ret);
+	fail_unless(found == 103, "Found %d instead of 103.", found);
+	found = 0;
+	srd_inst_ann_store_query(inst, "rx-data-vals", 200, 300,
+		ann_store_cb, &found);
+	fail_unless(found == 0, "Found %d annotations after the data.", found);
+
+	ret = srd_inst_ann_store_summary(inst, "rx-data-vals", 0, 112, 2, counts);
+	fail_unless(ret == SRD_OK, "srd_inst_ann_store_summary() failed: %d.", ret);
+	fail_unless(counts[0] == 3 && counts[1] == 0);
+
+	/* Resetting drops the kept annotations. */
+	srd_session_terminate_reset(sess);
+	found = 0;
+	srd_inst_ann_store_query(inst, NULL, 0, 112, ann_store_cb, &found);
+	fail_unless(found == 0, "Found %d annotations after reset.", found);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static struct srd_stack_template *uart_template(void)
+{
+	struct srd_stack_template *tmpl;
+	GHashTable *options, *channels;
+	int ret;
+
+	srd_stack_template_new(&tmpl);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "baudrate", g_variant_new_int64(1000));
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "rx", g_variant_new_int32(0));
+	ret = srd_stack_template_add(tmpl, "uart", options, channels);
+	fail_unless(ret == SRD_OK, "srd_stack_template_add() failed: %d.", ret);
+	fail_unless(g_hash_table_size(options) == 1);
+	g_hash_table_destroy(options);
+	g_hash_table_destroy(channels);
+
+	return tmpl;
+}
+
+/* Decode the UART samples, return what the annotation store found. */
+static int uart_decode(struct srd_session *sess, struct srd_decoder_inst *inst)
+{
+	uint8_t samples[112];
+	int ret, found;
+
+	uart_samples(samples);
+	srd_session_ann_store_set(sess, TRUE);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+		g_variant_new_uint64(8000));
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	found = 0;
+	srd_inst_ann_store_query(inst, "rx-data-vals", 0, 112,
+		ann_store_cb, &found);
+
+	return found;
+}
+
+/*
+ * Check whether stack templates check their decoders' options and
+ * channels, and build working stacks.
+ */
+START_TEST(test_stack_template)
+{
+	struct srd_session *sess1, *sess2;
+	struct srd_decoder_inst *inst1, *inst2;
+	struct srd_stack_template *tmpl;
+	GHashTable *options, *channels;
+	int ret, found;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	tmpl = uart_template();
+
+	/* Bogus option types and channels are rejected when added. */
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "baudrate", g_variant_new_string("fast"));
+	ret = srd_stack_template_add(tmpl, "uart", options, NULL);
+	fail_unless(ret != SRD_OK, "srd_stack_template_add() worked.");
+	g_hash_table_destroy(options);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "nonexisting", g_variant_new_int32(0));
+	ret = srd_stack_template_add(tmpl, "uart", NULL, channels);
+	fail_unless(ret != SRD_OK, "srd_stack_template_add() worked.");
+	g_hash_table_destroy(channels);
+	ret = srd_stack_template_add(tmpl, "nonexisting", NULL, NULL);
+	fail_unless(ret != SRD_OK, "srd_stack_template_add() worked.");
+
+	srd_session_new(&sess1);
+	srd_session_new(&sess2);
+	ret = srd_stack_template_instantiate(tmpl, sess1, &inst1);
+	fail_unless(ret == SRD_OK, "Instantiating failed: %d.", ret);
+	ret = srd_stack_template_instantiate(tmpl, sess2, &inst2);
+	fail_unless(ret == SRD_OK, "Instantiating failed: %d.", ret);
+	fail_unless(inst1 != inst2);
+	fail_unless(srd_inst_find_by_id(sess1, "uart-1") == inst1);
+	fail_unless(srd_inst_find_by_id(sess2, "uart-1") == inst2);
+
+	/* A second stack in the same session gets unique IDs. */
+	ret = srd_stack_template_instantiate(tmpl, sess2, NULL);
+	fail_unless(ret == SRD_OK, "Instantiating failed: %d.", ret);
+	fail_unless(srd_inst_find_by_id(sess2, "uart-2") != NULL);
+
+	/* The instances got the template's options and channels. */
+	found = uart_decode(sess1, inst1);
+	fail_unless(found == 103, "Found %d instead of 103.", found);
+	found = uart_decode(sess2, inst2);
+	fail_unless(found == 103, "Found %d instead of 103.", found);
+
+	srd_stack_template_free(tmpl);
+	srd_session_destroy(sess1);
+	srd_session_destroy(sess2);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether stack pools hand out working stacks, and reuse the
+ * sessions which are put back, without what the previous user set up.
+ */
+START_TEST(test_stack_pool)
+{
+	static const int no_classes[] = { 0 };
+	struct srd_session *sess, *sess_again;
+	struct srd_stack_template *tmpl;
+	struct srd_stack_pool *pool;
+	struct srd_decoder_inst *inst;
+	GHashTable *options, *channels;
+	int ret, found;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	tmpl = uart_template();
+	srd_stack_pool_new(tmpl, &pool);
+
+	ret = srd_stack_pool_get(pool, &sess);
+	fail_unless(ret == SRD_OK, "srd_stack_pool_get() failed: %d.", ret);
+	inst = srd_inst_find_by_id(sess, "uart-1");
+	fail_unless(inst != NULL);
+	found = uart_decode(sess, inst);
+	fail_unless(found == 103, "Found %d instead of 103.", found);
+
+	/* Settings of this user, which would drop all of the output. */
+	srd_session_shard_set(sess, 0, 1000, UINT64_MAX);
+	srd_inst_output_filter_set(inst, SRD_OUTPUT_ANN, no_classes, 0);
+	srd_inst_binary_coalesce_set(inst, 1024);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "baudrate", g_variant_new_int64(2000));
+	srd_inst_option_set(inst, options);
+	g_hash_table_destroy(options);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "rx", g_variant_new_int32(1));
+	srd_inst_channel_set_all(inst, channels);
+	g_hash_table_destroy(channels);
+
+	ret = srd_stack_pool_put(pool, sess);
+	fail_unless(ret == SRD_OK, "srd_stack_pool_put() failed: %d.", ret);
+	ret = srd_stack_pool_get(pool, &sess_again);
+	fail_unless(ret == SRD_OK, "srd_stack_pool_get() failed: %d.", ret);
+	fail_unless(sess_again == sess, "The session was not reused.");
+	fail_unless(srd_inst_find_by_id(sess, "uart-1") == inst);
+
+	/* The reused stack decodes from scratch, with the template's setup. */
+	fail_unless(inst->output_filters == NULL);
+	fail_unless(inst->bin_coalesce == NULL);
+	found = 0;
+	srd_inst_ann_store_query(inst, NULL, 0, 112, ann_store_cb, &found);
+	fail_unless(found == 0, "Found %d annotations after reuse.", found);
+	found = uart_decode(sess, inst);
+	fail_unless(found == 103, "Found %d instead of 103.", found);
+
+	srd_stack_pool_put(pool, sess);
+	srd_stack_pool_free(pool);
+	srd_stack_template_free(tmpl);
+	srd_exit();
+}
+END_TEST
+
 Suite *suite_inst(void)
 {
 	Suite *s;
@@ -159,5 +502,18 @@ Suite *suite_inst(void)
 	tcase_add_test(tc, test_inst_option_set_bogus);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("output");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_inst_binary_coalesce_set);
+	tcase_add_test(tc, test_inst_output_filter_set);
+	tcase_add_test(tc, test_inst_ann_store);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("template");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_stack_template);
+	tcase_add_test(tc, test_stack_pool);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
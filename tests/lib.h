@@ -22,10 +22,12 @@
 
 void srdtest_setup(void);
 void srdtest_teardown(void);
+void srdtest_decoder_add(const char *name, const char *source);
 
 Suite *suite_core(void);
 Suite *suite_decoder(void);
 Suite *suite_inst(void);
 Suite *suite_session(void);
+Suite *suite_decode(void);
 
 #endif
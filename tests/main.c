@@ -21,16 +21,75 @@
 #include <libsigrokdecode.h> /* First, to avoid compiler warning. */
 #include <stdlib.h>
 #include <check.h>
+#include <glib/gstdio.h>
 #include "lib.h"
 
+/* The directory of decoders written by tests, see srdtest_decoder_add(). */
+static char *test_decoders_dir;
+
+static void remove_dir(const char *path)
+{
+	GDir *dir;
+	const char *name;
+	char *file;
+
+	if ((dir = g_dir_open(path, 0, NULL))) {
+		while ((name = g_dir_read_name(dir))) {
+			file = g_build_filename(path, name, NULL);
+			if (g_file_test(file, G_FILE_TEST_IS_DIR))
+				remove_dir(file);
+			else
+				g_unlink(file);
+			g_free(file);
+		}
+		g_dir_close(dir);
+	}
+	g_rmdir(path);
+}
+
 void srdtest_setup(void)
 {
 	/* Silence libsigrokdecode while the unit tests run. */
 	srd_log_loglevel_set(SRD_LOG_NONE);
+
+	/* Don't let the tests write the user's decoder metadata cache. */
+	g_setenv("SIGROKDECODE_CACHE", "", TRUE);
 }
 
 void srdtest_teardown(void)
 {
+	if (test_decoders_dir) {
+		g_unsetenv("SIGROKDECODE_DIR");
+		remove_dir(test_decoders_dir);
+		g_free(test_decoders_dir);
+		test_decoders_dir = NULL;
+	}
+}
+
+/*
+ * Write a decoder which only a test needs. The decoder's pd.py is
+ * 'source', it gets loaded as module 'name'. Must be called before
+ * srd_init(), the decoders are removed by srdtest_teardown().
+ */
+void srdtest_decoder_add(const char *name, const char *source)
+{
+	char *dir, *file;
+
+	if (!test_decoders_dir) {
+		test_decoders_dir = g_dir_make_tmp("srdtest-XXXXXX", NULL);
+		fail_unless(test_decoders_dir != NULL);
+		g_setenv("SIGROKDECODE_DIR", test_decoders_dir, TRUE);
+	}
+
+	dir = g_build_filename(test_decoders_dir, name, NULL);
+	g_mkdir_with_parents(dir, 0700);
+	file = g_build_filename(dir, "__init__.py", NULL);
+	g_file_set_contents(file, "from .pd import Decoder\n", -1, NULL);
+	g_free(file);
+	file = g_build_filename(dir, "pd.py", NULL);
+	g_file_set_contents(file, source, -1, NULL);
+	g_free(file);
+	g_free(dir);
 }
 
 int main(void)
@@ -47,6 +106,7 @@ int main(void)
 	srunner_add_suite(srunner, suite_decoder());
 	srunner_add_suite(srunner, suite_inst());
 	srunner_add_suite(srunner, suite_session());
+	srunner_add_suite(srunner, suite_decode());
 
 	srunner_run_all(srunner, CK_VERBOSE);
 	ret = srunner_ntests_failed(srunner);
@@ -22,6 +22,8 @@
 #include <libsigrokdecode.h>
 #include <stdint.h>
 #include <stdlib.h>
+#include <string.h>
+#include <glib/gstdio.h>
 #include <check.h>
 #include "lib.h"
 
@@ -260,6 +262,442 @@ START_TEST(test_session_reset_nodata)
 }
 END_TEST
 
+/*
+ * Check whether srd_session_send_transitions() fails with invalid input.
+ * If it returns SRD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_session_send_transitions_bogus)
+{
+	struct srd_session *sess;
+	uint64_t samplenums[] = { 0, 10, 20 };
+	uint64_t unordered[] = { 0, 20, 10 };
+	uint8_t samples[] = { 0x00, 0x01, 0x00 };
+	int ret;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+
+	/* NULL session, NULL pointers, zero counts. */
+	ret = srd_session_send_transitions(NULL, 0, 30, samplenums, samples, 3, 1);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+	ret = srd_session_send_transitions(sess, 0, 30, NULL, samples, 3, 1);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+	ret = srd_session_send_transitions(sess, 0, 30, samplenums, NULL, 3, 1);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+	ret = srd_session_send_transitions(sess, 0, 30, samplenums, samples, 0, 1);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+	ret = srd_session_send_transitions(sess, 0, 30, samplenums, samples, 3, 0);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+
+	/* First transition not at the chunk's start. */
+	ret = srd_session_send_transitions(sess, 5, 30, samplenums, samples, 3, 1);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+
+	/* Transitions out of order, or beyond the chunk's end. */
+	ret = srd_session_send_transitions(sess, 0, 30, unordered, samples, 3, 1);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+	ret = srd_session_send_transitions(sess, 0, 20, samplenums, samples, 3, 1);
+	fail_unless(ret != SRD_OK, "srd_session_send_transitions() worked.");
+
+	/* Valid input, yet no decoders in the session. */
+	ret = srd_session_send_transitions(sess, 0, 30, samplenums, samples, 3, 1);
+	fail_unless(ret == SRD_OK, "srd_session_send_transitions() failed: %d.", ret);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_session_queue_depth_set() and srd_session_flush()
+ * work on sessions without decoders, and fail on NULL sessions.
+ */
+START_TEST(test_session_queue_flush)
+{
+	struct srd_session *sess;
+	uint8_t samples[] = { 0x00, 0x01, 0x00, 0x01 };
+	int ret;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+
+	ret = srd_session_queue_depth_set(NULL, 4);
+	fail_unless(ret != SRD_OK, "srd_session_queue_depth_set() worked.");
+	ret = srd_session_flush(NULL);
+	fail_unless(ret != SRD_OK, "srd_session_flush() worked.");
+
+	ret = srd_session_queue_depth_set(sess, 4);
+	fail_unless(ret == SRD_OK, "srd_session_queue_depth_set() failed: %d.", ret);
+	ret = srd_session_start(sess);
+	fail_unless(ret == SRD_OK, "srd_session_start() failed: %d.", ret);
+	ret = srd_session_send(sess, 0, 4, samples, sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	ret = srd_session_flush(sess);
+	fail_unless(ret == SRD_OK, "srd_session_flush() failed: %d.", ret);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_session_shard_set() rejects invalid shards, and
+ * makes the session accept samples from the shard's start on.
+ */
+START_TEST(test_session_shard)
+{
+	struct srd_session *sess;
+	uint8_t samples[] = { 0x00, 0x01, 0x00, 0x01 };
+	int ret;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+
+	ret = srd_session_shard_set(NULL, 0, 100, 200);
+	fail_unless(ret != SRD_OK, "srd_session_shard_set() worked.");
+	ret = srd_session_shard_set(sess, 150, 100, 200);
+	fail_unless(ret != SRD_OK, "srd_session_shard_set() worked.");
+	ret = srd_session_shard_set(sess, 50, 200, 200);
+	fail_unless(ret != SRD_OK, "srd_session_shard_set() worked.");
+
+	ret = srd_session_shard_set(sess, 50, 100, 200);
+	fail_unless(ret == SRD_OK, "srd_session_shard_set() failed: %d.", ret);
+	ret = srd_session_start(sess);
+	fail_unless(ret == SRD_OK, "srd_session_start() failed: %d.", ret);
+	ret = srd_session_send(sess, 50, 54, samples, sizeof(samples), 1);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	ret = srd_session_terminate_reset(sess);
+	fail_unless(ret == SRD_OK, "srd_session_terminate_reset() failed: %d.", ret);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static void batch_cb(struct srd_proto_data *pdata, unsigned int num_pdata,
+		void *cb_data)
+{
+	(void)pdata;
+	(void)num_pdata;
+	(void)cb_data;
+}
+
+/*
+ * Check whether srd_pd_output_callback_add_batched() only accepts
+ * annotation callbacks with a batch size.
+ */
+START_TEST(test_session_callback_add_batched)
+{
+	struct srd_session *sess;
+	int ret;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+
+	ret = srd_pd_output_callback_add_batched(NULL, SRD_OUTPUT_ANN,
+			batch_cb, 100, NULL);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_batched() worked.");
+	ret = srd_pd_output_callback_add_batched(sess, SRD_OUTPUT_ANN,
+			NULL, 100, NULL);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_batched() worked.");
+	ret = srd_pd_output_callback_add_batched(sess, SRD_OUTPUT_ANN,
+			batch_cb, 0, NULL);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_batched() worked.");
+	ret = srd_pd_output_callback_add_batched(sess, SRD_OUTPUT_BINARY,
+			batch_cb, 100, NULL);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_batched() worked.");
+
+	ret = srd_pd_output_callback_add_batched(sess, SRD_OUTPUT_ANN,
+			batch_cb, 100, NULL);
+	fail_unless(ret == SRD_OK, "srd_pd_output_callback_add_batched() "
+			"failed: %d.", ret);
+	ret = srd_pd_output_callback_add_batched(sess, SRD_OUTPUT_ANN,
+			batch_cb, 100, NULL);
+	fail_unless(ret != SRD_OK, "Second batched callback was accepted.");
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_session_ann_text_get() handles unknown ids.
+ */
+START_TEST(test_session_ann_text_get_bogus)
+{
+	struct srd_session *sess;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+
+	fail_unless(srd_session_ann_text_get(NULL, 0) == NULL,
+			"srd_session_ann_text_get() worked.");
+	fail_unless(srd_session_ann_text_get(sess, 0) == NULL,
+			"srd_session_ann_text_get() found unknown id 0.");
+	fail_unless(srd_session_ann_text_get(sess, 1234) == NULL,
+			"srd_session_ann_text_get() found unknown id 1234.");
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static void output_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	(void)pdata;
+	(void)cb_data;
+}
+
+/*
+ * Check whether srd_pd_output_callback_add_filtered() accepts several
+ * callbacks per output type, and rejects invalid arguments.
+ */
+START_TEST(test_session_callback_add_filtered)
+{
+	struct srd_session *sess;
+	int classes[] = { 0, 3 };
+	int negative[] = { -1, 2 };
+	int ret;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+
+	ret = srd_pd_output_callback_add_filtered(NULL, SRD_OUTPUT_ANN,
+			output_cb, NULL, NULL, classes, 2);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_filtered() worked.");
+	ret = srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+			NULL, NULL, NULL, classes, 2);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_filtered() worked.");
+	ret = srd_pd_output_callback_add_filtered(sess, 1234,
+			output_cb, NULL, NULL, classes, 2);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_filtered() worked.");
+	ret = srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+			output_cb, NULL, NULL, negative, 1);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_filtered() worked.");
+	ret = srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+			output_cb, NULL, NULL, negative, 2);
+	fail_unless(ret != SRD_OK, "srd_pd_output_callback_add_filtered() worked.");
+
+	ret = srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, output_cb, NULL);
+	fail_unless(ret == SRD_OK, "srd_pd_output_callback_add() failed: %d.", ret);
+	ret = srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_ANN,
+			output_cb, NULL, NULL, classes, 2);
+	fail_unless(ret == SRD_OK, "srd_pd_output_callback_add_filtered() "
+			"failed: %d.", ret);
+	ret = srd_pd_output_callback_add_filtered(sess, SRD_OUTPUT_BINARY,
+			output_cb, NULL, NULL, NULL, 0);
+	fail_unless(ret == SRD_OK, "srd_pd_output_callback_add_filtered() "
+			"failed: %d.", ret);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/* Pass output to all of a session's callbacks of its type. */
+static void send_output(struct srd_session *sess, struct srd_proto_data *pdata)
+{
+	GSList *l;
+	struct srd_pd_callback *pd_cb;
+
+	for (l = sess->callbacks[pdata->pdo->output_type]; l; l = l->next) {
+		pd_cb = l->data;
+		pd_cb->cb(pdata, pd_cb->cb_data);
+	}
+}
+
+/*
+ * Check whether output written with srd_outfile_open() is read back
+ * unchanged, and whether the reader honors sample ranges.
+ */
+START_TEST(test_session_outfile)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	struct srd_outfile *outfile;
+	struct srd_outfile_reader *reader;
+	struct srd_pd_output ann_pdo, bin_pdo;
+	struct srd_proto_data pdata, *rd_pdata;
+	struct srd_proto_data_annotation pda, *rd_pda;
+	struct srd_proto_data_binary pdb, *rd_pdb;
+	char *texts[] = { "Data: 41", "41", NULL };
+	char *other_texts[][2] = { { "Data: 42", NULL }, { "Data: 43", NULL } };
+	const unsigned char data[] = { 0x41, 0x42 };
+	const char *inst_id;
+	char *path, *written_inst_id;
+	int ret, i;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "uart", NULL);
+	path = g_build_filename(g_get_tmp_dir(), "srd-test-outfile", NULL);
+
+	ret = srd_outfile_open(sess, path, &outfile);
+	fail_unless(ret == SRD_OK, "srd_outfile_open() failed: %d.", ret);
+
+	ann_pdo.pdo_id = 0;
+	ann_pdo.output_type = SRD_OUTPUT_ANN;
+	ann_pdo.di = inst;
+	ann_pdo.proto_id = "uart";
+	bin_pdo = ann_pdo;
+	bin_pdo.pdo_id = 1;
+	bin_pdo.output_type = SRD_OUTPUT_BINARY;
+
+	/*
+	 * Annotations at samples 1000, 1100, 800, ..., two annotations
+	 * with texts which are not interned, then binary data.
+	 */
+	pdata.pdo = &ann_pdo;
+	pda.ann_class = 0;
+	pda.ann_text = texts;
+	pda.ann_text_id = 0;
+	pda.num_values = 0;
+	pda.payload = NULL;
+	pdata.data = &pda;
+	for (i = 0; i < 10; i++) {
+		pdata.start_sample = 1000 + ((i & 1) ? i * 100 : -i * 100);
+		pdata.end_sample = pdata.start_sample + 10;
+		send_output(sess, &pdata);
+	}
+	pda.ann_text_id = SRD_ANN_TEXT_ID_NONE;
+	for (i = 0; i < 2; i++) {
+		pda.ann_text = other_texts[i];
+		pdata.start_sample = 2000 + i * 100;
+		pdata.end_sample = pdata.start_sample + 10;
+		send_output(sess, &pdata);
+	}
+	pdata.pdo = &bin_pdo;
+	pdb.bin_class = 1;
+	pdb.size = sizeof(data);
+	pdb.data = data;
+	pdata.data = &pdb;
+	pdata.start_sample = 5000;
+	pdata.end_sample = 5020;
+	send_output(sess, &pdata);
+
+	ret = srd_outfile_close(outfile);
+	fail_unless(ret == SRD_OK, "srd_outfile_close() failed: %d.", ret);
+	written_inst_id = g_strdup(inst->inst_id);
+	srd_session_destroy(sess);
+
+	ret = srd_outfile_reader_open(path, &reader);
+	fail_unless(ret == SRD_OK, "srd_outfile_reader_open() failed: %d.", ret);
+	for (i = 0; i < 10; i++) {
+		fail_unless(srd_outfile_reader_next(reader, &rd_pdata, &inst_id));
+		rd_pda = rd_pdata->data;
+		fail_unless(rd_pdata->start_sample ==
+			(uint64_t)(1000 + ((i & 1) ? i * 100 : -i * 100)));
+		fail_unless(rd_pdata->end_sample == rd_pdata->start_sample + 10);
+		fail_unless(rd_pdata->pdo->output_type == SRD_OUTPUT_ANN);
+		fail_unless(!strcmp(rd_pdata->pdo->proto_id, "uart"));
+		fail_unless(!strcmp(inst_id, written_inst_id));
+		fail_unless(!strcmp(rd_pda->ann_text[0], "Data: 41"));
+		fail_unless(!strcmp(rd_pda->ann_text[1], "41"));
+		fail_unless(!rd_pda->ann_text[2]);
+	}
+	for (i = 0; i < 2; i++) {
+		fail_unless(srd_outfile_reader_next(reader, &rd_pdata, NULL));
+		rd_pda = rd_pdata->data;
+		fail_unless(rd_pdata->start_sample == (uint64_t)(2000 + i * 100));
+		fail_unless(!strcmp(rd_pda->ann_text[0], other_texts[i][0]),
+			"Read text %s instead of %s.", rd_pda->ann_text[0],
+			other_texts[i][0]);
+		fail_unless(!rd_pda->ann_text[1]);
+	}
+	fail_unless(srd_outfile_reader_next(reader, &rd_pdata, NULL));
+	rd_pdb = rd_pdata->data;
+	fail_unless(rd_pdata->pdo->output_type == SRD_OUTPUT_BINARY);
+	fail_unless(rd_pdb->bin_class == 1 && rd_pdb->size == sizeof(data));
+	fail_unless(!memcmp(rd_pdb->data, data, sizeof(data)));
+	fail_unless(!srd_outfile_reader_next(reader, &rd_pdata, NULL));
+
+	/* Only the annotations starting in [800, 1300). */
+	ret = srd_outfile_reader_seek(reader, 800, 1300);
+	fail_unless(ret == SRD_OK, "srd_outfile_reader_seek() failed: %d.", ret);
+	for (i = 0; srd_outfile_reader_next(reader, &rd_pdata, NULL); i++) {
+		fail_unless(rd_pdata->start_sample >= 800);
+		fail_unless(rd_pdata->start_sample < 1300);
+	}
+	fail_unless(i == 3, "Read %d records instead of 3.", i);
+
+	srd_outfile_reader_close(reader);
+	g_unlink(path);
+	g_free(written_inst_id);
+	g_free(path);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether annotation payloads are read back, and whether records
+ * with payloads of indefinite types are rejected.
+ */
+START_TEST(test_session_outfile_payload)
+{
+	struct srd_session *sess;
+	struct srd_outfile *outfile;
+	struct srd_outfile_reader *reader;
+	struct srd_pd_output pdo;
+	struct srd_proto_data pdata, *rd_pdata;
+	struct srd_proto_data_annotation pda, *rd_pda;
+	char *path, *contents;
+	gsize len;
+	int ret;
+
+	srd_init(DECODERS_TESTDIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	path = g_build_filename(g_get_tmp_dir(), "srd-test-outfile", NULL);
+	ret = srd_outfile_open(sess, path, &outfile);
+	fail_unless(ret == SRD_OK, "srd_outfile_open() failed: %d.", ret);
+
+	pdo.pdo_id = 0;
+	pdo.output_type = SRD_OUTPUT_ANN;
+	pdo.di = srd_inst_new(sess, "uart", NULL);
+	pdo.proto_id = "uart";
+	pdata.pdo = &pdo;
+	pdata.start_sample = 100;
+	pdata.end_sample = 110;
+	pda.ann_class = 0;
+	pda.ann_text = NULL;
+	pda.ann_text_id = SRD_ANN_TEXT_ID_NONE;
+	pda.num_values = 0;
+	pda.payload = g_variant_ref_sink(g_variant_new_int64(0x41));
+	pdata.data = &pda;
+	send_output(sess, &pdata);
+	g_variant_unref(pda.payload);
+	ret = srd_outfile_close(outfile);
+	fail_unless(ret == SRD_OK, "srd_outfile_close() failed: %d.", ret);
+	srd_session_destroy(sess);
+
+	ret = srd_outfile_reader_open(path, &reader);
+	fail_unless(ret == SRD_OK, "srd_outfile_reader_open() failed: %d.", ret);
+	fail_unless(srd_outfile_reader_next(reader, &rd_pdata, NULL));
+	rd_pda = rd_pdata->data;
+	fail_unless(rd_pda->payload != NULL);
+	fail_unless(g_variant_is_of_type(rd_pda->payload, G_VARIANT_TYPE_INT64));
+	fail_unless(g_variant_get_int64(rd_pda->payload) == 0x41);
+	srd_outfile_reader_close(reader);
+
+	/* The record ends with the payload: "x", 8 bytes of data. */
+	fail_unless(g_file_get_contents(path, &contents, &len, NULL));
+	fail_unless(len > 10 && contents[len - 10] == 'x');
+	contents[len - 10] = '*';
+	fail_unless(g_file_set_contents(path, contents, len, NULL));
+	g_free(contents);
+	ret = srd_outfile_reader_open(path, &reader);
+	fail_unless(ret == SRD_OK, "srd_outfile_reader_open() failed: %d.", ret);
+	fail_unless(!srd_outfile_reader_next(reader, &rd_pdata, NULL),
+		"Payload of type \"*\" was read.");
+	srd_outfile_reader_close(reader);
+
+	g_unlink(path);
+	g_free(path);
+	srd_exit();
+}
+END_TEST
+
 Suite *suite_session(void)
 {
 	Suite *s;
@@ -280,11 +718,23 @@ Suite *suite_session(void)
 	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
 	tcase_add_test(tc, test_session_metadata_set);
 	tcase_add_test(tc, test_session_metadata_set_bogus);
+	tcase_add_test(tc, test_session_callback_add_batched);
+	tcase_add_test(tc, test_session_callback_add_filtered);
+	tcase_add_test(tc, test_session_ann_text_get_bogus);
 	suite_add_tcase(s, tc);
 
 	tc = tcase_create("reset");
 	tcase_add_test(tc, test_session_reset_nodata);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("send");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_send_transitions_bogus);
+	tcase_add_test(tc, test_session_queue_flush);
+	tcase_add_test(tc, test_session_shard);
+	tcase_add_test(tc, test_session_outfile);
+	tcase_add_test(tc, test_session_outfile_payload);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
@@ -0,0 +1,546 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * A local decode service: a pool of pre-forked worker processes, each of
+ * which initializes libsigrokdecode and loads all decoders once, then
+ * serves one client at a time on a Unix socket.
+ *
+ * A client sends header lines, then raw samples until it shuts down its
+ * side of the connection:
+ *
+ *   samplerate <Hz>
+ *   unitsize <bytes per sample>
+ *   decoder <id>[:<option or channel>=<value>]...
+ *   data
+ *
+ * Each "decoder" line is stacked on top of the previous one. The server
+ * replies with one line per annotation,
+ *
+ *   <start>-<end> <instance>: <class>: "<text>"
+ *
+ * and "end" once all samples are decoded, or "error <message>".
+ */
+
+#include <config.h>
+#include <libsigrokdecode.h>
+#include <errno.h>
+#include <inttypes.h>
+#include <signal.h>
+#include <stdarg.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <sys/wait.h>
+#include <unistd.h>
+#include <glib.h>
+#include <glib/gstdio.h>
+
+/* Samples per srd_session_send() call, and output bytes to buffer. */
+#define CHUNK_SIZE (256 * 1024)
+#define OUTPUT_BUFFER_SIZE (64 * 1024)
+
+struct client {
+	int fd;
+	GMutex lock;
+	GString *out;
+	gboolean write_failed;
+};
+
+static gchar *opt_socket = NULL;
+static gint opt_workers = 0;
+static gchar *opt_decoders_dir = NULL;
+static gint opt_loglevel = SRD_LOG_WARN;
+
+static GOptionEntry optargs[] = {
+	{"socket", 's', 0, G_OPTION_ARG_FILENAME, &opt_socket,
+		"Unix socket to listen on", "PATH"},
+	{"workers", 'j', 0, G_OPTION_ARG_INT, &opt_workers,
+		"Number of worker processes (default: number of CPUs)", "N"},
+	{"decoders", 'd', 0, G_OPTION_ARG_FILENAME, &opt_decoders_dir,
+		"Additional protocol decoder search path", "PATH"},
+	{"loglevel", 'l', 0, G_OPTION_ARG_INT, &opt_loglevel,
+		"libsigrokdecode log level (0-5)", "LEVEL"},
+	{NULL, 0, 0, 0, NULL, NULL, NULL}
+};
+
+static volatile sig_atomic_t quit = 0;
+
+static void quit_handler(int sig)
+{
+	(void)sig;
+
+	quit = 1;
+}
+
+static gboolean write_all(int fd, const char *buf, size_t len)
+{
+	ssize_t n;
+
+	while (len > 0) {
+		if ((n = write(fd, buf, len)) < 0) {
+			if (errno == EINTR)
+				continue;
+			return FALSE;
+		}
+		buf += n;
+		len -= n;
+	}
+
+	return TRUE;
+}
+
+/* The caller holds the client's lock. */
+static void client_flush(struct client *c)
+{
+	if (!c->write_failed && !write_all(c->fd, c->out->str, c->out->len))
+		c->write_failed = TRUE;
+	g_string_truncate(c->out, 0);
+}
+
+static void client_printf(struct client *c, const char *format, ...)
+{
+	va_list args;
+
+	g_mutex_lock(&c->lock);
+	va_start(args, format);
+	g_string_append_vprintf(c->out, format, args);
+	va_end(args);
+	client_flush(c);
+	g_mutex_unlock(&c->lock);
+}
+
+/* Called from the decoder stacks' threads. */
+static void annotation_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct client *c;
+	struct srd_proto_data_annotation *pda;
+	char **ann_class, *text;
+
+	c = cb_data;
+	pda = pdata->data;
+	ann_class = g_slist_nth_data(pdata->pdo->di->decoder->annotations,
+		pda->ann_class);
+	text = srd_proto_data_annotation_text(pdata, 0);
+
+	g_mutex_lock(&c->lock);
+	g_string_append_printf(c->out, "%" PRIu64 "-%" PRIu64 " %s: %s: \"%s\"\n",
+		pdata->start_sample, pdata->end_sample, pdata->pdo->di->inst_id,
+		ann_class ? ann_class[0] : "?", text ? text : "");
+	if (c->out->len >= OUTPUT_BUFFER_SIZE)
+		client_flush(c);
+	g_mutex_unlock(&c->lock);
+
+	g_free(text);
+}
+
+/* Parse a decimal number, which must make up the whole string. */
+static gboolean parse_uint(const char *str, uint64_t max, uint64_t *value)
+{
+	char *end;
+
+	if (!g_ascii_isdigit(*str))
+		return FALSE;
+	errno = 0;
+	*value = g_ascii_strtoull(str, &end, 10);
+
+	return !*end && !errno && *value <= max;
+}
+
+static gboolean is_channel(const GSList *channels, const char *id)
+{
+	const struct srd_channel *pdch;
+
+	for (; channels; channels = channels->next) {
+		pdch = channels->data;
+		if (!strcmp(pdch->id, id))
+			return TRUE;
+	}
+
+	return FALSE;
+}
+
+/* Parse an option value according to the type of its default value. */
+static GVariant *option_value(const struct srd_decoder *dec, const char *id,
+		const char *val)
+{
+	const struct srd_decoder_option *o;
+	const GSList *l;
+	char *end;
+	int64_t i;
+	double d;
+
+	for (l = dec->options; l; l = l->next) {
+		o = l->data;
+		if (strcmp(o->id, id))
+			continue;
+		if (g_variant_is_of_type(o->def, G_VARIANT_TYPE_STRING))
+			return g_variant_new_string(val);
+		if (g_variant_is_of_type(o->def, G_VARIANT_TYPE_INT64)) {
+			i = g_ascii_strtoll(val, &end, 0);
+			return (*val && !*end) ? g_variant_new_int64(i) : NULL;
+		}
+		if (g_variant_is_of_type(o->def, G_VARIANT_TYPE_DOUBLE)) {
+			d = g_ascii_strtod(val, &end);
+			return (*val && !*end) ? g_variant_new_double(d) : NULL;
+		}
+		return NULL;
+	}
+
+	return NULL;
+}
+
+/*
+ * Create a decoder instance from "<id>[:<key>=<value>]...", where keys are
+ * channel ids (mapped to sample bit numbers) or option ids.
+ */
+static struct srd_decoder_inst *decoder_new(struct srd_session *sess,
+		const char *spec, char **error)
+{
+	struct srd_decoder *dec;
+	struct srd_decoder_inst *di;
+	GHashTable *options, *channels;
+	GVariant *value;
+	uint64_t num;
+	char **tokens, *eq;
+	int i;
+
+	tokens = g_strsplit(spec, ":", 0);
+	if (!(dec = srd_decoder_get_by_id(tokens[0]))) {
+		*error = g_strdup_printf("unknown decoder %s", tokens[0]);
+		g_strfreev(tokens);
+		return NULL;
+	}
+
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	di = NULL;
+	for (i = 1; tokens[i]; i++) {
+		if (!(eq = strchr(tokens[i], '='))) {
+			*error = g_strdup_printf("no value for %s", tokens[i]);
+			goto out;
+		}
+		*eq++ = '\0';
+		if (is_channel(dec->channels, tokens[i]) ||
+				is_channel(dec->opt_channels, tokens[i])) {
+			if (!parse_uint(eq, G_MAXINT32, &num)) {
+				*error = g_strdup_printf("invalid channel %s "
+					"for %s", tokens[i], dec->id);
+				goto out;
+			}
+			value = g_variant_new_int32(num);
+			g_hash_table_insert(channels, tokens[i],
+				g_variant_ref_sink(value));
+		} else if ((value = option_value(dec, tokens[i], eq))) {
+			g_hash_table_insert(options, tokens[i],
+				g_variant_ref_sink(value));
+		} else {
+			*error = g_strdup_printf("invalid option %s for %s",
+				tokens[i], dec->id);
+			goto out;
+		}
+	}
+
+	if (!(di = srd_inst_new(sess, dec->id, options))) {
+		*error = g_strdup_printf("cannot create %s", dec->id);
+		goto out;
+	}
+	if (g_hash_table_size(channels) &&
+			srd_inst_channel_set_all(di, channels) != SRD_OK) {
+		*error = g_strdup_printf("invalid channels for %s", dec->id);
+		di = NULL;
+	}
+
+out:
+	g_hash_table_destroy(channels);
+	g_hash_table_destroy(options);
+	g_strfreev(tokens);
+
+	return di;
+}
+
+/* Read the header, up to the "data" line. */
+static struct srd_session *read_header(FILE *in, unsigned int *unitsize,
+		char **error)
+{
+	struct srd_session *sess;
+	struct srd_decoder_inst *di, *prev;
+	char *line;
+	size_t line_size;
+	uint64_t samplerate, num;
+	gboolean data;
+
+	srd_session_new(&sess);
+	data = FALSE;
+	line = NULL;
+	line_size = 0;
+	prev = NULL;
+	samplerate = 0;
+	*unitsize = 1;
+	while (getline(&line, &line_size, in) > 0) {
+		g_strchomp(line);
+		if (!strcmp(line, "data")) {
+			data = TRUE;
+			break;
+		} else if (g_str_has_prefix(line, "samplerate ")) {
+			if (!parse_uint(line + 11, G_MAXUINT64, &samplerate)) {
+				*error = g_strdup("invalid samplerate");
+				break;
+			}
+		} else if (g_str_has_prefix(line, "unitsize ")) {
+			if (!parse_uint(line + 9, 8, &num) || num < 1) {
+				*error = g_strdup("invalid unitsize");
+				break;
+			}
+			*unitsize = num;
+		} else if (g_str_has_prefix(line, "decoder ")) {
+			if (!(di = decoder_new(sess, line + 8, error)))
+				break;
+			if (prev && srd_inst_stack(sess, prev, di) != SRD_OK) {
+				*error = g_strdup_printf("cannot stack %s",
+					line + 8);
+				break;
+			}
+			prev = di;
+		} else {
+			*error = g_strdup_printf("unknown request: %s", line);
+			break;
+		}
+	}
+	free(line);
+
+	if (data && !*error && !prev)
+		*error = g_strdup("no decoder");
+	if (data && !*error) {
+		if (samplerate)
+			srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+				g_variant_new_uint64(samplerate));
+		return sess;
+	}
+	if (!*error)
+		*error = g_strdup("incomplete header");
+
+	srd_session_destroy(sess);
+
+	return NULL;
+}
+
+static void serve(int fd)
+{
+	struct client c;
+	struct srd_session *sess;
+	FILE *in;
+	char *error, *buf;
+	unsigned int unitsize;
+	uint64_t samplenum;
+	size_t len, n;
+
+	if (!(in = fdopen(dup(fd), "r")))
+		return;
+
+	c.fd = fd;
+	g_mutex_init(&c.lock);
+	c.out = g_string_sized_new(OUTPUT_BUFFER_SIZE + 256);
+	c.write_failed = FALSE;
+
+	error = NULL;
+	if (!(sess = read_header(in, &unitsize, &error))) {
+		client_printf(&c, "error %s\n", error);
+		goto out;
+	}
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, annotation_cb, &c);
+
+	if (srd_session_start(sess) != SRD_OK) {
+		client_printf(&c, "error cannot start decoding\n");
+		goto out;
+	}
+
+	buf = g_malloc(CHUNK_SIZE * unitsize);
+	samplenum = 0;
+	len = 0;
+	while (!c.write_failed) {
+		n = fread(buf + len, 1, CHUNK_SIZE * unitsize - len, in);
+		len += n;
+		/* Send whole samples, keep a partial one for the next round. */
+		if ((n == 0 || len == CHUNK_SIZE * unitsize) && len >= unitsize) {
+			if (srd_session_send(sess, samplenum,
+					samplenum + len / unitsize, (uint8_t *)buf,
+					len - len % unitsize, unitsize) != SRD_OK) {
+				error = g_strdup("decoding failed");
+				break;
+			}
+			samplenum += len / unitsize;
+			memmove(buf, buf + len - len % unitsize, len % unitsize);
+			len %= unitsize;
+		}
+		if (n == 0)
+			break;
+	}
+	g_free(buf);
+	srd_session_flush(sess);
+
+	if (error)
+		client_printf(&c, "error %s\n", error);
+	else
+		client_printf(&c, "end\n");
+
+out:
+	if (sess)
+		srd_session_destroy(sess);
+	fclose(in);
+	g_free(error);
+	g_string_free(c.out, TRUE);
+	g_mutex_clear(&c.lock);
+}
+
+static int worker(int listen_fd)
+{
+	struct sigaction sa;
+	int fd;
+
+	/* The parent tells workers to quit with SIGTERM. */
+	memset(&sa, 0, sizeof(sa));
+	sa.sa_handler = SIG_DFL;
+	sigaction(SIGTERM, &sa, NULL);
+	sigaction(SIGINT, &sa, NULL);
+
+	srd_log_loglevel_set(opt_loglevel);
+	if (srd_init(opt_decoders_dir) != SRD_OK)
+		return 1;
+	srd_decoder_load_all();
+
+	while ((fd = accept(listen_fd, NULL, NULL)) >= 0 || errno == EINTR) {
+		if (fd < 0)
+			continue;
+		serve(fd);
+		close(fd);
+	}
+	g_printerr("accept() failed: %s\n", g_strerror(errno));
+	srd_exit();
+
+	return 1;
+}
+
+static pid_t worker_start(int listen_fd)
+{
+	pid_t pid;
+
+	if ((pid = fork()) == 0)
+		_exit(worker(listen_fd));
+	if (pid < 0)
+		g_printerr("fork() failed: %s\n", g_strerror(errno));
+
+	return pid;
+}
+
+static int listen_socket(const char *path)
+{
+	struct sockaddr_un addr;
+	int fd;
+
+	if (strlen(path) >= sizeof(addr.sun_path)) {
+		g_printerr("Socket path too long.\n");
+		return -1;
+	}
+	memset(&addr, 0, sizeof(addr));
+	addr.sun_family = AF_UNIX;
+	strcpy(addr.sun_path, path);
+
+	if ((fd = socket(AF_UNIX, SOCK_STREAM, 0)) < 0 ||
+			(g_unlink(path) < 0 && errno != ENOENT) ||
+			bind(fd, (struct sockaddr *)&addr, sizeof(addr)) < 0 ||
+			listen(fd, 64) < 0) {
+		g_printerr("Cannot listen on %s: %s\n", path, g_strerror(errno));
+		if (fd >= 0)
+			close(fd);
+		return -1;
+	}
+
+	return fd;
+}
+
+int main(int argc, char **argv)
+{
+	GOptionContext *context;
+	GError *error;
+	struct sigaction sa;
+	pid_t *pids, pid;
+	int listen_fd, status, i, ret;
+
+	context = g_option_context_new(NULL);
+	g_option_context_set_summary(context, "Serve protocol decoding on a "
+		"Unix socket, from a pool of worker processes.");
+	g_option_context_add_main_entries(context, optargs, NULL);
+	error = NULL;
+	if (!g_option_context_parse(context, &argc, &argv, &error) ||
+			!opt_socket) {
+		g_printerr("%s\n", error ? error->message : "No socket given.");
+		return 1;
+	}
+	g_option_context_free(context);
+	if (opt_workers <= 0)
+		opt_workers = g_get_num_processors();
+
+	memset(&sa, 0, sizeof(sa));
+	sa.sa_handler = SIG_IGN;
+	sigaction(SIGPIPE, &sa, NULL);
+	sa.sa_handler = quit_handler;
+	sigaction(SIGTERM, &sa, NULL);
+	sigaction(SIGINT, &sa, NULL);
+
+	if ((listen_fd = listen_socket(opt_socket)) < 0)
+		return 1;
+
+	pids = g_malloc0(opt_workers * sizeof(pid_t));
+	for (i = 0; i < opt_workers; i++)
+		pids[i] = worker_start(listen_fd);
+
+	/* Restart workers which exit, until told to quit. */
+	ret = 0;
+	while (!quit) {
+		if ((pid = waitpid(-1, &status, 0)) < 0) {
+			if (errno == EINTR)
+				continue;
+			ret = 1;
+			break;
+		}
+		for (i = 0; i < opt_workers; i++) {
+			if (pids[i] != pid)
+				continue;
+			g_printerr("Worker %d exited, restarting it.\n", (int)pid);
+			if (WIFEXITED(status) && WEXITSTATUS(status))
+				sleep(1);
+			pids[i] = worker_start(listen_fd);
+		}
+	}
+
+	for (i = 0; i < opt_workers; i++) {
+		if (pids[i] > 0)
+			kill(pids[i], SIGTERM);
+	}
+	while (wait(NULL) > 0 || errno == EINTR)
+		;
+	close(listen_fd);
+	g_unlink(opt_socket);
+	g_free(pids);
+
+	return ret;
+}
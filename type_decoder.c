@@ -22,9 +22,10 @@
 #include "libsigrokdecode.h"
 #include <inttypes.h>
 
-/** @cond PRIVATE */
-extern SRD_PRIV GSList *sessions;
-/** @endcond */
+/* Not part of the limited API headers before Python 3.11. */
+#ifndef PyBUF_READ
+#define PyBUF_READ 0x100
+#endif
 
 typedef struct {
         PyObject_HEAD
@@ -44,39 +45,33 @@ SRD_PRIV const char *output_type_name(unsigned int idx)
 	return names[MIN(idx, G_N_ELEMENTS(names) - 1)];
 }
 
-static void release_annotation(struct srd_proto_data_annotation *pda)
-{
-	if (!pda)
-		return;
-	if (pda->ann_text)
-		g_strfreev(pda->ann_text);
-}
-
-static int convert_annotation(struct srd_decoder_inst *di, PyObject *obj,
-		struct srd_proto_data *pdata)
+/*
+ * Check an annotation's [annotation class, [string, ...]] list, and get
+ * its class and (borrowed) list of strings. Instead of the strings, the
+ * second element can be a tuple of raw values, see get_ann_values().
+ * An optional third element is the annotation's payload, see
+ * convert_ann_payload(). The caller must hold the GIL.
+ */
+static int parse_annotation(struct srd_decoder_inst *di, PyObject *obj,
+		int *out_class, PyObject **out_texts, PyObject **out_payload)
 {
 	PyObject *py_tmp;
 	struct srd_pd_output *pdo;
-	struct srd_proto_data_annotation *pda;
 	int ann_class;
-	char **ann_text;
-	PyGILState_STATE gstate;
-
-	gstate = PyGILState_Ensure();
 
-	/* Should be a list of [annotation class, [string, ...]]. */
+	/* Should be a list of [annotation class, [string, ...] or (value, ...)]. */
 	if (!PyList_Check(obj)) {
 		srd_err("Protocol decoder %s submitted an annotation that"
 			" is not a list", di->decoder->name);
-		goto err;
+		return SRD_ERR_PYTHON;
 	}
 
-	/* Should have 2 elements. */
-	if (PyList_Size(obj) != 2) {
+	/* Should have 2 elements, plus an optional payload. */
+	if (PyList_Size(obj) != 2 && PyList_Size(obj) != 3) {
 		srd_err("Protocol decoder %s submitted annotation list with "
-			"%zd elements instead of 2", di->decoder->name,
+			"%zd elements instead of 2 or 3", di->decoder->name,
 			PyList_Size(obj));
-		goto err;
+		return SRD_ERR_PYTHON;
 	}
 
 	/*
@@ -87,47 +82,383 @@ static int convert_annotation(struct srd_decoder_inst *di, PyObject *obj,
 	if (!PyLong_Check(py_tmp)) {
 		srd_err("Protocol decoder %s submitted annotation list, but "
 			"first element was not an integer.", di->decoder->name);
-		goto err;
+		return SRD_ERR_PYTHON;
 	}
 	ann_class = PyLong_AsLong(py_tmp);
 	if (!(pdo = g_slist_nth_data(di->decoder->annotations, ann_class))) {
 		srd_err("Protocol decoder %s submitted data to unregistered "
 			"annotation class %d.", di->decoder->name, ann_class);
-		goto err;
+		return SRD_ERR_PYTHON;
 	}
 
-	/* Second element must be a list. */
+	/* Second element must be a list, or a tuple for raw values. */
 	py_tmp = PyList_GetItem(obj, 1);
-	if (!PyList_Check(py_tmp)) {
+	if (!PyList_Check(py_tmp) && !PyTuple_Check(py_tmp)) {
 		srd_err("Protocol decoder %s submitted annotation list, but "
 			"second element was not a list.", di->decoder->name);
-		goto err;
+		return SRD_ERR_PYTHON;
 	}
-	if (py_strseq_to_char(py_tmp, &ann_text) != SRD_OK) {
-		srd_err("Protocol decoder %s submitted annotation list, but "
-			"second element was malformed.", di->decoder->name);
-		goto err;
+
+	*out_class = ann_class;
+	*out_texts = py_tmp;
+	*out_payload = (PyList_Size(obj) == 3) ? PyList_GetItem(obj, 2) : NULL;
+
+	return SRD_OK;
+}
+
+/*
+ * Convert an annotation's payload to a GVariant. Supported are booleans,
+ * integers, floats, strings, bytes and bytearrays, lists of integers (as
+ * arrays of int64), and tuples of any of these. Returns a floating
+ * reference, or NULL upon errors, in which case the annotation goes
+ * out without a payload. The caller must hold the GIL.
+ */
+static GVariant *convert_ann_payload(struct srd_decoder_inst *di,
+		PyObject *obj)
+{
+	PyObject *py_item;
+	GVariant *var, **items;
+	int64_t *ints;
+	Py_ssize_t i, num_items;
+	char *buf;
+
+	if (PyBool_Check(obj))
+		return g_variant_new_boolean(obj == Py_True);
+
+	if (PyLong_Check(obj) || PyFloat_Check(obj) || PyUnicode_Check(obj))
+		return py_obj_to_variant(obj);
+
+	if (PyBytes_Check(obj)) {
+		if (PyBytes_AsStringAndSize(obj, &buf, &num_items) < 0) {
+			srd_exception_catch("Protocol decoder %s annotation "
+				"payload", di->decoder->name);
+			return NULL;
+		}
+		return g_variant_new_fixed_array(G_VARIANT_TYPE_BYTE,
+			buf, num_items, 1);
 	}
 
-	pda = pdata->data;
-	pda->ann_class = ann_class;
-	pda->ann_text = ann_text;
+	if (PyByteArray_Check(obj)) {
+		return g_variant_new_fixed_array(G_VARIANT_TYPE_BYTE,
+			PyByteArray_AsString(obj), PyByteArray_Size(obj), 1);
+	}
 
-	PyGILState_Release(gstate);
+	if (PyList_Check(obj)) {
+		num_items = PyList_Size(obj);
+		ints = g_new(int64_t, num_items);
+		for (i = 0; i < num_items; i++) {
+			py_item = PyList_GetItem(obj, i);
+			if (!PyLong_Check(py_item)) {
+				srd_err("Protocol decoder %s submitted an "
+					"annotation payload list with "
+					"non-integer items.", di->decoder->name);
+				g_free(ints);
+				return NULL;
+			}
+			ints[i] = PyLong_AsLongLong(py_item);
+			if (PyErr_Occurred()) {
+				srd_exception_catch("Protocol decoder %s "
+					"annotation payload", di->decoder->name);
+				g_free(ints);
+				return NULL;
+			}
+		}
+		var = g_variant_new_fixed_array(G_VARIANT_TYPE_INT64,
+			ints, num_items, sizeof(int64_t));
+		g_free(ints);
+		return var;
+	}
+
+	if (PyTuple_Check(obj)) {
+		num_items = PyTuple_Size(obj);
+		items = g_new(GVariant *, num_items);
+		for (i = 0; i < num_items; i++) {
+			items[i] = convert_ann_payload(di,
+				PyTuple_GetItem(obj, i));
+			if (!items[i]) {
+				while (i--)
+					g_variant_unref(items[i]);
+				g_free(items);
+				return NULL;
+			}
+		}
+		var = g_variant_new_tuple(items, num_items);
+		g_free(items);
+		return var;
+	}
+
+	srd_err("Protocol decoder %s submitted an annotation payload of "
+		"unsupported type.", di->decoder->name);
+
+	return NULL;
+}
+
+/*
+ * Get the raw values of an annotation, which get formatted using the
+ * annotation class' templates, see srd_proto_data_annotation_text().
+ * Values from 2^63 to 2^64 - 1 (e.g. 64 bit data words) are kept as
+ * their 64 bit pattern, which the unsigned conversions format as is.
+ * The caller must hold the GIL.
+ */
+static int get_ann_values(struct srd_decoder_inst *di, PyObject *py_values,
+		struct srd_proto_data_annotation *pda)
+{
+	PyObject *py_item;
+	Py_ssize_t i, num_values;
+
+	if (!g_slist_nth_data(di->decoder->ann_formats, pda->ann_class)) {
+		srd_err("Protocol decoder %s submitted values to annotation "
+			"class %d, which has no templates.", di->decoder->name,
+			pda->ann_class);
+		return SRD_ERR_PYTHON;
+	}
+
+	num_values = PyTuple_Size(py_values);
+	if (num_values > SRD_ANN_MAX_VALUES) {
+		srd_err("Protocol decoder %s submitted %zd annotation values, "
+			"max. %d are supported.", di->decoder->name, num_values,
+			SRD_ANN_MAX_VALUES);
+		return SRD_ERR_PYTHON;
+	}
+
+	for (i = 0; i < num_values; i++) {
+		py_item = PyTuple_GetItem(py_values, i);
+		if (!PyLong_Check(py_item)) {
+			srd_err("Protocol decoder %s submitted an annotation "
+				"value which is not an integer.",
+				di->decoder->name);
+			return SRD_ERR_PYTHON;
+		}
+		pda->values[i] = PyLong_AsLongLong(py_item);
+		if (PyErr_Occurred() &&
+				PyErr_ExceptionMatches(PyExc_OverflowError)) {
+			PyErr_Clear();
+			pda->values[i] = (int64_t)PyLong_AsUnsignedLongLong(py_item);
+		}
+		if (PyErr_Occurred()) {
+			srd_exception_catch("Protocol decoder %s annotation "
+				"value", di->decoder->name);
+			return SRD_ERR_PYTHON;
+		}
+	}
+	pda->num_values = num_values;
 
 	return SRD_OK;
+}
 
-err:
-	PyGILState_Release(gstate);
+/*
+ * Get the interned copy of an annotation's texts, see
+ * srd_session_ann_text_get(). The texts are either taken from the list of
+ * strings, or (if py_texts is NULL) formatted from the annotation's raw
+ * values. When the session interned SRD_ANN_TEXTS_MAX texts already, new
+ * texts are not interned: The annotation gets a copy of its texts, and
+ * its ann_text_id is SRD_ANN_TEXT_ID_NONE. The caller must g_strfreev()
+ * the copy. The caller must hold the GIL.
+ */
+static int intern_ann_text(struct srd_decoder_inst *di, PyObject *py_texts,
+		struct srd_proto_data_annotation *pda)
+{
+	PyObject *py_item, *py_bytes;
+	struct srd_session *sess;
+	GString *key;
+	GBytes *key_bytes;
+	Py_ssize_t i, num_texts;
+	gpointer id;
+	char **ann_text, **formats;
+	const char *text;
+
+	sess = di->sess;
+	key = sess->ann_text_key;
+	g_string_truncate(key, 0);
+
+	/* The key holds all texts, each NUL terminated. */
+	num_texts = 0;
+	if (!py_texts) {
+		formats = g_slist_nth_data(di->decoder->ann_formats,
+			pda->ann_class);
+		for (; formats[num_texts]; num_texts++) {
+			srd_ann_text_format(key, formats[num_texts],
+				pda->values, pda->num_values);
+			g_string_append_c(key, '\0');
+		}
+	} else {
+		num_texts = PyList_Size(py_texts);
+	}
+	for (i = 0; py_texts && i < num_texts; i++) {
+		py_item = PyList_GetItem(py_texts, i);
+		if (!PyUnicode_Check(py_item))
+			return SRD_ERR_PYTHON;
+		if (!(py_bytes = PyUnicode_AsUTF8String(py_item))) {
+			srd_exception_catch("Protocol decoder %s annotation "
+				"text", di->decoder->name);
+			return SRD_ERR_PYTHON;
+		}
+		text = PyBytes_AsString(py_bytes);
+		g_string_append_len(key, text, strlen(text) + 1);
+		Py_DECREF(py_bytes);
+	}
 
-	return SRD_ERR_PYTHON;
+	g_mutex_lock(&sess->ann_text_mutex);
+
+	key_bytes = g_bytes_new_static(key->str, key->len);
+	id = g_hash_table_lookup(sess->ann_text_ids, key_bytes);
+	g_bytes_unref(key_bytes);
+
+	if (!id) {
+		ann_text = g_new(char *, num_texts + 1);
+		for (i = 0, text = key->str; i < num_texts; i++) {
+			ann_text[i] = g_strdup(text);
+			text += strlen(text) + 1;
+		}
+		ann_text[num_texts] = NULL;
+		if (sess->ann_texts->len >= SRD_ANN_TEXTS_MAX) {
+			g_mutex_unlock(&sess->ann_text_mutex);
+			pda->ann_text_id = SRD_ANN_TEXT_ID_NONE;
+			pda->ann_text = ann_text;
+			return SRD_OK;
+		}
+		g_ptr_array_add(sess->ann_texts, ann_text);
+		id = GUINT_TO_POINTER(sess->ann_texts->len);
+		g_hash_table_insert(sess->ann_text_ids,
+			g_bytes_new(key->str, key->len), id);
+	}
+
+	pda->ann_text_id = GPOINTER_TO_UINT(id) - 1;
+	pda->ann_text = g_ptr_array_index(sess->ann_texts, pda->ann_text_id);
+
+	g_mutex_unlock(&sess->ann_text_mutex);
+
+	return SRD_OK;
 }
 
-static void release_binary(struct srd_proto_data_binary *pdb)
+/*
+ * Pass output to all callbacks of its type which want it. The caller
+ * must hold the GIL, which gets released during the callbacks unless
+ * the output is a Python object. Callbacks run under the session's
+ * callback mutex, since stacks may put output concurrently.
+ */
+static void send_to_callbacks(struct srd_decoder_inst *di,
+		struct srd_proto_data *pdata, int output_class)
 {
-	if (!pdb)
+	GSList *l;
+	struct srd_pd_callback *cb;
+	int output_type;
+
+	output_type = pdata->pdo->output_type;
+	for (l = di->sess->callbacks[output_type]; l; l = l->next) {
+		cb = l->data;
+		if (!cb->cb || !srd_pd_output_callback_wants(cb, di, output_class))
+			continue;
+		if (output_type == SRD_OUTPUT_PYTHON) {
+			cb->cb(pdata, cb->cb_data);
+			continue;
+		}
+		Py_BEGIN_ALLOW_THREADS
+		g_mutex_lock(&di->sess->callback_mutex);
+		cb->cb(pdata, cb->cb_data);
+		g_mutex_unlock(&di->sess->callback_mutex);
+		Py_END_ALLOW_THREADS
+	}
+}
+
+/*
+ * Check whether output of the type and class is wanted, by the instance's
+ * output filter and by any callback, or the annotation store.
+ */
+static gboolean output_wanted(struct srd_decoder_inst *di, int output_type,
+		int output_class)
+{
+	GSList *l;
+
+	if (!srd_inst_output_filter_wants(di, output_type, output_class))
+		return FALSE;
+
+	if (output_type == SRD_OUTPUT_ANN && di->sess->ann_store)
+		return TRUE;
+
+	for (l = di->sess->callbacks[output_type]; l; l = l->next) {
+		if (srd_pd_output_callback_wants(l->data, di, output_class))
+			return TRUE;
+	}
+
+	return FALSE;
+}
+
+static struct srd_ann_batch *ann_batch_new(void)
+{
+	struct srd_ann_batch *batch;
+
+	batch = g_malloc(sizeof(struct srd_ann_batch));
+	batch->pdata = g_array_new(FALSE, FALSE, sizeof(struct srd_proto_data));
+	batch->pda = g_array_new(FALSE, FALSE,
+		sizeof(struct srd_proto_data_annotation));
+
+	return batch;
+}
+
+/* Deliver an instance's batched annotations. The caller must hold the GIL. */
+static void ann_batch_deliver(struct srd_decoder_inst *di,
+		const struct srd_pd_callback *cb)
+{
+	struct srd_ann_batch *batch;
+	struct srd_proto_data *pdata;
+	struct srd_proto_data_annotation *pda;
+	guint i;
+
+	batch = di->ann_batch;
+	if (!batch || !batch->pdata->len)
 		return;
-	g_free((void *)pdb->data);
+
+	pdata = (struct srd_proto_data *)batch->pdata->data;
+	pda = (struct srd_proto_data_annotation *)batch->pda->data;
+	for (i = 0; i < batch->pdata->len; i++)
+		pdata[i].data = &pda[i];
+
+	Py_BEGIN_ALLOW_THREADS
+	g_mutex_lock(&di->sess->callback_mutex);
+	cb->batch_cb(pdata, batch->pdata->len, cb->cb_data);
+	g_mutex_unlock(&di->sess->callback_mutex);
+	Py_END_ALLOW_THREADS
+
+	for (i = 0; i < batch->pda->len; i++) {
+		if (pda[i].payload)
+			g_variant_unref(pda[i].payload);
+		if (pda[i].ann_text_id == SRD_ANN_TEXT_ID_NONE)
+			g_strfreev(pda[i].ann_text);
+	}
+	g_array_set_size(batch->pdata, 0);
+	g_array_set_size(batch->pda, 0);
+}
+
+/*
+ * Add an annotation to the instance's batch, and deliver the batch when
+ * it is full. The caller must hold the GIL.
+ */
+static void batch_annotation(struct srd_decoder_inst *di,
+		const struct srd_pd_callback *cb,
+		const struct srd_proto_data *pdata)
+{
+	struct srd_ann_batch *batch;
+	struct srd_proto_data_annotation pda;
+
+	if (!di->ann_batch)
+		di->ann_batch = ann_batch_new();
+	batch = di->ann_batch;
+
+	/*
+	 * The batch keeps its own reference to the payload, and its own
+	 * copy of texts which are not interned.
+	 */
+	pda = *(const struct srd_proto_data_annotation *)pdata->data;
+	if (pda.payload)
+		g_variant_ref(pda.payload);
+	if (pda.ann_text_id == SRD_ANN_TEXT_ID_NONE)
+		pda.ann_text = g_strdupv(pda.ann_text);
+	g_array_append_vals(batch->pda, &pda, 1);
+	g_array_append_vals(batch->pdata, pdata, 1);
+
+	if (batch->pdata->len >= cb->batch_size)
+		ann_batch_deliver(di, cb);
 }
 
 static int convert_binary(struct srd_decoder_inst *di, PyObject *obj,
@@ -171,32 +502,36 @@ static int convert_binary(struct srd_decoder_inst *di, PyObject *obj,
 		goto err;
 	}
 
-	/* Second element should be bytes. */
+	/*
+	 * Second element should be bytes or bytearray. The data is not
+	 * copied, the list keeps the object alive during the callback.
+	 */
 	py_tmp = PyList_GetItem(obj, 1);
-	if (!PyBytes_Check(py_tmp)) {
+	if (PyBytes_Check(py_tmp)) {
+		if (PyBytes_AsStringAndSize(py_tmp, &buf, &size) == -1)
+			goto err;
+	} else if (PyByteArray_Check(py_tmp)) {
+		buf = PyByteArray_AsString(py_tmp);
+		size = PyByteArray_Size(py_tmp);
+	} else {
 		srd_err("Protocol decoder %s submitted SRD_OUTPUT_BINARY list, "
 			"but second element was not bytes.", di->decoder->name);
 		goto err;
 	}
 
 	/* Consider an empty set of bytes a bug. */
-	if (PyBytes_Size(py_tmp) == 0) {
+	if (size == 0) {
 		srd_err("Protocol decoder %s submitted SRD_OUTPUT_BINARY "
 				"with empty data set.", di->decoder->name);
 		goto err;
 	}
 
-	if (PyBytes_AsStringAndSize(py_tmp, &buf, &size) == -1)
-		goto err;
-
 	PyGILState_Release(gstate);
 
 	pdb = pdata->data;
 	pdb->bin_class = bin_class;
 	pdb->size = size;
-	if (!(pdb->data = g_try_malloc(pdb->size)))
-		return SRD_ERR_MALLOC;
-	memcpy((void *)pdb->data, (const void *)buf, pdb->size);
+	pdb->data = (const unsigned char *)buf;
 
 	return SRD_OK;
 
@@ -206,63 +541,167 @@ err:
 	return SRD_ERR_PYTHON;
 }
 
-static inline struct srd_decoder_inst *srd_sess_inst_find_by_obj(
-	struct srd_session *sess, const GSList *stack, const PyObject *obj)
+/* Deliver an instance's coalesced binary output. The caller must hold the GIL. */
+static void bin_coalesce_deliver(struct srd_decoder_inst *di)
 {
-	const GSList *l;
-	struct srd_decoder_inst *tmp, *di;
+	struct srd_bin_coalesce *co;
 
-	if (!sess)
-		return NULL;
+	co = di->bin_coalesce;
+	if (!co || !co->data->len)
+		return;
+
+	co->pdb.size = co->data->len;
+	co->pdb.data = co->data->data;
+	co->pdata.data = &co->pdb;
+	send_to_callbacks(di, &co->pdata, co->pdb.bin_class);
+
+	g_byte_array_set_size(co->data, 0);
+}
+
+/*
+ * Append binary output to the instance's coalescing buffer. Output of
+ * another output or binary class, or a full buffer, get the previous
+ * data delivered. The caller must hold the GIL.
+ */
+static void coalesce_binary(struct srd_decoder_inst *di,
+		const struct srd_proto_data *pdata)
+{
+	struct srd_bin_coalesce *co;
+	const struct srd_proto_data_binary *pdb;
+
+	co = di->bin_coalesce;
+	pdb = pdata->data;
 
-	di = NULL;
-	for (l = stack ? stack : sess->di_list; di == NULL && l != NULL; l = l->next) {
-		tmp = l->data;
-		if (tmp->py_inst == obj)
-			di = tmp;
-		else if (tmp->next_di)
-			di = srd_sess_inst_find_by_obj(sess, tmp->next_di, obj);
+	if (co->data->len && (co->pdata.pdo != pdata->pdo ||
+			co->pdb.bin_class != pdb->bin_class))
+		bin_coalesce_deliver(di);
+
+	if (!co->data->len) {
+		co->pdata = *pdata;
+		co->pdb.bin_class = pdb->bin_class;
 	}
+	co->pdata.end_sample = pdata->end_sample;
+	g_byte_array_append(co->data, pdb->data, pdb->size);
 
-	return di;
+	if (co->data->len >= co->max_size)
+		bin_coalesce_deliver(di);
+}
+
+/*
+ * Pass the queued output of the instance below to decode_items(). The
+ * caller must hold the GIL.
+ */
+static void items_deliver(struct srd_decoder_inst *di)
+{
+	PyObject *py_items, *py_res;
+
+	if (!di->py_items || !PyList_Size(di->py_items))
+		return;
+
+	/* Output of decode_items() must not go to the list being passed. */
+	py_items = di->py_items;
+	if (!(di->py_items = PyList_New(0))) {
+		di->py_items = py_items;
+		srd_exception_catch("Protocol decoder instance %s", di->inst_id);
+		return;
+	}
+
+	py_res = PyObject_CallFunctionObjArgs(di->py_decode_items, py_items, NULL);
+	if (!py_res)
+		srd_exception_catch("Calling %s decode_items() failed",
+				di->inst_id);
+	Py_XDECREF(py_res);
+	Py_DECREF(py_items);
+}
+
+/*
+ * Check for batched, coalesced or queued output in an instance's stack.
+ * The caller must hold the GIL.
+ */
+static gboolean output_pending(const struct srd_decoder_inst *di)
+{
+	GSList *l;
+
+	if (di->py_items && PyList_Size(di->py_items))
+		return TRUE;
+	if (di->ann_batch && di->ann_batch->pdata->len)
+		return TRUE;
+	if (di->bin_coalesce && di->bin_coalesce->data->len)
+		return TRUE;
+	for (l = di->next_di; l; l = l->next) {
+		if (output_pending(l->data))
+			return TRUE;
+	}
+
+	return FALSE;
 }
 
 /**
- * Find a decoder instance by its Python object.
- *
- * I.e. find that instance's instantiation of the sigrokdecode.Decoder class.
- * This will recurse to find the instance anywhere in the stack tree of all
- * sessions.
- *
- * @param stack Pointer to a GSList of struct srd_decoder_inst, indicating the
- *              stack to search. To start searching at the bottom level of
- *              decoder instances, pass NULL.
- * @param obj The Python class instantiation.
+ * Deliver the batched annotations and coalesced binary output of an
+ * instance and the instances stacked on top of it, and the queued
+ * Python output to the stacked instances. The caller must hold the GIL.
  *
- * @return Pointer to struct srd_decoder_inst, or NULL if not found.
- *
- * @since 0.1.0
+ * @private
  */
-static inline struct srd_decoder_inst *srd_inst_find_by_obj(
-		const GSList *stack, const PyObject *obj)
+SRD_PRIV void srd_inst_output_flush(struct srd_decoder_inst *di)
 {
-	struct srd_decoder_inst *di;
-	struct srd_session *sess;
+	struct srd_pd_callback *cb;
+	struct srd_decoder_inst *next_di;
 	GSList *l;
 
-	/* Performance shortcut: Handle the most common case first. */
-	sess = sessions->data;
-	di = sess->di_list->data;
-	if (di->py_inst == obj)
-		return di;
+	if (!di)
+		return;
+
+	if ((cb = srd_pd_output_batch_callback_find(di->sess)))
+		ann_batch_deliver(di, cb);
+	bin_coalesce_deliver(di);
 
-	di = NULL;
-	for (l = sessions; di == NULL && l != NULL; l = l->next) {
-		sess = l->data;
-		di = srd_sess_inst_find_by_obj(sess, stack, obj);
+	for (l = di->next_di; l; l = l->next) {
+		next_di = l->data;
+		items_deliver(next_di);
+		srd_inst_output_flush(next_di);
 	}
+}
+
+/**
+ * Drop the batched annotations, coalesced binary output and queued
+ * Python output of an instance.
+ *
+ * @private
+ */
+SRD_PRIV void srd_inst_output_discard(struct srd_decoder_inst *di)
+{
+	struct srd_ann_batch *batch;
+	struct srd_proto_data_annotation *pda;
+	PyGILState_STATE gstate;
+	guint i;
+
+	if (!di)
+		return;
+
+	if (di->py_items) {
+		gstate = PyGILState_Ensure();
+		PyList_SetSlice(di->py_items, 0, PY_SSIZE_T_MAX, NULL);
+		PyGILState_Release(gstate);
+	}
+
+	if (di->bin_coalesce)
+		g_byte_array_set_size(di->bin_coalesce->data, 0);
 
-	return di;
+	if (!(batch = di->ann_batch))
+		return;
+
+	pda = (struct srd_proto_data_annotation *)batch->pda->data;
+	for (i = 0; i < batch->pda->len; i++) {
+		if (pda[i].payload)
+			g_variant_unref(pda[i].payload);
+		if (pda[i].ann_text_id == SRD_ANN_TEXT_ID_NONE)
+			g_strfreev(pda[i].ann_text);
+	}
+	g_array_free(batch->pdata, TRUE);
+	g_array_free(batch->pda, TRUE);
+	g_free(batch);
+	di->ann_batch = NULL;
 }
 
 static int convert_meta(struct srd_proto_data *pdata, PyObject *obj)
@@ -315,7 +754,7 @@ static void release_meta(GVariant *gvar)
 static PyObject *Decoder_put(PyObject *self, PyObject *args)
 {
 	GSList *l;
-	PyObject *py_data, *py_res;
+	PyObject *py_data, *py_res, *py_args, *py_texts, *py_payload;
 	struct srd_decoder_inst *di, *next_di;
 	struct srd_pd_output *pdo;
 	struct srd_proto_data pdata;
@@ -324,13 +763,14 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 	uint64_t start_sample, end_sample;
 	int output_id;
 	struct srd_pd_callback *cb;
+	gboolean wanted;
 	PyGILState_STATE gstate;
 
 	py_data = NULL;
 
 	gstate = PyGILState_Ensure();
 
-	if (!(di = srd_inst_find_by_obj(NULL, self))) {
+	if (!(di = srd_inst_find_by_obj(self))) {
 		/* Shouldn't happen. */
 		srd_dbg("put(): self instance not found.");
 		goto err;
@@ -366,23 +806,72 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 	pdata.pdo = pdo;
 	pdata.data = NULL;
 
+	/* Output outside of the session's shard does not go to the frontend. */
+	wanted = srd_session_output_wanted(di->sess, start_sample);
+
 	switch (pdo->output_type) {
 	case SRD_OUTPUT_ANN:
-		/* Annotations are only fed to callbacks. */
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
-			pdata.data = &pda;
-			/* Convert from PyDict to srd_proto_data_annotation. */
-			if (convert_annotation(di, py_data, &pdata) != SRD_OK) {
-				/* An error was already logged. */
+		/*
+		 * Annotations are only fed to callbacks and the annotation
+		 * store. Check whether any of them wants the annotation,
+		 * before converting its texts.
+		 */
+		if (!wanted || (!di->sess->callbacks[SRD_OUTPUT_ANN] &&
+				!di->sess->ann_store))
+			break;
+		if (parse_annotation(di, py_data, &pda.ann_class, &py_texts,
+				&py_payload) != SRD_OK)
+			break;
+		if (!output_wanted(di, SRD_OUTPUT_ANN, pda.ann_class))
+			break;
+		pda.num_values = 0;
+		if (PyTuple_Check(py_texts)) {
+			/* Raw values, only formatted on demand if lazy. */
+			if (get_ann_values(di, py_texts, &pda) != SRD_OK)
 				break;
+			py_texts = NULL;
+			if (di->sess->lazy_ann_text) {
+				pda.ann_text = NULL;
+				pda.ann_text_id = SRD_ANN_TEXT_ID_NONE;
 			}
-			Py_BEGIN_ALLOW_THREADS
-			cb->cb(&pdata, cb->cb_data);
-			Py_END_ALLOW_THREADS
-			release_annotation(pdata.data);
 		}
+		if ((py_texts || !di->sess->lazy_ann_text) &&
+				intern_ann_text(di, py_texts, &pda) != SRD_OK) {
+			srd_err("Protocol decoder %s submitted annotation list, but "
+				"second element was malformed.", di->decoder->name);
+			break;
+		}
+		/* The annotation is still delivered without a bad payload. */
+		pda.payload = NULL;
+		if (py_payload) {
+			if ((pda.payload = convert_ann_payload(di, py_payload)))
+				g_variant_ref_sink(pda.payload);
+			else
+				srd_warn("Protocol decoder %s: dropping payload of "
+					"annotation class %d.", di->decoder->name,
+					pda.ann_class);
+		}
+		pdata.data = &pda;
+		if (di->sess->ann_store)
+			srd_ann_store_add(di, &pdata);
+		if ((cb = srd_pd_output_batch_callback_find(di->sess)) &&
+				srd_pd_output_callback_wants(cb, di, pda.ann_class))
+			batch_annotation(di, cb, &pdata);
+		send_to_callbacks(di, &pdata, pda.ann_class);
+		if (pda.payload)
+			g_variant_unref(pda.payload);
+		if (pda.ann_text_id == SRD_ANN_TEXT_ID_NONE)
+			g_strfreev(pda.ann_text);
 		break;
 	case SRD_OUTPUT_PYTHON:
+		/* The same (ss, es, data) tuple goes to all stacked instances. */
+		py_args = NULL;
+		if (di->next_di && !(py_args = Py_BuildValue("(KKO)",
+				start_sample, end_sample, py_data))) {
+			srd_exception_catch("Protocol decoder instance %s",
+					di->inst_id);
+			break;
+		}
 		for (l = di->next_di; l; l = l->next) {
 			next_di = l->data;
 			srd_spew("Instance %s put %" PRIu64 "-%" PRIu64 " %s "
@@ -390,47 +879,55 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 				 start_sample,
 				 end_sample, output_type_name(pdo->output_type),
 				 output_id, pdo->proto_id, next_di->inst_id);
-			if (!(py_res = PyObject_CallMethod(
-				next_di->py_inst, "decode", "KKO", start_sample,
-				end_sample, py_data))) {
+			if (next_di->py_items) {
+				/* Delivered by srd_inst_output_flush(). */
+				if (PyList_Append(next_di->py_items, py_args) < 0)
+					srd_exception_catch("Queueing output for %s "
+						"failed", next_di->inst_id);
+				continue;
+			}
+			if (!(py_res = PyObject_CallObject(next_di->py_decode,
+					py_args))) {
 				srd_exception_catch("Calling %s decode() failed",
 							next_di->inst_id);
 			}
 			Py_XDECREF(py_res);
 		}
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		Py_XDECREF(py_args);
+		if (wanted) {
 			/*
 			 * Frontends aren't really supposed to get Python
 			 * callbacks, but it's useful for testing.
 			 */
 			pdata.data = py_data;
-			cb->cb(&pdata, cb->cb_data);
+			send_to_callbacks(di, &pdata, -1);
 		}
 		break;
 	case SRD_OUTPUT_BINARY:
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		if (wanted && di->sess->callbacks[SRD_OUTPUT_BINARY]) {
 			pdata.data = &pdb;
 			/* Convert from PyDict to srd_proto_data_binary. */
 			if (convert_binary(di, py_data, &pdata) != SRD_OK) {
 				/* An error was already logged. */
 				break;
 			}
-			Py_BEGIN_ALLOW_THREADS
-			cb->cb(&pdata, cb->cb_data);
-			Py_END_ALLOW_THREADS
-			release_binary(pdata.data);
+			if (!output_wanted(di, SRD_OUTPUT_BINARY, pdb.bin_class))
+				break;
+			if (di->bin_coalesce) {
+				coalesce_binary(di, &pdata);
+				break;
+			}
+			send_to_callbacks(di, &pdata, pdb.bin_class);
 		}
 		break;
 	case SRD_OUTPUT_META:
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		if (wanted && output_wanted(di, SRD_OUTPUT_META, -1)) {
 			/* Annotations need converting from PyObject. */
 			if (convert_meta(&pdata, py_data) != SRD_OK) {
 				/* An exception was already set up. */
 				break;
 			}
-			Py_BEGIN_ALLOW_THREADS
-			cb->cb(&pdata, cb->cb_data);
-			Py_END_ALLOW_THREADS
+			send_to_callbacks(di, &pdata, -1);
 			release_meta(pdata.data);
 		}
 		break;
@@ -472,7 +969,7 @@ static PyObject *Decoder_register(PyObject *self, PyObject *args,
 	meta_type_gv = NULL;
 	meta_name = meta_descr = NULL;
 
-	if (!(di = srd_inst_find_by_obj(NULL, self))) {
+	if (!(di = srd_inst_find_by_obj(self))) {
 		PyErr_SetString(PyExc_Exception, "decoder instance not found");
 		goto err;
 	}
@@ -583,7 +1080,7 @@ static int get_term_type(const char *v)
  * @return A newly allocated PyTuple containing the pin values at the
  *         current sample number.
  */
-static PyObject *get_current_pinvalues(const struct srd_decoder_inst *di)
+static PyObject *get_current_pinvalues(struct srd_decoder_inst *di)
 {
 	int i;
 	uint8_t sample;
@@ -607,7 +1104,7 @@ static PyObject *get_current_pinvalues(const struct srd_decoder_inst *di)
 			/* Value of unused channel is 0xff, instead of 0 or 1. */
 			PyTuple_SetItem(py_pinvalues, i, PyLong_FromUnsignedLong(0xff));
 		} else {
-			sample_pos = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * di->data_unitsize);
+			sample_pos = srd_inst_sample_pos(di, di->abs_cur_samplenum);
 			byte_offset = di->dec_channelmap[i] / 8;
 			bit_offset = di->dec_channelmap[i] % 8;
 			sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
@@ -620,52 +1117,85 @@ static PyObject *get_current_pinvalues(const struct srd_decoder_inst *di)
 	return py_pinvalues;
 }
 
+/*
+ * Get the term type of a dict value in a .wait() condition. Try the
+ * cheap identity check against the interned type strings first (string
+ * literals in decoders' source code are interned as well). Unknown types
+ * never match. Returns -1 if the value is not a string.
+ */
+static int py_term_type(const struct srd_module_state *state,
+		PyObject *py_value)
+{
+	unsigned int i;
+	char *term_str;
+	int type;
+
+	for (i = 0; state && i < G_N_ELEMENTS(state->term_type_strs); i++) {
+		if (py_value == state->term_type_strs[i])
+			return SRD_TERM_HIGH + i;
+	}
+
+	if (py_str_as_str(py_value, &term_str) != SRD_OK)
+		return -1;
+	type = get_term_type(term_str);
+	g_free(term_str);
+
+	return (type < 0) ? SRD_TERM_ALWAYS_FALSE : type;
+}
+
 /**
- * Create a list of terms in the specified condition.
+ * Append the terms of the specified condition to the condition list key.
  *
- * If there are no terms in the condition, 'term_list' will be NULL.
+ * The number of terms gets appended first, then the terms, encoded by
+ * SRD_COND_KEY(). For every term the number of samples to skip (zero
+ * for non-skip terms) gets appended to di->condition_skips.
  *
  * @param di The decoder instance to use. Must not be NULL.
  * @param py_dict A Python dict containing terms. Must not be NULL.
- * @param term_list Pointer to a GSList which will be set to the newly
- *                  created list of terms. Must not be NULL.
  *
  * @return SRD_OK upon success, a negative error code otherwise.
  */
-static int create_term_list(struct srd_decoder_inst *di,
-	PyObject *py_dict, GSList **term_list)
+static int append_condition_key(struct srd_decoder_inst *di, PyObject *py_dict)
 {
 	Py_ssize_t pos = 0;
 	PyObject *py_key, *py_value;
-	struct srd_term *term;
 	int64_t num_samples_to_skip;
-	char *term_str;
+	uint64_t skip;
+	uint32_t term_key, num_terms;
+	long channel;
+	int type;
+	struct srd_module_state *state;
 	PyGILState_STATE gstate;
 
-	if (!py_dict || !term_list)
+	if (!py_dict)
 		return SRD_ERR_ARG;
 
-	/* "Create" an empty GSList of terms. */
-	*term_list = NULL;
-
 	gstate = PyGILState_Ensure();
 
+	state = srd_module_state_get();
+
+	num_terms = PyDict_Size(py_dict);
+	g_array_append_val(di->condition_key, num_terms);
+
 	/* Iterate over all items in the current dict. */
 	while (PyDict_Next(py_dict, &pos, &py_key, &py_value)) {
+		skip = 0;
 		/* Check whether the current key is a string or a number. */
 		if (PyLong_Check(py_key)) {
 			/* The key is a number. */
-			/* Get the value string. */
-			if ((py_pydictitem_as_str(py_dict, py_key, &term_str)) != SRD_OK) {
+			if ((type = py_term_type(state, py_value)) < 0) {
 				srd_err("Failed to get the value.");
 				goto err;
 			}
-			term = g_malloc(sizeof(struct srd_term));
-			term->type = get_term_type(term_str);
-			term->channel = PyLong_AsLong(py_key);
-			if (term->channel < 0 || term->channel >= di->dec_num_channels)
-				term->type = SRD_TERM_ALWAYS_FALSE;
-			g_free(term_str);
+			channel = PyLong_AsLong(py_key);
+			if (channel == -1 && PyErr_Occurred())
+				PyErr_Clear();
+			if (type == SRD_TERM_ALWAYS_FALSE || channel < 0 ||
+					channel >= di->dec_num_channels) {
+				type = SRD_TERM_ALWAYS_FALSE;
+				channel = 0;
+			}
+			term_key = SRD_COND_KEY(type, channel);
 		} else if (PyUnicode_Check(py_key)) {
 			/* The key is a string. */
 			/* TODO: Check if the key is "skip". */
@@ -673,19 +1203,19 @@ static int create_term_list(struct srd_decoder_inst *di,
 				srd_err("Failed to get number of samples to skip.");
 				goto err;
 			}
-			term = g_malloc(sizeof(struct srd_term));
-			term->type = SRD_TERM_SKIP;
-			term->num_samples_to_skip = num_samples_to_skip;
-			term->num_samples_already_skipped = 0;
-			if (num_samples_to_skip < 0)
-				term->type = SRD_TERM_ALWAYS_FALSE;
+			if (num_samples_to_skip < 0) {
+				term_key = SRD_COND_KEY(SRD_TERM_ALWAYS_FALSE, 0);
+			} else {
+				term_key = SRD_COND_KEY(SRD_TERM_SKIP, 0);
+				skip = num_samples_to_skip;
+			}
 		} else {
 			srd_err("Term key is neither a string nor a number.");
 			goto err;
 		}
 
-		/* Add the term to the list of terms. */
-		*term_list = g_slist_append(*term_list, term);
+		g_array_append_val(di->condition_key, term_key);
+		g_array_append_val(di->condition_skips, skip);
 	}
 
 	PyGILState_Release(gstate);
@@ -698,32 +1228,67 @@ err:
 	return SRD_ERR;
 }
 
+/*
+ * Look up the (compiled) condition list for the key in di->condition_key,
+ * and load the skip counts from di->condition_skips into its terms.
+ */
+static void use_condition_key(struct srd_decoder_inst *di)
+{
+	struct srd_condition_list *cl;
+	unsigned int i;
+
+	cl = condition_list_get(di, (const uint32_t *)di->condition_key->data,
+		di->condition_key->len);
+
+	for (i = 0; i < cl->num_terms; i++) {
+		if (cl->terms[i].type != SRD_TERM_SKIP)
+			continue;
+		cl->terms[i].num_samples_to_skip =
+			g_array_index(di->condition_skips, uint64_t, i);
+		cl->terms[i].num_samples_already_skipped = 0;
+	}
+
+	di->condition_list = cl;
+}
+
+/* Start a new condition list key in the instance's scratch buffers. */
+static void reset_condition_key(struct srd_decoder_inst *di, uint32_t num_conds)
+{
+	if (!di->condition_key)
+		di->condition_key = g_array_new(FALSE, FALSE, sizeof(uint32_t));
+	if (!di->condition_skips)
+		di->condition_skips = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+
+	g_array_set_size(di->condition_key, 0);
+	g_array_set_size(di->condition_skips, 0);
+	g_array_append_val(di->condition_key, num_conds);
+}
+
 /**
  * Replace the current condition list with the new one.
  *
  * @param self TODO. Must not be NULL.
- * @param args TODO. Must not be NULL.
+ * @param py_conds The conditions passed to .wait(). Must not be NULL.
  *
  * @retval SRD_OK The new condition list was set successfully.
  * @retval SRD_ERR There was an error setting the new condition list.
  *                 The contents of di->condition_list are undefined.
  * @retval 9999 TODO.
  */
-static int set_new_condition_list(PyObject *self, PyObject *args)
+static int set_new_condition_list(PyObject *self, PyObject *py_conds)
 {
 	struct srd_decoder_inst *di;
-	GSList *term_list;
-	PyObject *py_conditionlist, *py_conds, *py_dict;
+	PyObject *py_conditionlist, *py_dict;
 	int i, num_conditions, ret;
 	PyGILState_STATE gstate;
 
-	if (!self || !args)
+	if (!self || !py_conds)
 		return SRD_ERR_ARG;
 
 	gstate = PyGILState_Ensure();
 
 	/* Get the decoder instance. */
-	if (!(di = srd_inst_find_by_obj(NULL, self))) {
+	if (!(di = srd_inst_find_by_obj(self))) {
 		PyErr_SetString(PyExc_Exception, "decoder instance not found");
 		goto err;
 	}
@@ -738,17 +1303,10 @@ static int set_new_condition_list(PyObject *self, PyObject *args)
 	}
 
 	/*
-	 * Parse the argument of self.wait() into 'py_conds', and check
-	 * the data type. The argument is optional, None is assumed in
-	 * its absence. None or an empty dict or an empty list mean that
-	 * there is no condition, and the next available sample shall
-	 * get returned to the caller.
+	 * Check the data type of the argument of self.wait(). None or
+	 * an empty dict or an empty list mean that there is no condition,
+	 * and the next available sample shall get returned to the caller.
 	 */
-	py_conds = Py_None;
-	if (!PyArg_ParseTuple(args, "|O", &py_conds)) {
-		/* Let Python raise this exception. */
-		goto err;
-	}
 	if (py_conds == Py_None) {
 		/* 'py_conds' is None. */
 		goto ret_9999;
@@ -778,7 +1336,8 @@ static int set_new_condition_list(PyObject *self, PyObject *args)
 
 	ret = SRD_OK;
 
-	/* Iterate over the conditions, set di->condition_list accordingly. */
+	/* Iterate over the conditions, build the condition list's key. */
+	reset_condition_key(di, num_conditions);
 	for (i = 0; i < num_conditions; i++) {
 		/* Get a condition (dict) from the condition list. */
 		py_dict = PyList_GetItem(py_conditionlist, i);
@@ -788,14 +1347,15 @@ static int set_new_condition_list(PyObject *self, PyObject *args)
 			break;
 		}
 
-		/* Create the list of terms in this condition. */
-		if ((ret = create_term_list(di, py_dict, &term_list)) < 0)
+		/* Add the terms of this condition to the key. */
+		if ((ret = append_condition_key(di, py_dict)) < 0)
 			break;
-
-		/* Add the new condition to the PD instance's condition list. */
-		di->condition_list = g_slist_append(di->condition_list, term_list);
 	}
 
+	/* Set di->condition_list to the (cached) compiled conditions. */
+	if (ret == SRD_OK)
+		use_condition_key(di);
+
 	Py_DecRef(py_conditionlist);
 
 	PyGILState_Release(gstate);
@@ -824,7 +1384,7 @@ ret_9999:
  *                 The contents of di->condition_list are undefined.
  *
  * This routine is a reduced and specialized version of the @ref
- * set_new_condition_list() and @ref create_term_list() routines which
+ * set_new_condition_list() and @ref append_condition_key() routines which
  * gets invoked when .wait() was called without specifications for
  * conditions. This minor duplication of the SKIP term list creation
  * simplifies the logic and avoids the creation of expensive Python
@@ -834,45 +1394,35 @@ ret_9999:
  */
 static int set_skip_condition(struct srd_decoder_inst *di, uint64_t count)
 {
-	struct srd_term *term;
-	GSList *term_list;
+	uint32_t num_terms, term_key;
 
 	condition_list_free(di);
-	term = g_malloc(sizeof(*term));
-	term->type = SRD_TERM_SKIP;
-	term->num_samples_to_skip = count;
-	term->num_samples_already_skipped = 0;
-	term_list = g_slist_append(NULL, term);
-	di->condition_list = g_slist_append(di->condition_list, term_list);
+	reset_condition_key(di, 1);
+	num_terms = 1;
+	term_key = SRD_COND_KEY(SRD_TERM_SKIP, 0);
+	g_array_append_val(di->condition_key, num_terms);
+	g_array_append_val(di->condition_key, term_key);
+	g_array_append_val(di->condition_skips, count);
+	use_condition_key(di);
 
 	return SRD_OK;
 }
 
-static PyObject *Decoder_wait(PyObject *self, PyObject *args)
+/*
+ * Set up the conditions of a .wait() or .wait_many() call. Returns 9999
+ * when the caller passed no conditions, and a skip condition was set up
+ * instead.
+ */
+static int set_wait_conditions(PyObject *self, struct srd_decoder_inst *di,
+		PyObject *py_conds)
 {
 	int ret;
 	uint64_t skip_count;
-	unsigned int i;
-	gboolean found_match;
-	struct srd_decoder_inst *di;
-	PyObject *py_pinvalues, *py_matched, *py_samplenum;
-	PyGILState_STATE gstate;
-
-	if (!self || !args)
-		return NULL;
-
-	gstate = PyGILState_Ensure();
 
-	if (!(di = srd_inst_find_by_obj(NULL, self))) {
-		PyErr_SetString(PyExc_Exception, "decoder instance not found");
-		PyGILState_Release(gstate);
-		Py_RETURN_NONE;
-	}
-
-	ret = set_new_condition_list(self, args);
+	ret = set_new_condition_list(self, py_conds);
 	if (ret < 0) {
 		srd_dbg("%s: %s: Aborting wait().", di->inst_id, __func__);
-		goto err;
+		return ret;
 	}
 	if (ret == 9999) {
 		/*
@@ -880,22 +1430,50 @@ static PyObject *Decoder_wait(PyObject *self, PyObject *args)
 		 * execution of regular match handling code paths such that
 		 * the next available sample is returned to the caller.
 		 * Make sure to skip one sample when "anywhere within the
-		 * stream", yet make sure to not skip sample number 0.
+		 * stream", yet make sure to not skip the stream's first
+		 * sample.
 		 */
-		if (di->abs_cur_samplenum)
+		if (di->abs_cur_samplenum != di->abs_first_samplenum)
 			skip_count = 1;
 		else if (!di->condition_list)
 			skip_count = 0;
 		else
 			skip_count = 1;
-		ret = set_skip_condition(di, skip_count);
-		if (ret < 0) {
+		if (set_skip_condition(di, skip_count) < 0) {
 			srd_dbg("%s: %s: Cannot setup condition-less wait().",
 				di->inst_id, __func__);
-			goto err;
+			return SRD_ERR;
 		}
 	}
 
+	return ret;
+}
+
+/*
+ * Drop the memoryview of the current chunk, see .peek_chunk(). The view
+ * holds a reference to the samples' bytes object, views which the
+ * decoder keeps remain valid. The caller holds the GIL.
+ */
+static void release_inbuf_view(struct srd_decoder_inst *di)
+{
+	if (!di->py_inbuf)
+		return;
+
+	Py_DECREF((PyObject *)di->py_inbuf);
+	di->py_inbuf = NULL;
+}
+
+/*
+ * Process sample chunks until the current conditions match. Upon a
+ * match, returns with di->data_mutex held, the caller must release it.
+ * When 'more_chunks' is FALSE and the current chunk did not contain a
+ * match, returns with *found_match set to FALSE, and keeps the chunk
+ * (such that the next call continues where this one left off).
+ * Returns SRD_ERR when termination was requested.
+ */
+static int wait_for_match(struct srd_decoder_inst *di, gboolean more_chunks,
+		gboolean *found_match)
+{
 	while (1) {
 
 		Py_BEGIN_ALLOW_THREADS
@@ -912,50 +1490,33 @@ static PyObject *Decoder_wait(PyObject *self, PyObject *args)
 		 * previously stored samples, and returns to the main thread,
 		 * while the termination request still gets signalled.
 		 */
-		found_match = FALSE;
+		*found_match = FALSE;
 
 		/* Ignore return value for now, should never be negative. */
-		(void)process_samples_until_condition_match(di, &found_match);
+		(void)process_samples_until_condition_match(di, found_match);
 
 		Py_END_ALLOW_THREADS
 
-		/* If there's a match, set self.samplenum etc. and return. */
-		if (found_match) {
-			/* Set self.samplenum to the (absolute) sample number that matched. */
-			py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
-			PyObject_SetAttrString(di->py_inst, "samplenum", py_samplenum);
-			Py_DECREF(py_samplenum);
-
-			if (di->match_array && di->match_array->len > 0) {
-				py_matched = PyTuple_New(di->match_array->len);
-				for (i = 0; i < di->match_array->len; i++)
-					PyTuple_SetItem(py_matched, i, PyBool_FromLong(di->match_array->data[i]));
-				PyObject_SetAttrString(di->py_inst, "matched", py_matched);
-				Py_DECREF(py_matched);
-				match_array_free(di);
-			} else {
-				PyObject_SetAttrString(di->py_inst, "matched", Py_None);
-			}
-
-			py_pinvalues = get_current_pinvalues(di);
+		if (*found_match)
+			return SRD_OK;
 
+		if (!more_chunks && !di->want_wait_terminate) {
 			g_mutex_unlock(&di->data_mutex);
-
-			PyGILState_Release(gstate);
-
-			return py_pinvalues;
+			return SRD_OK;
 		}
 
-		/* No match, reset state for the next chunk. */
-		di->got_new_samples = FALSE;
-		di->handled_all_samples = TRUE;
-		di->abs_start_samplenum = 0;
-		di->abs_end_samplenum = 0;
-		di->inbuf = NULL;
-		di->inbuflen = 0;
-
-		/* Signal the main thread that we handled all samples. */
-		g_cond_signal(&di->handled_all_samples_cond);
+		/*
+		 * No match, continue with the next queued chunk, or
+		 * signal the main thread that we handled all samples.
+		 * Deliver the chunk's batched and coalesced output before.
+		 */
+		release_inbuf_view(di);
+		if (output_pending(di)) {
+			g_mutex_unlock(&di->data_mutex);
+			srd_inst_output_flush(di);
+			g_mutex_lock(&di->data_mutex);
+		}
+		srd_inst_chunk_done(di);
 
 		/*
 		 * When termination of wait() and decode() was requested,
@@ -965,15 +1526,372 @@ static PyObject *Decoder_wait(PyObject *self, PyObject *args)
 			srd_dbg("%s: %s: Will return from wait().",
 				di->inst_id, __func__);
 			g_mutex_unlock(&di->data_mutex);
+			return SRD_ERR;
+		}
+
+		g_mutex_unlock(&di->data_mutex);
+	}
+
+	return SRD_OK;
+}
+
+static PyObject *Decoder_wait(PyObject *self, PyObject *args)
+{
+	int ret;
+	unsigned int i;
+	gboolean found_match;
+	struct srd_decoder_inst *di;
+	PyObject *py_conds, *py_pinvalues, *py_matched, *py_samplenum;
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = srd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		PyGILState_Release(gstate);
+		Py_RETURN_NONE;
+	}
+
+	/*
+	 * Parse the argument of self.wait() into 'py_conds'. The argument
+	 * is optional, None is assumed in its absence.
+	 */
+	py_conds = Py_None;
+	if (!PyArg_ParseTuple(args, "|O", &py_conds)) {
+		/* Let Python raise this exception. */
+		goto err;
+	}
+
+	ret = set_wait_conditions(self, di, py_conds);
+	if (ret < 0)
+		goto err;
+
+	if (wait_for_match(di, TRUE, &found_match) < 0)
+		goto err;
+
+	/* There's a match, set self.samplenum etc. and return. */
+
+	/* Set self.samplenum to the (absolute) sample number that matched. */
+	py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
+	PyObject_SetAttrString(di->py_inst, "samplenum", py_samplenum);
+	Py_DECREF(py_samplenum);
+
+	if (di->match_array && di->match_array->len > 0) {
+		py_matched = PyTuple_New(di->match_array->len);
+		for (i = 0; i < di->match_array->len; i++)
+			PyTuple_SetItem(py_matched, i, PyBool_FromLong(di->match_array->data[i]));
+		PyObject_SetAttrString(di->py_inst, "matched", py_matched);
+		Py_DECREF(py_matched);
+		g_array_set_size(di->match_array, 0);
+	} else {
+		PyObject_SetAttrString(di->py_inst, "matched", Py_None);
+	}
+
+	py_pinvalues = get_current_pinvalues(di);
+
+	g_mutex_unlock(&di->data_mutex);
+
+	PyGILState_Release(gstate);
+
+	return py_pinvalues;
+
+err:
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
+/*
+ * Get the pin values at the current sample number, packed into an
+ * integer (bit N is the value of channel N). Unused optional channels
+ * read as 0.
+ */
+static uint64_t get_current_pinbits(struct srd_decoder_inst *di)
+{
+	int i, idx;
+	uint64_t pinbits;
+	const uint8_t *sample_pos;
+
+	sample_pos = srd_inst_sample_pos(di, di->abs_cur_samplenum);
+	pinbits = 0;
+	for (i = 0; i < di->dec_num_channels; i++) {
+		idx = di->dec_channelmap[i];
+		if (idx == -1)
+			continue;
+		if (sample_pos[idx / 8] & (1 << (idx % 8)))
+			pinbits |= (uint64_t)1 << i;
+	}
+
+	return pinbits;
+}
+
+/* Create an array.array of unsigned 64bit integers from 'values'. */
+static PyObject *py_u64_array(const GArray *values)
+{
+	struct srd_module_state *state;
+	PyObject *py_array_mod, *py_bytes, *py_array;
+
+	if (!(state = srd_module_state_get())) {
+		PyErr_SetString(PyExc_Exception, "sigrokdecode module not found");
+		return NULL;
+	}
+
+	if (!state->array_type) {
+		if (!(py_array_mod = py_import_by_name("array")))
+			return NULL;
+		state->array_type = PyObject_GetAttrString(py_array_mod, "array");
+		Py_DECREF(py_array_mod);
+		if (!state->array_type)
+			return NULL;
+	}
+
+	py_bytes = PyBytes_FromStringAndSize(values->data,
+		values->len * sizeof(uint64_t));
+	if (!py_bytes)
+		return NULL;
+	py_array = PyObject_CallFunction(state->array_type, "sO", "Q", py_bytes);
+	Py_DECREF(py_bytes);
+
+	return py_array;
+}
+
+/**
+ * Wait for up to 'max_matches' matches of the conditions.
+ *
+ * This is equivalent to calling .wait() with the same conditions
+ * 'max_matches' times, yet takes one call from Python. The result is
+ * a tuple of three array.array('Q') of equal length: the sample numbers
+ * of the matches, the pin values at the matches (bit N is channel N,
+ * unused optional channels read as 0), and which conditions matched
+ * (bit N is condition N). Fewer matches are returned when the current
+ * chunk of samples has no more matches. The samples after the last
+ * match are checked again by the next call then, such that the matches
+ * are those of repeated .wait() calls, even when the next call passes
+ * other conditions. self.samplenum and self.matched are set as for the
+ * last match.
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args The conditions and the max. number of matches.
+ *             Must not be NULL.
+ *
+ * @return A tuple of three arrays, or NULL upon errors or when
+ *         termination was requested.
+ */
+static PyObject *Decoder_wait_many(PyObject *self, PyObject *args)
+{
+	int ret;
+	unsigned int i, num_conds;
+	Py_ssize_t max_matches, count;
+	gboolean found_match;
+	uint64_t samplenum, pinbits, matchbits, match_samplenum;
+	uint8_t *match_pins;
+	struct srd_decoder_inst *di;
+	GArray *samplenums, *pins, *matched;
+	PyObject *py_conds, *py_matched, *py_samplenum, *py_ret;
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	samplenums = pins = matched = NULL;
+	match_pins = NULL;
+	match_samplenum = 0;
+	py_ret = NULL;
+
+	if (!(di = srd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	if (!PyArg_ParseTuple(args, "On", &py_conds, &max_matches)) {
+		/* Let Python raise this exception. */
+		goto err;
+	}
+	if (max_matches < 1) {
+		PyErr_SetString(PyExc_ValueError, "max_matches must be positive");
+		goto err;
+	}
+	if (di->dec_num_channels > 64) {
+		PyErr_SetString(PyExc_ValueError, "too many channels for wait_many()");
+		goto err;
+	}
+
+	if ((ret = set_wait_conditions(self, di, py_conds)) < 0)
+		goto err;
+	if (di->condition_list && di->condition_list->num_conds > 64) {
+		PyErr_SetString(PyExc_ValueError, "too many conditions for wait_many()");
+		goto err;
+	}
+
+	samplenums = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	pins = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	matched = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+
+	/*
+	 * Only block for more samples as long as there's no match yet.
+	 * When the rest of the chunk has no more matches, return to the
+	 * state after the last match, which is where the next .wait() or
+	 * .wait_many() call has to start over with its conditions.
+	 */
+	if (di->dec_num_channels)
+		match_pins = g_malloc(di->dec_num_channels);
+	num_conds = 0;
+	matchbits = 0;
+	for (count = 0; count < max_matches; count++) {
+		if (count > 0) {
+			match_samplenum = di->abs_cur_samplenum;
+			if (match_pins && di->old_pins_array)
+				memcpy(match_pins, di->old_pins_array->data,
+					di->dec_num_channels);
+		}
+		if (wait_for_match(di, count == 0, &found_match) < 0) {
+			/* Termination: hand out the matches so far first. */
+			if (count > 0)
+				break;
 			goto err;
 		}
+		if (!found_match) {
+			g_mutex_lock(&di->data_mutex);
+			di->abs_cur_samplenum = match_samplenum;
+			if (match_pins && di->old_pins_array)
+				memcpy(di->old_pins_array->data, match_pins,
+					di->dec_num_channels);
+			g_mutex_unlock(&di->data_mutex);
+			break;
+		}
+
+		samplenum = di->abs_cur_samplenum;
+		pinbits = get_current_pinbits(di);
+		matchbits = 0;
+		num_conds = 0;
+		if (di->match_array && di->match_array->len > 0) {
+			num_conds = di->match_array->len;
+			for (i = 0; i < num_conds; i++) {
+				if (di->match_array->data[i])
+					matchbits |= (uint64_t)1 << i;
+			}
+			g_array_set_size(di->match_array, 0);
+		}
 
 		g_mutex_unlock(&di->data_mutex);
+
+		g_array_append_val(samplenums, samplenum);
+		g_array_append_val(pins, pinbits);
+		g_array_append_val(matched, matchbits);
+
+		/* The next match is that of another .wait() call. */
+		if (ret == 9999)
+			set_skip_condition(di, 1);
+		else
+			use_condition_key(di);
+	}
+
+	/* Set self.samplenum and self.matched as per the last match. */
+	py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
+	PyObject_SetAttrString(di->py_inst, "samplenum", py_samplenum);
+	Py_DECREF(py_samplenum);
+	if (num_conds) {
+		py_matched = PyTuple_New(num_conds);
+		for (i = 0; i < num_conds; i++)
+			PyTuple_SetItem(py_matched, i, PyBool_FromLong((matchbits >> i) & 1));
+		PyObject_SetAttrString(di->py_inst, "matched", py_matched);
+		Py_DECREF(py_matched);
+	} else {
+		PyObject_SetAttrString(di->py_inst, "matched", Py_None);
+	}
+
+	py_ret = PyTuple_New(3);
+	PyTuple_SetItem(py_ret, 0, py_u64_array(samplenums));
+	PyTuple_SetItem(py_ret, 1, py_u64_array(pins));
+	PyTuple_SetItem(py_ret, 2, py_u64_array(matched));
+	if (PyErr_Occurred()) {
+		Py_DECREF(py_ret);
+		py_ret = NULL;
 	}
 
+err:
+	g_free(match_pins);
+	if (samplenums)
+		g_array_free(samplenums, TRUE);
+	if (pins)
+		g_array_free(pins, TRUE);
+	if (matched)
+		g_array_free(matched, TRUE);
+
 	PyGILState_Release(gstate);
 
-	Py_RETURN_NONE;
+	return py_ret;
+}
+
+/**
+ * Get the raw samples of the current chunk.
+ *
+ * The samples are returned as a read-only memoryview, along with the
+ * absolute sample number of the chunk's first sample and the unitsize
+ * (bytes per sample). Queued chunks (see srd_session_queue_depth_set())
+ * are viewed without copying, their samples are kept in a bytes object
+ * already. Otherwise the samples belong to the frontend, and get copied
+ * upon the first call for a chunk. The view, and slices of it, remain
+ * valid after .wait() proceeded to the next chunk.
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args Unused.
+ *
+ * @return A tuple (abs_start_samplenum, unitsize, memoryview), None
+ *         when there's no current chunk or the chunk is a list of
+ *         transitions, or NULL upon errors.
+ */
+static PyObject *Decoder_peek_chunk(PyObject *self, PyObject *args)
+{
+	struct srd_decoder_inst *di;
+	PyObject *py_bytes, *py_ret;
+	PyGILState_STATE gstate;
+
+	(void)args;
+
+	if (!self)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = srd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	if (!di->got_new_samples || !di->inbuf || di->transitions) {
+		PyGILState_Release(gstate);
+		Py_RETURN_NONE;
+	}
+
+	if (!di->py_inbuf) {
+		if (di->chunk) {
+			py_bytes = di->chunk->py_inbuf;
+			Py_INCREF(py_bytes);
+		} else {
+			py_bytes = PyBytes_FromStringAndSize(
+				(const char *)di->inbuf, di->inbuflen);
+			if (!py_bytes)
+				goto err;
+		}
+		di->py_inbuf = PyMemoryView_FromObject(py_bytes);
+		Py_DECREF(py_bytes);
+		if (!di->py_inbuf)
+			goto err;
+	}
+
+	py_ret = Py_BuildValue("(KiO)",
+		(unsigned long long)di->abs_start_samplenum,
+		di->data_unitsize, (PyObject *)di->py_inbuf);
+
+	PyGILState_Release(gstate);
+
+	return py_ret;
 
 err:
 	PyGILState_Release(gstate);
@@ -1002,7 +1920,7 @@ static PyObject *Decoder_has_channel(PyObject *self, PyObject *args)
 
 	gstate = PyGILState_Ensure();
 
-	if (!(di = srd_inst_find_by_obj(NULL, self))) {
+	if (!(di = srd_inst_find_by_obj(self))) {
 		PyErr_SetString(PyExc_Exception, "decoder instance not found");
 		goto err;
 	}
@@ -1034,6 +1952,62 @@ err:
 	return NULL;
 }
 
+/**
+ * Return whether annotations of the specified class are wanted.
+ *
+ * Decoders can use this to skip building annotations which put() would
+ * drop anyway, see srd_inst_output_filter_set(). Annotations are also
+ * unwanted while a decoder with logic input is in the resync prefix of
+ * a shard, see srd_session_shard_set(), assuming that annotations don't
+ * start after the current sample.
+ *
+ * @param self The decoder object. Must not be NULL.
+ * @param args The annotation class. Must not be NULL.
+ *
+ * @retval Py_True The frontend wants annotations of this class.
+ * @retval Py_False No callback or filter wants annotations of this
+ *         class, or annotations up to the current sample are outside
+ *         of the session's output window.
+ * @retval NULL An error occurred.
+ */
+static PyObject *Decoder_has_ann_listener(PyObject *self, PyObject *args)
+{
+	int ann_class;
+	gboolean wanted;
+	struct srd_decoder_inst *di;
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = srd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	if (!PyArg_ParseTuple(args, "i", &ann_class)) {
+		/* Let Python raise this exception. */
+		goto err;
+	}
+
+	wanted = ann_class >= 0 && output_wanted(di, SRD_OUTPUT_ANN, ann_class);
+
+	/* Stacked decoders have no current sample, their input tells. */
+	if (!di->py_decode && di->abs_cur_samplenum < di->sess->output_start)
+		wanted = FALSE;
+
+	PyGILState_Release(gstate);
+
+	return PyBool_FromLong(wanted);
+
+err:
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
 static PyMethodDef Decoder_methods[] = {
 	{ "put", Decoder_put, METH_VARARGS,
 	  "Accepts a dictionary with the following keys: startsample, endsample, data" },
@@ -1041,8 +2015,14 @@ static PyMethodDef Decoder_methods[] = {
 			"Register a new output stream" },
 	{ "wait", Decoder_wait, METH_VARARGS,
 			"Wait for one or more conditions to occur" },
+	{ "wait_many", Decoder_wait_many, METH_VARARGS,
+			"Wait for up to N matches of the conditions" },
 	{ "has_channel", Decoder_has_channel, METH_VARARGS,
 			"Report whether a channel was supplied" },
+	{ "has_ann_listener", Decoder_has_ann_listener, METH_VARARGS,
+			"Report whether annotations of a class are wanted" },
+	{ "peek_chunk", Decoder_peek_chunk, METH_NOARGS,
+			"Get the raw samples of the current chunk" },
 	{NULL, NULL, 0, NULL}
 };
 